@@ -0,0 +1,165 @@
+"""
+Benchmarks the parse and serialise cost of `/items/recommend` requests.
+
+Synthetic request bodies are decoded and validated, and their responses
+encoded, with the former path (the standard `json` module and a pydantic
+model), with the `RecommendationRequest` JSON path and with the packed
+content type. The median and p99 cost per request, in microseconds, are
+written as JSON so runs on different commits can be compared.
+
+Usage, from the repository root:
+
+    PYTHONPATH=src python benchmarks/codec_benchmark.py --requests 20000 --order-items 20
+"""
+
+import argparse
+import json
+from time import perf_counter_ns
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import orjson
+from pydantic import BaseModel
+
+from api.controller.request_parser import RecommendationRequest
+from synthetic_data import generate_workload
+
+
+class LegacyRequest(BaseModel):
+    """The pydantic request model the controller used to validate with."""
+
+    customer_id: int
+    order_items: list
+    num_recommendations: Optional[int] = 3
+
+
+def legacy_parse(data: bytes) -> Any:
+    """
+    Parses a body the former way.
+
+    Args:
+        data (bytes): The JSON body.
+
+    Returns:
+        Any: The validated body, whose order items the model walked again.
+    """
+    body = json.loads(data)
+    LegacyRequest(**body)
+    return [item["item_id"] for item in body["order_items"]]
+
+
+def time_calls(call: Callable[[Any], Any], inputs: List[Any], warm_up: int) -> Dict[str, float]:
+    """
+    Times a call on every input.
+
+    Args:
+        call (Callable[[Any], Any]): The parse or serialise call.
+        inputs (List[Any]): Its inputs.
+        warm_up (int): Number of first inputs called but not measured.
+
+    Returns:
+        Dict[str, float]: Median and p99 cost per call, in microseconds.
+    """
+    for value in inputs[:warm_up]:
+        call(value)
+    costs: List[int] = []
+    for value in inputs[warm_up:]:
+        start = perf_counter_ns()
+        call(value)
+        costs.append(perf_counter_ns() - start)
+    p50, p99 = np.percentile(costs, [50, 99]) / 1000
+    return {"p50_us": round(float(p50), 2), "p99_us": round(float(p99), 2)}
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Runs the benchmark.
+
+    Args:
+        args (argparse.Namespace): The parsed command line, see `parse_args`.
+
+    Returns:
+        Dict[str, Any]: The settings and the cost of every path.
+    """
+    bodies: List[dict] = generate_workload(
+        args.requests, customers=args.requests, items=args.items, seed=args.seed
+    )
+    rng = np.random.default_rng(args.seed)
+    for body in bodies:  # orders of the requested size, the workload's are smaller
+        body["order_items"] = [
+            {"item_id": int(item_id)} for item_id in rng.integers(0, args.items, args.order_items)
+        ]
+    json_bodies: List[bytes] = [json.dumps(body).encode() for body in bodies]
+    packed_bodies: List[bytes] = [
+        RecommendationRequest.from_json(body).to_packed() for body in bodies
+    ]
+    responses: List[dict] = [
+        {
+            "recommended_items": rng.integers(0, args.items, 3).tolist(),
+            "tier": "knn",
+            "model_version": "v1",
+        }
+        for _ in bodies
+    ]
+    return {
+        "settings": vars(args),
+        "request_bytes": {
+            "json": float(np.mean([len(data) for data in json_bodies])),
+            "packed": float(np.mean([len(data) for data in packed_bodies])),
+        },
+        "parse": {
+            "legacy_json": time_calls(legacy_parse, json_bodies, args.warm_up),
+            "json": time_calls(
+                lambda data: RecommendationRequest.from_json(orjson.loads(data)),
+                json_bodies,
+                args.warm_up,
+            ),
+            "packed": time_calls(RecommendationRequest.from_packed, packed_bodies, args.warm_up),
+        },
+        "serialise": {
+            "json": time_calls(
+                lambda response: json.dumps(response).encode(), responses, args.warm_up
+            ),
+            "orjson": time_calls(orjson.dumps, responses, args.warm_up),
+        },
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parses the command line.
+
+    Args:
+        argv (Optional[List[str]]): Command line arguments, `sys.argv` by default.
+
+    Returns:
+        argparse.Namespace: The benchmark settings.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--requests", type=int, default=10_000)
+    parser.add_argument("--items", type=int, default=1_000)
+    parser.add_argument("--order-items", type=int, default=10, help="items per order")
+    parser.add_argument("--warm-up", type=int, default=100, help="calls made before measuring")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON report path, printed when missing")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Runs the benchmark from the command line.
+
+    Args:
+        argv (Optional[List[str]]): Command line arguments, `sys.argv` by default.
+    """
+    args = parse_args(argv)
+    report = json.dumps(run(args), indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
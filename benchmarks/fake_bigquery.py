@@ -0,0 +1,92 @@
+"""
+Local stand-in for the BigQuery client, answering the recommender queries
+from in-memory purchase counts so the BigQuery code path can be benchmarked
+offline.
+"""
+
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+import numpy as np
+from pandas import DataFrame
+
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.index.purchase_count_index import PurchaseCountIndex
+
+
+class FakeBigQueryClient:
+    """
+    Answers the parameterised queries of `api.queries` by their `query_name`
+    label, after an optional simulated network latency.
+
+    Attributes:
+        _counts (CustomerItemsMatrix): Purchase counts of every customer.
+        _index (PurchaseCountIndex): The same counts, to rank items.
+        _latency_seconds (float): Time every query waits before answering.
+        queries (Dict[str, int]): Number of queries answered by name.
+    """
+
+    def __init__(self, counts: CustomerItemsMatrix, latency_seconds: float = 0.0):
+        self._counts: CustomerItemsMatrix = counts
+        self._index = PurchaseCountIndex(counts)
+        self._latency_seconds: float = latency_seconds
+        self.queries: Dict[str, int] = {}
+
+    def query(self, sql: str, job_config: Any = None, timeout: Optional[float] = None):
+        """
+        Runs a query, mimicking `google.cloud.bigquery.Client.query`.
+
+        Args:
+            sql (str): The SQL text, unused.
+            job_config (QueryJobConfig): Holds the query name label and parameters.
+            timeout (Optional[float]): Unused.
+
+        Raises:
+            ValueError: For queries without a known `query_name` label.
+
+        Returns:
+            SimpleNamespace: A finished job whose `result().to_dataframe()`
+            returns the query result.
+        """
+        del sql, timeout
+        name: str = (getattr(job_config, "labels", None) or {}).get("query_name", "")
+        parameters: Dict[str, Any] = {
+            p.name: getattr(p, "values", getattr(p, "value", None))
+            for p in getattr(job_config, "query_parameters", [])
+        }
+        handler = getattr(self, f"_{name}", None)
+        if handler is None:
+            raise ValueError(f"Unknown query {name!r}.")
+        if self._latency_seconds:
+            time.sleep(self._latency_seconds)
+        result: DataFrame = handler(**parameters)
+        self.queries[name] = self.queries.get(name, 0) + 1
+        return SimpleNamespace(
+            result=lambda timeout=None: SimpleNamespace(to_dataframe=lambda: result),
+            total_bytes_processed=int(result.memory_usage(index=False).sum()),
+            cache_hit=False,
+        )
+
+    def _customer_items_array(self, customer_id: int) -> DataFrame:
+        row = self._counts.get_row(customer_id)
+        vector = np.zeros(self._counts.num_items) if row is None else row.ravel()
+        return DataFrame({"interaction": vector})
+
+    def _customers_purchases(self, customer_ids: list) -> DataFrame:
+        rows = self._counts.customer_rows(np.asarray(customer_ids))
+        counts = self._counts.matrix[rows].tocoo()
+        return DataFrame({
+            "customer_id": self._counts.customer_ids[rows][counts.row],
+            "item_id": self._counts.item_ids[counts.col],
+            "interaction": counts.data,
+        })
+
+    def _most_sold_products_for_customer(
+        self, customer_ids: list, excluded_item_ids: list, num_recommendations: int
+    ) -> DataFrame:
+        return DataFrame({
+            "item_id": self._index.top_items(
+                np.asarray(customer_ids), np.asarray(excluded_item_ids), num_recommendations
+            )
+        })
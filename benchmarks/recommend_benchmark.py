@@ -0,0 +1,357 @@
+"""
+Benchmarks the recommend hot path on synthetic data.
+
+Synthetic orders are generated and trained into artefacts with the training
+pipeline, then a workload of requests is run through `KNNModel.recommend`
+and through the Flask `/items/recommend` endpoint, with BigQuery replaced by
+a local fake. Latency percentiles, throughput and memory are written as JSON
+so runs on different commits can be compared.
+
+Usage, from the repository root:
+
+    PYTHONPATH=src python benchmarks/recommend_benchmark.py \\
+        --customers 100000 --items 10000 --output results.json
+
+    # replay recorded `/items/recommend` bodies, one JSON object per line
+    PYTHONPATH=src python benchmarks/recommend_benchmark.py --workload requests.jsonl
+
+    # compare with a previous run
+    PYTHONPATH=src python benchmarks/recommend_benchmark.py --baseline results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from api.controller.controller import controller_bp
+from api.flask_app_builder import FlaskAppBuilder
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.knn_model import KNNModel
+from api.memory_usage import memory_usage
+from api.model_registry import ModelRegistry
+from fake_bigquery import FakeBigQueryClient
+from synthetic_data import generate_workload, write_orders
+from training.train_knn_model import CONF_FILE_NAME, train
+
+
+def load_workload(path: str) -> Tuple[List[dict], int]:
+    """
+    Reads recorded request bodies, one JSON object per line. Lines that
+    aren't recommendation requests are skipped.
+
+    Args:
+        path (str): Path of the JSON lines file.
+
+    Returns:
+        Tuple[List[dict], int]: The request bodies and the number of skipped lines.
+    """
+    bodies: List[dict] = []
+    skipped = 0
+    with open(path, encoding="utf-8") as workload_file:
+        for line in workload_file:
+            try:
+                body = json.loads(line)
+            except json.JSONDecodeError:
+                body = None
+            if isinstance(body, dict) and {"customer_id", "order_items"} <= body.keys():
+                bodies.append(body)
+            elif line.strip():
+                skipped += 1
+    return bodies, skipped
+
+
+def summarise(latencies: List[float], errors: int, elapsed_seconds: float) -> Dict[str, Any]:
+    """
+    Summarises the latencies of a run.
+
+    Args:
+        latencies (List[float]): Latency of every request, in seconds.
+        errors (int): Number of failed requests.
+        elapsed_seconds (float): Duration of the whole run.
+
+    Returns:
+        Dict[str, Any]: Request and error counts, latency percentiles in
+        milliseconds and throughput in requests per second.
+    """
+    milliseconds = np.asarray(latencies) * 1000
+    summary: Dict[str, Any] = {"requests": len(latencies), "errors": errors}
+    if milliseconds.size:
+        p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+        summary.update({
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "p99_ms": p99,
+            "mean_ms": float(milliseconds.mean()),
+            "max_ms": float(milliseconds.max()),
+        })
+    summary["throughput_rps"] = len(latencies) / elapsed_seconds if elapsed_seconds else 0.0
+    return summary
+
+
+def measure(call: Callable[[dict], bool], bodies: List[dict], warm_up: int) -> Dict[str, Any]:
+    """
+    Sends every request body and times it.
+
+    Args:
+        call (Callable[[dict], bool]): Sends a request, returns whether it succeeded.
+        bodies (List[dict]): The request bodies.
+        warm_up (int): Number of first requests sent but not measured.
+
+    Returns:
+        Dict[str, Any]: The summary of the run, see `summarise`.
+    """
+    for body in bodies[:warm_up]:
+        call(body)
+    latencies: List[float] = []
+    errors = 0
+    start = perf_counter()
+    for body in bodies[warm_up:]:
+        request_start = perf_counter()
+        succeeded = call(body)
+        latencies.append(perf_counter() - request_start)
+        errors += not succeeded
+    return summarise(latencies, errors, perf_counter() - start)
+
+
+def build_model(
+    artefacts_dir: str,
+    serve_from: str,
+    latency_seconds: float,
+    caches: bool,
+    scoring_mode: str = "knn",
+) -> Tuple[KNNModel, FakeBigQueryClient]:
+    """
+    Loads the trained model with a fake BigQuery client.
+
+    Args:
+        artefacts_dir (str): The training artefacts.
+        serve_from (str): "table" to serve the precomputed recommendations,
+        "artefacts" to search neighbours and serve customer vectors and
+        purchase counts from the local matrix, "bigquery" to query them.
+        latency_seconds (float): Simulated latency of every BigQuery query.
+        caches (bool): Whether the model caches are enabled.
+        scoring_mode (str): "knn" or "blend", see `KNNModel`.
+
+    Returns:
+        Tuple[KNNModel, FakeBigQueryClient]: The model and its BigQuery client.
+    """
+    with open(os.path.join(artefacts_dir, CONF_FILE_NAME), encoding="utf-8") as conf_file:
+        conf: Dict[str, Any] = json.load(conf_file)
+    if serve_from != "table":
+        conf["recommendation_table_path"] = None
+    if serve_from == "bigquery":
+        conf["artefacts_dir"] = None
+    if not caches:
+        conf.update({"neighbours_cache_size": 0, "query_cache_size": 0})
+    conf["scoring_mode"] = scoring_mode
+    conf_path = os.path.join(artefacts_dir, f"benchmark_{serve_from}.json")
+    with open(conf_path, "w", encoding="utf-8") as conf_file:
+        json.dump(conf, conf_file)
+    bq_client = FakeBigQueryClient(CustomerItemsMatrix.load(artefacts_dir), latency_seconds)
+    return KNNModel(conf_path, bq_client=bq_client), bq_client
+
+
+def http_caller(knn_model: KNNModel) -> Callable[[dict], bool]:
+    """
+    Builds an in-process client of the Flask application serving the model.
+
+    Args:
+        knn_model (KNNModel): The model to serve.
+
+    Returns:
+        Callable[[dict], bool]: Posts a body to `/items/recommend`.
+    """
+    app = FlaskAppBuilder() \
+        .with_config({"TESTING": True}) \
+        .with_recommender(ModelRegistry("benchmark", model_factory=lambda _: knn_model)) \
+        .with_blueprints([controller_bp]) \
+        .build()
+    client = app.test_client()
+    return lambda body: client.post("/items/recommend", json=body).status_code == 200
+
+
+def model_caller(knn_model: KNNModel) -> Callable[[dict], bool]:
+    """
+    Builds a caller of `KNNModel.recommend`.
+
+    Args:
+        knn_model (KNNModel): The model to call.
+
+    Returns:
+        Callable[[dict], bool]: Asks the model for the recommendations of a body.
+    """
+
+    def call(body: dict) -> bool:
+        try:
+            knn_model.recommend(
+                customer_id=body["customer_id"],
+                order_items=body["order_items"],
+                num_recommendations=body.get("num_recommendations") or 3,
+            )
+            return True
+        except Exception:  # pylint: disable=broad-exception-caught
+            return False
+
+    return call
+
+
+def git_commit() -> Optional[str]:
+    """
+    Gets the commit being benchmarked.
+
+    Returns:
+        Optional[str]: The current commit hash, None outside a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """
+    Compares the results of a run with a baseline run.
+
+    Args:
+        report (Dict[str, Any]): The current run.
+        baseline (Dict[str, Any]): The baseline run.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Current to baseline ratio of the latency
+        percentiles and throughput of every mode run in both.
+    """
+    ratios: Dict[str, Dict[str, float]] = {}
+    for mode, results in report["results"].items():
+        base = baseline.get("results", {}).get(mode)
+        if not base:
+            continue
+        ratios[mode] = {
+            metric: results[metric] / base[metric]
+            for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+            if results.get(metric) and base.get(metric)
+        }
+    return ratios
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Runs the benchmark.
+
+    Args:
+        args (argparse.Namespace): The parsed command line, see `parse_args`.
+
+    Returns:
+        Dict[str, Any]: The report of the run.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        orders_path = os.path.join(work_dir, "orders.parquet")
+        write_orders(
+            orders_path,
+            args.customers,
+            args.items,
+            purchases_per_customer=args.purchases_per_customer,
+            skew=args.skew,
+            seed=args.seed,
+        )
+        manifest = train(orders_path, os.path.join(work_dir, "artefacts"))
+        knn_model, bq_client = build_model(
+            manifest["artefacts_dir"],
+            args.serve_from,
+            args.bigquery_latency_ms / 1000,
+            args.caches,
+            args.scoring_mode,
+        )
+        skipped = 0
+        if args.workload:
+            bodies, skipped = load_workload(args.workload)
+        else:
+            bodies = generate_workload(
+                args.requests, args.customers, args.items, args.skew, seed=args.seed + 1
+            )
+        callers = {"model": model_caller, "http": http_caller}
+        results = {
+            mode: measure(callers[mode](knn_model), bodies, args.warm_up) for mode in args.modes
+        }
+        report: Dict[str, Any] = {
+            "git_commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+            "workload": {"requests": len(bodies), "skipped_lines": skipped},
+            "training": {k: v for k, v in manifest.items() if k != "artefacts_dir"},
+            "results": results,
+            "memory": memory_usage(),
+            "query_stats": knn_model.query_stats(),
+            "bigquery_queries": bq_client.queries,
+            "neighbours_cache": knn_model.cache_info(),
+        }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            report["comparison"] = compare(report, json.load(baseline_file))
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parses the command line.
+
+    Args:
+        argv (Optional[List[str]]): Command line arguments, `sys.argv` by default.
+
+    Returns:
+        argparse.Namespace: The benchmark settings.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--customers", type=int, default=10_000)
+    parser.add_argument("--items", type=int, default=1_000)
+    parser.add_argument("--purchases-per-customer", type=float, default=10.0)
+    parser.add_argument("--skew", type=float, default=1.1, help="item popularity skew")
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--warm-up", type=int, default=20, help="requests sent before measuring")
+    parser.add_argument("--workload", help="JSON lines of /items/recommend bodies to replay")
+    parser.add_argument("--modes", nargs="+", choices=["model", "http"], default=["model", "http"])
+    parser.add_argument(
+        "--serve-from",
+        choices=["table", "artefacts", "bigquery"],
+        default="artefacts",
+        help="serve precomputed recommendations, or search neighbours and serve customer "
+        "vectors and purchases from the local matrix or the fake BigQuery",
+    )
+    parser.add_argument("--scoring-mode", choices=["knn", "blend"], default="knn")
+    parser.add_argument("--bigquery-latency-ms", type=float, default=0.0)
+    parser.add_argument("--no-caches", dest="caches", action="store_false")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON report path, printed when missing")
+    parser.add_argument("--baseline", help="previous JSON report to compare with")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Runs the benchmark from the command line.
+
+    Args:
+        argv (Optional[List[str]]): Command line arguments, `sys.argv` by default.
+    """
+    args = parse_args(argv)
+    report = json.dumps(run(args), indent=4, default=float)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Measures the throughput of the sharded neighbour search as shards are added.
+
+Random purchase vectors are fitted into the exact scikit-learn model, then
+the same queries are answered by the unsharded model and by
+`ShardedNeighbourSearch` over every requested number of shards, from
+`--clients` threads at once. The report gives the queries per second of
+every run and checks the sharded neighbours against the unsharded ones.
+
+Usage, from the repository root:
+
+    PYTHONPATH=src python benchmarks/sharded_search_benchmark.py \\
+        --customers 200000 --items 5000 --shards 1 2 4 8
+"""
+
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from numpy import ndarray
+from scipy.sparse import csr_matrix
+from sklearn.neighbors import NearestNeighbors
+
+from api.neighbours.neighbour_search import ExactNeighbourSearch, NeighbourSearch
+from api.neighbours.sharded_neighbour_search import ShardedNeighbourSearch
+from synthetic_data import item_popularity
+
+
+def purchase_vectors(customers: int, items: int, purchases: int, seed: int) -> csr_matrix:
+    """
+    Generates binary purchase vectors with skewed item popularity.
+
+    Args:
+        customers (int): Number of customers.
+        items (int): Number of items.
+        purchases (int): Purchases per customer.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        csr_matrix: One row per customer.
+    """
+    rng = np.random.default_rng(seed)
+    rows: ndarray = np.repeat(np.arange(customers), purchases)
+    columns: ndarray = rng.choice(items, size=rows.size, p=item_popularity(items, 1.1))
+    matrix = csr_matrix((np.ones(rows.size), (rows, columns)), shape=(customers, items))
+    matrix.data[:] = 1.0  # repeated purchases count once
+    return matrix
+
+
+def throughput(
+    search: NeighbourSearch, queries: List[csr_matrix], n_neighbors: int, clients: int
+) -> Dict[str, Any]:
+    """
+    Answers every query from several client threads.
+
+    Args:
+        search (NeighbourSearch): The engine.
+        queries (List[csr_matrix]): Query batches.
+        n_neighbors (int): Neighbours per query.
+        clients (int): Concurrent client threads.
+
+    Returns:
+        Dict[str, Any]: Queries per second and the neighbour distances.
+    """
+    search.kneighbors(queries[0], n_neighbors)  # starts the shards
+    start = perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        results = list(executor.map(lambda batch: search.kneighbors(batch, n_neighbors), queries))
+    elapsed: float = perf_counter() - start
+    return {
+        "queries_per_second": round(sum(batch.shape[0] for batch in queries) / elapsed, 1),
+        "distances": np.vstack([distances for distances, _ in results]),
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Runs the benchmark.
+
+    Args:
+        args (argparse.Namespace): The parsed command line, see `parse_args`.
+
+    Returns:
+        Dict[str, Any]: The settings and the throughput of every run.
+    """
+    data: csr_matrix = purchase_vectors(args.customers, args.items, args.purchases, args.seed)
+    model = NearestNeighbors(metric="cosine", algorithm="brute").fit(data)
+    rows: ndarray = np.random.default_rng(args.seed + 1).integers(
+        0, args.customers, args.queries * args.batch_size
+    )
+    queries: List[csr_matrix] = [
+        data[rows[start : start + args.batch_size]]
+        for start in range(0, rows.size, args.batch_size)
+    ]
+    unsharded = throughput(ExactNeighbourSearch(model), queries, args.neighbours, args.clients)
+    report: Dict[str, Any] = {
+        "settings": vars(args),
+        "unsharded": {"queries_per_second": unsharded["queries_per_second"]},
+        "sharded": {},
+    }
+    for num_shards in args.shards:
+        search = ShardedNeighbourSearch(model, num_shards)
+        try:
+            sharded = throughput(search, queries, args.neighbours, args.clients)
+        finally:
+            search.close()
+        report["sharded"][str(num_shards)] = {
+            "queries_per_second": sharded["queries_per_second"],
+            "same_distances": bool(
+                np.allclose(sharded["distances"], unsharded["distances"], atol=1e-9)
+            ),
+        }
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parses the command line.
+
+    Args:
+        argv (Optional[List[str]]): Command line arguments, `sys.argv` by default.
+
+    Returns:
+        argparse.Namespace: The benchmark settings.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--customers", type=int, default=50_000)
+    parser.add_argument("--items", type=int, default=2_000)
+    parser.add_argument("--purchases", type=int, default=10, help="purchases per customer")
+    parser.add_argument("--queries", type=int, default=200, help="query batches")
+    parser.add_argument("--batch-size", type=int, default=1, help="customers per query")
+    parser.add_argument("--neighbours", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client threads")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON report path, printed when missing")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Runs the benchmark from the command line.
+
+    Args:
+        argv (Optional[List[str]]): Command line arguments, `sys.argv` by default.
+    """
+    args = parse_args(argv)
+    report = json.dumps(run(args), indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Generates synthetic orders and recommendation workloads at a configurable
+scale, with a skewed item popularity like real catalogues.
+"""
+
+from typing import Dict, Iterator, List
+
+import numpy as np
+from numpy import ndarray
+import pyarrow
+import pyarrow.parquet
+
+
+def item_popularity(items: int, skew: float) -> ndarray:
+    """
+    Zipf-like popularity of the items: the item of rank r is bought with a
+    probability proportional to 1 / r^skew. Item ids are their rank.
+
+    Args:
+        items (int): Number of items.
+        skew (float): Popularity skew, 0 for uniform.
+
+    Returns:
+        ndarray: The purchase probability of every item.
+    """
+    weights = 1.0 / np.arange(1, items + 1, dtype=np.float64) ** skew
+    return weights / weights.sum()
+
+
+def iter_orders(
+    customers: int,
+    items: int,
+    purchases_per_customer: float = 10.0,
+    skew: float = 1.1,
+    chunk_customers: int = 100_000,
+    seed: int = 0,
+) -> Iterator[Dict[str, ndarray]]:
+    """
+    Generates exploded orders, one row per purchased item, chunk by chunk so
+    millions of customers never have to fit in memory at once. Customer ids go
+    from 0 to `customers` - 1 and every customer buys at least one item.
+
+    Args:
+        customers (int): Number of customers.
+        items (int): Number of items.
+        purchases_per_customer (float): Average number of purchased items.
+        skew (float): Item popularity skew, see `item_popularity`.
+        chunk_customers (int): Number of customers per chunk.
+        seed (int): Seed of the random generator.
+
+    Yields:
+        Dict[str, ndarray]: The `customer_id` and `item_id` columns of a chunk.
+    """
+    rng = np.random.default_rng(seed)
+    popularity: ndarray = item_popularity(items, skew)
+    for first in range(0, customers, chunk_customers):
+        chunk_ids = np.arange(first, min(first + chunk_customers, customers), dtype=np.int64)
+        purchases = 1 + rng.poisson(max(purchases_per_customer - 1, 0), len(chunk_ids))
+        yield {
+            "customer_id": np.repeat(chunk_ids, purchases),
+            "item_id": rng.choice(items, int(purchases.sum()), p=popularity).astype(np.int64),
+        }
+
+
+def write_orders(path: str, customers: int, items: int, **kwargs) -> int:
+    """
+    Writes synthetic orders to a Parquet file, one row group per chunk.
+
+    Args:
+        path (str): Path of the Parquet file.
+        customers (int): Number of customers.
+        items (int): Number of items.
+        **kwargs: Other arguments of `iter_orders`.
+
+    Returns:
+        int: The number of purchases written.
+    """
+    schema = pyarrow.schema([("customer_id", pyarrow.int64()), ("item_id", pyarrow.int64())])
+    rows = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for chunk in iter_orders(customers, items, **kwargs):
+            writer.write_table(pyarrow.table(chunk, schema=schema))
+            rows += len(chunk["customer_id"])
+    return rows
+
+
+def generate_workload(
+    requests: int,
+    customers: int,
+    items: int,
+    skew: float = 1.1,
+    unknown_customers: float = 0.05,
+    seed: int = 1,
+) -> List[dict]:
+    """
+    Generates `/items/recommend` request bodies.
+
+    Args:
+        requests (int): Number of requests.
+        customers (int): Number of customers in the orders.
+        items (int): Number of items.
+        skew (float): Popularity skew of the order items.
+        unknown_customers (float): Share of requests from customers without
+        orders, which take the BigQuery fallback path.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        List[dict]: The request bodies.
+    """
+    rng = np.random.default_rng(seed)
+    popularity: ndarray = item_popularity(items, skew)
+    customer_ids = rng.integers(0, customers, requests)
+    unknown = rng.random(requests) < unknown_customers
+    customer_ids[unknown] = customers + rng.integers(0, customers, int(unknown.sum()))
+    order_sizes = rng.integers(1, 4, requests)
+    order_items = rng.choice(items, int(order_sizes.sum()), p=popularity)
+    bodies: List[dict] = []
+    for customer_id, items_of_order in zip(
+        customer_ids.tolist(), np.split(order_items, np.cumsum(order_sizes)[:-1])
+    ):
+        bodies.append({
+            "customer_id": customer_id,
+            "order_items": [{"item_id": item_id} for item_id in items_of_order.tolist()],
+            "num_recommendations": 3,
+        })
+    return bodies
@@ -0,0 +1,132 @@
+"""
+Measures the memory of several worker processes serving the same KNN model,
+with the model and matrix files memory-mapped or read into every worker.
+
+Synthetic orders are trained into artefacts with the training pipeline, then
+`--workers` processes each load a `KNNModel`, answer a request and report
+their memory while all of them are alive, so the proportional set size splits
+the shared pages between them.
+
+Usage, from the repository root:
+
+    PYTHONPATH=src python benchmarks/worker_memory.py --workers 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from api.memory_usage import memory_usage
+from synthetic_data import write_orders
+from training.train_knn_model import CONF_FILE_NAME, train
+
+
+def build_artefacts(directory: str, customers: int, items: int, purchases: int) -> str:
+    """
+    Trains artefacts on random orders.
+
+    Args:
+        directory (str): Working directory.
+        customers (int): Number of customers.
+        items (int): Number of items.
+        purchases (int): Number of purchased items.
+
+    Returns:
+        str: The artefacts directory.
+    """
+    orders_path = os.path.join(directory, "orders.parquet")
+    write_orders(orders_path, customers, items, purchases_per_customer=purchases / customers)
+    return train(orders_path, os.path.join(directory, "artefacts"))["artefacts_dir"]
+
+
+def write_conf(artefacts_dir: str, mmap_mode: Optional[str]) -> str:
+    """
+    Writes a copy of the artefacts configuration with the given mmap mode.
+
+    Args:
+        artefacts_dir (str): The artefacts directory.
+        mmap_mode (Optional[str]): The mmap mode of the model files.
+
+    Returns:
+        str: Path of the configuration.
+    """
+    with open(os.path.join(artefacts_dir, CONF_FILE_NAME), encoding="utf-8") as conf_file:
+        conf: Dict[str, Any] = json.load(conf_file)
+    conf.update({"mmap_mode": mmap_mode, "neighbours_cache_size": 0})
+    conf_path = os.path.join(artefacts_dir, f"conf_{mmap_mode}.json")
+    with open(conf_path, "w", encoding="utf-8") as conf_file:
+        json.dump(conf, conf_file)
+    return conf_path
+
+
+def serve(conf_path: str, barrier, results) -> None:
+    """
+    Worker process: loads the model, answers a request and reports its memory.
+
+    Args:
+        conf_path (str): The model configuration.
+        barrier (Barrier): Keeps every worker alive until all have measured.
+        results (Queue): Receives the memory usage of the worker.
+    """
+    from api.knn_model import KNNModel  # pylint: disable=import-outside-toplevel
+
+    knn_model = KNNModel(conf_path)
+    knn_model.recommend(customer_id=0, order_items=[{"item_id": 1}])
+    barrier.wait()
+    results.put(memory_usage())
+    barrier.wait()
+
+
+def measure(conf_path: str, workers: int) -> Dict[str, Any]:
+    """
+    Runs worker processes and sums up their memory.
+
+    Args:
+        conf_path (str): The model configuration.
+        workers (int): Number of worker processes.
+
+    Returns:
+        Dict[str, Any]: Memory of every worker and totals.
+    """
+    context = multiprocessing.get_context("spawn")
+    barrier, results = context.Barrier(workers), context.Queue()
+    processes = [
+        context.Process(target=serve, args=(conf_path, barrier, results)) for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    usages: List[Dict[str, Optional[int]]] = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return {
+        "workers": usages,
+        "total_rss_bytes": sum(u["rss_bytes"] or 0 for u in usages),
+        "total_pss_bytes": sum(u["pss_bytes"] or 0 for u in usages),
+    }
+
+
+def main() -> None:
+    """Runs the benchmark and prints its JSON report."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--customers", type=int, default=200_000)
+    parser.add_argument("--items", type=int, default=5_000)
+    parser.add_argument("--purchases", type=int, default=5_000_000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        artefacts_dir = build_artefacts(directory, args.customers, args.items, args.purchases)
+        report = {
+            "artefacts_bytes": sum(
+                entry.stat().st_size for entry in os.scandir(artefacts_dir)
+            ),
+            "read": measure(write_conf(artefacts_dir, None), args.workers),
+            "mmap": measure(write_conf(artefacts_dir, "r"), args.workers),
+        }
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
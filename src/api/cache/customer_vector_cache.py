@@ -0,0 +1,363 @@
+"""
+Two-level cache of the customer vectors queried from BigQuery: a bounded
+in-process cache in front of a SQLite database shared by every worker of a
+node, so workers starting after a deploy find the vectors the others
+already queried.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+from threading import Lock
+from time import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from numpy import ndarray
+
+from api.cache.ttl_lru_cache import TTLLRUCache
+
+
+logger = logging.getLogger(__name__)
+
+_PACKED = b"b"  # binary vector, one bit per item
+_RAW = b"f"  # purchase counts, float64 per item
+
+
+def catalogue_version(num_items: int, item_ids: Optional[ndarray] = None) -> str:
+    """
+    Identifies a catalogue snapshot, so vectors cached for another one,
+    whose columns are other items, are never returned.
+
+    Args:
+        num_items (int): Number of items, the length of every vector.
+        item_ids (Optional[ndarray]): The item id of every column, when known.
+
+    Returns:
+        str: The snapshot version.
+    """
+    if item_ids is None:
+        return str(num_items)
+    digest: str = hashlib.sha1(
+        np.ascontiguousarray(item_ids, dtype=np.int64).tobytes()
+    ).hexdigest()[:16]
+    return f"{num_items}-{digest}"
+
+
+def encode_vector(vector: ndarray) -> bytes:
+    """
+    Encodes a customer vector, bit-packed when it's binary.
+
+    Args:
+        vector (ndarray): The vector, one value per item.
+
+    Returns:
+        bytes: The encoded vector.
+    """
+    vector = np.asarray(vector).reshape(-1)
+    if np.all((vector == 0) | (vector == 1)):
+        return _PACKED + np.packbits(vector.astype(bool)).tobytes()
+    return _RAW + vector.astype(np.float64).tobytes()
+
+
+def decode_vector(data: bytes, num_items: int) -> Optional[ndarray]:
+    """
+    Decodes a vector written by `encode_vector`.
+
+    Args:
+        data (bytes): The encoded vector.
+        num_items (int): Number of items of the catalogue.
+
+    Returns:
+        Optional[ndarray]: The float64 vector, or None when it wasn't
+        encoded for a catalogue of this size.
+    """
+    kind, payload = data[:1], data[1:]
+    if kind == _PACKED and len(payload) == (num_items + 7) // 8:
+        return np.unpackbits(np.frombuffer(payload, dtype=np.uint8), count=num_items).astype(
+            np.float64
+        )
+    if kind == _RAW and len(payload) == num_items * 8:
+        return np.frombuffer(payload, dtype=np.float64).copy()
+    return None
+
+
+class SQLiteVectorStore:
+    """
+    Encoded vectors by catalogue version and customer id in a SQLite
+    database in WAL mode, so the worker processes of a node read it
+    concurrently while one of them writes.
+
+    Every process opens its own connection on first use, connections
+    don't survive a fork. The store is best-effort: a locked or broken
+    database counts as a miss and drops the write, the vector being queried
+    again.
+
+    Attributes:
+        _path (str): Path of the database file.
+        _ttl_seconds (Optional[float]): Lifetime of a vector, None means forever.
+        _clock (Callable[[], float]): Wall clock in seconds, shared by the processes.
+        _prune_every (int): Writes between deletions of the expired vectors.
+        _lock (Lock): Serialises the use of the connection.
+        _connection (Optional[sqlite3.Connection]): Connection of the current process.
+        _pid (Optional[int]): Process the connection was opened by.
+        _writes (int): Writes since the last pruning.
+        hits (int): Vectors found.
+        misses (int): Vectors looked up but not found.
+        errors (int): Failed reads and writes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time,
+        prune_every: int = 1000,
+    ):
+        self._path: str = path
+        self._ttl_seconds: Optional[float] = ttl_seconds
+        self._clock: Callable[[], float] = clock
+        self._prune_every: int = prune_every
+        self._lock = Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._writes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.errors: int = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Gets the connection of the current process, creating the database
+        on first use. Must be called with the lock held.
+
+        Returns:
+            sqlite3.Connection: The connection.
+        """
+        if self._connection is not None and self._pid == os.getpid():
+            return self._connection
+        directory: str = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(
+            self._path, timeout=1.0, isolation_level=None, check_same_thread=False
+        )
+        connection.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS customer_vectors (
+                catalogue_version TEXT NOT NULL,
+                customer_id INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (catalogue_version, customer_id)
+            ) WITHOUT ROWID;
+            """
+        )
+        self._connection, self._pid = connection, os.getpid()
+        return connection
+
+    def get_many(self, version: str, customer_ids: List[int]) -> Dict[int, bytes]:
+        """
+        Looks up the vectors of several customers with a single query.
+
+        Args:
+            version (str): The catalogue version, see `catalogue_version`.
+            customer_ids (List[int]): The customers.
+
+        Returns:
+            Dict[int, bytes]: The encoded vectors found, by customer id.
+        """
+        if not customer_ids:
+            return {}
+        oldest: float = (
+            float("-inf") if self._ttl_seconds is None else self._clock() - self._ttl_seconds
+        )
+        placeholders: str = ", ".join("?" for _ in customer_ids)
+        try:
+            with self._lock:
+                rows = self._connect().execute(
+                    "SELECT customer_id, vector FROM customer_vectors "
+                    "WHERE catalogue_version = ? AND stored_at >= ? "
+                    f"AND customer_id IN ({placeholders})",
+                    [version, oldest, *customer_ids],
+                ).fetchall()
+        except sqlite3.Error:
+            logger.warning("Customer vector store read failed", exc_info=True)
+            self.errors += 1
+            rows = []
+        found: Dict[int, bytes] = dict(rows)
+        self.hits += len(found)
+        self.misses += len(customer_ids) - len(found)
+        return found
+
+    def put_many(self, version: str, vectors: Dict[int, bytes]) -> None:
+        """
+        Stores encoded vectors, replacing the customers' previous ones.
+
+        Args:
+            version (str): The catalogue version, see `catalogue_version`.
+            vectors (Dict[int, bytes]): The encoded vectors by customer id.
+        """
+        if not vectors:
+            return
+        now: float = self._clock()
+        try:
+            with self._lock:
+                connection: sqlite3.Connection = self._connect()
+                connection.executemany(
+                    "INSERT OR REPLACE INTO customer_vectors VALUES (?, ?, ?, ?)",
+                    [(version, customer_id, now, data) for customer_id, data in vectors.items()],
+                )
+                self._writes += len(vectors)
+                if self._ttl_seconds is not None and self._writes >= self._prune_every:
+                    # vectors of previous catalogues expire like the others
+                    connection.execute(
+                        "DELETE FROM customer_vectors WHERE stored_at < ?",
+                        (now - self._ttl_seconds,),
+                    )
+                    self._writes = 0
+        except sqlite3.Error:
+            logger.warning("Customer vector store write failed", exc_info=True)
+            self.errors += 1
+
+    def discard_many(self, version: str, customer_ids: Iterable[int]) -> None:
+        """
+        Drops the vectors of customers, e.g. after they bought.
+
+        Args:
+            version (str): The catalogue version, see `catalogue_version`.
+            customer_ids (Iterable[int]): The customers.
+        """
+        try:
+            with self._lock:
+                self._connect().executemany(
+                    "DELETE FROM customer_vectors WHERE catalogue_version = ? AND customer_id = ?",
+                    [(version, customer_id) for customer_id in customer_ids],
+                )
+        except sqlite3.Error:
+            logger.warning("Customer vector store write failed", exc_info=True)
+            self.errors += 1
+
+    def cache_info(self) -> Dict[str, float]:
+        """
+        Reports the store usage of the current process.
+
+        Returns:
+            Dict[str, float]: Hits, misses, errors and hit rate.
+        """
+        lookups: int = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        """Closes the connection of the current process, reopened on next use."""
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+
+class CustomerVectorCache:
+    """
+    Customer vectors of a catalogue snapshot, looked up in memory first,
+    then in the shared store, whose hits are kept in memory. Both levels
+    hold encoded vectors, a few hundred bytes per customer on a binary
+    catalogue of thousands of items, and decode them on every hit.
+
+    Attributes:
+        _num_items (int): Number of items of the catalogue.
+        _version (str): The catalogue version, see `catalogue_version`.
+        _memory (TTLLRUCache): Encoded vectors by customer id.
+        _store (Optional[SQLiteVectorStore]): The shared store, if any.
+    """
+
+    def __init__(
+        self,
+        num_items: int,
+        version: str,
+        memory: TTLLRUCache,
+        store: Optional[SQLiteVectorStore] = None,
+    ):
+        self._num_items: int = num_items
+        self._version: str = version
+        self._memory: TTLLRUCache = memory
+        self._store: Optional[SQLiteVectorStore] = store
+
+    def get_many(self, customer_ids: List[int]) -> Dict[int, ndarray]:
+        """
+        Looks up the vectors of several customers.
+
+        Args:
+            customer_ids (List[int]): The customers.
+
+        Returns:
+            Dict[int, ndarray]: The vectors found, by customer id.
+        """
+        encoded: Dict[int, bytes] = {}
+        missing: List[int] = []
+        for customer_id in customer_ids:
+            data: Optional[bytes] = self._memory.get(customer_id)
+            if data is None:
+                missing.append(customer_id)
+            else:
+                encoded[customer_id] = data
+        if missing and self._store is not None:
+            stored: Dict[int, bytes] = self._store.get_many(self._version, missing)
+            for customer_id, data in stored.items():
+                self._memory.put(customer_id, data)
+            encoded.update(stored)
+        vectors: Dict[int, ndarray] = {}
+        for customer_id, data in encoded.items():
+            vector: Optional[ndarray] = decode_vector(data, self._num_items)
+            if vector is not None:
+                vectors[customer_id] = vector
+        return vectors
+
+    def put_many(self, vectors: Dict[int, ndarray]) -> None:
+        """
+        Caches queried vectors in both levels.
+
+        Args:
+            vectors (Dict[int, ndarray]): The vectors by customer id.
+        """
+        encoded: Dict[int, bytes] = {
+            customer_id: encode_vector(vector) for customer_id, vector in vectors.items()
+        }
+        for customer_id, data in encoded.items():
+            self._memory.put(customer_id, data)
+        if self._store is not None:
+            self._store.put_many(self._version, encoded)
+
+    def discard_many(self, customer_ids: Iterable[int]) -> None:
+        """
+        Drops the vectors of customers from both levels.
+
+        Args:
+            customer_ids (Iterable[int]): The customers.
+        """
+        customer_ids = list(customer_ids)
+        for customer_id in customer_ids:
+            self._memory.discard(customer_id)
+        if self._store is not None:
+            self._store.discard_many(self._version, customer_ids)
+
+    def cache_info(self) -> Dict[str, Dict[str, float]]:
+        """
+        Reports the usage of both levels.
+
+        Returns:
+            Dict[str, Dict[str, float]]: The in-process cache usage under
+            "memory" and the shared store usage under "shared", empty when
+            there's no store.
+        """
+        return {
+            "memory": self._memory.cache_info(),
+            "shared": {} if self._store is None else self._store.cache_info(),
+        }
@@ -0,0 +1,124 @@
+"""
+Bounded, thread safe in-memory cache with least recently used eviction and
+time to live expiration.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLLRUCache:
+    """
+    A cache holding at most `max_size` entries for at most `ttl_seconds` each.
+
+    When the cache is full the least recently used entry is evicted. Every
+    operation takes a lock, so a single instance can be shared by the threads
+    of a multi-threaded WSGI server.
+
+    Attributes:
+        _max_size (int): Maximum number of entries, 0 disables the cache.
+        _ttl_seconds (Optional[float]): Lifetime of an entry, None means forever.
+        _clock (Callable[[], float]): Monotonic clock in seconds.
+        _entries (OrderedDict): Entries with their expiration time, least
+        recently used first.
+        _lock (Lock): Lock guarding the entries and counters.
+        hits (int): Number of lookups that found a live entry.
+        misses (int): Number of lookups that didn't.
+        evictions (int): Number of entries dropped to make room for new ones.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl_seconds: Optional[float] = None,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self._max_size: int = max_size
+        self._ttl_seconds: Optional[float] = ttl_seconds
+        self._clock: Callable[[], float] = clock
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Looks up a key, marking it as the most recently used.
+
+        Args:
+            key (Hashable): The key to look up.
+
+        Returns:
+            Optional[Any]: The cached value, or None if the key is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Stores a value, evicting the least recently used entries if needed.
+
+        Args:
+            key (Hashable): The key of the value.
+            value (Any): The value to store.
+        """
+        if self._max_size <= 0:
+            return
+        expires_at = (
+            float("inf") if self._ttl_seconds is None else self._clock() + self._ttl_seconds
+        )
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key: Hashable) -> None:
+        """
+        Drops an entry, if present, e.g. when its value got stale.
+
+        Args:
+            key (Hashable): The key of the entry.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Drops every entry. Counters are kept."""
+        with self._lock:
+            self._entries.clear()
+
+    def cache_info(self) -> Dict[str, float]:
+        """
+        Reports the cache usage.
+
+        Returns:
+            Dict[str, float]: Hits, misses, evictions, current size, maximum
+            size and hit rate of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
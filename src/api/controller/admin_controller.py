@@ -0,0 +1,88 @@
+"""
+API module providing administration endpoints, such as reloading the KNN
+model after it has been retrained.
+"""
+
+from hmac import compare_digest
+from typing import Optional
+
+from flask import Blueprint, Response, current_app, jsonify, request
+
+from api.memory_usage import memory_usage
+from api.model_registry import ModelRegistry
+from api.serving.model_call_limiter import ModelCallLimiter
+from api.updates.order_updater import OrderUpdater
+from api.controller.controller import get_model_registry
+
+
+admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
+
+
+@admin_bp.before_request
+def check_admin_token():
+    """
+    Rejects admin requests without the `X-Admin-Token` header set to the
+    `ADMIN_TOKEN` of the application configuration. Every admin request is
+    rejected when no token is configured.
+
+    Returns:
+        Response: A 403 response if no token is configured or the token is
+        wrong, None otherwise.
+    """
+    admin_token = current_app.config.get("ADMIN_TOKEN")
+    if not admin_token:
+        return jsonify({"Exception": "Admin endpoints are disabled, set ADMIN_TOKEN"}), 403
+    if not compare_digest(request.headers.get("X-Admin-Token", ""), admin_token):
+        return jsonify({"Exception": "Invalid admin token"}), 403
+    return None
+
+
+@admin_bp.route("/model", methods=["GET"])
+def get_model() -> Response:
+    """Endpoint reporting the version and query usage of the model being served.
+
+    Returns:
+        Response: JSON response with the model version, the error of the
+        last failed reload, if any, the BigQuery usage of the model, the
+        progress of the order updates, if enabled, the limits and load of the
+        recommendation calls, if limited, and the memory used by the worker
+        process.
+    """
+    model_registry: ModelRegistry = get_model_registry()
+    order_updater: Optional[OrderUpdater] = current_app.extensions.get("order_updater")
+    model_call_limiter: Optional[ModelCallLimiter] = current_app.extensions.get(
+        "model_call_limiter"
+    )
+    return jsonify(
+        {
+            "model_version": model_registry.model_version,
+            "last_reload_error": model_registry.last_reload_error,
+            "query_stats": (
+                model_registry.get().query_stats() if model_registry.is_loaded else None
+            ),
+            "order_updates": (
+                None
+                if order_updater is None
+                else {**order_updater.stats, "invalid_events": order_updater.invalid_events}
+            ),
+            "model_calls": None if model_call_limiter is None else model_call_limiter.stats(),
+            "worker_memory": memory_usage(),
+        }
+    )
+
+
+@admin_bp.route("/model/reload", methods=["POST"])
+def reload_model() -> Response:
+    """Endpoint loading the model again in the background.
+
+    The current model keeps serving requests until the new one is loaded.
+
+    Returns:
+        Response: 202 if the reload was started, 409 if one is already running.
+    """
+    model_registry: ModelRegistry = get_model_registry()
+    started: bool = model_registry.reload_in_background()
+    return (
+        jsonify({"reload_started": started, "model_version": model_registry.model_version}),
+        202 if started else 409,
+    )
@@ -3,15 +3,151 @@ API module providing an endpoint for item recommendations based on customer
 purchase history. Uses KNN modeling to analyze and suggest items for users.
 """
 
-from flask import Blueprint, Response, request, jsonify
+from typing import TYPE_CHECKING, Any, Callable, Iterator, List, Optional, Tuple
+
+import orjson
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 from flask_wtf.csrf import generate_csrf
 
-from api.knn_model import KNNModel
-from api.controller.request_parser import RequestParser
+from api.metrics import stage
+from api.model_registry import ModelRegistry
+from api.serving.micro_batcher import MicroBatcher
+from api.serving.model_call_limiter import (
+    ModelCallLimiter,
+    ModelCallTimeoutError,
+    OverloadedError,
+)
+from api.serving.single_flight import SingleFlight
+from api.controller.request_parser import PACKED_CONTENT_TYPE, RecommendationRequest
+
+if TYPE_CHECKING:
+    from api.knn_model import KNNModel, Recommendation
 
 
 controller_bp = Blueprint("controller", __name__)
-knn_model = KNNModel(r"src/api/conf/knn_model_conf.json")
+
+
+def get_model_registry() -> ModelRegistry:
+    """
+    Gets the model registry registered with `FlaskAppBuilder.with_recommender`.
+
+    Returns:
+        ModelRegistry: The registry of the current application.
+    """
+    return current_app.extensions["model_registry"]
+
+
+def get_model_call_limiter() -> Optional[ModelCallLimiter]:
+    """
+    Gets the limiter registered with `FlaskAppBuilder.with_model_call_limiter`.
+
+    Returns:
+        Optional[ModelCallLimiter]: The limiter of the current application,
+        None when the calls aren't limited.
+    """
+    return current_app.extensions.get("model_call_limiter")
+
+
+def call_model(function: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Runs a model call within the limits of the application, if any.
+
+    Args:
+        function (Callable[..., Any]): The call.
+        *args: Its positional arguments.
+        **kwargs: Its keyword arguments.
+
+    Raises:
+        OverloadedError: If too many calls are running or waiting.
+        ModelCallTimeoutError: If the call doesn't finish in time.
+
+    Returns:
+        Any: The result of the call.
+    """
+    model_call_limiter: Optional[ModelCallLimiter] = get_model_call_limiter()
+    if model_call_limiter is None:
+        return function(*args, **kwargs)
+    return model_call_limiter.run(function, *args, **kwargs)
+
+
+def recommend(
+    knn_model: "KNNModel", recommendation_request: RecommendationRequest
+) -> "Recommendation":
+    """
+    Runs a recommendation request, coalesced with the identical requests in
+    flight and micro-batched with the concurrent ones when enabled, see
+    `FlaskAppBuilder.with_request_coalescing`.
+
+    Args:
+        knn_model (KNNModel): The model serving the request.
+        recommendation_request (RecommendationRequest): The parsed request.
+
+    Returns:
+        Recommendation: The recommended items and the tier that completed them.
+    """
+    micro_batcher: Optional[MicroBatcher] = current_app.extensions.get("micro_batcher")
+    single_flight: Optional[SingleFlight] = current_app.extensions.get("single_flight")
+    request_kwargs: dict = recommendation_request.as_kwargs()
+
+    def run() -> "Recommendation":
+        if micro_batcher is None:
+            return call_model(knn_model.recommend_with_tier, **request_kwargs)
+        model_call_limiter: Optional[ModelCallLimiter] = get_model_call_limiter()
+        if model_call_limiter is None:
+            return micro_batcher.recommend(knn_model, request_kwargs)
+        # batched calls run on the batcher thread, they only hold a slot while waited for
+        return model_call_limiter.wait(lambda: micro_batcher.submit(knn_model, request_kwargs))
+
+    if single_flight is None:
+        return run()
+    key: Tuple = (
+        knn_model.model_version,
+        recommendation_request.customer_id,
+        tuple(sorted(recommendation_request.item_ids.tolist())),
+        recommendation_request.num_recommendations,
+    )
+    return single_flight.do(key, run)
+
+
+def parse_requests(many: bool = False) -> List[RecommendationRequest]:
+    """
+    Parses the body of the current request, packed when sent with the
+    `application/x-recommend-packed` content type, JSON otherwise.
+
+    Args:
+        many (bool): Whether the body holds a list of requests rather than
+        a single one.
+
+    Raises:
+        ValueError: If the body is empty or invalid.
+
+    Returns:
+        List[RecommendationRequest]: The parsed requests, in order.
+    """
+    if request.mimetype == PACKED_CONTENT_TYPE:
+        if many:
+            return RecommendationRequest.many_from_packed(request.get_data())
+        return [RecommendationRequest.from_packed(request.get_data())]
+    body: Any = orjson.loads(request.get_data()) if request.is_json and request.get_data() else None
+    if many:
+        return RecommendationRequest.many_from_json(body)
+    return [RecommendationRequest.from_json(body)]
+
+
+def overloaded(error: Exception) -> Response:
+    """
+    Builds the response of a request shed because the model is overloaded.
+
+    Args:
+        error (Exception): The reason.
+
+    Returns:
+        Response: A 503 response asking the client to retry a second later.
+    """
+    response = jsonify({"Exception": str(error)})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
 
 
 @controller_bp.route("/get-csrf-token", methods=["GET"])
@@ -33,27 +169,94 @@ def get_csrf_token():
 def recommend_items() -> Response:
     """Endpoint to recommend items for a specific customer based on their purchase history.
 
+    The body is a JSON object, or a single packed request sent with the
+    `application/x-recommend-packed` content type, see `request_parser`.
+
     Raises:
         ValueError: If the JSON request is empty or missing required fields.
 
     Returns:
-        Response: JSON response containing recommended items 
-        or an error message if an exception occurs.
+        Response: JSON response containing recommended items, the tier that
+        completed them and the version of the model that served them, or an
+        error message if an exception occurs: 503 when the model is
+        overloaded, 504 when it doesn't answer in time, 400 otherwise.
     """
     try:
-        json_request = request.get_json(silent=True)
-        if json_request is None:
-            raise ValueError("The given request is empty!")
-        RequestParser(**json_request)
-        recommended_items: list[int] = knn_model.recommend(
-            customer_id=json_request["customer_id"],
-            order_items=json_request["order_items"],
-            num_recommendations=(
-                json_request["num_recommendations"]
-                if json_request.get("num_recommendations")
-                else 3
-            ),
-        )
-        return jsonify({"recommended_items": recommended_items})
+        with stage("parse"):
+            parsed_request: RecommendationRequest = parse_requests()[0]
+        knn_model: "KNNModel" = get_model_registry().get()  # same model for the whole request
+        recommendation: "Recommendation" = recommend(knn_model, parsed_request)
+        with stage("serialise"):
+            return Response(
+                orjson.dumps(
+                    {
+                        "recommended_items": recommendation.item_ids,
+                        "tier": recommendation.tier,
+                        "model_version": knn_model.model_version,
+                    }
+                ),
+                mimetype="application/json",
+            )
+    except OverloadedError as e:
+        return overloaded(e)
+    except (ModelCallTimeoutError, TimeoutError) as e:
+        return jsonify({"Exception": str(e)}), 504
+    except Exception as e:
+        return jsonify({"Exception": str(e)}), 400
+
+
+@controller_bp.route("/items/recommend/batch", methods=["POST"])
+def recommend_items_batch() -> Response:
+    """Endpoint to recommend items for many customers in a single call.
+
+    The request body is a JSON list of recommendation requests, each one shaped
+    like the `/items/recommend` body, or packed requests sent with the
+    `application/x-recommend-packed` content type. Results are streamed back
+    as JSON lines, one line per request and in the same order.
+
+    Raises:
+        ValueError: If the JSON request isn't a non-empty list or any of its
+        requests is missing required fields.
+
+    Returns:
+        Response: Streamed JSON lines containing the recommended items of each
+        customer and the tier that completed them, or an error message if the
+        request is invalid, or 503 when the model is overloaded. The batch
+        holds a model call slot while it streams, but isn't timed out. The
+        version of the model that served the batch is sent in the
+        `X-Model-Version` header.
+    """
+    try:
+        parsed_requests: List[RecommendationRequest] = parse_requests(many=True)
+        knn_model: "KNNModel" = get_model_registry().get()  # same model for the whole batch
     except Exception as e:
         return jsonify({"Exception": str(e)}), 400
+    model_call_limiter: Optional[ModelCallLimiter] = get_model_call_limiter()
+    if model_call_limiter is not None:
+        try:
+            model_call_limiter.admit()
+        except OverloadedError as e:
+            return overloaded(e)
+
+    def generate() -> Iterator[bytes]:
+        recommendations = knn_model.recommend_many_with_tier(
+            parsed_request.as_kwargs() for parsed_request in parsed_requests
+        )
+        for parsed_request, recommendation in zip(parsed_requests, recommendations):
+            yield orjson.dumps(
+                {
+                    "customer_id": parsed_request.customer_id,
+                    "recommended_items": recommendation.item_ids,
+                    "tier": recommendation.tier,
+                },
+                option=orjson.OPT_APPEND_NEWLINE,
+            )
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"X-Model-Version": knn_model.model_version},
+    )
+    if model_call_limiter is not None:
+        response.call_on_close(model_call_limiter.release)  # once streamed or abandoned
+    return response
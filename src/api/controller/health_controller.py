@@ -0,0 +1,33 @@
+"""
+API module providing the readiness endpoint used by the container orchestrator
+to know when the recommender can take traffic.
+"""
+
+from flask import Blueprint, Response, jsonify
+
+from api.model_registry import ModelRegistry
+from api.controller.controller import get_model_registry
+
+
+health_bp = Blueprint("health", __name__)
+
+
+@health_bp.route("/ready", methods=["GET"])
+def ready() -> Response:
+    """Endpoint reporting whether the model and its indexes are loaded.
+
+    Returns:
+        Response: 200 with the model version once the model is loaded and
+        warmed up, 503 otherwise.
+    """
+    model_registry: ModelRegistry = get_model_registry()
+    return (
+        jsonify(
+            {
+                "ready": model_registry.is_ready,
+                "model_version": model_registry.model_version,
+                "last_reload_error": model_registry.last_reload_error,
+            }
+        ),
+        200 if model_registry.is_ready else 503,
+    )
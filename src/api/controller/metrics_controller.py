@@ -0,0 +1,37 @@
+"""
+API module exposing the recommender metrics in the Prometheus text format,
+for the monitoring system to scrape.
+"""
+
+import os
+from typing import List
+
+from flask import Blueprint, Response
+
+from api.metrics import REGISTRY, MetricFamily, model_metrics
+from api.model_registry import ModelRegistry
+from api.controller.controller import get_model_registry
+
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def get_metrics() -> Response:
+    """Endpoint reporting the hot path timings, errors, cache usage and
+    query usage of the worker serving the scrape. Every series is labelled
+    with the pid of the worker, as the workers of the prefork server each
+    count on their own and are scraped in turn.
+
+    Returns:
+        Response: The metrics, in Prometheus text exposition format.
+    """
+    model_registry: ModelRegistry = get_model_registry()
+    extra: List[MetricFamily] = []
+    if model_registry.is_loaded:
+        knn_model = model_registry.get()
+        extra = model_metrics(knn_model.cache_info(), knn_model.query_stats())
+    return Response(
+        REGISTRY.render(extra, labels={"worker": str(os.getpid())}),
+        mimetype="text/plain; version=0.0.4",
+    )
@@ -1,22 +1,229 @@
 """
-Module for parsing and validating incoming JSON requests for item recommendations.
+Module for parsing and validating incoming recommendation requests, sent as
+JSON or, by high-volume internal callers, as packed integers.
+
+A packed body is a sequence of little-endian int64 records, one per request:
+the customer id, the number of recommendations (0 for the default), the
+number of order items, and then the order item ids.
 """
 
-from typing import Optional
+import struct
+from typing import Any, List
+
+import numpy as np
+from numpy import ndarray
 
-from pydantic import BaseModel
+PACKED_CONTENT_TYPE = "application/x-recommend-packed"
+DEFAULT_NUM_RECOMMENDATIONS = 3
+_HEADER = struct.Struct("<qqq")
+_ITEM_ID = np.dtype("<i8")
 
 
-class RequestParser(BaseModel):
+class RecommendationRequest:
     """
-    Parses and validates the input data for item recommendation requests.
+    A parsed recommendation request. The order item ids are parsed once into
+    an array, which `KNNModel` takes as `order_items`, so neither the model
+    nor the controller walk the raw body again.
 
     Attributes:
         customer_id (int): Unique identifier for the customer requesting recommendations.
-        order_items (list): List of items associated with the customer's order.
-        num_recommendations (Optional[int]): Desired number of recommendations, defaults to 3.
+        item_ids (ndarray): The int64 ids of the items in the customer's order.
+        num_recommendations (int): Desired number of recommendations, defaults to 3.
     """
 
-    customer_id: int
-    order_items: list
-    num_recommendations: Optional[int] = 3
+    __slots__ = ("customer_id", "item_ids", "num_recommendations")
+
+    def __init__(
+        self,
+        customer_id: int,
+        item_ids: ndarray,
+        num_recommendations: int = DEFAULT_NUM_RECOMMENDATIONS,
+    ):
+        self.customer_id: int = customer_id
+        self.item_ids: ndarray = item_ids
+        self.num_recommendations: int = num_recommendations
+
+    @classmethod
+    def from_json(cls, body: Any) -> "RecommendationRequest":
+        """
+        Parses a decoded JSON request.
+
+        Args:
+            body (Any): An object with a `customer_id`, a list of
+            `order_items` objects with an `item_id`, and an optional
+            `num_recommendations`.
+
+        Raises:
+            ValueError: If the request is empty or a field is missing or invalid.
+
+        Returns:
+            RecommendationRequest: The parsed request.
+        """
+        if not isinstance(body, dict):
+            raise ValueError("The given request is empty!")
+        try:
+            order_items = body["order_items"]
+            customer_id: int = _to_int(body["customer_id"], "customer_id")
+        except KeyError as e:
+            raise ValueError(f"Field required: {e.args[0]}") from e
+        if not isinstance(order_items, list):
+            raise ValueError("order_items must be a list")
+        try:
+            item_ids = np.fromiter(
+                (_to_int(item["item_id"], "item_id") for item in order_items),
+                dtype=np.int64,
+                count=len(order_items),
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError("Every order item must be an object with an item_id") from e
+        num_recommendations = body.get("num_recommendations")
+        return cls(
+            customer_id,
+            item_ids,
+            (
+                _to_positive_int(num_recommendations, "num_recommendations")
+                if num_recommendations
+                else DEFAULT_NUM_RECOMMENDATIONS
+            ),
+        )
+
+    @classmethod
+    def many_from_json(cls, body: Any) -> List["RecommendationRequest"]:
+        """
+        Parses a decoded JSON list of requests.
+
+        Args:
+            body (Any): A non-empty list of requests, see `from_json`.
+
+        Raises:
+            ValueError: If the list is empty or any request is invalid.
+
+        Returns:
+            List[RecommendationRequest]: The parsed requests, in order.
+        """
+        if not isinstance(body, list) or not body:
+            raise ValueError("The given request must be a non-empty list!")
+        return [cls.from_json(customer_request) for customer_request in body]
+
+    @classmethod
+    def many_from_packed(cls, data: bytes) -> List["RecommendationRequest"]:
+        """
+        Parses packed requests.
+
+        Args:
+            data (bytes): The packed records.
+
+        Raises:
+            ValueError: If the body is empty or a record is truncated or invalid.
+
+        Returns:
+            List[RecommendationRequest]: The parsed requests, in order.
+        """
+        if not data or len(data) % _ITEM_ID.itemsize:
+            raise ValueError("The packed request must be a non-empty sequence of int64 values!")
+        values: ndarray = np.frombuffer(data, dtype=_ITEM_ID)
+        requests: List[RecommendationRequest] = []
+        position = 0
+        while position < len(values):
+            if position + 3 > len(values):
+                raise ValueError("Truncated packed request")
+            customer_id, num_recommendations, num_items = values[position : position + 3].tolist()
+            position += 3
+            if num_recommendations < 0 or num_items < 0 or position + num_items > len(values):
+                raise ValueError("Invalid packed request")
+            requests.append(
+                cls(
+                    customer_id,
+                    values[position : position + num_items],
+                    num_recommendations or DEFAULT_NUM_RECOMMENDATIONS,
+                )
+            )
+            position += num_items
+        return requests
+
+    @classmethod
+    def from_packed(cls, data: bytes) -> "RecommendationRequest":
+        """
+        Parses a single packed request.
+
+        Args:
+            data (bytes): The packed record.
+
+        Raises:
+            ValueError: If the body doesn't hold exactly one valid record.
+
+        Returns:
+            RecommendationRequest: The parsed request.
+        """
+        requests: List[RecommendationRequest] = cls.many_from_packed(data)
+        if len(requests) != 1:
+            raise ValueError(f"Expected a single packed request, got {len(requests)}")
+        return requests[0]
+
+    def to_packed(self) -> bytes:
+        """
+        Packs the request, e.g. for a client.
+
+        Returns:
+            bytes: The packed record.
+        """
+        return _HEADER.pack(
+            self.customer_id, self.num_recommendations, len(self.item_ids)
+        ) + np.asarray(self.item_ids, dtype=_ITEM_ID).tobytes()
+
+    def as_kwargs(self) -> dict:
+        """
+        Gets the request as `KNNModel.recommend` arguments.
+
+        Returns:
+            dict: The `customer_id`, `order_items` and `num_recommendations`.
+        """
+        return {
+            "customer_id": self.customer_id,
+            "order_items": self.item_ids,
+            "num_recommendations": self.num_recommendations,
+        }
+
+
+def _to_int(value: Any, name: str) -> int:
+    """
+    Validates an integer field. Integral floats and decimal strings are
+    accepted, like the former pydantic request model did.
+
+    Args:
+        value (Any): The field value.
+        name (str): The field name, for the error message.
+
+    Raises:
+        ValueError: If the value isn't an integer.
+
+    Returns:
+        int: The value.
+    """
+    if type(value) is int:  # pylint: disable=unidiomatic-typecheck
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().lstrip("+-").isdigit():
+        return int(value)
+    raise ValueError(f"{name} must be an integer, got {value!r}")
+
+
+def _to_positive_int(value: Any, name: str) -> int:
+    """
+    Validates a positive integer field.
+
+    Args:
+        value (Any): The field value.
+        name (str): The field name, for the error message.
+
+    Raises:
+        ValueError: If the value isn't a positive integer.
+
+    Returns:
+        int: The value.
+    """
+    number: int = _to_int(value, name)
+    if number < 1:
+        raise ValueError(f"{name} must be positive, got {number}")
+    return number
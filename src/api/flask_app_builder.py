@@ -1,8 +1,16 @@
-from typing import List
+from time import perf_counter
+from typing import Callable, List, Optional
 
-from flask import Flask, Blueprint
+from flask import Flask, Blueprint, Response, g, request
 from flask_wtf.csrf import CSRFProtect
 
+from api.metrics import REQUEST_SECONDS, enable_tracing
+from api.model_registry import ModelRegistry
+from api.serving.micro_batcher import MicroBatcher
+from api.serving.model_call_limiter import ModelCallLimiter
+from api.serving.single_flight import SingleFlight
+from api.updates.order_updater import OrderUpdater
+
 
 class FlaskAppBuilder:
     """
@@ -69,6 +77,129 @@ class FlaskAppBuilder:
                 self._app.register_blueprint(blueprint)
         return self
 
+    def with_recommender(
+        self,
+        model_registry: ModelRegistry,
+        warm_up: bool = False,
+        warm_up_hook: Optional[Callable] = None,
+    ):
+        """
+        Registers the registry serving the KNN model. The model isn't loaded
+        here, so building the application stays fast.
+
+        Args:
+            model_registry (ModelRegistry): The registry controllers get the
+                model from, stored in `app.extensions["model_registry"]`.
+            warm_up (bool): Whether to start loading the model in the
+                background right away instead of on the first request.
+            warm_up_hook (Optional[Callable]): Called with the loaded model at
+                the end of the warm-up.
+
+        Returns:
+            FlaskAppBuilder: The current instance, allowing method chaining.
+        """
+        self._app.extensions["model_registry"] = model_registry
+        if warm_up:
+            model_registry.warm_up(warm_up_hook)
+        return self
+
+    def with_order_updates(
+        self, order_updater: OrderUpdater, interval_seconds: Optional[float] = None
+    ):
+        """
+        Registers the job applying new orders to the served model.
+
+        Args:
+            order_updater (OrderUpdater): The job, stored in
+                `app.extensions["order_updater"]` so the admin endpoints
+                report its progress.
+            interval_seconds (Optional[float]): Time between two polls of the
+                order events. The job is started when set, and polled
+                manually otherwise.
+
+        Returns:
+            FlaskAppBuilder: The current instance, allowing method chaining.
+        """
+        self._app.extensions["order_updater"] = order_updater
+        if interval_seconds is not None:
+            order_updater.start(interval_seconds)
+        return self
+
+    def with_model_call_limiter(self, model_call_limiter: ModelCallLimiter):
+        """
+        Bounds the recommendation calls running or waiting at once, and how
+        long a request waits for its call. Requests past the limits get a
+        503, and the ones timing out a 504.
+
+        Args:
+            model_call_limiter (ModelCallLimiter): The limits, stored in
+                `app.extensions["model_call_limiter"]`.
+
+        Returns:
+            FlaskAppBuilder: The current instance, allowing method chaining.
+        """
+        self._app.extensions["model_call_limiter"] = model_call_limiter
+        return self
+
+    def with_request_coalescing(
+        self,
+        single_flight: Optional[SingleFlight] = None,
+        micro_batcher: Optional[MicroBatcher] = None,
+    ):
+        """
+        Answers concurrent identical recommendation requests, same customer,
+        order items and number of recommendations, with a single model call,
+        and optionally gathers the requests arriving within a few
+        milliseconds into one batched model call.
+
+        Args:
+            single_flight (Optional[SingleFlight]): Collapses the identical
+                requests, stored in `app.extensions["single_flight"]`. A new
+                one by default.
+            micro_batcher (Optional[MicroBatcher]): Batches the requests left,
+                stored in `app.extensions["micro_batcher"]`, if any.
+
+        Returns:
+            FlaskAppBuilder: The current instance, allowing method chaining.
+        """
+        self._app.extensions["single_flight"] = single_flight or SingleFlight()
+        if micro_batcher is not None:
+            self._app.extensions["micro_batcher"] = micro_batcher
+        return self
+
+    def with_metrics(self, tracing: bool = False):
+        """
+        Times every request in the `recommender_http_request_seconds`
+        histogram, by endpoint, method and status code.
+
+        Args:
+            tracing (bool): Whether to also trace the hot path stages as
+                OpenTelemetry spans, exported by the global tracer provider.
+
+        Returns:
+            FlaskAppBuilder: The current instance, allowing method chaining.
+        """
+
+        def start_timer() -> None:
+            g.request_start = perf_counter()
+
+        def record_duration(response: Response) -> Response:
+            start: Optional[float] = g.pop("request_start", None)
+            if start is not None:
+                REQUEST_SECONDS.observe(
+                    perf_counter() - start,
+                    request.url_rule.rule if request.url_rule else "unmatched",
+                    request.method,
+                    str(response.status_code),
+                )
+            return response
+
+        self._app.before_request(start_timer)
+        self._app.after_request(record_duration)
+        if tracing:
+            enable_tracing()
+        return self
+
     def build(self) -> Flask:
         """
         Builds and returns the configured Flask application instance.
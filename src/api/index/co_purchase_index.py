@@ -0,0 +1,278 @@
+"""
+Item-to-item index of the items most often bought together, used to
+recommend from the items of a purchase order without any customer vector.
+"""
+
+import os
+from typing import List, Optional
+
+import numpy as np
+from numpy import ndarray
+from scipy.sparse import csr_matrix, diags
+
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.index.purchase_count_index import top_scored
+
+
+class CoPurchaseIndex:
+    """
+    The top-K co-purchased items of every item, kept as a sparse item x item
+    matrix: row `i` holds the number of customers who bought both item `i`
+    and each of its K most co-purchased items. Co-purchases are counted once
+    per customer, so a few big buyers don't drive them.
+
+    Attributes:
+        item_ids (ndarray): Sorted item ids, one per row and column.
+        matrix (csr_matrix): The co-purchase counts.
+    """
+
+    def __init__(self, item_ids: ndarray, matrix: csr_matrix):
+        if matrix.shape != (len(item_ids), len(item_ids)):
+            raise ValueError(
+                f"Matrix shape {matrix.shape} doesn't match {len(item_ids)} items."
+            )
+        self.item_ids: ndarray = item_ids
+        self.matrix: csr_matrix = matrix
+
+    @classmethod
+    def build(
+        cls, counts: CustomerItemsMatrix, top_k: int, batch_size: int = 1024
+    ) -> "CoPurchaseIndex":
+        """
+        Counts the co-purchases of the customer-item matrix with a sparse
+        item x item product, `batch_size` items at a time so the full
+        product is never held in memory.
+
+        Args:
+            counts (CustomerItemsMatrix): Purchase counts by customer and item.
+            top_k (int): Co-purchased items kept per item.
+            batch_size (int): Items whose co-purchases are counted at once.
+
+        Returns:
+            CoPurchaseIndex: The index of the given purchases.
+        """
+        matrix: csr_matrix = counts.matrix
+        bought = csr_matrix(
+            (np.ones(len(matrix.data)), matrix.indices, matrix.indptr), shape=matrix.shape
+        )  # one per (customer, item) pair, whatever the quantity
+        buyers: csr_matrix = bought.T.tocsr()
+        columns: List[ndarray] = []
+        scores: List[ndarray] = []
+        for start in range(0, counts.num_items, batch_size):
+            _keep_top_k(
+                buyers[start : start + batch_size] @ bought,
+                start,
+                counts.item_ids,
+                top_k,
+                columns,
+                scores,
+            )
+        indptr = np.cumsum([0] + [len(row_columns) for row_columns in columns])
+        return cls(
+            counts.item_ids,
+            csr_matrix(
+                (
+                    np.concatenate([np.empty(0), *scores]),
+                    np.concatenate([np.empty(0, dtype=np.int64), *columns]),
+                    indptr,
+                ),
+                shape=(counts.num_items, counts.num_items),
+            ),
+        )
+
+    def save(self, directory: str) -> None:
+        """
+        Writes the index as `.npy` files, which can be memory-mapped when loaded.
+
+        Args:
+            directory (str): An existing directory to write the files to.
+        """
+        for name in ("data", "indices", "indptr"):
+            np.save(os.path.join(directory, f"co_purchase_{name}.npy"), getattr(self.matrix, name))
+
+    @classmethod
+    def load(
+        cls, directory: str, item_ids: ndarray, mmap_mode: Optional[str] = None
+    ) -> Optional["CoPurchaseIndex"]:
+        """
+        Loads an index written by `save`.
+
+        Args:
+            directory (str): The directory holding the index files.
+            item_ids (ndarray): The items of the customer-item matrix the
+            index was built from.
+            mmap_mode (Optional[str]): Memory-map the arrays instead of reading
+            them, e.g. "r", see `numpy.load`.
+
+        Returns:
+            Optional[CoPurchaseIndex]: The loaded index, or None when the
+            directory doesn't hold one.
+        """
+        paths: List[str] = [
+            os.path.join(directory, f"co_purchase_{name}.npy")
+            for name in ("data", "indices", "indptr")
+        ]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        data, indices, indptr = (np.load(path, mmap_mode=mmap_mode) for path in paths)
+        return cls(item_ids, csr_matrix((data, indices, indptr), shape=(len(item_ids),) * 2))
+
+    @property
+    def top_k(self) -> int:
+        """int: The largest number of co-purchased items kept for an item."""
+        return int(np.diff(self.matrix.indptr).max(initial=0))
+
+    def scores_many(self, order_item_ids: List[List[int]]) -> csr_matrix:
+        """
+        Adds up the co-purchase counts of the items of several orders at once,
+        with a single sparse product.
+
+        Args:
+            order_item_ids (List[List[int]]): The items of every order,
+            unknown ones being ignored.
+
+        Returns:
+            csr_matrix: A (len(order_item_ids), num_items) matrix of scores.
+        """
+        rows: List[ndarray] = [self._rows(item_ids) for item_ids in order_item_ids]
+        selection = csr_matrix(
+            (
+                np.ones(sum(len(order_rows) for order_rows in rows)),
+                np.concatenate([np.empty(0, dtype=np.int64), *rows]),
+                np.cumsum([0] + [len(order_rows) for order_rows in rows]),
+            ),
+            shape=(len(rows), len(self.item_ids)),
+        )
+        return selection @ self.matrix
+
+    def top_items(
+        self, order_item_ids: List[int], excluded_item_ids: List[int], num_items: int
+    ) -> ndarray:
+        """
+        Finds the items most bought together with the items of an order.
+
+        Args:
+            order_item_ids (List[int]): The items in the purchase order.
+            excluded_item_ids (List[int]): Items that can't be returned.
+            num_items (int): The maximum number of items to return.
+
+        Returns:
+            ndarray: Item ids sorted by total co-purchases with the order
+            items, ties broken by item id.
+        """
+        scores: ndarray = self.scores_many([order_item_ids]).toarray().ravel()
+        scores[self._rows(excluded_item_ids)] = 0
+        return self.item_ids[top_scored(scores, self.item_ids, num_items)]
+
+    def _rows(self, item_ids: List[int]) -> ndarray:
+        """
+        Maps item ids to rows, dropping the unknown ones.
+
+        Args:
+            item_ids (List[int]): Item ids to map.
+
+        Returns:
+            ndarray: The rows of the known items.
+        """
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        if self.item_ids.size == 0 or item_ids.size == 0:
+            return np.empty(0, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.item_ids, item_ids), len(self.item_ids) - 1)
+        return rows[self.item_ids[rows] == item_ids]
+
+
+def _keep_top_k(
+    together: csr_matrix,
+    start: int,
+    item_ids: ndarray,
+    top_k: int,
+    columns: List[ndarray],
+    scores: List[ndarray],
+) -> None:
+    """
+    Keeps the top-K co-purchased items of a batch of items.
+
+    Args:
+        together (csr_matrix): The co-purchase counts of the batch items, one
+        row per item.
+        start (int): The column of the first item of the batch.
+        item_ids (ndarray): Sorted item ids, one per column.
+        top_k (int): Co-purchased items kept per item.
+        columns (List[ndarray]): The columns kept for every item, appended to.
+        scores (List[ndarray]): The counts kept for every item, appended to.
+    """
+    for row in range(together.shape[0]):
+        segment = slice(together.indptr[row], together.indptr[row + 1])
+        row_columns: ndarray = together.indices[segment]
+        row_scores: ndarray = np.where(
+            row_columns == start + row, 0, together.data[segment]
+        )  # an item isn't bought together with itself
+        top: ndarray = top_scored(row_scores, item_ids[row_columns], top_k)
+        columns.append(row_columns[top])
+        scores.append(row_scores[top])
+
+
+def blend_scores(
+    knn_scores: csr_matrix, co_purchase_scores: csr_matrix, weight: float
+) -> csr_matrix:
+    """
+    Blends two score matrices row by row, each row being scaled by its
+    maximum first so both scores weigh the same whatever their magnitude.
+
+    Args:
+        knn_scores (csr_matrix): The purchases of the similar customers of
+        every request.
+        co_purchase_scores (csr_matrix): The co-purchases with the order items
+        of every request.
+        weight (float): The weight of the co-purchases, between 0 and 1.
+
+    Returns:
+        csr_matrix: `(1 - weight) * knn + weight * co_purchase`, normalised.
+    """
+    return _scale_rows(knn_scores, 1 - weight) + _scale_rows(co_purchase_scores, weight)
+
+
+def _scale_rows(scores: csr_matrix, weight: float) -> csr_matrix:
+    """
+    Scales every row so its maximum becomes `weight`.
+
+    Args:
+        scores (csr_matrix): Non-negative scores.
+        weight (float): The maximum of every non-empty row once scaled.
+
+    Returns:
+        csr_matrix: The scaled scores.
+    """
+    maxima: ndarray = scores.max(axis=1).toarray().ravel().astype(np.float64)
+    factors = np.divide(weight, maxima, out=np.zeros_like(maxima), where=maxima > 0)
+    return diags(factors) @ scores
+
+
+def top_scored_rows(
+    scores: csr_matrix,
+    item_ids: ndarray,
+    excluded_item_ids: List[List[int]],
+    num_items: List[int],
+) -> List[List[int]]:
+    """
+    Ranks the items of every row of a score matrix.
+
+    Args:
+        scores (csr_matrix): A (requests, num_items) score matrix.
+        item_ids (ndarray): Sorted item ids, one per column.
+        excluded_item_ids (List[List[int]]): The items each row can't return.
+        num_items (List[int]): The maximum number of items of every row.
+
+    Returns:
+        List[List[int]]: The item ids of every row, best first and ties
+        broken by item id.
+    """
+    ranked: List[List[int]] = []
+    for row, (excluded, num) in enumerate(zip(excluded_item_ids, num_items)):
+        segment = slice(scores.indptr[row], scores.indptr[row + 1])
+        columns: ndarray = scores.indices[segment]
+        row_scores: ndarray = np.where(
+            np.isin(item_ids[columns], excluded), 0, scores.data[segment]
+        )
+        ranked.append(item_ids[columns[top_scored(row_scores, item_ids[columns], num)]].tolist())
+    return ranked
@@ -0,0 +1,363 @@
+"""
+In-memory sparse customer-item matrix used to serve customer purchase vectors
+without querying BigQuery on every request.
+"""
+
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+from numpy import ndarray
+from pandas import DataFrame, read_parquet
+from scipy.sparse import csr_matrix
+
+from api.index.item_catalogue import ItemCatalogue
+
+
+class CustomerItemsMatrix:
+    """
+    A customer x item matrix stored in CSR format.
+
+    Rows follow the ascending order of customer ids and columns the ascending
+    order of item ids, which is the same layout `DataFrame.pivot_table` produces
+    when the KNN model is trained, so row positions returned by `kneighbors`
+    can be mapped back to customer ids.
+
+    Purchases added after the matrix was built are kept apart in a small
+    delta matrix, see `add_purchases`: the vectors returned include them,
+    but `customer_ids` and `matrix` only do once `merge_delta` is called.
+
+    Attributes:
+        customer_ids (ndarray): Sorted customer ids, one per matrix row.
+        item_ids (ndarray): Sorted item ids, one per matrix column.
+        matrix (csr_matrix): The customer x item interactions.
+        delta (Optional[CustomerItemsMatrix]): The purchases added since the
+        matrix was built, with the same columns, None when there are none.
+    """
+
+    def __init__(
+        self,
+        customer_ids: ndarray,
+        item_ids: ndarray,
+        matrix: csr_matrix,
+        delta: Optional["CustomerItemsMatrix"] = None,
+    ):
+        if matrix.shape != (len(customer_ids), len(item_ids)):
+            raise ValueError(
+                f"Matrix shape {matrix.shape} doesn't match "
+                f"{len(customer_ids)} customers and {len(item_ids)} items."
+            )
+        self.customer_ids: ndarray = customer_ids
+        self.item_ids: ndarray = item_ids
+        self.matrix: csr_matrix = matrix
+        self.delta: Optional[CustomerItemsMatrix] = delta
+
+    @classmethod
+    def from_dataframe(
+        cls,
+        interactions: DataFrame,
+        customer_col: str = "customer_id",
+        item_col: str = "item_id",
+        value_col: str = "interaction",
+    ) -> "CustomerItemsMatrix":
+        """
+        Builds the matrix from a long format DataFrame, such as the result of
+        the `customers_items_matrix` training query.
+
+        Args:
+            interactions (DataFrame): One row per (customer, item) pair.
+            customer_col (str): Name of the customer id column.
+            item_col (str): Name of the item id column.
+            value_col (str): Name of the interaction value column. When the
+            column is missing every row counts as one interaction, so a raw
+            export of exploded orders can be used as well.
+
+        Returns:
+            CustomerItemsMatrix: The matrix built from the given interactions.
+        """
+        customers: ndarray = interactions[customer_col].to_numpy(dtype=np.int64)
+        items: ndarray = interactions[item_col].to_numpy(dtype=np.int64)
+        values: ndarray = (
+            interactions[value_col].to_numpy(dtype=np.float64)
+            if value_col in interactions.columns
+            else np.ones(len(interactions), dtype=np.float64)
+        )
+        customer_ids, rows = np.unique(customers, return_inverse=True)
+        item_ids, cols = np.unique(items, return_inverse=True)
+        matrix = csr_matrix(
+            (values, (rows, cols)), shape=(len(customer_ids), len(item_ids))
+        )  # duplicated (customer, item) pairs are summed up
+        return cls(customer_ids, item_ids, matrix)
+
+    @classmethod
+    def from_parquet(cls, path: str, **kwargs) -> "CustomerItemsMatrix":
+        """
+        Builds the matrix from a Parquet export of customer-item interactions.
+
+        Args:
+            path (str): Path of the Parquet file or directory.
+            **kwargs: Column names forwarded to `from_dataframe`.
+
+        Returns:
+            CustomerItemsMatrix: The matrix built from the Parquet export.
+        """
+        return cls.from_dataframe(read_parquet(path), **kwargs)
+
+    def save(self, directory: str) -> None:
+        """
+        Writes the ids and the CSR arrays of the matrix, delta merged, as
+        `.npy` files, which can be memory-mapped when loaded. Every file is
+        written next to its final path and renamed, so the readers still
+        mapping the previous files keep reading them.
+
+        Args:
+            directory (str): An existing directory to write the files to.
+        """
+        merged: CustomerItemsMatrix = self.merge_delta()
+        for name, values in [
+            ("customer_ids", merged.customer_ids),
+            ("item_ids", merged.item_ids),
+            ("matrix_data", merged.matrix.data),
+            ("matrix_indices", merged.matrix.indices),
+            ("matrix_indptr", merged.matrix.indptr),
+        ]:
+            path = os.path.join(directory, f"{name}.npy")
+            staging_path = f"{path}.tmp.npy"
+            np.save(staging_path, values)
+            os.replace(staging_path, path)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: Optional[str] = None) -> "CustomerItemsMatrix":
+        """
+        Loads a matrix written by `save`.
+
+        Args:
+            directory (str): The directory holding the matrix files.
+            mmap_mode (Optional[str]): Memory-map the arrays instead of reading
+            them, e.g. "r", see `numpy.load`.
+
+        Returns:
+            CustomerItemsMatrix: The loaded matrix.
+        """
+
+        def load_array(name: str) -> ndarray:
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        customer_ids, item_ids = load_array("customer_ids"), load_array("item_ids")
+        matrix = csr_matrix(
+            (load_array("matrix_data"), load_array("matrix_indices"), load_array("matrix_indptr")),
+            shape=(len(customer_ids), len(item_ids)),
+        )
+        return cls(customer_ids, item_ids, matrix)
+
+    def add_purchases(
+        self, customer_ids: ndarray, item_ids: ndarray
+    ) -> Tuple["CustomerItemsMatrix", int]:
+        """
+        Adds purchases to the delta of the counts, in time linear in the size
+        of the delta: the matrix itself, possibly memory-mapped and shared
+        with other processes, isn't copied. Items out of the catalogue are
+        dropped, since the model has no feature for them.
+
+        Args:
+            customer_ids (ndarray): The customer of every purchase.
+            item_ids (ndarray): The purchased item of every purchase.
+
+        Returns:
+            Tuple[CustomerItemsMatrix, int]: A new matrix, this one being left
+            unchanged for the readers still using it, and the number of
+            purchases of unknown items.
+        """
+        customer_ids = np.asarray(customer_ids, dtype=np.int64)
+        columns, known = ItemCatalogue(self.item_ids).columns(item_ids)
+        new_customer_ids, rows = np.unique(customer_ids[known], return_inverse=True)
+        purchases = CustomerItemsMatrix(
+            new_customer_ids,
+            self.item_ids,
+            csr_matrix(
+                (np.ones(len(rows)), (rows, columns[known])),
+                shape=(len(new_customer_ids), self.num_items),
+            ),  # duplicated (customer, item) pairs are summed up
+        )
+        delta = purchases if self.delta is None else self.delta.merge(purchases)
+        return CustomerItemsMatrix(self.customer_ids, self.item_ids, self.matrix, delta), int(
+            np.count_nonzero(~known)
+        )
+
+    def merge(self, other: "CustomerItemsMatrix") -> "CustomerItemsMatrix":
+        """
+        Sums up two matrices with the same columns, the customers of the other
+        one getting a row in customer id order. Deltas are left out.
+
+        Args:
+            other (CustomerItemsMatrix): The counts to add.
+
+        Returns:
+            CustomerItemsMatrix: A new matrix, in memory.
+        """
+        all_customer_ids: ndarray = np.union1d(self.customer_ids, other.customer_ids)
+        current, added = self.matrix.tocoo(), other.matrix.tocoo()
+        matrix = csr_matrix(
+            (
+                np.concatenate([current.data, added.data]),
+                (
+                    np.concatenate([
+                        np.searchsorted(all_customer_ids, self.customer_ids)[current.row],
+                        np.searchsorted(all_customer_ids, other.customer_ids)[added.row],
+                    ]),
+                    np.concatenate([current.col, added.col]),
+                ),
+            ),
+            shape=(len(all_customer_ids), self.num_items),
+        )
+        return CustomerItemsMatrix(all_customer_ids, self.item_ids, matrix)
+
+    def merge_delta(self) -> "CustomerItemsMatrix":
+        """
+        Merges the delta into the matrix, in time linear in the number of
+        stored interactions, e.g. when the neighbour index is rebuilt.
+
+        Returns:
+            CustomerItemsMatrix: A matrix without delta, this one if it has none.
+        """
+        if self.delta is None:
+            return self
+        return CustomerItemsMatrix(self.customer_ids, self.item_ids, self.matrix).merge(
+            self.delta
+        )
+
+    @property
+    def num_items(self) -> int:
+        """int: Number of items (columns) in the matrix."""
+        return len(self.item_ids)
+
+    def customer_row(self, customer_id: int) -> Optional[int]:
+        """
+        Finds the matrix row of a customer. Customers only found in the
+        delta have no row.
+
+        Args:
+            customer_id (int): The customer id to look for.
+
+        Returns:
+            Optional[int]: The row position, or None if the customer is unknown.
+        """
+        row = int(np.searchsorted(self.customer_ids, customer_id))
+        if row < len(self.customer_ids) and self.customer_ids[row] == customer_id:
+            return row
+        return None
+
+    def customer_rows(self, customer_ids: ndarray) -> ndarray:
+        """
+        Maps customer ids to matrix rows, dropping the unknown ones.
+
+        Args:
+            customer_ids (ndarray): Customer ids to map.
+
+        Returns:
+            ndarray: The row positions of the known customers.
+        """
+        return _positions(self.customer_ids, customer_ids)
+
+    def item_columns(self, item_ids: ndarray) -> ndarray:
+        """
+        Maps item ids to matrix columns, dropping the unknown ones.
+
+        Args:
+            item_ids (ndarray): Item ids to map.
+
+        Returns:
+            ndarray: The column positions of the known items.
+        """
+        return _positions(self.item_ids, item_ids)
+
+    def has_customer(self, customer_id: int) -> bool:
+        """
+        Tells whether a customer has purchases, in the matrix or its delta.
+
+        Args:
+            customer_id (int): The customer id to look for.
+
+        Returns:
+            bool: True if the customer is known.
+        """
+        return self.customer_row(customer_id) is not None or (
+            self.delta is not None and self.delta.has_customer(customer_id)
+        )
+
+    def get_row(self, customer_id: int) -> Optional[ndarray]:
+        """
+        Returns the dense interaction vector of a customer, delta included.
+
+        Args:
+            customer_id (int): The customer whose vector is wanted.
+
+        Returns:
+            Optional[ndarray]: A (1, num_items) array, or None if the customer
+            is unknown.
+        """
+        row = self.customer_row(customer_id)
+        delta_row: Optional[ndarray] = (
+            None if self.delta is None else self.delta.get_row(customer_id)
+        )
+        if row is None:
+            return delta_row
+        vector: ndarray = self.matrix[row].toarray()
+        return vector if delta_row is None else vector + delta_row
+
+    def get_rows(self, customer_ids: ndarray) -> Tuple[ndarray, ndarray]:
+        """
+        Returns the dense interaction vectors of several customers at once,
+        delta included.
+
+        Args:
+            customer_ids (ndarray): The customers whose vectors are wanted.
+
+        Returns:
+            Tuple[ndarray, ndarray]: A (len(customer_ids), num_items) array,
+            with zero rows for unknown customers, and a boolean mask telling
+            which customers are known.
+        """
+        customer_ids = np.asarray(customer_ids, dtype=np.int64)
+        vectors = np.zeros((len(customer_ids), self.num_items), dtype=self.matrix.dtype)
+        known = np.zeros(len(customer_ids), dtype=bool)
+        if self.customer_ids.size:
+            rows = np.minimum(
+                np.searchsorted(self.customer_ids, customer_ids), len(self.customer_ids) - 1
+            )
+            known = self.customer_ids[rows] == customer_ids
+            vectors[known] = self.matrix[rows[known]].toarray()
+        if self.delta is not None:
+            delta_vectors, delta_known = self.delta.get_rows(customer_ids)
+            vectors, known = vectors + delta_vectors, known | delta_known
+        return vectors, known
+
+    def to_customer_ids(self, rows: ndarray) -> ndarray:
+        """
+        Maps matrix rows, e.g. the output of `kneighbors`, to customer ids.
+
+        Args:
+            rows (ndarray): Row positions.
+
+        Returns:
+            ndarray: The customer ids of the given rows.
+        """
+        return self.customer_ids[rows]
+
+
+def _positions(sorted_ids: ndarray, ids: ndarray) -> ndarray:
+    """
+    Finds the positions of the given ids in a sorted id array.
+
+    Args:
+        sorted_ids (ndarray): Sorted, unique ids.
+        ids (ndarray): Ids to look for.
+
+    Returns:
+        ndarray: The positions of the ids found in `sorted_ids`.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if sorted_ids.size == 0:
+        return np.empty(0, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return positions[sorted_ids[positions] == ids]
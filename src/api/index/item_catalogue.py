@@ -0,0 +1,102 @@
+"""
+The item catalogue a model was trained on: the item id of every feature
+column, saved with the model so serving builds customer vectors in the
+exact layout the model was fitted with.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+
+class ItemCatalogue:
+    """
+    Sorted item ids, the position of an item being its model column.
+
+    Items outside the catalogue, e.g. added to the shop after training, have
+    no column: they are reported as unknown rather than shifting the columns
+    of the others.
+
+    Attributes:
+        item_ids (ndarray): Sorted item ids, one per model column.
+    """
+
+    def __init__(self, item_ids: ndarray):
+        item_ids = np.asarray(item_ids)
+        if np.any(item_ids[1:] <= item_ids[:-1]):
+            raise ValueError("The catalogue item ids must be sorted and unique.")
+        self.item_ids: ndarray = item_ids
+
+    @property
+    def num_items(self) -> int:
+        """int: Number of items, the number of features of the model."""
+        return len(self.item_ids)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the item ids as a `.npy` file.
+
+        Args:
+            path (str): The file to write.
+        """
+        np.save(path, np.asarray(self.item_ids, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = None) -> "ItemCatalogue":
+        """
+        Loads a catalogue written by `save`.
+
+        Args:
+            path (str): The `.npy` file.
+            mmap_mode (Optional[str]): Memory-map the ids instead of reading
+            them, e.g. "r", see `numpy.load`.
+
+        Returns:
+            ItemCatalogue: The loaded catalogue.
+        """
+        return cls(np.load(path, mmap_mode=mmap_mode))
+
+    def columns(self, item_ids: ndarray) -> Tuple[ndarray, ndarray]:
+        """
+        Maps item ids to their columns.
+
+        Args:
+            item_ids (ndarray): The item ids.
+
+        Returns:
+            Tuple[ndarray, ndarray]: The column of every item, meaningless
+            for unknown items, and whether every item is in the catalogue.
+        """
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        if not self.num_items:
+            return np.zeros(len(item_ids), dtype=np.int64), np.zeros(len(item_ids), dtype=bool)
+        columns: ndarray = np.minimum(np.searchsorted(self.item_ids, item_ids), self.num_items - 1)
+        return columns, self.item_ids[columns] == item_ids
+
+    def vectors(
+        self, rows: ndarray, item_ids: ndarray, values: ndarray, num_rows: int
+    ) -> Tuple[ndarray, int]:
+        """
+        Builds customer vectors by scattering their purchases into the
+        catalogue columns, in time linear in the number of purchases.
+
+        Args:
+            rows (ndarray): The vector row of every purchase.
+            item_ids (ndarray): The purchased item of every purchase.
+            values (ndarray): The interaction of every purchase, e.g. counts.
+            num_rows (int): Number of vectors.
+
+        Returns:
+            Tuple[ndarray, int]: A (num_rows, num_items) array, values of the
+            same customer and item summed up, and the number of purchases of
+            unknown items, left out.
+        """
+        columns, known = self.columns(item_ids)
+        vectors: ndarray = np.zeros((num_rows, self.num_items))
+        np.add.at(
+            vectors,
+            (np.asarray(rows)[known], columns[known]),
+            np.asarray(values, dtype=np.float64)[known],
+        )
+        return vectors, int(np.count_nonzero(~known))
@@ -0,0 +1,61 @@
+"""
+In-memory top-K array of the most bought items, used to recommend items to
+customers without similar customers nor co-purchases.
+"""
+
+from typing import List
+
+import numpy as np
+from numpy import ndarray
+
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.index.purchase_count_index import top_scored
+
+
+class PopularityIndex:
+    """
+    The items most bought overall, ties broken by item id, answering the
+    last cold-start tier in constant time.
+
+    Attributes:
+        popular (ndarray): The top-K popular item ids.
+    """
+
+    def __init__(self, popular: ndarray):
+        self.popular: ndarray = popular
+
+    @classmethod
+    def build(cls, counts: CustomerItemsMatrix, top_k: int) -> "PopularityIndex":
+        """
+        Ranks the items from the purchase counts.
+
+        Args:
+            counts (CustomerItemsMatrix): Purchase counts by customer and item.
+            top_k (int): Items kept.
+
+        Returns:
+            PopularityIndex: The ranking of the given purchases.
+        """
+        totals: ndarray = np.asarray(counts.matrix.sum(axis=0)).ravel()
+        return cls(counts.item_ids[top_scored(totals, counts.item_ids, top_k)])
+
+    def recommend_popular(self, excluded_item_ids: List[int], num_items: int) -> List[int]:
+        """
+        Picks the most popular items.
+
+        Args:
+            excluded_item_ids (List[int]): Items that can't be returned, e.g.
+            the ones already in the purchase order.
+            num_items (int): The maximum number of items to return.
+
+        Returns:
+            List[int]: The item ids, most bought first.
+        """
+        excluded = set(excluded_item_ids)
+        items: List[int] = []
+        for item_id in self.popular.tolist():
+            if len(items) == num_items:
+                break
+            if item_id not in excluded:
+                items.append(item_id)
+        return items
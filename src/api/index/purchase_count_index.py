@@ -0,0 +1,184 @@
+"""
+In-memory index of how many times each customer bought each item, used to
+find the most sold items among a group of similar customers without querying
+BigQuery.
+"""
+
+from typing import List
+
+import numpy as np
+from numpy import ndarray
+from pandas import DataFrame
+from scipy.sparse import csr_matrix
+
+from api.index.customer_items_matrix import CustomerItemsMatrix
+
+
+class PurchaseCountIndex:
+    """
+    Per-customer item purchase counts kept as a sparse customer x item matrix,
+    the purchases added since it was built counted from its delta.
+
+    Attributes:
+        _counts (CustomerItemsMatrix): Purchase counts, one row per customer
+        and one column per item.
+    """
+
+    def __init__(self, counts: CustomerItemsMatrix):
+        self._counts: CustomerItemsMatrix = counts
+
+    @classmethod
+    def from_dataframe(cls, orders: DataFrame, **kwargs) -> "PurchaseCountIndex":
+        """
+        Builds the index from exploded orders, one row per purchased item.
+
+        Args:
+            orders (DataFrame): Exploded orders with customer and item ids. An
+            optional `interaction` column holds the purchased quantity.
+            **kwargs: Column names forwarded to `CustomerItemsMatrix.from_dataframe`.
+
+        Returns:
+            PurchaseCountIndex: The index built from the given orders.
+        """
+        return cls(CustomerItemsMatrix.from_dataframe(orders, **kwargs))
+
+    @classmethod
+    def from_parquet(cls, path: str, **kwargs) -> "PurchaseCountIndex":
+        """
+        Builds the index from a Parquet export of exploded orders.
+
+        Args:
+            path (str): Path of the Parquet file or directory.
+            **kwargs: Column names forwarded to `CustomerItemsMatrix.from_dataframe`.
+
+        Returns:
+            PurchaseCountIndex: The index built from the Parquet export.
+        """
+        return cls(CustomerItemsMatrix.from_parquet(path, **kwargs))
+
+    def add_purchases(self, customer_ids: ndarray, item_ids: ndarray) -> "PurchaseCountIndex":
+        """
+        Adds purchases to the delta of the counts, see
+        `CustomerItemsMatrix.add_purchases`.
+
+        Args:
+            customer_ids (ndarray): The customer of every purchase.
+            item_ids (ndarray): The purchased item of every purchase.
+
+        Returns:
+            PurchaseCountIndex: A new index, this one being left unchanged.
+        """
+        return PurchaseCountIndex(self._counts.add_purchases(customer_ids, item_ids)[0])
+
+    def merge_delta(self) -> "PurchaseCountIndex":
+        """
+        Merges the purchases added so far into the counts, see
+        `CustomerItemsMatrix.merge_delta`.
+
+        Returns:
+            PurchaseCountIndex: A new index, this one being left unchanged.
+        """
+        return PurchaseCountIndex(self._counts.merge_delta())
+
+    def item_totals(self, customer_ids: ndarray) -> ndarray:
+        """
+        Adds up the purchase counts of the given customers per item.
+
+        Args:
+            customer_ids (ndarray): The customers whose purchases are counted.
+            Unknown customers are ignored.
+
+        Returns:
+            ndarray: Total purchases of every item, aligned with the index columns.
+        """
+        matrix = self._counts.matrix
+        rows: ndarray = self._counts.customer_rows(customer_ids)
+        totals: ndarray = np.zeros(self._counts.num_items, dtype=np.float64)
+        if rows.size:
+            segments = [slice(matrix.indptr[row], matrix.indptr[row + 1]) for row in rows]
+            totals = np.bincount(
+                np.concatenate([matrix.indices[segment] for segment in segments]),
+                weights=np.concatenate([matrix.data[segment] for segment in segments]),
+                minlength=self._counts.num_items,
+            )
+        if self._counts.delta is not None:
+            totals += PurchaseCountIndex(self._counts.delta).item_totals(customer_ids)
+        return totals
+
+    def top_items(
+        self, customer_ids: ndarray, excluded_item_ids: ndarray, num_items: int
+    ) -> ndarray:
+        """
+        Finds the items most bought by the given customers.
+
+        Args:
+            customer_ids (ndarray): The customers whose purchases are counted.
+            excluded_item_ids (ndarray): Items that can't be returned, e.g.
+            the ones already in the purchase order.
+            num_items (int): The maximum number of items to return.
+
+        Returns:
+            ndarray: Item ids sorted by total purchases, most bought first
+            and ties broken by item id. Items nobody in the group bought are
+            never returned.
+        """
+        totals: ndarray = self.item_totals(customer_ids)
+        totals[self._counts.item_columns(excluded_item_ids)] = 0
+        return self._counts.item_ids[top_scored(totals, self._counts.item_ids, num_items)]
+
+    def item_totals_many(self, customer_id_groups: List[ndarray]) -> csr_matrix:
+        """
+        Adds up the purchase counts of several groups of customers at once,
+        with a single sparse product.
+
+        Args:
+            customer_id_groups (List[ndarray]): The customers of every group.
+            Unknown customers are ignored.
+
+        Returns:
+            csr_matrix: A (len(customer_id_groups), num_items) matrix of the
+            total purchases of every group.
+        """
+        rows: List[ndarray] = [self._counts.customer_rows(group) for group in customer_id_groups]
+        selection = csr_matrix(
+            (
+                np.ones(sum(len(group_rows) for group_rows in rows)),
+                np.concatenate([np.empty(0, dtype=np.int64), *rows]),
+                np.cumsum([0] + [len(group_rows) for group_rows in rows]),
+            ),
+            shape=(len(rows), len(self._counts.customer_ids)),
+        )
+        totals: csr_matrix = selection @ self._counts.matrix
+        if self._counts.delta is not None:
+            totals = totals + PurchaseCountIndex(self._counts.delta).item_totals_many(
+                customer_id_groups
+            )
+        return totals
+
+    @property
+    def item_ids(self) -> ndarray:
+        """ndarray: Sorted item ids, aligned with the item totals."""
+        return self._counts.item_ids
+
+
+def top_scored(scores: ndarray, item_ids: ndarray, num_items: int) -> ndarray:
+    """
+    Ranks the items with a positive score, best first and ties broken by
+    item id, without sorting the whole catalogue.
+
+    Args:
+        scores (ndarray): A score per item.
+        item_ids (ndarray): The id of every item.
+        num_items (int): The maximum number of items to return.
+
+    Returns:
+        ndarray: The positions of the best items.
+    """
+    positive: ndarray = np.flatnonzero(scores > 0)
+    num_items = min(num_items, len(positive))
+    if num_items <= 0:
+        return np.empty(0, dtype=np.int64)
+    lowest_kept: float = -np.partition(-scores[positive], num_items - 1)[num_items - 1]
+    candidates = positive[scores[positive] >= lowest_kept]  # every item tied with the last one
+    ranking = np.lexsort((item_ids[candidates], -scores[candidates]))
+    return candidates[ranking[:num_items]]
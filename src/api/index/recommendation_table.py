@@ -0,0 +1,280 @@
+"""
+Precomputed neighbours and ranked candidate items of every known customer, so
+recommendations for them are served without any neighbour search or purchase
+lookup.
+"""
+
+import os
+from typing import List, Optional, Set
+
+import numpy as np
+from numpy import ndarray
+from scipy.sparse import csr_matrix
+
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.neighbours.neighbour_search import NeighbourSearch
+
+PADDING = -1  # fills candidate slots past the items the neighbours bought
+
+
+class RecommendationTable:
+    """
+    One record per customer, sorted by customer id, holding:
+        - `customer_id`.
+        - `neighbours`: the similar customers, without the customer itself.
+        - `candidates`: the items most bought by the neighbours, most bought
+          first and ties broken by item id, padded with -1.
+
+    The records are a single NumPy structured array, saved as one `.npy` file
+    that can be memory-mapped and replaced atomically.
+
+    Since candidates are ranked exactly like `PurchaseCountIndex.top_items`,
+    removing the order items and slicing gives the same recommendations as the
+    live path, as long as enough candidates are left.
+
+    Attributes:
+        records (ndarray): The structured records.
+    """
+
+    def __init__(self, records: ndarray):
+        self.records: ndarray = records
+
+    @staticmethod
+    def record_dtype(num_neighbours: int, num_candidates: int) -> np.dtype:
+        """
+        Gets the type of the records of a table.
+
+        Args:
+            num_neighbours (int): Similar customers kept per customer.
+            num_candidates (int): Candidate items kept per customer.
+
+        Returns:
+            np.dtype: The structured record type.
+        """
+        return np.dtype([
+            ("customer_id", np.int64),
+            ("neighbours", np.int64, (num_neighbours,)),
+            ("candidates", np.int64, (num_candidates,)),
+        ])
+
+    @classmethod
+    def build(
+        cls,
+        counts: CustomerItemsMatrix,
+        search: NeighbourSearch,
+        similar_customers_number: int,
+        num_candidates: int,
+        customer_ids: Optional[ndarray] = None,
+        batch_size: int = 256,
+    ) -> "RecommendationTable":
+        """
+        Computes the records of the given customers, in batches of
+        `kneighbors` calls and sparse sums of the neighbours' purchases.
+
+        Args:
+            counts (CustomerItemsMatrix): The purchase counts the model was
+            fitted on, giving both the customer vectors and the purchases.
+            search (NeighbourSearch): The neighbour search engine of the model.
+            similar_customers_number (int): Number of neighbours asked to
+            `kneighbors`, the first one being the customer itself.
+            num_candidates (int): Candidate items kept per customer.
+            customer_ids (Optional[ndarray]): Customers to compute, all the
+            customers in `counts` by default. Unknown ones are skipped.
+            batch_size (int): Customers per `kneighbors` call.
+
+        Returns:
+            RecommendationTable: The table of the given customers.
+        """
+        rows: ndarray = (
+            np.arange(len(counts.customer_ids))
+            if customer_ids is None
+            else counts.customer_rows(np.unique(customer_ids))
+        )
+        records = np.empty(
+            len(rows), dtype=cls.record_dtype(similar_customers_number - 1, num_candidates)
+        )
+        records["customer_id"] = counts.customer_ids[rows]
+        for start in range(0, len(rows), batch_size):
+            batch = slice(start, start + batch_size)
+            _, neighbour_rows = search.kneighbors(
+                counts.matrix[rows[batch]].toarray(), n_neighbors=similar_customers_number
+            )
+            neighbour_rows = neighbour_rows[:, 1:]  # the first one is the customer itself
+            records["neighbours"][batch] = counts.to_customer_ids(neighbour_rows)
+            records["candidates"][batch] = _rank_candidates(counts, neighbour_rows, num_candidates)
+        return cls(records)
+
+    def affected_customers(self, changed_customer_ids: ndarray) -> ndarray:
+        """
+        Finds the records affected by new purchases: the customers who bought,
+        whose vectors and so neighbours changed, and the customers having them
+        as neighbours, whose candidates changed.
+
+        Args:
+            changed_customer_ids (ndarray): The customers who bought.
+
+        Returns:
+            ndarray: The sorted ids of the customers to refresh.
+        """
+        changed_customer_ids = np.asarray(changed_customer_ids, dtype=np.int64)
+        having_changed_neighbours = np.isin(self.records["neighbours"], changed_customer_ids)
+        return np.union1d(
+            changed_customer_ids,
+            self.records["customer_id"][having_changed_neighbours.any(axis=1)],
+        )
+
+    def refresh(
+        self,
+        counts: CustomerItemsMatrix,
+        search: NeighbourSearch,
+        customer_ids: ndarray,
+        batch_size: int = 256,
+    ) -> "RecommendationTable":
+        """
+        Recomputes the records of some customers, e.g. the ones returned by
+        `affected_customers`, keeping the others as they are until the next
+        full build. Customers that aren't in the table yet are added.
+
+        Args:
+            counts (CustomerItemsMatrix): The updated purchase counts.
+            search (NeighbourSearch): The neighbour search engine of the model.
+            customer_ids (ndarray): The customers to recompute.
+            batch_size (int): Customers per `kneighbors` call.
+
+        Returns:
+            RecommendationTable: A new table, the current one is unchanged.
+        """
+        refreshed: RecommendationTable = RecommendationTable.build(
+            counts,
+            search,
+            self.num_neighbours + 1,
+            self.num_candidates,
+            customer_ids=customer_ids,
+            batch_size=batch_size,
+        )
+        kept = self.records[~np.isin(self.records["customer_id"], refreshed.records["customer_id"])]
+        records = np.concatenate([kept, refreshed.records])
+        return RecommendationTable(records[np.argsort(records["customer_id"], kind="stable")])
+
+    def save(self, path: str) -> None:
+        """
+        Writes the table to a `.npy` file. The file is written next to its
+        final path and renamed, so readers never see a partial table.
+
+        Args:
+            path (str): Path of the file.
+        """
+        staging_path = f"{path}.tmp.npy"
+        np.save(staging_path, self.records)
+        os.replace(staging_path, path)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = None) -> "RecommendationTable":
+        """
+        Loads a table written by `save`.
+
+        Args:
+            path (str): Path of the file.
+            mmap_mode (Optional[str]): Memory-map the records instead of
+            reading them, e.g. "r", see `numpy.load`.
+
+        Returns:
+            RecommendationTable: The loaded table.
+        """
+        return cls(np.load(path, mmap_mode=mmap_mode))
+
+    @property
+    def num_neighbours(self) -> int:
+        """int: Similar customers kept per customer."""
+        return self.records.dtype["neighbours"].shape[0]
+
+    @property
+    def num_candidates(self) -> int:
+        """int: Candidate items kept per customer."""
+        return self.records.dtype["candidates"].shape[0]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def find(self, customer_id: int) -> Optional[int]:
+        """
+        Finds the record of a customer.
+
+        Args:
+            customer_id (int): The customer to look for.
+
+        Returns:
+            Optional[int]: The record position, or None if the customer isn't
+            in the table.
+        """
+        customer_ids: ndarray = self.records["customer_id"]
+        position = int(np.searchsorted(customer_ids, customer_id))
+        if position < len(customer_ids) and customer_ids[position] == customer_id:
+            return position
+        return None
+
+    def recommend(
+        self, customer_id: int, excluded_item_ids: List[int], num_recommendations: int
+    ) -> Optional[List[int]]:
+        """
+        Picks the recommended items of a customer from its candidates.
+
+        Args:
+            customer_id (int): The customer.
+            excluded_item_ids (List[int]): Items that can't be returned, e.g.
+            the ones already in the purchase order.
+            num_recommendations (int): The maximum number of items to return.
+
+        Returns:
+            Optional[List[int]]: The recommended item ids, or None when the
+            customer isn't in the table or too few candidates are left once
+            the excluded items are removed, the live path answering then.
+        """
+        position: Optional[int] = self.find(customer_id)
+        if position is None:
+            return None
+        excluded: Set[int] = set(excluded_item_ids)
+        recommended: List[int] = []
+        for item_id in self.records["candidates"][position].tolist():
+            if item_id == PADDING:
+                return recommended  # every item the neighbours bought was seen
+            if item_id not in excluded:
+                recommended.append(item_id)
+                if len(recommended) == num_recommendations:
+                    return recommended
+        return None
+
+
+def _rank_candidates(
+    counts: CustomerItemsMatrix, neighbour_rows: ndarray, num_candidates: int
+) -> ndarray:
+    """
+    Ranks the items most bought by each group of neighbours.
+
+    Args:
+        counts (CustomerItemsMatrix): The purchase counts.
+        neighbour_rows (ndarray): A (customers, neighbours) array of rows.
+        num_candidates (int): Items kept per customer.
+
+    Returns:
+        ndarray: A (customers, num_candidates) array of item ids, most bought
+        first and ties broken by item id, padded with -1.
+    """
+    num_customers, num_neighbours = neighbour_rows.shape
+    selection = csr_matrix(
+        (
+            np.ones(neighbour_rows.size),
+            (np.repeat(np.arange(num_customers), num_neighbours), neighbour_rows.ravel()),
+        ),
+        shape=(num_customers, counts.matrix.shape[0]),
+    )
+    totals: csr_matrix = selection @ counts.matrix  # purchases of each group, per item
+    candidates = np.full((num_customers, num_candidates), PADDING, dtype=np.int64)
+    for customer in range(num_customers):
+        segment = slice(totals.indptr[customer], totals.indptr[customer + 1])
+        scores: ndarray = totals.data[segment]
+        item_ids: ndarray = counts.item_ids[totals.indices[segment]]
+        bought = scores > 0
+        ranking = np.lexsort((item_ids[bought], -scores[bought]))[:num_candidates]
+        candidates[customer, : len(ranking)] = item_ids[bought][ranking]
+    return candidates
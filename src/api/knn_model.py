@@ -1,25 +1,112 @@
+# pylint: disable=too-many-lines
 """
 Module for generating personalized item recommendations for customers 
 based on past purchase data and similarity to other customers.
 """
 
-from typing import List
+import logging
+from concurrent.futures import Future
+from hashlib import file_digest
+from itertools import islice
+from threading import Lock, Thread
+from typing import (
+    TYPE_CHECKING, Any, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Set,
+    Tuple, Union,
+)
 
-from google.cloud.bigquery import Client
 from credit_risk_lib.config.config import Config
 from credit_risk_lib.config.config_factory import ConfigFactory
-from sklearn.neighbors import NearestNeighbors
+import numpy as np
 from numpy import ndarray
 from pandas import DataFrame
 
 from joblib import load
-from api.queries.customer_items_array import QUERY as CUSTOMER_ITEMS_ARRAY_QUERY
+from sklearn.base import clone
+from api.cache.customer_vector_cache import (
+    CustomerVectorCache, SQLiteVectorStore, catalogue_version,
+)
+from api.cache.ttl_lru_cache import TTLLRUCache
+from api.index.co_purchase_index import CoPurchaseIndex, blend_scores, top_scored_rows
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.index.item_catalogue import ItemCatalogue
+from api.index.popularity_index import PopularityIndex
+from api.index.purchase_count_index import PurchaseCountIndex
+from api.index.recommendation_table import RecommendationTable
+from api.metrics import INDEX_REBUILDS, stage
+from api.neighbours.neighbour_search import NeighbourSearch
+from api.neighbours.neighbour_search_factory import NeighbourSearchFactory
+from api.queries.query_executor import QueryExecutor, chain_future
+from api.queries.query_executor_factory import QueryExecutorFactory
+from api.queries.query_runner import QueryRunner
+from api.queries.customer_items_array import (
+    PARAMETERISED_QUERY as CUSTOMER_ITEMS_ARRAY_QUERY,
+)
+from api.queries.customers_purchases import PARAMETERISED_QUERY as CUSTOMERS_PURCHASES_QUERY
 from api.queries.most_sold_products_for_customer import (
-    QUERY as MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY,
+    PARAMETERISED_QUERY as MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY,
 )  # pylint: disable=line-too-long
 
+if TYPE_CHECKING:
+    from google.cloud.bigquery import Client
+    from sklearn.neighbors import NearestNeighbors
 
-class KNNModel:
+
+logger = logging.getLogger(__name__)
+
+KNN_TIER = "knn"  # items most bought by the similar customers
+BLEND_TIER = "blend"  # the similar customers' items blended with the co-purchases
+CO_PURCHASE_TIER = "co_purchase"  # items most bought together with the order items
+POPULAR_TIER = "popular"  # items most bought overall
+
+
+class Recommendation(NamedTuple):
+    """
+    The recommended items of a request and the tier that completed them.
+
+    Attributes:
+        item_ids (List[int]): The recommended item IDs.
+        tier (str): The last tier consulted: "knn", or "blend" in the blend
+        scoring mode, when the similar customers were enough, "co_purchase"
+        or "popular" when the cold-start tiers had to fill in.
+    """
+
+    item_ids: List[int]
+    tier: str
+
+
+
+class NeighbourIndex(NamedTuple):
+    """
+    A neighbour search engine and the customers of its rows, swapped together
+    when the index is rebuilt.
+
+    Attributes:
+        search (NeighbourSearch): Engine used to find similar customers.
+        customer_ids (Optional[ndarray]): Customer id of every row of the
+        search data, None when no customer-item matrix is loaded and
+        `kneighbors` positions are returned as they are.
+    """
+
+    search: NeighbourSearch
+    customer_ids: Optional[ndarray]
+
+    def to_customer_ids(self, neighbours: ndarray) -> ndarray:
+        """
+        Maps the positions returned by `kneighbors` to customer ids.
+
+        Args:
+            neighbours (ndarray): Row positions in the search data.
+
+        Returns:
+            ndarray: The customer ids, or the positions themselves when the
+            customers of the rows are unknown.
+        """
+        if self.customer_ids is None:
+            return neighbours
+        return self.customer_ids[neighbours]
+
+
+class KNNModel:  # pylint: disable=too-many-instance-attributes
     """
     A K-Nearest Neighbors (KNN) model class for generating personalized
     item recommendations for customers based on past purchase data and
@@ -34,18 +121,550 @@ class KNNModel:
         such as paths and settings for the number of similar customers.
         _model (NearestNeighbors): Pre-trained NearestNeighbors model for
         finding similar customers.
-        _bq_client (Client): BigQuery client used for querying customer data.
+        _mmap_mode (Optional[str]): How the fitted data of the model and the
+        artefacts matrix are memory-mapped, e.g. "r", so the worker processes
+        of a node share a single page cache backed copy. None reads them into
+        the memory of every worker.
+        _neighbour_index (NeighbourIndex): Engine used to find similar
+        customers, the exact model or an approximate index over its data,
+        with the customers of its rows. Rebuilt in the background once the
+        orders applied with `apply_orders` changed more than
+        `index_rebuild_drift` of its customers.
+        _query_executor (QueryExecutor): Runs the queries on the backend set
+        with `query_backend`, BigQuery on a bounded thread pool with pooled
+        clients by default or SQLite over local Parquet exports.
+        _query_runner (QueryRunner): Runs the parameterised queries on the
+        executor, caching up to `query_cache_size` results for
+        `query_cache_ttl_seconds`.
+        _item_catalogue (Optional[ItemCatalogue]): The item of every model
+        column, loaded from `item_catalogue_path` or taken from the
+        customer-item matrix. Customer vectors are then built from the
+        purchases of the customers, otherwise queried as dense rows over the
+        whole item table.
+        _unknown_item_purchases (int): Queried purchases of items out of the
+        catalogue, left out of the customer vectors.
+        _customer_vector_cache (Optional[CustomerVectorCache]): Vectors of
+        the customers queried from BigQuery, up to
+        `customer_vector_cache_size` in memory, in front of the SQLite
+        database at `customer_vector_store_path` shared by the workers of the
+        node, both expired after `customer_vector_cache_ttl_seconds`. None
+        when neither is set, the query result cache keeping them then.
+        _customer_items_matrix (Optional[CustomerItemsMatrix]): In-memory
+        customer-item matrix loaded from `artefacts_dir` or
+        `customer_items_matrix_path`, used to serve customer vectors without
+        querying BigQuery.
+        _purchase_count_index (Optional[PurchaseCountIndex]): In-memory
+        purchase counts loaded from `artefacts_dir` or `purchase_counts_path`,
+        used to find the items most bought by similar customers without
+        querying BigQuery.
+        _recommendation_table (Optional[RecommendationTable]): Precomputed
+        neighbours and candidate items of the known customers, loaded from
+        `recommendation_table_path`, answering their requests without any
+        neighbour search.
+        _co_purchase_index (Optional[CoPurchaseIndex]): The
+        `co_purchase_top_k` (default 50) items most bought together with
+        every item, loaded from `artefacts_dir` or built from the
+        customer-item matrix.
+        _popularity_index (Optional[PopularityIndex]): The `fallback_top_k`
+        (default 50) items most bought overall, built from the customer-item
+        matrix. With the co-purchases, it answers the customers missing from
+        the matrix and completes recommendations when the similar customers
+        don't give enough items.
+        _scoring_mode (str): How known customers are scored, with
+        `scoring_mode`: "knn" (default) ranks the items most bought by the
+        similar customers, "blend" blends them with the co-purchases of the
+        order items, weighted with `blend_weight` (default 0.5).
+        _model_version (str): Digest of the model pickle, identifying the
+        loaded model.
+        _neighbours_cache (TTLLRUCache): Customer vectors and similar
+        customers by (model version, customer id), sized with
+        `neighbours_cache_size` and expired after `neighbours_cache_ttl_seconds`.
+        _update_lock (Lock): Serialises the order updates and index swaps.
+        _changed_customers (Set[int]): Customers with orders applied since
+        the neighbour index was built.
+        _stale_customers (FrozenSet[int]): Customers whose precomputed
+        recommendations are out of date, answered live until the table is
+        refreshed by the next index rebuild.
+        _rebuild_thread (Optional[Thread]): The running index rebuild, if any.
+        _rebuild_purchases (Optional[List[Tuple[ndarray, ndarray]]]): The
+        purchases applied while an index rebuild runs, added again to the
+        matrix it merged. None when no rebuild runs.
     """
 
-    def __init__(self, knn_model_conf_path: str, bq_client: Client = None):
+    def __init__(
+        self,
+        knn_model_conf_path: str,
+        bq_client: "Client" = None,
+        query_executor: Optional[QueryExecutor] = None,
+    ):
         self._conf: Config = ConfigFactory.get_conf(knn_model_conf_path)
-        self._model: NearestNeighbors = load(self._conf.model_pkl_path)
-        self._bq_client = Client() if bq_client is None else bq_client
+        self._mmap_mode: Optional[str] = getattr(self._conf, "mmap_mode", None)
+        self._model: "NearestNeighbors" = load(
+            self._conf.model_pkl_path, mmap_mode=self._mmap_mode
+        )
+        self._model_version: str = _file_version(self._conf.model_pkl_path)
+        self._query_executor: QueryExecutor = query_executor or QueryExecutorFactory.get_executor(
+            self._conf, bq_client
+        )
+        self._query_runner = QueryRunner(
+            self._query_executor,
+            TTLLRUCache(
+                max_size=getattr(self._conf, "query_cache_size", None) or 0,
+                ttl_seconds=getattr(self._conf, "query_cache_ttl_seconds", None),
+            ),
+        )
+        self._customer_items_matrix: Optional[CustomerItemsMatrix] = (
+            self._load_customer_items_matrix()
+        )
+        self._purchase_count_index: Optional[PurchaseCountIndex] = (
+            self._load_purchase_count_index()
+        )
+        self._recommendation_table: Optional[RecommendationTable] = (
+            self._load_recommendation_table()
+        )
+        self._co_purchase_index: Optional[CoPurchaseIndex] = self._load_co_purchase_index()
+        self._popularity_index: Optional[PopularityIndex] = self._build_popularity_index(
+            self._customer_items_matrix
+        )
+        self._item_catalogue: Optional[ItemCatalogue] = self._load_item_catalogue()
+        self._unknown_item_purchases: int = 0
+        self._customer_vector_cache: Optional[CustomerVectorCache] = (
+            self._build_customer_vector_cache()
+        )
+        self._scoring_mode: str = self._check_scoring_mode()
+        self._neighbour_index = NeighbourIndex(
+            NeighbourSearchFactory.get_search(self._model, self._conf),
+            (
+                None
+                if self._customer_items_matrix is None
+                else self._customer_items_matrix.customer_ids
+            ),
+        )
+        self._neighbours_cache = TTLLRUCache(
+            max_size=getattr(self._conf, "neighbours_cache_size", None) or 0,
+            ttl_seconds=getattr(self._conf, "neighbours_cache_ttl_seconds", None),
+        )
+        self._update_lock = Lock()
+        self._changed_customers: Set[int] = set()
+        self._stale_customers: FrozenSet[int] = frozenset()
+        self._rebuild_thread: Optional[Thread] = None
+        self._rebuild_purchases: Optional[List[Tuple[ndarray, ndarray]]] = None
+
+    @property
+    def model_version(self) -> str:
+        """str: Identifier of the loaded model, derived from its pickle content."""
+        return self._model_version
+
+    @property
+    def model_pkl_path(self) -> str:
+        """str: Path of the pickle the model was loaded from."""
+        return self._conf.model_pkl_path
+
+    @property
+    def _neighbour_search(self) -> NeighbourSearch:
+        """NeighbourSearch: Engine of the current neighbour index."""
+        return self._neighbour_index.search
+
+    @property
+    def recommendation_table_path(self) -> Optional[str]:
+        """Optional[str]: Path of the precomputed recommendation table, if any."""
+        return getattr(self._conf, "recommendation_table_path", None)
+
+    def cache_info(self) -> Dict[str, float]:
+        """
+        Reports the usage of the similar customers cache.
+
+        Returns:
+            Dict[str, float]: Hits, misses, evictions, size and hit rate.
+        """
+        return self._neighbours_cache.cache_info()
+
+    def query_stats(self) -> Dict:
+        """
+        Reports the BigQuery queries run by the model.
+
+        Returns:
+            Dict: Runs, wall time, bytes processed and BigQuery cache hits of
+            every query, the usage of the local query result cache, the
+            queried purchases of items out of the catalogue and, under
+            "customer_vectors", the usage of the customer vector cache.
+        """
+        stats: Dict = self._query_runner.query_stats()
+        stats["unknown_item_purchases"] = self._unknown_item_purchases
+        if self._customer_vector_cache is not None:
+            stats["customer_vectors"] = self._customer_vector_cache.cache_info()
+        return stats
+
+    def _load_customer_items_matrix(self) -> Optional[CustomerItemsMatrix]:
+        """
+        Loads the customer-item matrix set in the configuration, if any: the
+        purchase counts written by the training pipeline in `artefacts_dir`,
+        or a Parquet export in `customer_items_matrix_path`.
+
+        Raises:
+            ValueError: If the matrix doesn't have as many items as the model
+            has features, or as many customers as the model has rows, its
+            customers mapping the neighbour rows back to customer ids.
+
+        Returns:
+            Optional[CustomerItemsMatrix]: The loaded matrix, or None when no
+            export is configured.
+        """
+        artefacts_dir: Optional[str] = getattr(self._conf, "artefacts_dir", None)
+        matrix_path: Optional[str] = getattr(
+            self._conf, "customer_items_matrix_path", None
+        )
+        if artefacts_dir:
+            matrix = CustomerItemsMatrix.load(artefacts_dir, mmap_mode=self._mmap_mode)
+        elif matrix_path:
+            matrix = CustomerItemsMatrix.from_parquet(matrix_path)
+        else:
+            return None
+        if matrix.num_items != self._model.n_features_in_:
+            raise ValueError(
+                f"The customer items matrix has {matrix.num_items} items but the "
+                f"model was trained with {self._model.n_features_in_}."
+            )
+        if len(matrix.customer_ids) != self._model.n_samples_fit_:
+            raise ValueError(
+                f"The customer items matrix has {len(matrix.customer_ids)} customers but "
+                f"the model was trained with {self._model.n_samples_fit_}, e.g. customers "
+                "without purchases are missing from the export."
+            )
+        return matrix
+
+    def _load_item_catalogue(self) -> Optional[ItemCatalogue]:
+        """
+        Loads the item catalogue saved with the model in
+        `item_catalogue_path`, or takes the items of the customer-item matrix.
+
+        Raises:
+            ValueError: If the catalogue doesn't have as many items as the
+            model has features, or other items than the customer-item matrix.
+
+        Returns:
+            Optional[ItemCatalogue]: The catalogue, or None when neither is set.
+        """
+        catalogue_path: Optional[str] = getattr(self._conf, "item_catalogue_path", None)
+        matrix: Optional[CustomerItemsMatrix] = self._customer_items_matrix
+        if catalogue_path:
+            catalogue = ItemCatalogue.load(catalogue_path, mmap_mode=self._mmap_mode)
+        elif matrix is not None:
+            return ItemCatalogue(matrix.item_ids)  # checked against the model when loaded
+        else:
+            return None
+        if catalogue.num_items != self._model.n_features_in_:
+            raise ValueError(
+                f"The item catalogue has {catalogue.num_items} items but the "
+                f"model was trained with {self._model.n_features_in_}."
+            )
+        if matrix is not None and not np.array_equal(matrix.item_ids, catalogue.item_ids):
+            raise ValueError("The customer items matrix and the item catalogue have other items.")
+        return catalogue
+
+    def _build_customer_vector_cache(self) -> Optional[CustomerVectorCache]:
+        """
+        Builds the cache of the customer vectors queried from BigQuery,
+        versioned by the items of the catalogue when loaded, by the number
+        of features of the model otherwise.
+
+        Returns:
+            Optional[CustomerVectorCache]: The cache, None when neither
+            `customer_vector_cache_size` nor `customer_vector_store_path`
+            is set.
+        """
+        max_size: int = getattr(self._conf, "customer_vector_cache_size", None) or 0
+        store_path: Optional[str] = getattr(self._conf, "customer_vector_store_path", None)
+        if not max_size and not store_path:
+            return None
+        ttl_seconds: Optional[float] = getattr(
+            self._conf, "customer_vector_cache_ttl_seconds", None
+        )
+        num_items: int = self._model.n_features_in_
+        return CustomerVectorCache(
+            num_items,
+            catalogue_version(
+                num_items,
+                None if self._item_catalogue is None else self._item_catalogue.item_ids,
+            ),
+            TTLLRUCache(max_size=max_size, ttl_seconds=ttl_seconds),
+            SQLiteVectorStore(store_path, ttl_seconds) if store_path else None,
+        )
+
+    def _load_purchase_count_index(self) -> Optional[PurchaseCountIndex]:
+        """
+        Loads the purchase counts set in the configuration, if any. The
+        training pipeline artefacts hold a single matrix that serves both as
+        customer vectors and purchase counts.
+
+        Raises:
+            ValueError: If the purchase counts are configured without the
+            customer items matrix, since neighbours can't be mapped to
+            customer ids then.
+
+        Returns:
+            Optional[PurchaseCountIndex]: The loaded index, or None when no
+            export is configured.
+        """
+        if getattr(self._conf, "artefacts_dir", None):
+            return PurchaseCountIndex(self._customer_items_matrix)
+        counts_path: Optional[str] = getattr(self._conf, "purchase_counts_path", None)
+        if not counts_path:
+            return None
+        if self._customer_items_matrix is None:
+            raise ValueError(
+                "purchase_counts_path requires customer_items_matrix_path to be set."
+            )
+        return PurchaseCountIndex.from_parquet(counts_path)
+
+    def _load_recommendation_table(self) -> Optional[RecommendationTable]:
+        """
+        Loads the precomputed recommendation table set in the configuration,
+        if any.
+
+        Raises:
+            ValueError: If the table wasn't computed with the configured
+            number of similar customers.
+
+        Returns:
+            Optional[RecommendationTable]: The loaded table, or None when no
+            table is configured.
+        """
+        if not self.recommendation_table_path:
+            return None
+        table = RecommendationTable.load(self.recommendation_table_path, mmap_mode=self._mmap_mode)
+        if table.num_neighbours != self._conf.similar_customers_number - 1:
+            raise ValueError(
+                f"The recommendation table has {table.num_neighbours} neighbours per customer "
+                f"but similar_customers_number is {self._conf.similar_customers_number}."
+            )
+        return table
+
+    def _build_popularity_index(
+        self, matrix: Optional[CustomerItemsMatrix]
+    ) -> Optional[PopularityIndex]:
+        """
+        Ranks the popular items of the customer-item matrix.
+
+        Args:
+            matrix (Optional[CustomerItemsMatrix]): The matrix, if loaded.
+
+        Returns:
+            Optional[PopularityIndex]: The rankings, or None without matrix or
+            when `fallback_top_k` is 0.
+        """
+        top_k: Optional[int] = getattr(self._conf, "fallback_top_k", None)
+        if matrix is None or top_k == 0:
+            return None
+        with stage("popularity_index"):
+            return PopularityIndex.build(matrix, top_k or 50)
+
+    def _load_co_purchase_index(self) -> Optional[CoPurchaseIndex]:
+        """
+        Loads the co-purchases written by the training pipeline in
+        `artefacts_dir`, or builds them from the customer-item matrix.
+
+        Returns:
+            Optional[CoPurchaseIndex]: The index, or None without matrix or
+            when `co_purchase_top_k` is 0.
+        """
+        top_k: Optional[int] = getattr(self._conf, "co_purchase_top_k", None)
+        if self._customer_items_matrix is None or top_k == 0:
+            return None
+        artefacts_dir: Optional[str] = getattr(self._conf, "artefacts_dir", None)
+        if artefacts_dir:
+            index: Optional[CoPurchaseIndex] = CoPurchaseIndex.load(
+                artefacts_dir, self._customer_items_matrix.item_ids, mmap_mode=self._mmap_mode
+            )
+            if index is not None:
+                return index
+        with stage("co_purchase_index"):
+            return CoPurchaseIndex.build(self._customer_items_matrix, top_k or 50)
+
+    def _check_scoring_mode(self) -> str:
+        """
+        Reads the scoring mode set in the configuration.
+
+        Raises:
+            ValueError: If the mode is unknown, or is "blend" without
+            in-memory purchase counts and co-purchases over the same items.
+
+        Returns:
+            str: The scoring mode.
+        """
+        scoring_mode: str = getattr(self._conf, "scoring_mode", None) or "knn"
+        if scoring_mode not in ("knn", "blend"):
+            raise ValueError(f"Unknown scoring mode: {scoring_mode}")
+        if scoring_mode == "blend" and (
+            self._purchase_count_index is None
+            or self._co_purchase_index is None
+            or not np.array_equal(
+                self._purchase_count_index.item_ids, self._co_purchase_index.item_ids
+            )
+        ):
+            raise ValueError(
+                "The blend scoring mode requires the purchase counts and the co-purchases "
+                "of the same items to be loaded."
+            )
+        return scoring_mode
+
+    def _is_cold(self, customer_id: int) -> bool:
+        """
+        Tells whether a customer has no purchases to find similar customers
+        with: the customer-item matrix holds every customer who bought, so
+        the ones missing from it are answered by the cold-start tiers
+        without querying their vector.
+
+        Args:
+            customer_id (int): The customer.
+
+        Returns:
+            bool: True if the customer is cold and the cold-start tiers are loaded.
+        """
+        return (
+            self._popularity_index is not None or self._co_purchase_index is not None
+        ) and not self._customer_items_matrix.has_customer(customer_id)
+
+    def _complete(
+        self,
+        item_ids: List[int],
+        recommended_items: List[int],
+        num_recommendations: int,
+        tier: str = KNN_TIER,
+    ) -> Recommendation:
+        """
+        Fills the recommendations the similar customers couldn't give, first
+        with the items most bought together with the order items and then
+        with the most popular ones.
+
+        Args:
+            item_ids (list[int]): The items in the purchase order.
+            recommended_items (list[int]): The items recommended so far.
+            num_recommendations (int): The number of recommended items wanted.
+            tier (str): The tier that gave the items recommended so far.
+
+        Returns:
+            Recommendation: The recommended items and the last tier consulted.
+        """
+        if len(recommended_items) >= num_recommendations:
+            return Recommendation(recommended_items, tier)
+        with stage("fallback"):
+            recommended_items = list(recommended_items)
+            if self._co_purchase_index is not None and tier != BLEND_TIER:
+                tier = CO_PURCHASE_TIER
+                recommended_items += self._co_purchase_index.top_items(
+                    item_ids,
+                    item_ids + recommended_items,
+                    num_recommendations - len(recommended_items),
+                ).tolist()
+            if self._popularity_index is not None and len(recommended_items) < num_recommendations:
+                tier = POPULAR_TIER
+                recommended_items += self._popularity_index.recommend_popular(
+                    item_ids + recommended_items, num_recommendations - len(recommended_items)
+                )
+        return Recommendation(recommended_items, tier)
+
+    def _blend_neighbours(self, customer_ids: List[int]) -> List[ndarray]:
+        """
+        Gets the similar customers of several customers for the blend scoring
+        mode: from the recommendation table when it holds them, with a single
+        `kneighbors` call for the others, and none for cold customers.
+
+        Args:
+            customer_ids (list[int]): The customers.
+
+        Returns:
+            list[ndarray]: The similar customers of each customer, without
+            the customer itself.
+        """
+        neighbours: List[Optional[ndarray]] = [None] * len(customer_ids)
+        table: Optional[RecommendationTable] = self._recommendation_table
+        live: List[int] = []
+        for i, customer_id in enumerate(customer_ids):
+            position: Optional[int] = (
+                None
+                if table is None or customer_id in self._stale_customers
+                else table.find(customer_id)
+            )
+            if self._is_cold(customer_id):
+                neighbours[i] = np.empty(0, dtype=np.int64)
+            elif position is not None:
+                neighbours[i] = table.records["neighbours"][position]
+            else:
+                live.append(i)
+        if live:
+            similar_customers: ndarray = self._find_similar_customers(
+                [customer_ids[i] for i in live]
+            )
+            for i, row in zip(live, similar_customers):
+                neighbours[i] = row[1:]  # The first position is always the given customer id
+        return neighbours
+
+    def _recommend_blend(self, batch: List[dict]) -> List[Recommendation]:
+        """
+        Scores a batch of requests in the blend scoring mode: the purchases of
+        the similar customers and the co-purchases of the order items are
+        summed up for the whole batch with two sparse products, and blended.
+        Cold customers only get the co-purchases.
+
+        Args:
+            batch (list[dict]): Recommendation requests with the same keys as
+            the `recommend` arguments.
+
+        Returns:
+            list[Recommendation]: The recommendations of each request, in order.
+        """
+        item_ids: List[List[int]] = [
+            order_item_ids(r["order_items"]) for r in batch
+        ]
+        num_recommendations: List[int] = [r.get("num_recommendations") or 3 for r in batch]
+        neighbours: List[ndarray] = self._blend_neighbours([r["customer_id"] for r in batch])
+        with stage("blend"):
+            scores = blend_scores(
+                self._purchase_count_index.item_totals_many(neighbours),
+                self._co_purchase_index.scores_many(item_ids),
+                getattr(self._conf, "blend_weight", None) or 0.5,
+            )
+            ranked: List[List[int]] = top_scored_rows(
+                scores, self._co_purchase_index.item_ids, item_ids, num_recommendations
+            )
+        return [
+            self._complete(
+                order_item_ids, items, num, BLEND_TIER if len(similar) else CO_PURCHASE_TIER
+            )
+            for order_item_ids, items, num, similar in zip(
+                item_ids, ranked, num_recommendations, neighbours
+            )
+        ]
+
+    def _precomputed_recommendations(
+        self, customer_id: int, item_ids: List[int], num_recommendations: int
+    ) -> Optional[List[int]]:
+        """
+        Answers a request from the precomputed recommendation table.
+
+        Args:
+            customer_id (int): The customer.
+            item_ids (list[int]): The items in the purchase order.
+            num_recommendations (int): The number of recommended items wanted.
+
+        Returns:
+            Optional[list[int]]: The recommended item IDs, or None when the
+            request must go through the neighbour search.
+        """
+        if self._recommendation_table is None or customer_id in self._stale_customers:
+            return None
+        with stage("recommendation_table"):
+            return self._recommendation_table.recommend(
+                customer_id, item_ids, num_recommendations
+            )
 
     def _query_customer_items_matrix(self, customer_id: int) -> ndarray:
         """
         Retrieves the items purchased by a specific customer and returns them
-        as a NumPy array.
+        as a NumPy array. The in-memory customer-item matrix is used when the
+        customer is in it, then the customer vector cache, BigQuery is only
+        queried for the other customers.
 
         Args:
             customer_id (int): The unique identifier of the customer whose
@@ -55,19 +674,216 @@ class KNNModel:
             ndarray: A NumPy array representing the items purchased by the
             specified customer, reshaped into a single row.
         """
-        return (
-            self._bq_client.query(CUSTOMER_ITEMS_ARRAY_QUERY.format(customer_id))
-            .to_dataframe()
-            .to_numpy()
-            .reshape(1, -1)
+        if self._customer_items_matrix is not None:
+            customer_items: Optional[ndarray] = self._customer_items_matrix.get_row(
+                customer_id
+            )
+            if customer_items is not None:
+                return customer_items
+        return self._query_customer_vectors([customer_id])
+
+    def _query_customers_items_matrix(self, customer_ids: List[int]) -> ndarray:
+        """
+        Retrieves the item vectors of several customers at once. The queries
+        of customers missing from the in-memory matrix and the customer
+        vector cache run concurrently.
+
+        Args:
+            customer_ids (list[int]): The customers whose vectors are wanted.
+
+        Returns:
+            ndarray: A (len(customer_ids), n_items) array, one row per customer.
+        """
+        if self._customer_items_matrix is None:
+            vectors = np.zeros((len(customer_ids), self._model.n_features_in_))
+            known = np.zeros(len(customer_ids), dtype=bool)
+        else:
+            vectors, known = self._customer_items_matrix.get_rows(customer_ids)
+        missing: ndarray = np.flatnonzero(~known)
+        if missing.size:
+            vectors[missing] = self._query_customer_vectors(
+                [customer_ids[position] for position in missing]
+            )
+        return vectors
+
+    def _query_customer_vectors(self, customer_ids: List[int]) -> ndarray:
+        """
+        Retrieves the vectors of customers missing from the in-memory matrix,
+        from the customer vector cache, querying BigQuery for the others and
+        caching their vectors.
+
+        Args:
+            customer_ids (List[int]): The customers.
+
+        Returns:
+            ndarray: A (len(customer_ids), n_items) array, one row per customer.
+        """
+        cache: Optional[CustomerVectorCache] = self._customer_vector_cache
+        found: Dict[int, ndarray] = {} if cache is None else cache.get_many(customer_ids)
+        missing: List[int] = [
+            customer_id for customer_id in dict.fromkeys(customer_ids) if customer_id not in found
+        ]
+        queried: Dict[int, ndarray] = (
+            self._query_catalogue_vectors(missing, cached=cache is None)
+            if self._item_catalogue is not None
+            else self._query_dense_vectors(missing, cached=cache is None)
+        )
+        if cache is not None:
+            cache.put_many(queried)
+        found.update(queried)
+        return np.vstack([found[customer_id] for customer_id in customer_ids])
+
+    def _query_catalogue_vectors(self, customer_ids: List[int], cached: bool) -> Dict[int, ndarray]:
+        """
+        Queries the purchases of customers at once and scatters them into
+        the catalogue columns, so the rows fetched grow with the purchases
+        rather than with the item table. Purchases of items out of the
+        catalogue are left out and counted.
+
+        Args:
+            customer_ids (List[int]): The customers, without duplicates.
+            cached (bool): Whether the query result cache is used.
+
+        Raises:
+            TimeoutError: If the purchases aren't queried in time.
+
+        Returns:
+            Dict[int, ndarray]: The vector of every customer, zeros for the
+            customers without purchases.
+        """
+        if not customer_ids:
+            return {}
+        sorted_ids: ndarray = np.sort(np.asarray(customer_ids, dtype=np.int64))
+        purchases: DataFrame = self._query_runner.submit(
+            CUSTOMERS_PURCHASES_QUERY, cached=cached, customer_ids=sorted_ids
+        ).result(timeout=self._query_executor.wait_timeout)
+        vectors, unknown_items = self._item_catalogue.vectors(
+            np.searchsorted(sorted_ids, purchases["customer_id"].to_numpy(dtype=np.int64)),
+            purchases["item_id"].to_numpy(dtype=np.int64),
+            purchases["interaction"].to_numpy(dtype=np.float64),
+            len(sorted_ids),
+        )
+        if unknown_items:
+            self._unknown_item_purchases += unknown_items
+            logger.debug("%d purchases of items out of the catalogue left out", unknown_items)
+        return dict(zip(sorted_ids.tolist(), vectors))
+
+    def _query_dense_vectors(self, customer_ids: List[int], cached: bool) -> Dict[int, ndarray]:
+        """
+        Queries the vectors of customers concurrently as dense rows over the
+        item table, when no catalogue is loaded to lay the purchases out.
+
+        Args:
+            customer_ids (List[int]): The customers, without duplicates.
+            cached (bool): Whether the query result cache is used.
+
+        Raises:
+            ValueError: If the item table doesn't have as many items as the
+            model has features, e.g. items were added since training.
+            TimeoutError: If a vector isn't queried in time.
+
+        Returns:
+            Dict[int, ndarray]: The vector of every customer.
+        """
+        futures: Dict[int, "Future[DataFrame]"] = {
+            customer_id: self._query_runner.submit(
+                CUSTOMER_ITEMS_ARRAY_QUERY, cached=cached, customer_id=customer_id
+            )
+            for customer_id in customer_ids
+        }
+        vectors: Dict[int, ndarray] = {}
+        for customer_id, future in futures.items():
+            vectors[customer_id] = (
+                future.result(timeout=self._query_executor.wait_timeout).to_numpy().reshape(-1)
+            )
+            if vectors[customer_id].size != self._model.n_features_in_:
+                raise ValueError(
+                    f"The item table has {vectors[customer_id].size} items but the model "
+                    f"was trained with {self._model.n_features_in_}, set "
+                    "item_catalogue_path to serve it."
+                )
+        return vectors
+
+    def _submit_customers_purchases(
+        self, customer_ids: ndarray
+    ) -> "Future[PurchaseCountIndex]":
+        """
+        Starts getting the purchase counts of the given customers, from the
+        in-memory index when it's loaded or with a single BigQuery query otherwise.
+
+        Args:
+            customer_ids (ndarray): The customers whose purchases are wanted.
+
+        Returns:
+            Future[PurchaseCountIndex]: An index holding at least the given customers.
+        """
+        if self._purchase_count_index is not None or not customer_ids.size:
+            done: "Future[PurchaseCountIndex]" = Future()
+            done.set_result(
+                self._purchase_count_index
+                or PurchaseCountIndex.from_dataframe(DataFrame({"customer_id": [], "item_id": []}))
+            )
+            return done
+        return chain_future(
+            self._query_runner.submit(CUSTOMERS_PURCHASES_QUERY, customer_ids=customer_ids),
+            PurchaseCountIndex.from_dataframe,
         )
 
+    def _search_similar_customers(self, customers_items_matrix: ndarray) -> ndarray:
+        """
+        Runs `kneighbors` on the current neighbour index.
+
+        Args:
+            customers_items_matrix (ndarray): One customer vector per row.
+
+        Returns:
+            ndarray: A (rows, similar_customers_number) array of customer ids.
+        """
+        neighbour_index: NeighbourIndex = self._neighbour_index
+        with stage("kneighbors"):
+            _, similar_customers = neighbour_index.search.kneighbors(
+                customers_items_matrix, n_neighbors=self._conf.similar_customers_number
+            )
+        return neighbour_index.to_customer_ids(similar_customers)
+
+    def _find_similar_customers(self, customer_ids: List[int]) -> ndarray:
+        """
+        Finds the similar customers of several customers, with a single
+        `kneighbors` call for the ones that aren't cached.
+
+        Args:
+            customer_ids (list[int]): The customers whose neighbours are wanted.
+
+        Returns:
+            ndarray: A (len(customer_ids), similar_customers_number) array of
+            customer ids, the first column being the customers themselves.
+        """
+        cached: List = [
+            self._neighbours_cache.get((self._model_version, customer_id))
+            for customer_id in customer_ids
+        ]
+        missing: List[int] = [i for i, entry in enumerate(cached) if entry is None]
+        if missing:
+            missing_ids: List[int] = [customer_ids[i] for i in missing]
+            with stage("customer_vectors"):
+                customers_items_matrix: ndarray = self._query_customers_items_matrix(
+                    missing_ids
+                )
+            similar_customers: ndarray = self._search_similar_customers(customers_items_matrix)
+            for i, customer_id, customer_items, neighbours in zip(
+                missing, missing_ids, customers_items_matrix, similar_customers
+            ):
+                cached[i] = (customer_items.reshape(1, -1), neighbours)
+                self._neighbours_cache.put((self._model_version, customer_id), cached[i])
+        return np.vstack([entry[1] for entry in cached])
+
     def _query_recommended_items(
         self, similar_customers: List, item_ids: List, num_recommendations: int
     ) -> List[int]:
         """
         Queries the recommended items based on similar customers and given
-        item IDs, returning a list of recommended item IDs.
+        item IDs, returning a list of recommended item IDs. The in-memory
+        purchase count index answers the query when it's loaded.
 
         Args:
             similar_customers (list): A list of customer IDs that are similar
@@ -80,28 +896,36 @@ class KNNModel:
         Returns:
             list[int]: A list of item IDs recommended for the target customer.
         """
-        if not similar_customers or not item_ids:
+        if not similar_customers:
             return []
-        
-        recommended_items_df: DataFrame = self._bq_client.query(
-            MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY.format(
-                tuple(similar_customers), tuple(item_ids), num_recommendations
-            )
-        ).to_dataframe()
+        if self._purchase_count_index is not None:
+            return self._purchase_count_index.top_items(
+                similar_customers, item_ids, num_recommendations
+            ).tolist()
+
+        recommended_items_df: DataFrame = self._query_runner.run(
+            MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY,
+            customer_ids=similar_customers,
+            excluded_item_ids=item_ids,
+            num_recommendations=num_recommendations,
+        )
         return recommended_items_df["item_id"].tolist()
 
     def recommend(
-        self, customer_id: int, order_items: List[dict], num_recommendations: int = 3
+        self,
+        customer_id: int,
+        order_items: Union[List[dict], ndarray],
+        num_recommendations: int = 3,
     ) -> List[int]:
         """
-        Recommended items for a given customer based on their past
-        purchases and the purchases of similar customers.
+        Recommended items for a given customer, see `recommend_with_tier`.
 
         Args:
             customer_id (int): The unique identifier of the customer for whom
             recommendations are being predicted.
-            order_items (list[dict]): A list of dictionaries containing the
-            details of the items that the customer is interested in.
+            order_items (Union[list[dict], ndarray]): A list of dictionaries
+            containing the details of the items that the customer is
+            interested in, or an array of their item ids.
             num_recommendations (int, optional): The number of recommendations
             to return. Defaults to 3.
 
@@ -109,19 +933,428 @@ class KNNModel:
             list[int]: A list of recommended item IDs for the specified
             customer.
         """
-        customer_items_matrix: ndarray = self._query_customer_items_matrix(customer_id)
-        _, similar_customers = self._model.kneighbors(
-            customer_items_matrix, n_neighbors=self._conf.similar_customers_number
+        return self.recommend_with_tier(customer_id, order_items, num_recommendations).item_ids
+
+    def recommend_with_tier(
+        self,
+        customer_id: int,
+        order_items: Union[List[dict], ndarray],
+        num_recommendations: int = 3,
+    ) -> Recommendation:
+        """
+        Recommended items for a given customer based on their past
+        purchases and the purchases of similar customers. Customers in the
+        precomputed recommendation table are answered from it directly.
+
+        When the similar customers don't give enough items, e.g. because the
+        customer never bought anything, the cold-start tiers fill in: the
+        items most bought together with the order items, then the most
+        popular items. In the "blend" scoring mode, the purchases of the
+        similar customers and the co-purchases of the order items are blended
+        into a single score instead, see `_recommend_blend`.
+
+        Args:
+            customer_id (int): The unique identifier of the customer for whom
+            recommendations are being predicted.
+            order_items (Union[list[dict], ndarray]): A list of dictionaries
+            containing the details of the items that the customer is
+            interested in, or an array of their item ids.
+            num_recommendations (int, optional): The number of recommendations
+            to return. Defaults to 3.
+
+        Returns:
+            Recommendation: The recommended item IDs for the specified
+            customer and the tier that completed them.
+        """
+        if self._scoring_mode == "blend":
+            return self._recommend_blend([{
+                "customer_id": customer_id,
+                "order_items": order_items,
+                "num_recommendations": num_recommendations,
+            }])[0]
+        item_ids: List[int] = order_item_ids(order_items)
+        if self._is_cold(customer_id):
+            return self._complete(item_ids, [], num_recommendations)
+        precomputed: Optional[List[int]] = self._precomputed_recommendations(
+            customer_id, item_ids, num_recommendations
         )
-        similar_customers: List[int] = (
-            similar_customers.flatten().tolist()
-        )  # pass from numpy ndarray to python list
+        if precomputed is not None:
+            return self._complete(item_ids, precomputed, num_recommendations)
+        cached = self._neighbours_cache.get((self._model_version, customer_id))
+        if cached is None:
+            with stage("customer_vectors"):
+                customer_items_matrix: ndarray = self._query_customer_items_matrix(customer_id)
+            cached = (
+                customer_items_matrix,
+                self._search_similar_customers(customer_items_matrix).flatten(),
+            )
+            self._neighbours_cache.put((self._model_version, customer_id), cached)
+        similar_customers: List[int] = cached[
+            1
+        ].tolist()  # pass from numpy ndarray to python list
         similar_customers: List[int] = similar_customers[
             1:
         ]  # The first position is always the given customer id
-        item_ids: List[int] = [item["item_id"] for item in order_items]
-        # TODO: See what happens if there are not similar customers
-        recommended_items = self._query_recommended_items(
-            similar_customers, item_ids, num_recommendations
+        with stage("recommended_items"):
+            recommended_items = self._query_recommended_items(
+                similar_customers, item_ids, num_recommendations
+            )
+        return self._complete(item_ids, recommended_items, num_recommendations)
+
+    def recommend_many(
+        self, requests: Iterable[dict], batch_size: int = 1000
+    ) -> Iterator[List[int]]:
+        """
+        Recommended items for many customers at once, see
+        `recommend_many_with_tier`.
+
+        Args:
+            requests (Iterable[dict]): Recommendation requests with the same
+            keys as the `recommend` arguments.
+            batch_size (int, optional): How many requests are processed
+            together. Defaults to 1000.
+
+        Yields:
+            list[int]: The recommended item IDs of each request, in order.
+        """
+        for recommendation in self.recommend_many_with_tier(requests, batch_size):
+            yield recommendation.item_ids
+
+    def recommend_many_with_tier(
+        self, requests: Iterable[dict], batch_size: int = 1000
+    ) -> Iterator[Recommendation]:
+        """
+        Recommended items for many customers at once. Requests are processed
+        in batches: each batch makes a single `kneighbors` call and a single
+        lookup of the neighbours' purchases. The purchases query of a batch
+        runs while the vectors and neighbours of the next batch are loaded.
+        Customers in the precomputed recommendation table, and cold customers,
+        skip both. Recommendations are completed like in `recommend_with_tier`,
+        and blended a batch at a time in the "blend" scoring mode.
+
+        Args:
+            requests (Iterable[dict]): Recommendation requests with the same
+            keys as the `recommend` arguments.
+            batch_size (int, optional): How many requests are processed
+            together. Defaults to 1000.
+
+        Yields:
+            Recommendation: The recommended item IDs of each request, in order.
+        """
+        requests = iter(requests)
+        if self._scoring_mode == "blend":
+            while batch := list(islice(requests, batch_size)):
+                yield from self._recommend_blend(batch)
+            return
+        pending = None  # previous batch, waiting for its neighbours' purchases
+        while batch := list(islice(requests, batch_size)):
+            precomputed: List[Optional[List[int]]] = [
+                []  # completed by the cold-start tiers
+                if self._is_cold(r["customer_id"])
+                else self._precomputed_recommendations(
+                    r["customer_id"],
+                    order_item_ids(r["order_items"]),
+                    r.get("num_recommendations") or 3,
+                )
+                for r in batch
+            ]
+            live_batch: List[dict] = [r for r, p in zip(batch, precomputed) if p is None]
+            similar_customers: ndarray = (
+                self._find_similar_customers([r["customer_id"] for r in live_batch])[:, 1:]
+                if live_batch  # The first position is always the given customer id
+                else np.empty((0, self._conf.similar_customers_number - 1), dtype=np.int64)
+            )
+            purchase_counts = self._submit_customers_purchases(np.unique(similar_customers))
+            if pending is not None:
+                yield from self._complete_batch(
+                pending[1], _merge_batch(*pending[0], self._query_executor.wait_timeout)
+            )
+            pending = ((precomputed, live_batch, similar_customers, purchase_counts), batch)
+        if pending is not None:
+            yield from self._complete_batch(
+                pending[1], _merge_batch(*pending[0], self._query_executor.wait_timeout)
+            )
+
+    def _complete_batch(
+        self, batch: List[dict], recommendations: Iterator[List[int]]
+    ) -> Iterator[Recommendation]:
+        """
+        Completes the recommendations of a batch, see `_complete`.
+
+        Args:
+            batch (list[dict]): The recommendation requests.
+            recommendations (Iterator[list[int]]): The recommended items of
+            every request, in order.
+
+        Yields:
+            Recommendation: The completed recommendations, in order.
+        """
+        for customer_request, recommended_items in zip(batch, recommendations):
+            yield self._complete(
+                order_item_ids(customer_request["order_items"]),
+                recommended_items,
+                customer_request.get("num_recommendations") or 3,
+            )
+
+    def apply_orders(self, customer_ids: ndarray, item_ids: ndarray) -> Dict[str, Any]:
+        """
+        Adds new purchases to the delta of the in-memory customer-item matrix
+        and purchase counts, so the next recommendations take them into
+        account without retraining:
+            - the customers who bought get their updated vectors, and their
+              cached neighbours are dropped;
+            - their purchases count for the customers they are neighbours of;
+            - the precomputed recommendations they affect are skipped until
+              the table is refreshed.
+
+        The neighbour index keeps the vectors it was built with. Once the
+        customers changed since it was built exceed `index_rebuild_drift`
+        (default 0.01) of its rows, it's rebuilt in the background and the
+        delta merged. Nothing is written to the artefacts, see `OrderUpdater`
+        for reloads.
+
+        Args:
+            customer_ids (ndarray): The customer of every purchase.
+            item_ids (ndarray): The purchased item of every purchase.
+
+        Raises:
+            ValueError: If no customer-item matrix is loaded.
+
+        Returns:
+            Dict[str, Any]: The applied and dropped purchases, the customers
+            who bought, the drift of the neighbour index and whether a
+            rebuild was started.
+        """
+        if self._customer_items_matrix is None:
+            raise ValueError(
+                "Orders can only be applied with artefacts_dir or "
+                "customer_items_matrix_path set."
+            )
+        with self._update_lock:
+            matrix, unknown_items = self._customer_items_matrix.add_purchases(
+                customer_ids, item_ids
+            )
+            if self._rebuild_purchases is not None:
+                self._rebuild_purchases.append((customer_ids, item_ids))
+            if self._purchase_count_index is not None:
+                self._purchase_count_index = (
+                    PurchaseCountIndex(matrix)  # the artefacts share a single matrix
+                    if getattr(self._conf, "artefacts_dir", None)
+                    else self._purchase_count_index.add_purchases(customer_ids, item_ids)
+                )
+            self._customer_items_matrix = matrix
+
+            changed: ndarray = np.unique(np.asarray(customer_ids, dtype=np.int64))
+            for customer_id in changed.tolist():
+                self._neighbours_cache.discard((self._model_version, customer_id))
+            if self._customer_vector_cache is not None:
+                self._customer_vector_cache.discard_many(changed.tolist())
+            if self._recommendation_table is not None:
+                self._stale_customers = self._stale_customers.union(
+                    self._recommendation_table.affected_customers(changed).tolist()
+                )
+            self._changed_customers.update(changed.tolist())
+            drift: float = self.index_drift
+            rebuild_started: bool = (
+                drift >= (getattr(self._conf, "index_rebuild_drift", None) or 0.01)
+                and self._start_index_rebuild()
+            )
+        return {
+            "purchases": len(item_ids) - unknown_items,
+            "unknown_item_purchases": unknown_items,
+            "customers": len(changed),
+            "index_drift": drift,
+            "index_rebuild_started": rebuild_started,
+        }
+
+    @property
+    def index_drift(self) -> float:
+        """float: Share of the neighbour index customers with orders applied since it was built."""
+        indexed: Optional[ndarray] = self._neighbour_index.customer_ids
+        return len(self._changed_customers) / max(0 if indexed is None else len(indexed), 1)
+
+    def _start_index_rebuild(self) -> bool:
+        """
+        Starts rebuilding the neighbour index in a background thread.
+
+        Returns:
+            bool: True if the rebuild was started, False if one is already running.
+        """
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return False
+        self._rebuild_thread = Thread(
+            target=self.rebuild_index, name="neighbour-index-rebuild", daemon=True
         )
-        return recommended_items
+        self._rebuild_thread.start()
+        return True
+
+    def rebuild_index(self) -> None:
+        """
+        Merges the delta of the customer-item matrix, fits the neighbour
+        index again on it and swaps it in, requests in flight finishing on
+        the previous one. The precomputed recommendations of the stale
+        customers are refreshed with the new index, the popular and
+        co-purchased items ranked again, and the similar customers cache is
+        cleared since any neighbour may have changed.
+
+        Orders applied while the index is fitted are added again to the
+        merged matrix, and count towards the drift of the new index.
+        """
+        shared_counts: bool = bool(getattr(self._conf, "artefacts_dir", None))
+        with self._update_lock:
+            current: CustomerItemsMatrix = self._customer_items_matrix
+            counts: Optional[PurchaseCountIndex] = self._purchase_count_index
+            changed: Set[int] = self._changed_customers
+            self._changed_customers = set()
+            self._rebuild_purchases = []
+        try:
+            matrix: CustomerItemsMatrix = current.merge_delta()
+            if counts is not None and not shared_counts:
+                counts = counts.merge_delta()
+            search: NeighbourSearch = NeighbourSearchFactory.get_search(
+                clone(self._model).fit(matrix.matrix), self._conf
+            )
+            popularity_index: Optional[PopularityIndex] = self._build_popularity_index(matrix)
+            co_purchase_index: Optional[CoPurchaseIndex] = (
+                None
+                if self._co_purchase_index is None
+                else CoPurchaseIndex.build(matrix, self._co_purchase_index.top_k)
+            )
+            table: Optional[RecommendationTable] = self._recommendation_table
+            stale: FrozenSet[int] = self._stale_customers
+            if table is not None and stale:
+                table = table.refresh(matrix, search, np.fromiter(stale, dtype=np.int64))
+        except Exception:  # pylint: disable=broad-exception-caught
+            with self._update_lock:
+                self._changed_customers.update(changed)
+                self._rebuild_purchases = None
+            INDEX_REBUILDS.inc("error")
+            logger.exception("Neighbour index rebuild failed")
+            return
+        with self._update_lock:
+            self._neighbour_index = NeighbourIndex(search, matrix.customer_ids)
+            for customer_ids, item_ids in self._rebuild_purchases:
+                matrix = matrix.add_purchases(customer_ids, item_ids)[0]
+                if counts is not None and not shared_counts:
+                    counts = counts.add_purchases(customer_ids, item_ids)
+            self._rebuild_purchases = None
+            self._customer_items_matrix = matrix
+            if counts is not None:
+                self._purchase_count_index = PurchaseCountIndex(matrix) if shared_counts else counts
+            self._popularity_index = popularity_index
+            self._co_purchase_index = co_purchase_index
+            self._recommendation_table = table
+            self._stale_customers = (
+                frozenset()
+                if table is None
+                else frozenset(
+                    table.affected_customers(
+                        np.fromiter(self._changed_customers, dtype=np.int64)
+                    ).tolist()
+                )
+            )
+            self._neighbours_cache.clear()
+        INDEX_REBUILDS.inc("success")
+        logger.info("Neighbour index rebuilt on %d customers", len(matrix.customer_ids))
+
+
+def _merge_batch(
+    precomputed: List[Optional[List[int]]],
+    live_batch: List[dict],
+    similar_customers: ndarray,
+    purchase_counts: "Future[PurchaseCountIndex]",
+    timeout: Optional[float] = None,
+) -> Iterator[List[int]]:
+    """
+    Yields the recommendations of a batch in request order, the precomputed
+    ones and the ones ranked from the neighbours' purchases.
+
+    Args:
+        precomputed (list[Optional[list[int]]]): The recommendations found in
+        the recommendation table, None for the requests ranked live.
+        live_batch (list[dict]): The requests ranked live.
+        similar_customers (ndarray): The similar customers of every live request.
+        purchase_counts (Future[PurchaseCountIndex]): The purchases of the
+        similar customers.
+        timeout (Optional[float]): Longest wait for the purchases, None
+        waits until they are queried.
+
+    Raises:
+        TimeoutError: If the purchases aren't queried in time.
+
+    Yields:
+        list[int]: The recommended item IDs of each request, in order.
+    """
+    live: List[List[int]] = list(
+        _rank_batch(live_batch, similar_customers, purchase_counts, timeout)
+    )
+    live_position = 0
+    for recommended_items in precomputed:
+        if recommended_items is None:
+            recommended_items = live[live_position]
+            live_position += 1
+        yield recommended_items
+
+
+def _rank_batch(
+    batch: List[dict],
+    similar_customers: ndarray,
+    purchase_counts: "Future[PurchaseCountIndex]",
+    timeout: Optional[float] = None,
+) -> Iterator[List[int]]:
+    """
+    Picks the recommended items of a batch of requests.
+
+    Args:
+        batch (list[dict]): The recommendation requests.
+        similar_customers (ndarray): The similar customers of every request.
+        purchase_counts (Future[PurchaseCountIndex]): The purchases of the
+        similar customers.
+        timeout (Optional[float]): Longest wait for the purchases, None
+        waits until they are queried.
+
+    Raises:
+        TimeoutError: If the purchases aren't queried in time.
+
+    Yields:
+        list[int]: The recommended item IDs of each request, in order.
+    """
+    with stage("customers_purchases"):
+        purchase_count_index: PurchaseCountIndex = purchase_counts.result(timeout=timeout)
+    for customer_request, neighbours in zip(batch, similar_customers):
+        item_ids: List[int] = order_item_ids(customer_request["order_items"])
+        yield purchase_count_index.top_items(
+            neighbours,
+            item_ids,
+            customer_request.get("num_recommendations") or 3,
+        ).tolist()
+
+
+def order_item_ids(order_items: Union[List[dict], ndarray]) -> List[int]:
+    """
+    Gets the item ids of a purchase order.
+
+    Args:
+        order_items (Union[List[dict], ndarray]): The order items, as
+        dictionaries with an `item_id` or as an array of item ids.
+
+    Returns:
+        List[int]: The item ids.
+    """
+    if isinstance(order_items, ndarray):
+        return order_items.tolist()
+    return [item["item_id"] for item in order_items]
+
+
+def _file_version(path: str) -> str:
+    """
+    Computes a short digest of a file, used to tell model versions apart.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        str: The first 12 hex characters of the file SHA-256 digest.
+    """
+    with open(path, "rb") as file:
+        return file_digest(file, "sha256").hexdigest()[:12]
@@ -0,0 +1,60 @@
+"""
+Reports the memory used by the current process, to compare worker processes
+loading private copies of the model with workers sharing memory-mapped files.
+"""
+
+import sys
+from typing import Dict, Optional
+
+
+def peak_memory_bytes() -> Optional[int]:
+    """
+    Reads the peak resident memory of the process.
+
+    Returns:
+        Optional[int]: The peak resident set size in bytes, None on platforms
+        without the `resource` module.
+    """
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return int(peak if sys.platform == "darwin" else peak * 1024)  # KiB on Linux
+
+
+def memory_usage() -> Dict[str, Optional[int]]:
+    """
+    Reads the current memory usage of the process.
+
+    The resident set size counts shared pages, such as memory-mapped model
+    files, in every process mapping them. The proportional set size splits
+    them between those processes, so summing it over the workers of a node
+    gives their actual footprint. Both are only available on Linux.
+
+    Returns:
+        Dict[str, Optional[int]]: The resident (`rss_bytes`), shared
+        (`shared_bytes`), proportional (`pss_bytes`) and peak resident
+        (`peak_rss_bytes`) memory in bytes, None when unavailable.
+    """
+    usage: Dict[str, Optional[int]] = {
+        "rss_bytes": None,
+        "shared_bytes": None,
+        "pss_bytes": None,
+        "peak_rss_bytes": peak_memory_bytes(),
+    }
+    try:
+        with open("/proc/self/smaps_rollup", encoding="ascii") as smaps:
+            fields = dict(line.split(":", 1) for line in smaps if ":" in line)
+    except OSError:
+        return usage
+
+    def kib_field(name: str) -> Optional[int]:
+        value = fields.get(name)
+        return None if value is None else int(value.split()[0]) * 1024
+
+    usage["rss_bytes"] = kib_field("Rss")
+    usage["pss_bytes"] = kib_field("Pss")
+    shared = [kib_field("Shared_Clean"), kib_field("Shared_Dirty")]
+    usage["shared_bytes"] = None if None in shared else sum(shared)
+    return usage
@@ -0,0 +1,248 @@
+"""
+Module holding the KNN model being served and swapping it for a retrained one
+without restarting the application.
+"""
+
+import logging
+import os
+from threading import Event, Lock, Thread
+from typing import TYPE_CHECKING, Callable, Dict, Optional
+
+if TYPE_CHECKING:
+    from api.knn_model import KNNModel
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_knn_model(knn_model_conf_path: str) -> "KNNModel":
+    """
+    Builds a KNN model. The model module, and with it scikit-learn, pandas and
+    the BigQuery client, is only imported when the first model is loaded.
+
+    Args:
+        knn_model_conf_path (str): Path of the model configuration file.
+
+    Returns:
+        KNNModel: The loaded model.
+    """
+    from api.knn_model import KNNModel  # pylint: disable=import-outside-toplevel
+
+    return KNNModel(knn_model_conf_path)
+
+
+class ModelRegistry:
+    """
+    Keeps the KNN model currently served and reloads it on demand or when its
+    configuration or pickle change on disk.
+
+    Nothing is loaded when the registry is created: the model is loaded by
+    `warm_up`, in the background, or by the first `get` call otherwise.
+
+    A reload builds a whole new `KNNModel`, with its indexes, in the background
+    and then swaps the served reference in a single assignment. Requests that
+    already got the previous model finish on it, new requests get the new one.
+
+    Attributes:
+        _knn_model_conf_path (str): Path of the model configuration file.
+        _model_factory (Callable[[str], KNNModel]): Builds a model from the
+        configuration path.
+        _model (Optional[KNNModel]): The model currently served, None until loaded.
+        _watched_mtimes (Dict[str, Optional[int]]): Modification times of the
+        configuration and pickle the current model was loaded from.
+        _reload_lock (Lock): Ensures a single load or reload runs at a time.
+        _warming_up (Event): Set while a warm-up is running.
+        _stop_watching (Event): Set to stop the watcher thread.
+        _watcher (Optional[Thread]): Thread polling the watched files.
+        last_reload_error (Optional[str]): Error of the last failed reload, if any.
+    """
+
+    def __init__(
+        self,
+        knn_model_conf_path: str,
+        model_factory: Callable[[str], "KNNModel"] = load_knn_model,
+    ):
+        self._knn_model_conf_path: str = knn_model_conf_path
+        self._model_factory: Callable[[str], "KNNModel"] = model_factory
+        self._model: Optional["KNNModel"] = None
+        self._watched_mtimes: Dict[str, Optional[int]] = {}
+        self._reload_lock = Lock()
+        self._warming_up = Event()
+        self._stop_watching = Event()
+        self._watcher: Optional[Thread] = None
+        self.last_reload_error: Optional[str] = None
+
+    def get(self) -> "KNNModel":
+        """
+        Returns the model currently served, loading it first if needed.
+        Callers should keep the returned reference for the whole request, so
+        it's served by a single model.
+
+        Returns:
+            KNNModel: The current model.
+        """
+        if self._model is None:
+            with self._reload_lock:
+                if self._model is None:
+                    self._swap(self._model_factory(self._knn_model_conf_path))
+        return self._model
+
+    @property
+    def is_loaded(self) -> bool:
+        """bool: Whether a model has been loaded."""
+        return self._model is not None
+
+    @property
+    def is_ready(self) -> bool:
+        """bool: Whether a model has been loaded and no warm-up is running."""
+        return self.is_loaded and not self._warming_up.is_set()
+
+    @property
+    def model_version(self) -> Optional[str]:
+        """Optional[str]: Version of the model currently served, None until loaded."""
+        return None if self._model is None else self._model.model_version
+
+    def _swap(self, model: "KNNModel") -> None:
+        """
+        Starts serving the given model.
+
+        Args:
+            model (KNNModel): The newly loaded model.
+        """
+        self._model = model
+        self._watched_mtimes = self._get_watched_mtimes()
+        logger.info("Model %s loaded", model.model_version)
+
+    def warm_up(self, hook: Optional[Callable[["KNNModel"], None]] = None) -> Thread:
+        """
+        Loads the model in a background thread, so the first request doesn't
+        pay for it, and then runs an optional warm-up hook on it. The registry
+        isn't ready until the warm-up ends.
+
+        Args:
+            hook (Optional[Callable[[KNNModel], None]]): Called with the loaded
+            model before the registry reports itself ready, e.g. to run a
+            first recommendation.
+
+        Returns:
+            Thread: The warm-up thread.
+        """
+
+        def load_and_warm_up() -> None:
+            try:
+                model: "KNNModel" = self.get()
+                if hook is not None:
+                    hook(model)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self.last_reload_error = str(e)
+                logger.exception("Model warm-up failed")
+            finally:
+                self._warming_up.clear()
+
+        self._warming_up.set()
+        thread = Thread(target=load_and_warm_up, name="model-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def _get_watched_mtimes(self) -> Dict[str, Optional[int]]:
+        """
+        Reads the modification times of the configuration, the model pickle
+        and the recommendation table, rewritten by incremental refreshes.
+
+        Returns:
+            Dict[str, Optional[int]]: Modification time in nanoseconds by path,
+            None for missing files.
+        """
+        mtimes: Dict[str, Optional[int]] = {}
+        paths = [self._knn_model_conf_path]
+        if self._model is not None:
+            paths.append(self._model.model_pkl_path)
+            if getattr(self._model, "recommendation_table_path", None):
+                paths.append(self._model.recommendation_table_path)
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                mtimes[path] = None
+        return mtimes
+
+    def reload(self) -> bool:
+        """
+        Loads a new model from the configuration and swaps it in. The current
+        model keeps being served if loading fails.
+
+        Returns:
+            bool: True if the new model was swapped in, False if loading failed
+            or another reload was already running.
+        """
+        if not self._reload_lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+            return False
+        return self._reload_and_release()
+
+    def _reload_and_release(self) -> bool:
+        """
+        Reloads the model with the reload lock held, and releases it. The
+        files of a failed reload are not watched again until they change.
+
+        Returns:
+            bool: True if the new model was swapped in, False if loading failed.
+        """
+        attempted_mtimes: Dict[str, Optional[int]] = self._get_watched_mtimes()
+        try:
+            self._swap(self._model_factory(self._knn_model_conf_path))
+            self.last_reload_error = None
+            return True
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self.last_reload_error = str(e)
+            self._watched_mtimes = attempted_mtimes
+            logger.exception("Model reload failed, still serving %s", self.model_version)
+            return False
+        finally:
+            self._reload_lock.release()
+
+    def reload_in_background(self) -> bool:
+        """
+        Starts a reload in a background thread.
+
+        Returns:
+            bool: True if the reload was started, False if one is already running.
+        """
+        if not self._reload_lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+            return False
+        Thread(target=self._reload_and_release, name="model-reload", daemon=True).start()
+        return True
+
+    def start_watching(self, interval_seconds: float) -> None:
+        """
+        Starts a background thread reloading the model whenever its
+        configuration or pickle change on disk.
+
+        Args:
+            interval_seconds (float): Time between two checks of the files.
+        """
+        if self._watcher is not None:
+            return
+        self._stop_watching.clear()
+        self._watcher = Thread(
+            target=self._watch, args=(interval_seconds,), name="model-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def stop_watching(self) -> None:
+        """Stops the watcher thread, if running."""
+        if self._watcher is None:
+            return
+        self._stop_watching.set()
+        self._watcher.join()
+        self._watcher = None
+
+    def _watch(self, interval_seconds: float) -> None:
+        """
+        Polls the watched files until asked to stop.
+
+        Args:
+            interval_seconds (float): Time between two checks of the files.
+        """
+        while not self._stop_watching.wait(interval_seconds):
+            if self._get_watched_mtimes() != self._watched_mtimes:
+                self.reload()
@@ -0,0 +1,78 @@
+"""
+Common interface of the nearest neighbour search engines used by the KNN model
+to find similar customers.
+"""
+
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+if TYPE_CHECKING:
+    from sklearn.neighbors import NearestNeighbors
+
+
+class NeighbourSearch(ABC):
+    """
+    A nearest neighbour search engine over the customers the model was fitted on.
+
+    Engines follow the `NearestNeighbors.kneighbors` contract so they can be
+    swapped without changing how the KNN model uses them.
+    """
+
+    @abstractmethod
+    def kneighbors(self, X: ndarray, n_neighbors: int) -> Tuple[ndarray, ndarray]:  # pylint: disable=invalid-name
+        """
+        Finds the nearest customers of each query vector.
+
+        Args:
+            X (ndarray): Query vectors, one row per customer.
+            n_neighbors (int): Number of neighbours to return per query.
+
+        Returns:
+            Tuple[ndarray, ndarray]: Distances and row positions of the
+            neighbours, both shaped (len(X), n_neighbors) and sorted by
+            increasing distance.
+        """
+
+
+class ExactNeighbourSearch(NeighbourSearch):
+    """
+    Exact search delegating to the fitted scikit-learn model. It's the reference
+    every approximate engine is checked against.
+
+    Attributes:
+        _model (NearestNeighbors): The fitted scikit-learn model.
+    """
+
+    def __init__(self, model: "NearestNeighbors"):
+        self._model: "NearestNeighbors" = model
+
+    def kneighbors(self, X: ndarray, n_neighbors: int) -> Tuple[ndarray, ndarray]:  # pylint: disable=invalid-name
+        return self._model.kneighbors(X, n_neighbors=n_neighbors)
+
+
+def recall_at_k(
+    approximate: NeighbourSearch, exact: NeighbourSearch, queries: ndarray, k: int
+) -> float:
+    """
+    Measures which share of the exact k nearest neighbours an approximate
+    engine finds. Customers at the same distance as the k-th exact neighbour
+    are equally good answers, so a returned neighbour counts as a hit when it
+    is no farther than it.
+
+    Args:
+        approximate (NeighbourSearch): The engine being checked. It must
+        return the true distances of the neighbours it finds.
+        exact (NeighbourSearch): The reference engine.
+        queries (ndarray): Query vectors, one row per customer.
+        k (int): Number of neighbours compared per query.
+
+    Returns:
+        float: The mean recall@k over all queries, between 0 and 1.
+    """
+    approximate_distances, _ = approximate.kneighbors(queries, n_neighbors=k)
+    exact_distances, _ = exact.kneighbors(queries, n_neighbors=k)
+    hits = approximate_distances <= exact_distances[:, -1:] + 1e-9
+    return float(np.mean(hits))
@@ -0,0 +1,64 @@
+"""
+Factory selecting the nearest neighbour search engine set in the model configuration.
+"""
+
+import os
+from typing import TYPE_CHECKING, Optional
+
+from credit_risk_lib.config.config import Config
+
+from api.neighbours.neighbour_search import ExactNeighbourSearch, NeighbourSearch
+from api.neighbours.random_projection_lsh import RandomProjectionLSH
+from api.neighbours.sharded_neighbour_search import ShardedNeighbourSearch
+
+if TYPE_CHECKING:
+    from sklearn.neighbors import NearestNeighbors
+
+
+class NeighbourSearchFactory:  # pylint: disable=too-few-public-methods
+    """
+    Builds neighbour search engines from the model configuration.
+
+    The engine is picked with the `neighbour_search_engine` key:
+        - "exact" (default): the fitted scikit-learn model itself.
+        - "lsh": a `RandomProjectionLSH` index over the model training data,
+          tuned with `lsh_num_tables`, `lsh_num_bits` and `lsh_num_probes`.
+        - "sharded": exact search over `neighbour_search_shards` (default one
+          per CPU) customer shards, each one searched in its own process.
+    """
+
+    @staticmethod
+    def get_search(model: "NearestNeighbors", conf: Config) -> NeighbourSearch:
+        """
+        Builds the neighbour search engine set in the configuration.
+
+        Args:
+            model (NearestNeighbors): The fitted scikit-learn model.
+            conf (Config): The model configuration.
+
+        Raises:
+            ValueError: If the engine is unknown or doesn't support the model metric.
+
+        Returns:
+            NeighbourSearch: The configured engine.
+        """
+        engine: str = getattr(conf, "neighbour_search_engine", None) or "exact"
+        if engine == "exact":
+            return ExactNeighbourSearch(model)
+        if engine == "lsh":
+            if model.metric != "cosine":
+                raise ValueError(
+                    f"The lsh engine only supports cosine distance, not {model.metric}."
+                )
+            num_probes: Optional[int] = getattr(conf, "lsh_num_probes", None)
+            return RandomProjectionLSH(
+                model._fit_X,  # pylint: disable=protected-access
+                num_tables=getattr(conf, "lsh_num_tables", None) or 8,
+                num_bits=getattr(conf, "lsh_num_bits", None) or 12,
+                num_probes=1 if num_probes is None else num_probes,  # 0 probes the own bucket only
+            )
+        if engine == "sharded":
+            return ShardedNeighbourSearch(
+                model, getattr(conf, "neighbour_search_shards", None) or os.cpu_count() or 1
+            )
+        raise ValueError(f"Unknown neighbour search engine: {engine}")
@@ -0,0 +1,125 @@
+"""
+Approximate nearest neighbour search for cosine distance based on random
+projection locality sensitive hashing (SimHash).
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+from numpy import ndarray
+from scipy.sparse import csr_matrix, issparse
+
+from api.neighbours.neighbour_search import NeighbourSearch
+
+
+class RandomProjectionLSH(NeighbourSearch):
+    """
+    Random projection LSH index for cosine distance.
+
+    Every table hashes a customer vector to the signs of its projections on
+    `num_bits` random hyperplanes, so customers with a small angle between them
+    tend to share buckets. Candidates from the query buckets of all the tables
+    are then ranked by their exact cosine distance. Per table buckets are kept
+    as sorted key arrays, so no Python object is allocated per customer.
+
+    Recall grows with `num_tables` and `num_probes`, latency drops as
+    `num_bits` grows because buckets get smaller.
+
+    Attributes:
+        _data (ndarray | csr_matrix): The customer vectors the model was fitted on.
+        _norms (ndarray): The L2 norm of every customer vector.
+        _planes (ndarray): Random hyperplanes, shaped (num_tables, n_features, num_bits).
+        _bit_values (ndarray): The value of every signature bit in a bucket key.
+        _num_probes (int): Extra buckets probed per table, the ones reached by
+        flipping the least certain signature bits.
+        _table_keys (List[ndarray]): Sorted bucket keys of every table.
+        _table_rows (List[ndarray]): Customer rows aligned with `_table_keys`.
+    """
+
+    def __init__(
+        self,
+        data: ndarray | csr_matrix,
+        num_tables: int = 8,
+        num_bits: int = 12,
+        num_probes: int = 1,
+        seed: int = 0,
+    ):
+        if not 0 < num_bits < 63:
+            raise ValueError("num_bits must be between 1 and 62.")
+        self._data = (
+            csr_matrix(data) if issparse(data) else np.asarray(data, dtype=np.float64)
+        )
+        self._norms: ndarray = _row_norms(self._data)
+        self._planes: ndarray = np.random.default_rng(seed).standard_normal(
+            (num_tables, self._data.shape[1], num_bits)
+        )
+        self._bit_values: ndarray = np.left_shift(1, np.arange(num_bits, dtype=np.int64))
+        self._num_probes: int = min(num_probes, num_bits)
+        self._table_keys: List[ndarray] = []
+        self._table_rows: List[ndarray] = []
+        for planes in self._planes:
+            keys: ndarray = ((self._data @ planes) > 0) @ self._bit_values
+            rows: ndarray = np.argsort(keys, kind="stable")
+            self._table_keys.append(keys[rows])
+            self._table_rows.append(rows)
+
+    def _candidates(self, projections: List[ndarray]) -> ndarray:
+        """
+        Collects the customers sharing a probed bucket with a query.
+
+        Args:
+            projections (List[ndarray]): The query projections on the
+            hyperplanes of every table.
+
+        Returns:
+            ndarray: Unique candidate rows.
+        """
+        candidates: List[ndarray] = []
+        for projection, keys, rows in zip(projections, self._table_keys, self._table_rows):
+            key = int((projection > 0) @ self._bit_values)
+            least_certain_bits = np.argsort(np.abs(projection))[: self._num_probes]
+            probes = [key] + [key ^ int(self._bit_values[bit]) for bit in least_certain_bits]
+            for probe in probes:
+                start, end = np.searchsorted(keys, [probe, probe + 1])
+                candidates.append(rows[start:end])
+        return np.unique(np.concatenate(candidates))
+
+    def kneighbors(self, X: ndarray, n_neighbors: int) -> Tuple[ndarray, ndarray]:  # pylint: disable=invalid-name
+        queries: ndarray = np.atleast_2d(
+            X.toarray() if issparse(X) else np.asarray(X, dtype=np.float64)
+        )
+        query_norms: ndarray = _row_norms(queries)
+        table_projections: List[ndarray] = [queries @ planes for planes in self._planes]
+        distances = np.empty((queries.shape[0], n_neighbors), dtype=np.float64)
+        neighbours = np.empty((queries.shape[0], n_neighbors), dtype=np.int64)
+        for i in range(queries.shape[0]):
+            candidates: ndarray = self._candidates([p[i] for p in table_projections])
+            if candidates.size < n_neighbors:  # not enough candidates, search them all
+                candidates = np.arange(self._data.shape[0])
+            similarities = np.asarray(self._data[candidates] @ queries[i]).ravel()
+            candidate_distances = 1.0 - similarities / (
+                self._norms[candidates] * query_norms[i]
+            )
+            nearest = np.argpartition(candidate_distances, n_neighbors - 1)[:n_neighbors]
+            nearest = nearest[np.argsort(candidate_distances[nearest], kind="stable")]
+            distances[i], neighbours[i] = candidate_distances[nearest], candidates[nearest]
+        return distances, neighbours
+
+
+def _row_norms(vectors: ndarray | csr_matrix) -> ndarray:
+    """
+    Computes the L2 norm of every row, using 1 for all-zero rows so their
+    cosine distance to anything is 1, as in scikit-learn.
+
+    Args:
+        vectors (ndarray | csr_matrix): Row vectors.
+
+    Returns:
+        ndarray: The norm of every row.
+    """
+    squared = (
+        vectors.multiply(vectors).sum(axis=1) if issparse(vectors) else (vectors**2).sum(axis=1)
+    )
+    norms = np.sqrt(np.asarray(squared, dtype=np.float64).ravel())
+    norms[norms == 0] = 1.0
+    return norms
@@ -0,0 +1,348 @@
+"""
+Exact nearest neighbour search split across local worker processes, for
+customer bases that don't fit comfortably in a single process.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.managers import BaseManager, BaseProxy
+from threading import Lock
+from typing import TYPE_CHECKING, Any, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from numpy import ndarray
+from scipy.sparse import csr_matrix, issparse
+
+from api.neighbours.neighbour_search import NeighbourSearch
+
+if TYPE_CHECKING:
+    from sklearn.neighbors import NearestNeighbors
+
+
+class ShardedNeighbourSearch(NeighbourSearch):
+    """
+    Exact search over customer shards, each one fitted and searched in its
+    own process. A query fans out to every shard, which returns its own top
+    k, and the shard results are merged into the global top k. Every
+    customer is in exactly one shard, so the merged neighbours and distances
+    are the ones of the unsharded model. Customers at the same distance are
+    ranked by row position, where scikit-learn ranks them arbitrarily.
+
+    The shard processes are spawned when the search is built, once per
+    host: a search built before the server forks its workers, e.g. by a
+    preloaded model, is shared by all of them. When the model training data
+    is memory-mapped, e.g. loaded with `mmap_mode`, every shard maps its own
+    rows from the same file, so the rows are neither copied by the process
+    building the search nor duplicated in memory. They are stopped with
+    `close`, or once the search is garbage collected by the process that
+    built it.
+
+    Attributes:
+        _model (NearestNeighbors): The fitted model, whose parameters every
+        shard is fitted with.
+        _bounds (ndarray): First row of every shard, then the number of rows.
+        _lock (Lock): Guards the start of the shard processes.
+        _shards (List[BaseProxy]): The shard of every process.
+        _managers (List[BaseManager]): The shard processes, stopped when
+        garbage collected by the process that started them.
+        _pool (Optional[ThreadPoolExecutor]): Fans the queries out to the
+        shards, created again by every forked process.
+        _pool_pid (Optional[int]): Process the pool was created in.
+    """
+
+    def __init__(self, model: "NearestNeighbors", num_shards: int):
+        if num_shards < 1:
+            raise ValueError("num_shards must be positive.")
+        self._model: "NearestNeighbors" = model
+        num_rows: int = model.n_samples_fit_
+        self._bounds: ndarray = np.linspace(0, num_rows, min(num_shards, num_rows) + 1).astype(
+            np.int64
+        )
+        self._lock = Lock()
+        self._shards: List[BaseProxy] = []
+        self._managers: List[BaseManager] = []
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_pid: Optional[int] = None
+        self._start()
+
+    @property
+    def num_shards(self) -> int:
+        """int: Number of shards, at most one per customer."""
+        return len(self._bounds) - 1
+
+    def _start(self) -> None:
+        """Spawns the shard processes and fits their shards, in parallel."""
+        self._managers, self._shards = _start_shards(self._model, self._bounds)
+
+    def _shard_pool(self) -> ThreadPoolExecutor:
+        """
+        Gets the threads fanning the queries out of the current process.
+        Threads don't survive a fork, so every process creates its own.
+
+        Returns:
+            ThreadPoolExecutor: A thread per shard.
+        """
+        with self._lock:
+            if self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(self.num_shards, "neighbour-shard")
+                self._pool_pid = os.getpid()
+                if not self._shards:
+                    self._start()  # closed, or a shard process died
+            return self._pool
+
+    def kneighbors(self, X: ndarray, n_neighbors: int) -> Tuple[ndarray, ndarray]:  # pylint: disable=invalid-name
+        if n_neighbors > self._bounds[-1]:
+            raise ValueError(
+                f"Expected n_neighbors <= n_samples_fit, but n_neighbors = {n_neighbors}, "
+                f"n_samples_fit = {self._bounds[-1]}"
+            )
+        pool: ThreadPoolExecutor = self._shard_pool()
+        futures: List[Future] = [
+            pool.submit(shard.kneighbors, X, min(n_neighbors, end - start))
+            for shard, start, end in zip(self._shards, self._bounds[:-1], self._bounds[1:])
+        ]
+        try:
+            shard_results: List[Tuple[ndarray, ndarray]] = [
+                future.result() for future in futures
+            ]
+        except (EOFError, OSError):
+            self.close()  # a shard process died, the next query starts them again
+            raise
+        return merge_top_k(
+            [distances for distances, _ in shard_results],
+            [rows + start for (_, rows), start in zip(shard_results, self._bounds[:-1])],
+            n_neighbors,
+        )
+
+    def close(self) -> None:
+        """
+        Stops the shard processes, a later query spawns them again. Processes
+        forked from the one that started them only stop using them.
+        """
+        with self._lock:
+            managers: List[BaseManager] = self._managers
+            self._shards, self._managers = [], []
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False)
+            self._pool, self._pool_pid = None, None
+        for manager in managers:
+            manager.shutdown()  # ignored outside the process that started it
+
+
+def merge_top_k(
+    distances: List[ndarray], rows: List[ndarray], n_neighbors: int
+) -> Tuple[ndarray, ndarray]:
+    """
+    Merges the top k of every shard into the global top k.
+
+    Args:
+        distances (List[ndarray]): Neighbour distances of every shard, shaped
+        (queries, shard k).
+        rows (List[ndarray]): Global row positions aligned with `distances`.
+        n_neighbors (int): Number of neighbours kept per query.
+
+    Returns:
+        Tuple[ndarray, ndarray]: Distances and row positions of the
+        neighbours, sorted by increasing distance, then by row position.
+    """
+    all_distances: ndarray = np.hstack(distances)
+    all_rows: ndarray = np.hstack(rows)
+    order: ndarray = np.lexsort((all_rows, all_distances))[:, :n_neighbors]
+    return (
+        np.take_along_axis(all_distances, order, axis=1),
+        np.take_along_axis(all_rows, order, axis=1),
+    )
+
+
+class MappedArray(NamedTuple):
+    """
+    A C-contiguous array stored in a file, mapped by the process loading it.
+
+    Attributes:
+        filename (str): The file holding the array.
+        offset (int): Position of the array in the file, in bytes.
+        dtype (str): The array dtype, e.g. "<f8".
+        shape (Tuple[int, ...]): The array shape.
+    """
+
+    filename: str
+    offset: int
+    dtype: str
+    shape: Tuple[int, ...]
+
+    def load(self) -> ndarray:
+        """
+        Maps the array, read-only.
+
+        Returns:
+            ndarray: The array, backed by the file.
+        """
+        return np.memmap(
+            self.filename, dtype=self.dtype, mode="r", offset=self.offset, shape=self.shape
+        )
+
+
+class CsrRows(NamedTuple):
+    """
+    Rows of a CSR matrix, their arrays stored in a file or in memory.
+
+    Attributes:
+        data (Union[MappedArray, ndarray]): The values of the rows.
+        indices (Union[MappedArray, ndarray]): The columns of the values.
+        indptr (ndarray): Where every row starts in `data`, then its length.
+        shape (Tuple[int, int]): Number of rows and columns.
+    """
+
+    data: Union[MappedArray, ndarray]
+    indices: Union[MappedArray, ndarray]
+    indptr: ndarray
+    shape: Tuple[int, int]
+
+    def load(self) -> csr_matrix:
+        """
+        Builds the rows, mapping their arrays when they are stored in a file.
+
+        Returns:
+            csr_matrix: The rows.
+        """
+        return csr_matrix(
+            (_load(self.data), _load(self.indices), self.indptr), shape=self.shape
+        )
+
+
+def shard_rows(data: Any, start: int, end: int) -> Union[CsrRows, MappedArray, ndarray]:
+    """
+    Describes the rows of a shard: the region of the file they are mapped
+    from when the training data is memory-mapped, the rows themselves
+    otherwise. Only the row offsets of sparse data are read.
+
+    Args:
+        data (Union[ndarray, csr_matrix]): The model training data.
+        start (int): First row of the shard.
+        end (int): Row after the last one of the shard.
+
+    Returns:
+        Union[CsrRows, MappedArray, ndarray]: The rows, loaded by the shard.
+    """
+    if issparse(data):
+        indptr: ndarray = np.asarray(data.indptr[start:end + 1], dtype=np.int64)
+        values = slice(int(indptr[0]), int(indptr[-1]))
+        return CsrRows(
+            _mapped_or_copied(data.data[values]),
+            _mapped_or_copied(data.indices[values]),
+            indptr - indptr[0],
+            (end - start, data.shape[1]),
+        )
+    return _mapped_or_copied(data[start:end])
+
+
+def _mapped_or_copied(array: ndarray) -> Union[MappedArray, ndarray]:
+    """
+    Locates an array in the file it's memory-mapped from.
+
+    Args:
+        array (ndarray): The array.
+
+    Returns:
+        Union[MappedArray, ndarray]: Where the array is stored, or the array
+        itself when it isn't a non-empty contiguous part of a mapped file.
+    """
+    root: ndarray = array
+    while isinstance(root.base, ndarray):
+        root = root.base
+    if (
+        not isinstance(root, np.memmap)
+        or getattr(root, "filename", None) is None
+        or not array.flags.c_contiguous
+        or array.size == 0
+    ):
+        return np.array(array)
+    position: int = array.__array_interface__["data"][0] - root.__array_interface__["data"][0]
+    return MappedArray(root.filename, root.offset + position, array.dtype.str, array.shape)
+
+
+def _load(rows: Union[CsrRows, MappedArray, ndarray]) -> Union[csr_matrix, ndarray]:
+    """
+    Loads rows described by `shard_rows`.
+
+    Args:
+        rows (Union[CsrRows, MappedArray, ndarray]): The rows.
+
+    Returns:
+        Union[csr_matrix, ndarray]: The rows, mapped from their file when stored in one.
+    """
+    return rows if isinstance(rows, ndarray) else rows.load()
+
+
+class _Shard:
+    """
+    The shard of a shard process, answering the queries of every process
+    connected to it.
+
+    Attributes:
+        _model (NearestNeighbors): The model fitted on the rows of the shard.
+    """
+
+    def __init__(self, params: dict, rows: Union[CsrRows, MappedArray, ndarray]):
+        from sklearn.neighbors import NearestNeighbors  # pylint: disable=import-outside-toplevel
+
+        self._model: "NearestNeighbors" = NearestNeighbors(**params).fit(_load(rows))
+
+    def kneighbors(self, X: ndarray, n_neighbors: int) -> Tuple[ndarray, ndarray]:  # pylint: disable=invalid-name
+        """
+        Searches the shard.
+
+        Args:
+            X (ndarray): Query vectors, one row per customer.
+            n_neighbors (int): Number of neighbours to return per query.
+
+        Returns:
+            Tuple[ndarray, ndarray]: Distances and shard row positions of the
+            neighbours.
+        """
+        return self._model.kneighbors(X, n_neighbors=n_neighbors)
+
+
+class _ShardManager(BaseManager):
+    """A shard process, serving every connection from its own thread."""
+
+
+_ShardManager.register("Shard", _Shard)
+
+
+def _start_shards(
+    model: "NearestNeighbors", bounds: ndarray
+) -> Tuple[List[BaseManager], List[BaseProxy]]:
+    """
+    Spawns a process per shard and fits its shard there. Processes are
+    spawned rather than forked, as the serving process runs threads.
+
+    Args:
+        model (NearestNeighbors): The fitted model.
+        bounds (ndarray): First row of every shard, then the number of rows.
+
+    Returns:
+        Tuple[List[BaseManager], List[BaseProxy]]: The process and the shard
+        of every shard.
+    """
+    data = model._fit_X  # pylint: disable=protected-access
+    context = multiprocessing.get_context("spawn")
+    managers: List[BaseManager] = []
+    for _ in range(len(bounds) - 1):
+        manager = _ShardManager(ctx=context)
+        manager.start()  # pylint: disable=consider-using-with
+        managers.append(manager)
+    # fit the shards in parallel, and fail here rather than on a query
+    with ThreadPoolExecutor(len(managers)) as pool:
+        shards: List[BaseProxy] = list(
+            pool.map(
+                lambda manager, start, end: manager.Shard(
+                    model.get_params(), shard_rows(data, start, end)
+                ),
+                managers,
+                bounds[:-1],
+                bounds[1:],
+            )
+        )
+    return managers, shards
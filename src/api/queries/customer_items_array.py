@@ -2,6 +2,8 @@
 For a given customer get all products he has and hasn't bought
 """
 
+from api.queries.parameterised_query import ParameterisedQuery
+
 QUERY = """
     WITH exploded_orders AS (
         SELECT
@@ -10,7 +12,7 @@ QUERY = """
         FROM `ing-datos-avanzado.main_data.orders` AS o,
         UNNEST(o.order_items) AS i
         WHERE
-        o.customer_id = {0}
+        o.customer_id = @customer_id
     ),
 
     all_combinations AS (
@@ -18,7 +20,7 @@ QUERY = """
             c.customer_id,
             i.item_id
         FROM
-            (SELECT customer_id FROM `ing-datos-avanzado.main_data.customer` WHERE customer_id = {0}) AS c
+            (SELECT customer_id FROM `ing-datos-avanzado.main_data.customer` WHERE customer_id = @customer_id) AS c
         CROSS JOIN
             (SELECT item_id FROM `ing-datos-avanzado.main_data.item`) AS i
     ),
@@ -47,4 +49,53 @@ QUERY = """
     GROUP BY
         customer_id,
         item_id
+    ORDER BY
+        item_id  -- the model features follow the item ids order
+"""
+
+LOCAL_QUERY = """
+    WITH exploded_orders AS (
+        SELECT customer_id, item_id FROM orders WHERE customer_id = :customer_id
+    ),
+
+    all_combinations AS (
+        SELECT
+            c.customer_id,
+            i.item_id
+        FROM
+            (SELECT customer_id FROM customer WHERE customer_id = :customer_id) AS c
+        CROSS JOIN
+            (SELECT item_id FROM item) AS i
+    ),
+
+    customer_product_interactions AS (
+        SELECT
+            ac.customer_id,
+            ac.item_id,
+        CASE
+            WHEN eo.item_id IS NOT NULL THEN 1
+            ELSE 0
+        END AS interaction
+        FROM
+            all_combinations AS ac
+        LEFT JOIN
+            exploded_orders AS eo
+        ON
+            ac.customer_id = eo.customer_id
+            AND ac.item_id = eo.item_id
+    )
+
+    SELECT
+        COUNT(interaction) AS interaction
+    FROM
+        customer_product_interactions
+    GROUP BY
+        customer_id,
+        item_id
+    ORDER BY
+        item_id
 """
+
+PARAMETERISED_QUERY = ParameterisedQuery(
+    "customer_items_array", QUERY, {"customer_id": "INT64"}, LOCAL_QUERY
+)
@@ -0,0 +1,76 @@
+"""
+This query fetches the purchase counts of every customer and item, the data
+the KNN model is trained on, in long format: one row per (customer, item)
+pair bought at least once, so the matrix can be built sparse.
+"""
+
+from api.queries.parameterised_query import ParameterisedQuery
+
+
+def _where_clause(where: str) -> str:
+    """
+    Formats the condition of a purchase counts query.
+
+    Args:
+        where (str): The condition, none when empty.
+
+    Returns:
+        str: The WHERE clause, on its own lines, or an empty string.
+    """
+    return f"\n  WHERE\n    {where}" if where else ""
+
+
+def purchase_counts_query(where: str = "") -> str:
+    """
+    Builds the BigQuery purchase counts query.
+
+    Args:
+        where (str): Condition on the orders, e.g. on their customer, none
+        by default.
+
+    Returns:
+        str: The SQL text.
+    """
+    return f"""
+  SELECT
+    orders.customer_id,
+    items.item_id,
+    COUNT(items.item_id) AS interaction
+  FROM
+    `ing-datos-avanzado.main_data.orders` AS orders,
+  UNNEST(orders.order_items) AS items{_where_clause(where)}
+  GROUP BY
+    orders.customer_id,
+    items.item_id
+"""
+
+
+def local_purchase_counts_query(where: str = "") -> str:
+    """
+    Builds the purchase counts query of the local SQLite backend.
+
+    Args:
+        where (str): Condition on the orders, e.g. on their customer, none
+        by default.
+
+    Returns:
+        str: The SQL text.
+    """
+    return f"""
+  SELECT
+    customer_id,
+    item_id,
+    COUNT(item_id) AS interaction
+  FROM
+    orders{_where_clause(where)}
+  GROUP BY
+    customer_id,
+    item_id
+"""
+
+
+QUERY = purchase_counts_query()
+
+LOCAL_QUERY = local_purchase_counts_query()
+
+PARAMETERISED_QUERY = ParameterisedQuery("customers_items_matrix", QUERY, {}, LOCAL_QUERY)
@@ -0,0 +1,17 @@
+"""
+This query fetches how many times each of the given customers bought each item.
+It's intended for being executed in BigQuery platform.
+"""
+
+from api.queries.customers_items_matrix import local_purchase_counts_query, purchase_counts_query
+from api.queries.parameterised_query import ParameterisedQuery
+
+QUERY = purchase_counts_query("orders.customer_id IN UNNEST(@customer_ids)")
+
+LOCAL_QUERY = local_purchase_counts_query(
+    "customer_id IN (SELECT value FROM json_each(:customer_ids))"
+)
+
+PARAMETERISED_QUERY = ParameterisedQuery(
+    "customers_purchases", QUERY, {"customer_ids": "ARRAY<INT64>"}, LOCAL_QUERY
+)
@@ -3,6 +3,8 @@ This query fetches the n most sell products for given customers.
 It's intended for being executed in BigQuery platform.
 """
 
+from api.queries.parameterised_query import ParameterisedQuery
+
 QUERY = """
   SELECT 
     item_id,
@@ -11,13 +13,40 @@ QUERY = """
     `ing-datos-avanzado.main_data.orders` AS orders,
   UNNEST(orders.order_items) AS items
   WHERE
-    orders.customer_id IN {}  -- similar customers ids
-    AND items.item_id NOT IN {}  -- excluded items, already in purchase order
+    orders.customer_id IN UNNEST(@customer_ids)  -- similar customers ids
+    AND items.item_id NOT IN UNNEST(@excluded_item_ids)  -- excluded items, already in purchase order
   GROUP BY
-    items.item_id,
-    orders.customer_id
+    items.item_id
   ORDER BY
     total_purchases DESC
   LIMIT
-    {}  -- wanted number of recomendations
+    @num_recommendations  -- wanted number of recomendations
 """
+
+LOCAL_QUERY = """
+  SELECT
+    item_id,
+    COUNT(item_id) AS total_purchases
+  FROM
+    orders
+  WHERE
+    customer_id IN (SELECT value FROM json_each(:customer_ids))
+    AND item_id NOT IN (SELECT value FROM json_each(:excluded_item_ids))
+  GROUP BY
+    item_id
+  ORDER BY
+    total_purchases DESC
+  LIMIT
+    :num_recommendations
+"""
+
+PARAMETERISED_QUERY = ParameterisedQuery(
+    "most_sold_products_for_customer",
+    QUERY,
+    {
+        "customer_ids": "ARRAY<INT64>",
+        "excluded_item_ids": "ARRAY<INT64>",
+        "num_recommendations": "INT64",
+    },
+    LOCAL_QUERY,
+)
@@ -0,0 +1,135 @@
+"""
+Named BigQuery queries taking their values as query parameters instead of
+being formatted into the SQL text, so the text of a query never changes and
+BigQuery can reuse cached results.
+"""
+
+from typing import TYPE_CHECKING, Any, Dict, Hashable, Optional, Tuple
+
+if TYPE_CHECKING:
+    from google.cloud.bigquery import QueryJobConfig
+
+
+class ParameterisedQuery:
+    """
+    A SQL query with named `@parameters`.
+
+    Array parameters are declared as `ARRAY<type>` and used in the SQL with
+    `IN UNNEST(@name)`, so lists of any length, including a single value or
+    none, are passed the same way.
+
+    Attributes:
+        name (str): Name of the query, used to label the BigQuery jobs and to
+        report per query statistics.
+        sql (str): The BigQuery SQL text.
+        parameter_types (Dict[str, str]): BigQuery type of every parameter,
+        such as `INT64` or `ARRAY<INT64>`.
+        local_sql (Optional[str]): The same query in SQLite SQL, run by the
+        local backend, with `:name` parameters and arrays read with
+        `json_each(:name)`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sql: str,
+        parameter_types: Dict[str, str],
+        local_sql: Optional[str] = None,
+    ):
+        self.name: str = name
+        self.sql: str = sql
+        self.parameter_types: Dict[str, str] = parameter_types
+        self.local_sql: Optional[str] = local_sql
+
+    def sql_for(self, dialect: str) -> str:
+        """
+        Gets the SQL text of the query in a dialect.
+
+        Args:
+            dialect (str): "bigquery" or "sqlite".
+
+        Raises:
+            ValueError: If the query isn't available in the dialect.
+
+        Returns:
+            str: The SQL text.
+        """
+        if dialect == "bigquery":
+            return self.sql
+        if dialect == "sqlite" and self.local_sql is not None:
+            return self.local_sql
+        raise ValueError(f"Query {self.name} isn't available in {dialect}.")
+
+    def bind(self, **parameters: Any) -> Tuple[Tuple[str, Hashable], ...]:
+        """
+        Checks and normalises parameter values, turning arrays into tuples
+        of plain Python values.
+
+        Args:
+            **parameters: The value of every parameter of the query.
+
+        Raises:
+            ValueError: If a parameter is missing or unknown.
+
+        Returns:
+            Tuple[Tuple[str, Hashable], ...]: The parameters sorted by name,
+            hashable so they can key a cache.
+        """
+        if parameters.keys() != self.parameter_types.keys():
+            raise ValueError(
+                f"Query {self.name} expects parameters {sorted(self.parameter_types)}, "
+                f"got {sorted(parameters)}."
+            )
+        return tuple(
+            (name, _normalise(value, self.parameter_types[name].startswith("ARRAY<")))
+            for name, value in sorted(parameters.items())
+        )
+
+    def job_config(self, bound_parameters: Tuple[Tuple[str, Hashable], ...]) -> "QueryJobConfig":
+        """
+        Builds the BigQuery job configuration of a query run.
+
+        Args:
+            bound_parameters (Tuple[Tuple[str, Hashable], ...]): Parameters
+            returned by `bind`.
+
+        Returns:
+            QueryJobConfig: The configuration, with the query parameters and
+            a `query_name` label.
+        """
+        from google.cloud.bigquery import (  # pylint: disable=import-outside-toplevel,redefined-outer-name
+            ArrayQueryParameter,
+            QueryJobConfig,
+            ScalarQueryParameter,
+        )
+
+        query_parameters = []
+        for name, value in bound_parameters:
+            parameter_type: str = self.parameter_types[name]
+            if parameter_type.startswith("ARRAY<"):
+                query_parameters.append(
+                    ArrayQueryParameter(name, parameter_type[len("ARRAY<") : -1], list(value))
+                )
+            else:
+                query_parameters.append(ScalarQueryParameter(name, parameter_type, value))
+        return QueryJobConfig(
+            query_parameters=query_parameters, labels={"query_name": self.name}
+        )
+
+
+def _normalise(value: Any, is_array: bool) -> Hashable:
+    """
+    Converts NumPy values and sequences to plain Python ones.
+
+    Args:
+        value (Any): A parameter value.
+        is_array (bool): Whether the parameter is an array.
+
+    Returns:
+        Hashable: A Python scalar, or a tuple of them for arrays.
+    """
+    if hasattr(value, "tolist"):
+        value = value.tolist()
+    if is_array:
+        return tuple(v.item() if hasattr(v, "item") else v for v in value)
+    return value
@@ -0,0 +1,344 @@
+"""
+Executors running the recommender SQL queries, either on BigQuery through a
+bounded thread pool or in memory for tests and local runs.
+"""
+
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Empty, LifoQueue
+from threading import Lock
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from google.cloud.bigquery import Client, QueryJobConfig
+    from pandas import DataFrame
+
+
+class QueryStats:
+    """
+    Thread safe per query counters of runs, wall time and bytes processed,
+    to find out which query drives latency and cost.
+
+    Attributes:
+        _lock (Lock): Lock guarding the counters.
+        _stats (Dict[str, Dict[str, float]]): Counters by query name.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(
+        self,
+        query_name: str,
+        wall_time_seconds: float,
+        bytes_processed: int = 0,
+        remote_cache_hit: bool = False,
+    ) -> None:
+        """
+        Records a query run.
+
+        Args:
+            query_name (str): Name of the query.
+            wall_time_seconds (float): Time the run took.
+            bytes_processed (int): Bytes BigQuery processed, and billed, for the run.
+            remote_cache_hit (bool): Whether BigQuery answered from its result cache.
+        """
+        with self._lock:
+            stats = self._stats.setdefault(
+                query_name,
+                {"runs": 0, "wall_time_seconds": 0.0, "bytes_processed": 0, "remote_cache_hits": 0},
+            )
+            stats["runs"] += 1
+            stats["wall_time_seconds"] += wall_time_seconds
+            stats["bytes_processed"] += bytes_processed
+            stats["remote_cache_hits"] += int(remote_cache_hit)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """
+        Copies the counters.
+
+        Returns:
+            Dict[str, Dict[str, float]]: Runs, total wall time, total bytes
+            processed and BigQuery cache hits by query name.
+        """
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+
+def get_query_name(job_config: Optional["QueryJobConfig"]) -> str:
+    """
+    Gets the name a query was labelled with.
+
+    Args:
+        job_config (Optional[QueryJobConfig]): The query settings.
+
+    Returns:
+        str: The `query_name` label, "adhoc" for unlabelled queries.
+    """
+    labels = getattr(job_config, "labels", None) or {}
+    return labels.get("query_name", "adhoc")
+
+
+class QueryExecutor(ABC):
+    """
+    Runs SQL queries and returns their results as DataFrames.
+
+    `submit` starts a query and returns right away, so independent queries can
+    run concurrently; `query` waits for the result. Every run is recorded in
+    `stats` under the `query_name` label of its job configuration.
+
+    Attributes:
+        dialect (str): SQL dialect of the queries the executor runs.
+        stats (QueryStats): Per query runs, wall time and bytes processed.
+    """
+
+    dialect: str = "bigquery"
+    stats: QueryStats
+
+    @property
+    def wait_timeout(self) -> Optional[float]:
+        """
+        Optional[float]: Longest wait for the result of a query submitted
+        with the default timeout, queueing included. None waits until the
+        query ends.
+        """
+        return None
+
+    @abstractmethod
+    def submit(
+        self,
+        query: str,
+        job_config: Optional["QueryJobConfig"] = None,
+        timeout: Optional[float] = None,
+    ) -> "Future[DataFrame]":
+        """
+        Starts running a query.
+
+        Args:
+            query (str): The SQL query.
+            job_config (Optional[QueryJobConfig]): Query settings such as parameters.
+            timeout (Optional[float]): Maximum seconds the query may take,
+            defaults to the executor timeout.
+
+        Returns:
+            Future[DataFrame]: The future query result.
+        """
+
+    def query(
+        self,
+        query: str,
+        job_config: Optional["QueryJobConfig"] = None,
+        timeout: Optional[float] = None,
+    ) -> "DataFrame":
+        """
+        Runs a query and waits for its result.
+
+        Args:
+            query (str): The SQL query.
+            job_config (Optional[QueryJobConfig]): Query settings such as parameters.
+            timeout (Optional[float]): Maximum seconds the query may take,
+            defaults to the executor timeout.
+
+        Raises:
+            TimeoutError: If the query takes longer than the timeout.
+
+        Returns:
+            DataFrame: The query result.
+        """
+        return self.submit(query, job_config, timeout).result()
+
+
+class BigQueryExecutor(QueryExecutor):
+    """
+    Runs queries on BigQuery from a bounded thread pool.
+
+    Clients are expensive to create, so they are kept in a pool and reused:
+    each running query borrows one and gives it back when done. At most
+    `max_workers` queries run at once, the rest wait in the pool queue instead
+    of blocking WSGI worker threads.
+
+    Attributes:
+        _client_factory (Callable[[], Client]): Creates a new BigQuery client.
+        _clients (LifoQueue): Idle clients, the most recently used first.
+        _timeout_seconds (float): Default maximum duration of a query.
+        _pool (ThreadPoolExecutor): Threads running the queries.
+        _lock (Lock): Guards the lazy creation of the thread pool.
+        _max_workers (int): Size of the thread pool.
+    """
+
+    def __init__(
+        self,
+        client_factory: Optional[Callable[[], "Client"]] = None,
+        max_workers: int = 8,
+        timeout_seconds: float = 30.0,
+    ):
+        self._client_factory: Callable[[], "Client"] = client_factory or _default_client
+        self._clients: LifoQueue = LifoQueue()
+        self._timeout_seconds: float = timeout_seconds
+        self._max_workers: int = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = Lock()
+        self.stats = QueryStats()
+
+    @classmethod
+    def from_client(cls, client: "Client", **kwargs) -> "BigQueryExecutor":
+        """
+        Builds an executor sharing a single existing client.
+
+        Args:
+            client (Client): The BigQuery client to use.
+            **kwargs: Other arguments of the executor.
+
+        Returns:
+            BigQueryExecutor: The executor.
+        """
+        return cls(client_factory=lambda: client, **kwargs)
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        """
+        Creates the thread pool on first use.
+
+        Returns:
+            ThreadPoolExecutor: The thread pool.
+        """
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self._max_workers, thread_name_prefix="bigquery"
+                    )
+        return self._pool
+
+    def _run(
+        self, query: str, job_config: Optional["QueryJobConfig"], timeout: float
+    ) -> "DataFrame":
+        """
+        Runs a query with a pooled client.
+
+        Args:
+            query (str): The SQL query.
+            job_config (Optional[QueryJobConfig]): Query settings such as parameters.
+            timeout (float): Maximum seconds the query may take.
+
+        Returns:
+            DataFrame: The query result.
+        """
+        try:
+            client: "Client" = self._clients.get_nowait()
+        except Empty:
+            client = self._client_factory()
+        start: float = perf_counter()
+        try:
+            job = client.query(query, job_config=job_config, timeout=timeout)
+            result: "DataFrame" = job.result(timeout=timeout).to_dataframe()
+        finally:
+            self._clients.put(client)
+        self.stats.record(
+            get_query_name(job_config),
+            perf_counter() - start,
+            getattr(job, "total_bytes_processed", None) or 0,
+            getattr(job, "cache_hit", None) is True,
+        )
+        return result
+
+    def submit(
+        self,
+        query: str,
+        job_config: Optional["QueryJobConfig"] = None,
+        timeout: Optional[float] = None,
+    ) -> "Future[DataFrame]":
+        return self._get_pool().submit(
+            self._run, query, job_config, timeout or self._timeout_seconds
+        )
+
+    @property
+    def wait_timeout(self) -> Optional[float]:
+        # the pool may queue the query, so the caller waits a bit longer than the query itself
+        return 2 * self._timeout_seconds
+
+    def query(
+        self,
+        query: str,
+        job_config: Optional["QueryJobConfig"] = None,
+        timeout: Optional[float] = None,
+    ) -> "DataFrame":
+        timeout = timeout or self._timeout_seconds
+        # the pool may queue the query, so the caller waits a bit longer than the query itself
+        return self.submit(query, job_config, timeout).result(timeout=2 * timeout)
+
+    def shutdown(self) -> None:
+        """Waits for running queries and stops the thread pool."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+class InMemoryQueryExecutor(QueryExecutor):
+    """
+    Answers queries synchronously with a Python function instead of BigQuery,
+    for tests, benchmarks and offline development.
+
+    Attributes:
+        _handler (Callable[[str, Optional[QueryJobConfig]], DataFrame]):
+        Computes the result of a query.
+        queries (List[str]): Every query submitted, in order.
+    """
+
+    def __init__(self, handler: Callable[[str, Optional["QueryJobConfig"]], "DataFrame"]):
+        self._handler = handler
+        self.queries: List[str] = []
+        self.stats = QueryStats()
+
+    def submit(
+        self,
+        query: str,
+        job_config: Optional["QueryJobConfig"] = None,
+        timeout: Optional[float] = None,
+    ) -> "Future[DataFrame]":
+        self.queries.append(query)
+        future: "Future[DataFrame]" = Future()
+        start: float = perf_counter()
+        try:
+            future.set_result(self._handler(query, job_config))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            future.set_exception(e)
+        self.stats.record(get_query_name(job_config), perf_counter() - start)
+        return future
+
+
+def chain_future(future: "Future", function: Callable) -> Future:
+    """
+    Applies a function to the result of a future without waiting for it.
+
+    Args:
+        future (Future): The future to chain.
+        function (Callable): Called with the future result once it's done.
+
+    Returns:
+        Future: The future result of the function.
+    """
+    chained: Future = Future()
+
+    def on_done(done: Future) -> None:
+        try:
+            chained.set_result(function(done.result()))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            chained.set_exception(e)
+
+    future.add_done_callback(on_done)
+    return chained
+
+
+def _default_client() -> "Client":
+    """
+    Creates a BigQuery client with the default credentials. The BigQuery
+    library is only imported here, since importing it is slow.
+
+    Returns:
+        Client: A new BigQuery client.
+    """
+    from google.cloud.bigquery import Client  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    return Client()
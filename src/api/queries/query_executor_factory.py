@@ -0,0 +1,62 @@
+"""
+Factory selecting the query backend set in the model configuration.
+"""
+
+from typing import TYPE_CHECKING, Optional
+
+from credit_risk_lib.config.config import Config
+
+from api.queries.query_executor import BigQueryExecutor, QueryExecutor
+from api.queries.sqlite_query_executor import SQLiteQueryExecutor
+
+if TYPE_CHECKING:
+    from google.cloud.bigquery import Client
+
+
+class QueryExecutorFactory:  # pylint: disable=too-few-public-methods
+    """
+    Builds query executors from the model configuration.
+
+    The backend is picked with the `query_backend` key:
+        - "bigquery" (default): a `BigQueryExecutor`, tuned with
+          `bigquery_max_workers` and `bigquery_timeout_seconds`.
+        - "sqlite": a `SQLiteQueryExecutor` over the Parquet exports set in
+          `local_orders_path`, `local_customers_path` and `local_items_path`.
+    """
+
+    @staticmethod
+    def get_executor(conf: Config, bq_client: Optional["Client"] = None) -> QueryExecutor:
+        """
+        Builds the query executor set in the configuration. BigQuery clients
+        and the local database are only created when the first query runs.
+
+        Args:
+            conf (Config): The model configuration.
+            bq_client (Optional[Client]): A BigQuery client to use for every
+            query, default clients are created otherwise.
+
+        Raises:
+            ValueError: If the backend is unknown or its data isn't set.
+
+        Returns:
+            QueryExecutor: The configured executor.
+        """
+        backend: str = getattr(conf, "query_backend", None) or "bigquery"
+        if backend == "bigquery":
+            settings = {
+                "max_workers": getattr(conf, "bigquery_max_workers", None) or 8,
+                "timeout_seconds": getattr(conf, "bigquery_timeout_seconds", None) or 30.0,
+            }
+            if bq_client is None:
+                return BigQueryExecutor(**settings)
+            return BigQueryExecutor.from_client(bq_client, **settings)
+        if backend == "sqlite":
+            orders_path: Optional[str] = getattr(conf, "local_orders_path", None)
+            if not orders_path:
+                raise ValueError("The sqlite query backend requires local_orders_path.")
+            return SQLiteQueryExecutor(
+                orders_path,
+                customers_path=getattr(conf, "local_customers_path", None),
+                items_path=getattr(conf, "local_items_path", None),
+            )
+        raise ValueError(f"Unknown query backend: {backend}")
@@ -0,0 +1,105 @@
+"""
+Runs the named parameterised queries of the recommender, keeping their
+results in a local cache.
+"""
+
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Dict
+
+from api.cache.ttl_lru_cache import TTLLRUCache
+from api.queries.parameterised_query import ParameterisedQuery
+from api.queries.query_executor import QueryExecutor
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+
+class QueryRunner:
+    """
+    Runs parameterised queries on a query executor.
+
+    Results are cached locally by query name and parameters, so repeated
+    lookups, e.g. the item vector of a returning customer, don't reach
+    BigQuery at all. Since the SQL text of a query never changes, the runs
+    that do reach it can be answered from BigQuery's own result cache.
+
+    Attributes:
+        _executor (QueryExecutor): Runs the queries.
+        _cache (TTLLRUCache): Query results by (query name, parameters).
+    """
+
+    def __init__(self, executor: QueryExecutor, cache: TTLLRUCache):
+        self._executor: QueryExecutor = executor
+        self._cache: TTLLRUCache = cache
+
+    def submit(
+        self, query: ParameterisedQuery, *, cached: bool = True, **parameters: Any
+    ) -> "Future[DataFrame]":
+        """
+        Starts running a query, unless its result is cached.
+
+        Args:
+            query (ParameterisedQuery): The query.
+            cached (bool): Whether the result is looked up in and added to
+            the cache. Callers keeping the results in a cache of their own
+            skip it, so they aren't held twice.
+            **parameters: The value of every parameter of the query.
+
+        Raises:
+            ValueError: If a parameter is missing or unknown.
+
+        Returns:
+            Future[DataFrame]: The future query result. Cached results must
+            not be modified.
+        """
+        bound_parameters = query.bind(**parameters)
+        key = (query.name, bound_parameters)
+        result = self._cache.get(key) if cached else None
+        if result is not None:
+            future: "Future[DataFrame]" = Future()
+            future.set_result(result)
+            return future
+        future = self._executor.submit(
+            query.sql_for(self._executor.dialect), query.job_config(bound_parameters)
+        )
+        if cached:
+            future.add_done_callback(
+                lambda done: done.exception() is None and self._cache.put(key, done.result())
+            )
+        return future
+
+    def run(self, query: ParameterisedQuery, **parameters: Any) -> "DataFrame":
+        """
+        Runs a query and waits for its result.
+
+        Args:
+            query (ParameterisedQuery): The query.
+            **parameters: The value of every parameter of the query.
+
+        Raises:
+            ValueError: If a parameter is missing or unknown.
+            TimeoutError: If the query takes longer than the executor timeout.
+
+        Returns:
+            DataFrame: The query result. Cached results must not be modified.
+        """
+        bound_parameters = query.bind(**parameters)
+        cached = self._cache.get((query.name, bound_parameters))
+        if cached is not None:
+            return cached
+        result: "DataFrame" = self._executor.query(
+            query.sql_for(self._executor.dialect), query.job_config(bound_parameters)
+        )
+        self._cache.put((query.name, bound_parameters), result)
+        return result
+
+    def query_stats(self) -> Dict[str, Any]:
+        """
+        Reports the queries run so far.
+
+        Returns:
+            Dict[str, Any]: The runs, wall time, bytes processed and BigQuery
+            cache hits of every query under "queries", and the local result
+            cache usage under "cache".
+        """
+        return {"queries": self._executor.stats.snapshot(), "cache": self._cache.cache_info()}
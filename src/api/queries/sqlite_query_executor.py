@@ -0,0 +1,143 @@
+"""
+Local query backend running the recommender queries with an embedded SQLite
+database loaded from Parquet exports, for offline development, CI, benchmarks
+and deployments without access to BigQuery.
+"""
+
+import json
+import sqlite3
+from concurrent.futures import Future
+from threading import Lock
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from api.queries.query_executor import QueryExecutor, QueryStats, get_query_name
+
+if TYPE_CHECKING:
+    from google.cloud.bigquery import QueryJobConfig
+    from pandas import DataFrame
+
+
+class SQLiteQueryExecutor(QueryExecutor):
+    """
+    Runs the `sqlite` dialect of the recommender queries on an in-memory
+    SQLite database with the same tables as the BigQuery dataset:
+        - `orders (customer_id, item_id)`: one row per purchased item, the
+          orders already exploded.
+        - `customer (customer_id)` and `item (item_id)`: the customers and
+          the catalogue, derived from the orders when no export is given.
+
+    The database is loaded on the first query. Queries run one at a time on a
+    single connection and their futures are returned completed.
+
+    Attributes:
+        _orders_path (str): Parquet export of the exploded orders.
+        _customers_path (Optional[str]): Parquet export of the customers.
+        _items_path (Optional[str]): Parquet export of the items.
+        _connection (Optional[sqlite3.Connection]): The loaded database.
+        _lock (Lock): Serialises the loading and the queries.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(
+        self,
+        orders_path: str,
+        customers_path: Optional[str] = None,
+        items_path: Optional[str] = None,
+    ):
+        self._orders_path: str = orders_path
+        self._customers_path: Optional[str] = customers_path
+        self._items_path: Optional[str] = items_path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = Lock()
+        self.stats = QueryStats()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Loads the Parquet exports into a new in-memory database.
+
+        Returns:
+            sqlite3.Connection: The connection to the database.
+        """
+        import pyarrow.dataset  # pylint: disable=import-outside-toplevel
+
+        connection = sqlite3.connect(":memory:", check_same_thread=False)
+        tables = [
+            ("orders", ["customer_id", "item_id"], self._orders_path),
+            ("customer", ["customer_id"], self._customers_path),
+            ("item", ["item_id"], self._items_path),
+        ]
+        for table, columns, path in tables:
+            definitions = ", ".join(f"{column} INTEGER" for column in columns)
+            connection.execute(f"CREATE TABLE {table} ({definitions})")
+            if path is None:
+                connection.execute(
+                    f"INSERT INTO {table} SELECT DISTINCT {columns[0]} FROM orders"
+                )
+                continue
+            placeholders = ", ".join("?" for _ in columns)
+            dataset = pyarrow.dataset.dataset(path, format="parquet")
+            for batch in dataset.to_batches(columns=columns):
+                connection.executemany(
+                    f"INSERT INTO {table} VALUES ({placeholders})",
+                    zip(*(batch.column(c).to_pylist() for c in columns)),
+                )
+        connection.executescript(
+            """
+            CREATE INDEX orders_customer ON orders (customer_id, item_id);
+            CREATE INDEX orders_item ON orders (item_id);
+            CREATE INDEX customer_id ON customer (customer_id);
+            ANALYZE;
+            """
+        )
+        return connection
+
+    def submit(
+        self,
+        query: str,
+        job_config: Optional["QueryJobConfig"] = None,
+        timeout: Optional[float] = None,
+    ) -> "Future[DataFrame]":
+        from pandas import read_sql_query  # pylint: disable=import-outside-toplevel
+
+        future: "Future[DataFrame]" = Future()
+        start: float = perf_counter()
+        try:
+            with self._lock:
+                if self._connection is None:
+                    self._connection = self._connect()
+                future.set_result(
+                    read_sql_query(query, self._connection, params=_sqlite_parameters(job_config))
+                )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            future.set_exception(e)
+        self.stats.record(get_query_name(job_config), perf_counter() - start)
+        return future
+
+    def close(self) -> None:
+        """Closes the database, it's loaded again by the next query."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def _sqlite_parameters(job_config: Optional["QueryJobConfig"]) -> Dict[str, Any]:
+    """
+    Converts BigQuery query parameters to SQLite named parameters, arrays
+    being passed as JSON to be read with `json_each`.
+
+    Args:
+        job_config (Optional[QueryJobConfig]): The query settings.
+
+    Returns:
+        Dict[str, Any]: The value of every parameter by name.
+    """
+    parameters: Dict[str, Any] = {}
+    for parameter in getattr(job_config, "query_parameters", None) or []:
+        if hasattr(parameter, "values"):
+            parameters[parameter.name] = json.dumps(list(parameter.values))
+        else:
+            parameters[parameter.name] = parameter.value
+    return parameters
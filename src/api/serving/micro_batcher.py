@@ -0,0 +1,171 @@
+"""
+Gathers the recommendation requests arriving within a few milliseconds of
+each other and answers them with a single batched model call, so concurrent
+requests share one `kneighbors` call and one purchases lookup.
+"""
+
+import logging
+from concurrent.futures import Future
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+from time import monotonic
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from api.metrics import MICRO_BATCH_SIZE
+
+if TYPE_CHECKING:
+    from api.knn_model import KNNModel, Recommendation
+
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Queues single recommendation requests and answers them from a
+    background thread with `KNNModel.recommend_many_with_tier`: the first
+    queued request opens a batch, which takes the requests queued within
+    `max_wait_seconds` after it, up to `max_batch_size` of them. Requests to
+    different models, e.g. around a reload, are answered by their own model.
+
+    The thread is started by the first request, so a batcher built before a
+    fork works in every worker.
+
+    Attributes:
+        max_wait_seconds (float): How long a batch waits for more requests.
+        max_batch_size (int): Requests answered by a single model call.
+        _queue (SimpleQueue): Model, request and result of the queued
+        requests, None asking the thread to stop.
+        _lock (Lock): Guards the start of the thread.
+        _thread (Optional[Thread]): The thread answering the batches.
+    """
+
+    def __init__(self, max_wait_seconds: float, max_batch_size: int = 64):
+        if max_wait_seconds < 0 or max_batch_size < 1:
+            raise ValueError("max_wait_seconds must be non-negative and max_batch_size positive.")
+        self.max_wait_seconds: float = max_wait_seconds
+        self.max_batch_size: int = max_batch_size
+        self._queue: SimpleQueue = SimpleQueue()
+        self._lock = Lock()
+        self._thread: Optional[Thread] = None
+
+    def recommend(self, knn_model: "KNNModel", request: dict) -> "Recommendation":
+        """
+        Queues a request and waits for its recommendation.
+
+        Args:
+            knn_model (KNNModel): The model answering the request.
+            request (dict): A request with the same keys as the
+            `KNNModel.recommend` arguments.
+
+        Returns:
+            Recommendation: The recommended items and the tier that completed
+            them. The exceptions of the model call answering the request are
+            raised as is.
+        """
+        return self.submit(knn_model, request).result()
+
+    def submit(self, knn_model: "KNNModel", request: dict) -> Future:
+        """
+        Queues a request.
+
+        Args:
+            knn_model (KNNModel): The model answering the request.
+            request (dict): A request with the same keys as the
+            `KNNModel.recommend` arguments.
+
+        Returns:
+            Future: The recommendation of the request, see `recommend`.
+        """
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = Thread(target=self._run, name="micro-batcher", daemon=True)
+                    self._thread.start()
+        future: Future = Future()
+        self._queue.put((knn_model, request, future))
+        return future
+
+    def close(self) -> None:
+        """Answers the queued requests and stops the thread, if running."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        """Answers batches of requests until asked to stop."""
+        stopping = False
+        while not stopping:
+            queued = self._queue.get()
+            if queued is None:
+                break
+            batch: List[Tuple["KNNModel", dict, Future]] = [queued]
+            deadline: float = monotonic() + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                try:
+                    queued = self._queue.get(timeout=max(0.0, deadline - monotonic()))
+                except Empty:
+                    break
+                if queued is None:
+                    stopping = True
+                    break
+                batch.append(queued)
+            self._answer(batch)
+
+    @staticmethod
+    def _answer(batch: List[Tuple["KNNModel", dict, Future]]) -> None:
+        """
+        Answers a batch with a model call per model. When a call fails, its
+        unanswered requests are answered one by one, so only the failing
+        ones get the error.
+
+        Args:
+            batch (List[Tuple[KNNModel, dict, Future]]): The model, request
+            and result of every request.
+        """
+        MICRO_BATCH_SIZE.observe(len(batch))
+        by_model: Dict[int, List[Tuple["KNNModel", dict, Future]]] = {}
+        for queued in batch:
+            by_model.setdefault(id(queued[0]), []).append(queued)
+        for model_batch in by_model.values():
+            futures: List[Future] = [future for _, _, future in model_batch]
+            try:
+                recommendations = model_batch[0][0].recommend_many_with_tier(
+                    [request for _, request, _ in model_batch], batch_size=len(model_batch)
+                )
+                for future, recommendation in zip(futures, recommendations):
+                    future.set_result(recommendation)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                pending: List[Tuple[dict, Future]] = [
+                    (request, future) for _, request, future in model_batch if not future.done()
+                ]
+                if len(pending) == 1:
+                    pending[0][1].set_exception(e)
+                    continue
+                logger.warning(
+                    "Micro-batch of %d requests failed, answering them one by one",
+                    len(model_batch),
+                    exc_info=True,
+                )
+                for request, future in pending:
+                    MicroBatcher._answer_one(model_batch[0][0], request, future)
+
+    @staticmethod
+    def _answer_one(knn_model: "KNNModel", request: dict, future: Future) -> None:
+        """
+        Answers a single request with its own model call.
+
+        Args:
+            knn_model (KNNModel): The model answering the request.
+            request (dict): The request.
+            future (Future): Its result.
+        """
+        try:
+            future.set_result(
+                next(iter(knn_model.recommend_many_with_tier([request], batch_size=1)))
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            future.set_exception(e)
@@ -0,0 +1,182 @@
+"""
+Bounds the number of KNN model calls running or waiting at once, so an
+overloaded process answers fast 503s instead of queueing without limit, and
+stops waiting for calls that take longer than the request timeout.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+from typing import Any, Callable, Dict, Optional
+
+from api.metrics import MODEL_CALL_QUEUE_SECONDS, MODEL_CALLS
+
+
+class OverloadedError(Exception):
+    """Raised when a model call is refused because too many are waiting."""
+
+
+class ModelCallTimeoutError(Exception):
+    """Raised when a model call doesn't finish within the request timeout."""
+
+
+class ModelCallLimiter:
+    """
+    Runs model calls on a fixed pool of threads, in front of which at most
+    `max_queued` calls may wait. Calls past that limit are refused right away.
+    Streamed calls, which can't leave the request thread, only take a slot
+    with `admit` and give it back with `release`. Calls already running
+    elsewhere, e.g. in a micro-batch, hold a slot while `wait` waits for them.
+
+    A call that times out can't be interrupted: the request gets its error,
+    but the call keeps its pool thread, and its slot, until it finishes. A
+    call still waiting for a thread is cancelled instead.
+
+    Attributes:
+        max_concurrent (int): Calls running at once.
+        max_queued (int): Calls allowed to wait for a thread.
+        timeout_seconds (Optional[float]): How long a request waits for its
+        call, queueing included. None waits forever.
+        _executor (ThreadPoolExecutor): The threads running the calls.
+        _slots (BoundedSemaphore): One slot per running or waiting call.
+        _lock (Lock): Guards the in-flight count.
+        _in_flight (int): Calls running or waiting.
+    """
+
+    def __init__(
+        self, max_concurrent: int, max_queued: int, timeout_seconds: Optional[float] = None
+    ):
+        if max_concurrent < 1 or max_queued < 0:
+            raise ValueError("max_concurrent must be positive and max_queued non-negative.")
+        self.max_concurrent: int = max_concurrent
+        self.max_queued: int = max_queued
+        self.timeout_seconds: Optional[float] = timeout_seconds
+        self._executor = ThreadPoolExecutor(max_concurrent, thread_name_prefix="model-call")
+        self._slots = BoundedSemaphore(max_concurrent + max_queued)
+        self._lock = Lock()
+        self._in_flight: int = 0
+
+    def run(self, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Runs a model call and waits for its result.
+
+        Args:
+            function (Callable[..., Any]): The call, e.g. `knn_model.recommend`.
+            *args: Its positional arguments.
+            **kwargs: Its keyword arguments.
+
+        Raises:
+            OverloadedError: If too many calls are running or waiting.
+            ModelCallTimeoutError: If the call doesn't finish in time.
+
+        Returns:
+            Any: The result of the call. Its exceptions are raised as is.
+        """
+        self.admit()
+        submitted: float = perf_counter()
+
+        def timed_call() -> Any:
+            MODEL_CALL_QUEUE_SECONDS.observe(perf_counter() - submitted)
+            return function(*args, **kwargs)
+
+        try:
+            future: Future = self._executor.submit(timed_call)
+        except RuntimeError:  # shut down
+            self.release()
+            raise
+        future.add_done_callback(lambda _: self.release())
+        try:
+            result: Any = future.result(self.timeout_seconds)
+        except FutureTimeoutError as e:
+            future.cancel()
+            MODEL_CALLS.inc("timeout")
+            raise ModelCallTimeoutError(
+                f"The recommendation took more than {self.timeout_seconds} seconds."
+            ) from e
+        except Exception:
+            MODEL_CALLS.inc("error")
+            raise
+        MODEL_CALLS.inc("served")
+        return result
+
+    def wait(self, submit: Callable[[], Future]) -> Any:
+        """
+        Submits a call running outside the pool and waits for its result. The
+        call only holds its slot while waited for.
+
+        Args:
+            submit (Callable[[], Future]): Submits the call, e.g. to a
+            `MicroBatcher`.
+
+        Raises:
+            OverloadedError: If too many calls are running or waiting.
+            ModelCallTimeoutError: If the call doesn't finish in time.
+
+        Returns:
+            Any: The result of the call. Its exceptions are raised as is.
+        """
+        self.admit()
+        try:
+            result: Any = submit().result(self.timeout_seconds)
+        except FutureTimeoutError as e:
+            MODEL_CALLS.inc("timeout")
+            raise ModelCallTimeoutError(
+                f"The recommendation took more than {self.timeout_seconds} seconds."
+            ) from e
+        except Exception:
+            MODEL_CALLS.inc("error")
+            raise
+        finally:
+            self.release()
+        MODEL_CALLS.inc("served")
+        return result
+
+    def admit(self) -> None:
+        """
+        Takes the slot of a call.
+
+        Raises:
+            OverloadedError: If too many calls are running or waiting.
+        """
+        if not self._slots.acquire(blocking=False):  # pylint: disable=consider-using-with
+            MODEL_CALLS.inc("shed")
+            raise OverloadedError(
+                f"{self.max_concurrent + self.max_queued} recommendations are already "
+                "running or waiting, try again later."
+            )
+        with self._lock:
+            self._in_flight += 1
+
+    def release(self) -> None:
+        """Gives back the slot of a finished or cancelled call."""
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    @property
+    def in_flight(self) -> int:
+        """int: Calls running or waiting."""
+        return self._in_flight
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Reports the limits and the current load.
+
+        Returns:
+            Dict[str, Any]: The limits and the calls running or waiting.
+        """
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "timeout_seconds": self.timeout_seconds,
+            "in_flight": self._in_flight,
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stops accepting calls.
+
+        Args:
+            wait (bool): Whether to wait for the calls in flight to finish.
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
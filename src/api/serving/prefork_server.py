@@ -0,0 +1,282 @@
+"""
+Production entry point serving the Flask application with waitress: the
+model is loaded once, then the process forks its workers, each one serving
+the shared listening socket with a pool of threads, and every worker drains
+its requests in flight before exiting on SIGTERM.
+"""
+
+import logging
+import os
+import signal
+import socket
+from threading import Event
+from time import monotonic
+from typing import Callable, Dict, Mapping, NamedTuple, Optional
+
+from flask import Flask
+from waitress import wasyncore
+from waitress.server import create_server
+
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = 0.1  # longest wait of the event loop while draining
+
+
+class ServerSettings(NamedTuple):
+    """
+    Settings of the production server.
+
+    Attributes:
+        host (str): Interface to listen on.
+        port (int): Port to listen on.
+        workers (int): Worker processes sharing the listening socket, 1 to
+        serve from the main process.
+        threads (int): Request threads per worker. Requests past the model
+        call limits get a 503 only when there are more threads than
+        concurrent and queued model calls, the others wait for a thread.
+        connection_limit (int): Open connections per worker, past which the
+        worker stops accepting new ones.
+        backlog (int): Connections the kernel queues before refusing them.
+        channel_timeout_seconds (int): Idle connections are closed after it.
+        graceful_timeout_seconds (float): How long a worker waits for the
+        requests in flight once asked to stop.
+        preload (bool): Whether to load the model before forking, so the
+        workers share its memory and its neighbour search shard processes,
+        and are ready right away.
+    """
+
+    host: str = "0.0.0.0"
+    port: int = 9092
+    workers: int = 1
+    threads: int = 16
+    connection_limit: int = 100
+    backlog: int = 1024
+    channel_timeout_seconds: int = 120
+    graceful_timeout_seconds: float = 30.0
+    preload: bool = True
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> "ServerSettings":
+        """
+        Reads the settings from environment variables, the defaults being
+        used for the missing ones.
+
+        Args:
+            environ (Optional[Mapping[str, str]]): The environment,
+            `os.environ` by default.
+
+        Returns:
+            ServerSettings: The settings.
+        """
+        environ = os.environ if environ is None else environ
+        defaults = cls()
+        return cls(
+            host=environ.get("HOST", defaults.host),
+            port=int(environ.get("PORT", defaults.port)),
+            workers=int(environ.get("WEB_WORKERS", defaults.workers)),
+            threads=int(environ.get("WEB_THREADS", defaults.threads)),
+            connection_limit=int(environ.get("WEB_CONNECTION_LIMIT", defaults.connection_limit)),
+            backlog=int(environ.get("WEB_BACKLOG", defaults.backlog)),
+            channel_timeout_seconds=int(
+                environ.get("WEB_CHANNEL_TIMEOUT_SECONDS", defaults.channel_timeout_seconds)
+            ),
+            graceful_timeout_seconds=float(
+                environ.get("GRACEFUL_TIMEOUT_SECONDS", defaults.graceful_timeout_seconds)
+            ),
+            preload=environ.get("MODEL_PRELOAD", "1") == "1",
+        )
+
+
+class PreforkServer:
+    """
+    Serves an application from several worker processes.
+
+    Background threads don't survive a fork, so the application factory must
+    not start any: they are started in every worker by `on_worker_start`,
+    and stopped by `on_worker_exit` once the worker has drained.
+
+    Attributes:
+        _app_factory (Callable[[], Flask]): Builds the application.
+        _settings (ServerSettings): The server settings.
+        _on_worker_start (Optional[Callable[[Flask], None]]): Called in every
+        worker before it serves requests.
+        _on_worker_exit (Optional[Callable[[Flask], None]]): Called in every
+        worker once its requests are drained.
+        _stopping (Event): Set when the process is asked to stop.
+        _workers (Dict[int, int]): Worker number by process id, in the main
+        process.
+    """
+
+    def __init__(
+        self,
+        app_factory: Callable[[], Flask],
+        settings: ServerSettings,
+        on_worker_start: Optional[Callable[[Flask], None]] = None,
+        on_worker_exit: Optional[Callable[[Flask], None]] = None,
+    ):
+        self._app_factory: Callable[[], Flask] = app_factory
+        self._settings: ServerSettings = settings
+        self._on_worker_start: Optional[Callable[[Flask], None]] = on_worker_start
+        self._on_worker_exit: Optional[Callable[[Flask], None]] = on_worker_exit
+        self._stopping = Event()
+        self._workers: Dict[int, int] = {}
+
+    def serve(self) -> None:
+        """
+        Builds the application, preloads its model and serves it until
+        SIGTERM or SIGINT.
+        """
+        app: Flask = self._app_factory()
+        if self._settings.preload:
+            model_registry = app.extensions.get("model_registry")
+            if model_registry is not None:
+                model_registry.get()
+        listener: socket.socket = socket.create_server(
+            (self._settings.host, self._settings.port), backlog=self._settings.backlog
+        )
+        logger.info(
+            "Serving on http://%s:%d with %d worker(s) of %d thread(s)",
+            self._settings.host,
+            listener.getsockname()[1],
+            self._settings.workers,
+            self._settings.threads,
+        )
+        try:
+            if self._settings.workers <= 1:
+                self.run_worker(app, listener)
+            else:
+                self._supervise(app, listener)
+        finally:
+            listener.close()
+
+    def stop(self) -> None:
+        """Asks the server to stop, as SIGTERM does."""
+        self._stopping.set()
+
+    def _handle_signal(self, signum: int, _) -> None:
+        """
+        Stops the server, forwarding the signal to the workers.
+
+        Args:
+            signum (int): The received signal.
+        """
+        self._stopping.set()
+        for pid in list(self._workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _supervise(self, app: Flask, listener: socket.socket) -> None:
+        """
+        Forks the workers and replaces the ones that die until asked to stop,
+        then waits for all of them to exit.
+
+        Args:
+            app (Flask): The application, built and preloaded.
+            listener (socket.socket): The shared listening socket.
+        """
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        for number in range(self._settings.workers):
+            self._fork_worker(number, app, listener)
+        while self._workers:
+            pid, status = os.waitpid(-1, 0)
+            number: Optional[int] = self._workers.pop(pid, None)
+            if number is not None and not self._stopping.is_set():
+                logger.error(
+                    "Worker %d (pid %d) exited with status %d, restarting it",
+                    number,
+                    pid,
+                    os.waitstatus_to_exitcode(status),
+                )
+                self._fork_worker(number, app, listener)
+
+    def _fork_worker(self, number: int, app: Flask, listener: socket.socket) -> None:
+        """
+        Starts a worker process.
+
+        Args:
+            number (int): The number of the worker.
+            app (Flask): The application, built and preloaded.
+            listener (socket.socket): The shared listening socket.
+        """
+        pid: int = os.fork()
+        if pid:
+            self._workers[pid] = number
+            return
+        exit_code = 1
+        try:
+            self._workers.clear()
+            self.run_worker(app, listener)
+            exit_code = 0
+        except BaseException:  # pylint: disable=broad-exception-caught
+            logger.exception("Worker %d failed", number)
+        finally:
+            logging.shutdown()
+            os._exit(exit_code)  # pylint: disable=protected-access
+
+    def run_worker(self, app: Flask, listener: socket.socket) -> None:
+        """
+        Serves requests from the listening socket until asked to stop, then
+        stops accepting connections and waits up to the graceful timeout for
+        the requests in flight to be answered.
+
+        Args:
+            app (Flask): The application.
+            listener (socket.socket): The listening socket.
+        """
+        self._stopping.clear()
+        try:
+            signal.signal(signal.SIGTERM, lambda *_: self._stopping.set())
+            signal.signal(signal.SIGINT, lambda *_: self._stopping.set())
+        except ValueError:  # not the main thread, only `stop` stops the worker
+            pass
+        if self._on_worker_start is not None:
+            self._on_worker_start(app)
+        socket_map: Dict = {}
+        server = create_server(
+            app,
+            map=socket_map,
+            sockets=[listener],
+            threads=self._settings.threads,
+            connection_limit=self._settings.connection_limit,
+            backlog=self._settings.backlog,
+            channel_timeout=self._settings.channel_timeout_seconds,
+        )
+        while not self._stopping.is_set():
+            wasyncore.loop(timeout=POLL_SECONDS, map=socket_map, use_poll=True, count=1)
+
+        server.del_channel()
+        listener.close()  # refuses new connections, unless other workers still listen
+        deadline: float = monotonic() + self._settings.graceful_timeout_seconds
+        while _is_busy(server) and monotonic() < deadline:
+            wasyncore.loop(timeout=POLL_SECONDS, map=socket_map, use_poll=True, count=1)
+        if _is_busy(server):
+            logger.warning("Graceful timeout reached, dropping the requests in flight")
+        server.task_dispatcher.shutdown(timeout=max(0.0, deadline - monotonic()))
+        wasyncore.close_all(socket_map)
+        if self._on_worker_exit is not None:
+            self._on_worker_exit(app)
+
+
+def _is_busy(server) -> bool:
+    """
+    Tells whether a waitress server still has requests to answer.
+
+    Args:
+        server (BaseWSGIServer): The server.
+
+    Returns:
+        bool: Whether requests are queued, running, or have responses left
+        to send.
+    """
+    dispatcher = server.task_dispatcher
+    return bool(
+        dispatcher.queue
+        or any(
+            channel.requests or channel.total_outbufs_len
+            for channel in list(server.active_channels.values())
+        )
+    )
@@ -0,0 +1,76 @@
+"""
+Collapses concurrent identical calls into one, so a burst of requests for
+the same recommendation runs the model, and its queries, only once.
+"""
+
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable
+
+from api.metrics import COALESCED_REQUESTS
+
+
+class SingleFlight:
+    """
+    Runs a single call per key at a time: the first caller of a key, the
+    leader, runs it, and the callers arriving while it runs, the followers,
+    wait for its result or exception instead of running it again. Results
+    aren't kept once the leader is done, the next caller runs the call again.
+
+    Attributes:
+        _calls (Dict[Hashable, Future]): The result of the call running for
+        each key.
+        _lock (Lock): Guards the running calls.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = Lock()
+
+    def do(self, key: Hashable, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Runs a call, or waits for the identical one already running.
+
+        Args:
+            key (Hashable): Identifies identical calls.
+            function (Callable[..., Any]): The call.
+            *args: Its positional arguments.
+            **kwargs: Its keyword arguments.
+
+        Returns:
+            Any: The result of the call. Its exceptions are raised as is, to
+            the leader and every follower.
+        """
+        with self._lock:
+            future: Future = self._calls.get(key)
+            is_leader: bool = future is None
+            if is_leader:
+                future = self._calls[key] = Future()
+        if not is_leader:
+            COALESCED_REQUESTS.inc("follower")
+            return future.result()
+        COALESCED_REQUESTS.inc("leader")
+        try:
+            result: Any = function(*args, **kwargs)
+        except BaseException as e:
+            self._forget(key)
+            future.set_exception(e)
+            raise
+        self._forget(key)
+        future.set_result(result)
+        return result
+
+    def _forget(self, key: Hashable) -> None:
+        """
+        Lets the next caller of a key run the call again.
+
+        Args:
+            key (Hashable): The key of the finished call.
+        """
+        with self._lock:
+            del self._calls[key]
+
+    @property
+    def in_flight(self) -> int:
+        """int: Keys whose call is running."""
+        return len(self._calls)
@@ -0,0 +1,146 @@
+"""
+Sources of order events consumed by the incremental model updates: a JSON
+lines file appended to by the order service, or an in-process queue standing
+in for a message broker.
+
+An event has the same shape as a recommendation request:
+
+    {"customer_id": 1, "order_items": [{"item_id": 10}, {"item_id": 20}]}
+"""
+
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from queue import Empty, Queue
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class OrderEventSource(ABC):
+    """
+    A source of order events, polled by the `OrderUpdater`.
+
+    Attributes:
+        invalid_events (int): Events skipped because they couldn't be parsed.
+    """
+
+    def __init__(self) -> None:
+        self.invalid_events: int = 0
+
+    @abstractmethod
+    def poll(self, max_events: int) -> List[dict]:
+        """
+        Gets the events received since the last poll, without waiting.
+
+        Args:
+            max_events (int): The maximum number of events to return, the
+            others being returned by the next polls.
+
+        Returns:
+            List[dict]: The valid events, in arrival order.
+        """
+
+    def _parse(self, event: Any) -> Optional[dict]:
+        """
+        Checks an event has a customer id and item ids, counting it as
+        invalid otherwise.
+
+        Args:
+            event (Any): The decoded event.
+
+        Returns:
+            Optional[dict]: The event, or None if it's invalid.
+        """
+        try:
+            int(event["customer_id"])
+            for item in event["order_items"]:
+                int(item["item_id"])
+            return event
+        except (KeyError, TypeError, ValueError):
+            self.invalid_events += 1
+            logger.warning("Skipping invalid order event: %r", event)
+            return None
+
+
+class JsonLinesOrderEvents(OrderEventSource):
+    """
+    Reads the events appended to a JSON lines file, one event per line.
+
+    The position of the last complete line read is kept, so every event is
+    read once and a line still being written is read by the next poll. The
+    file is read again from the start when it's truncated or rotated.
+
+    Attributes:
+        _path (str): Path of the file.
+        _offset (int): Byte offset of the first unread line.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self._path: str = path
+        self._offset: int = 0
+
+    def poll(self, max_events: int) -> List[dict]:
+        try:
+            if os.path.getsize(self._path) < self._offset:
+                logger.info("%s was truncated, reading it from the start", self._path)
+                self._offset = 0
+            with open(self._path, "rb") as events_file:
+                events_file.seek(self._offset)
+                events: List[dict] = []
+                while len(events) < max_events:
+                    line: bytes = events_file.readline()
+                    if not line.endswith(b"\n"):
+                        break  # end of file, or a line still being written
+                    self._offset += len(line)
+                    if line.strip():
+                        event: Optional[dict] = self._decode(line)
+                        if event is not None:
+                            events.append(event)
+                return events
+        except FileNotFoundError:
+            return []
+
+    def _decode(self, line: bytes) -> Optional[dict]:
+        """
+        Decodes and checks a line of the file.
+
+        Args:
+            line (bytes): The line.
+
+        Returns:
+            Optional[dict]: The event, or None if it's invalid.
+        """
+        try:
+            return self._parse(json.loads(line))
+        except ValueError:
+            self.invalid_events += 1
+            logger.warning("Skipping malformed order event line: %r", line)
+            return None
+
+
+class QueueOrderEvents(OrderEventSource):
+    """
+    Takes the events put on an in-process queue, e.g. by a message broker
+    consumer thread.
+
+    Attributes:
+        _queue (Queue): The queue of decoded events.
+    """
+
+    def __init__(self, queue: Queue):
+        super().__init__()
+        self._queue: Queue = queue
+
+    def poll(self, max_events: int) -> List[dict]:
+        events: List[dict] = []
+        while len(events) < max_events:
+            try:
+                event: Optional[dict] = self._parse(self._queue.get_nowait())
+            except Empty:
+                break
+            if event is not None:
+                events.append(event)
+        return events
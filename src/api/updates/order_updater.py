@@ -0,0 +1,182 @@
+"""
+Background job applying new orders to the served KNN model, so
+recommendations reflect fresh purchases without waiting for a retraining.
+"""
+
+import logging
+from threading import Event, Lock, Thread
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import numpy as np
+from numpy import ndarray
+
+from api.metrics import ORDER_EVENTS
+from api.model_registry import ModelRegistry
+from api.updates.order_events import OrderEventSource
+
+if TYPE_CHECKING:
+    from api.knn_model import KNNModel
+
+
+logger = logging.getLogger(__name__)
+
+
+class OrderUpdater:
+    """
+    Polls an order event source and applies the events to the model currently
+    served, see `KNNModel.apply_orders`.
+
+    Updates live in the memory of the model, and the source doesn't deliver
+    events twice. The purchases applied are therefore kept here too, and
+    applied again to a reloaded model with the same version, e.g. when only
+    its configuration or recommendation table changed. A model with another
+    version, retrained or refreshed by `precompute_recommendations` with the
+    new orders, is expected to include them: they are dropped.
+
+    Attributes:
+        _model_registry (ModelRegistry): The registry serving the model.
+        _source (OrderEventSource): Where the events come from.
+        _batch_size (int): Maximum number of events applied at once.
+        _model (Optional[KNNModel]): The model the purchases were applied to.
+        _customer_ids (List[ndarray]): The customer of every purchase applied
+        to models of the current version.
+        _item_ids (List[ndarray]): The item of every purchase applied to
+        models of the current version.
+        _poll_lock (Lock): Ensures a single poll runs at a time.
+        _stop (Event): Set to stop the polling thread.
+        _thread (Optional[Thread]): The polling thread.
+        stats (Dict[str, Any]): Events applied and failed, purchases applied
+        and applied again after reloads, and the report of the last update.
+    """
+
+    def __init__(
+        self, model_registry: ModelRegistry, source: OrderEventSource, batch_size: int = 10000
+    ):
+        self._model_registry: ModelRegistry = model_registry
+        self._source: OrderEventSource = source
+        self._batch_size: int = batch_size
+        self._model: Optional["KNNModel"] = None
+        self._customer_ids: List[ndarray] = []
+        self._item_ids: List[ndarray] = []
+        self._poll_lock = Lock()
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+        self.stats: Dict[str, Any] = {
+            "applied_events": 0,
+            "failed_events": 0,
+            "applied_purchases": 0,
+            "replayed_purchases": 0,
+            "last_update": None,
+        }
+
+    def poll_once(self) -> int:
+        """
+        Applies the events received since the last poll, after the purchases
+        applied so far when the model was reloaded. Nothing is polled until
+        the model is loaded, the events waiting in the source meanwhile.
+
+        Returns:
+            int: The number of events polled.
+        """
+        if not self._model_registry.is_loaded:
+            return 0
+        with self._poll_lock:
+            model: "KNNModel" = self._model_registry.get()
+            if model is not self._model:
+                self._replay(model)
+            events: List[dict] = self._source.poll(self._batch_size)
+            if not events:
+                return 0
+            customer_ids, item_ids = [], []
+            for event in events:
+                for item in event["order_items"]:
+                    customer_ids.append(int(event["customer_id"]))
+                    item_ids.append(int(item["item_id"]))
+            customer_ids = np.array(customer_ids, dtype=np.int64)
+            item_ids = np.array(item_ids, dtype=np.int64)
+            try:
+                report: Dict[str, Any] = model.apply_orders(customer_ids, item_ids)
+            except Exception:  # pylint: disable=broad-exception-caught
+                self.stats["failed_events"] += len(events)
+                ORDER_EVENTS.inc("failed", amount=len(events))
+                logger.exception("Applying %d order events failed", len(events))
+                return len(events)
+            self._customer_ids.append(customer_ids)
+            self._item_ids.append(item_ids)
+            self.stats["applied_events"] += len(events)
+            self.stats["applied_purchases"] += report["purchases"]
+            self.stats["last_update"] = report
+            ORDER_EVENTS.inc("applied", amount=len(events))
+            return len(events)
+
+    def _replay(self, model: "KNNModel") -> None:
+        """
+        Applies the purchases applied so far to a newly loaded model of the
+        same version, or drops them when its version differs.
+
+        Args:
+            model (KNNModel): The model now served.
+        """
+        previous: Optional["KNNModel"] = self._model
+        self._model = model
+        if previous is None or previous.model_version != model.model_version:
+            self._customer_ids, self._item_ids = [], []
+            return
+        if not self._customer_ids:
+            return
+        try:
+            report: Dict[str, Any] = model.apply_orders(
+                np.concatenate(self._customer_ids), np.concatenate(self._item_ids)
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Applying the orders again to the reloaded model failed")
+            return
+        self.stats["replayed_purchases"] += report["purchases"]
+        logger.info("%d purchases applied again to the reloaded model", report["purchases"])
+
+    @property
+    def invalid_events(self) -> int:
+        """int: Events of the source skipped because they couldn't be parsed."""
+        return self._source.invalid_events
+
+    def start(self, interval_seconds: float) -> None:
+        """
+        Starts a background thread polling the source.
+
+        Args:
+            interval_seconds (float): Time between two polls when the source
+            is drained.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = Thread(
+            target=self._run, args=(interval_seconds,), name="order-updater", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the polling thread, if running."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, interval_seconds: float) -> None:
+        """
+        Polls the source until asked to stop, right away while full batches
+        keep coming.
+
+        Args:
+            interval_seconds (float): Time between two polls when the source
+            is drained.
+        """
+        while not self._stop.is_set():
+            try:
+                polled: int = self.poll_once()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Polling the order events failed")
+                polled = 0
+            if polled < self._batch_size:
+                self._stop.wait(interval_seconds)
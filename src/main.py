@@ -1,26 +1,113 @@
+import logging
 import os
 from secrets import token_hex
 
 from flask import Flask
 
 from api.flask_app_builder import FlaskAppBuilder
+from api.model_registry import ModelRegistry
+from api.serving.micro_batcher import MicroBatcher
+from api.serving.model_call_limiter import ModelCallLimiter
+from api.serving.prefork_server import PreforkServer, ServerSettings
+from api.updates.order_events import JsonLinesOrderEvents
+from api.updates.order_updater import OrderUpdater
 from api.controller.controller import controller_bp
+from api.controller.admin_controller import admin_bp
+from api.controller.health_controller import health_bp
+from api.controller.metrics_controller import metrics_bp
 
 
-def create_app() -> Flask:
+def create_app(background_jobs: bool = True) -> Flask:
+    """
+    Builds the application from the environment variables. The development
+    server runs it with `PYTHONPATH=src flask --app main run --debug`, from
+    the repository root, which the configuration paths are relative to.
+
+    Args:
+        background_jobs (bool): Whether to start the model warm-up, the
+        model watcher and the order updates. The production server starts
+        them in every worker instead, after forking.
+
+    Returns:
+        Flask: The application.
+    """
     config = {
         "SECRET_KEY": os.environ.get("SECRET_KEY", f"{token_hex(32)}"),
-        "WTF_CSRF_ENABLED": True  
+        "WTF_CSRF_ENABLED": True,
+        "ADMIN_TOKEN": os.environ.get("ADMIN_TOKEN"),
     }
-    app = FlaskAppBuilder() \
+    model_registry = ModelRegistry(r"src/api/conf/knn_model_conf.json")
+    builder = FlaskAppBuilder() \
         .with_config(config) \
-        .with_blueprints(controller_bp) \
+        .with_recommender(
+            model_registry,
+            warm_up=background_jobs and os.environ.get("MODEL_WARM_UP", "1") == "1",
+        )
+    if os.environ.get("ORDER_EVENTS_PATH"):
+        builder.with_order_updates(
+            OrderUpdater(model_registry, JsonLinesOrderEvents(os.environ["ORDER_EVENTS_PATH"]))
+        )
+    micro_batch_wait_ms = float(os.environ.get("MICRO_BATCH_WAIT_MS", 0))
+    app = builder \
+        .with_model_call_limiter(ModelCallLimiter(
+            max_concurrent=int(os.environ.get("MODEL_MAX_CONCURRENT_CALLS", 4)),
+            max_queued=int(os.environ.get("MODEL_MAX_QUEUED_CALLS", 8)),
+            timeout_seconds=float(os.environ.get("MODEL_CALL_TIMEOUT_SECONDS", 5)) or None,
+        )) \
+        .with_request_coalescing(micro_batcher=(
+            MicroBatcher(
+                micro_batch_wait_ms / 1000, int(os.environ.get("MICRO_BATCH_MAX_SIZE", 64))
+            )
+            if micro_batch_wait_ms > 0
+            else None
+        )) \
+        .with_metrics(tracing=os.environ.get("OTEL_TRACING", "0") == "1") \
+        .with_blueprints([controller_bp, admin_bp, health_bp, metrics_bp]) \
         .with_csrf_protection() \
         .build()
+    if background_jobs:
+        start_background_jobs(app)
     return app
 
 
-app = create_app()
+def start_background_jobs(app: Flask) -> None:
+    """
+    Starts the order updates and the model watcher, when enabled.
+
+    Args:
+        app (Flask): The application built by `create_app`.
+    """
+    if "order_updater" in app.extensions:
+        app.extensions["order_updater"].start(
+            float(os.environ.get("ORDER_EVENTS_INTERVAL_SECONDS", 30))
+        )
+    if os.environ.get("MODEL_WATCH_INTERVAL_SECONDS"):
+        app.extensions["model_registry"].start_watching(
+            float(os.environ["MODEL_WATCH_INTERVAL_SECONDS"])
+        )
+
+
+def stop_background_jobs(app: Flask) -> None:
+    """
+    Stops the jobs started by `start_background_jobs`, the model calls
+    still running and the micro-batches.
+
+    Args:
+        app (Flask): The application built by `create_app`.
+    """
+    if "order_updater" in app.extensions:
+        app.extensions["order_updater"].stop()
+    app.extensions["model_registry"].stop_watching()
+    if "micro_batcher" in app.extensions:
+        app.extensions["micro_batcher"].close()
+    app.extensions["model_call_limiter"].shutdown(wait=False)
+
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 9092)))
+    logging.basicConfig(level=logging.INFO)
+    PreforkServer(
+        lambda: create_app(background_jobs=False),
+        ServerSettings.from_env(),
+        on_worker_start=start_background_jobs,
+        on_worker_exit=stop_background_jobs,
+    ).serve()
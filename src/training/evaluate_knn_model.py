@@ -0,0 +1,557 @@
+"""
+Command line evaluation of the KNN model on a time-based holdout of an
+orders export, replacing the one customer at a time checks of the notebook.
+
+The export holds one row per purchased item with the time of its order, e.g.
+
+    SELECT o.customer_id, i.item_id, o.order_date
+    FROM `ing-datos-avanzado.main_data.orders` AS o, UNNEST(o.order_items) AS i
+
+The purchases before the split time train the model, and the items every
+known customer buys from then on are the ones its recommendations should
+find. Precision@N, recall@N, hit rate and coverage are computed for the whole
+test population, with batched `kneighbors` calls and sparse sums of the
+neighbours' purchases ranked like the served recommendations.
+
+Usage, from the repository root:
+
+    PYTHONPATH=src python -m training.evaluate_knn_model \\
+        --orders <orders export> --time-column order_date \\
+        --similar-customers 3 5 10 --top-n 3 10 --engine sharded
+
+Every number of similar customers and of recommendations given is
+evaluated in the same run, from a single neighbour search.
+"""
+
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from numpy import ndarray
+from pandas import read_csv, to_datetime
+from scipy.sparse import csr_matrix
+
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.memory_usage import peak_memory_bytes
+from api.neighbours.neighbour_search import NeighbourSearch
+from api.neighbours.neighbour_search_factory import NeighbourSearchFactory
+from training.interaction_accumulator import InteractionAccumulator
+from training.train_knn_model import fit_model, read_conf_template
+
+
+logger = logging.getLogger(__name__)
+
+
+class HoldoutSplit(NamedTuple):
+    """
+    Purchases split at a point in time.
+
+    Attributes:
+        train (CustomerItemsMatrix): Purchase counts before the split time.
+        test (CustomerItemsMatrix): Purchase counts from the split time on.
+        split_time (np.datetime64): The split time.
+    """
+
+    train: CustomerItemsMatrix
+    test: CustomerItemsMatrix
+    split_time: np.datetime64
+
+
+def iter_timed_purchases(
+    orders_path: str,
+    chunk_size: int,
+    customer_col: str = "customer_id",
+    item_col: str = "item_id",
+    time_col: str = "order_date",
+) -> Iterator[Tuple[ndarray, ndarray, ndarray]]:
+    """
+    Reads an orders export chunk by chunk, with the time of every purchase.
+
+    Args:
+        orders_path (str): A CSV file, or a Parquet file or directory of files.
+        chunk_size (int): Maximum number of rows per chunk.
+        customer_col (str): Name of the customer id column.
+        item_col (str): Name of the item id column.
+        time_col (str): Name of the order date or timestamp column.
+
+    Yields:
+        Tuple[ndarray, ndarray, ndarray]: The customer ids, item ids and
+        `datetime64[ns]` times of a chunk of purchases.
+    """
+    if orders_path.endswith(".csv"):
+        for chunk in read_csv(
+            orders_path, usecols=[customer_col, item_col, time_col], chunksize=chunk_size
+        ):
+            yield (
+                chunk[customer_col].to_numpy(),
+                chunk[item_col].to_numpy(),
+                _to_times(chunk[time_col]),
+            )
+        return
+    import pyarrow.dataset  # pylint: disable=import-outside-toplevel
+
+    dataset = pyarrow.dataset.dataset(orders_path, format="parquet")
+    for batch in dataset.to_batches(
+        columns=[customer_col, item_col, time_col], batch_size=chunk_size
+    ):
+        yield (
+            batch.column(customer_col).to_numpy(zero_copy_only=False),
+            batch.column(item_col).to_numpy(zero_copy_only=False),
+            _to_times(batch.column(time_col).to_pandas()),
+        )
+
+
+def split_purchases(
+    orders_path: str,
+    chunk_size: int = 1_000_000,
+    split_time: Optional[str] = None,
+    test_fraction: float = 0.2,
+    **columns: str,
+) -> HoldoutSplit:
+    """
+    Splits an orders export at a point in time, streaming it so only the
+    customer-item matrices of both sides are held in memory.
+
+    Args:
+        orders_path (str): The orders export, see `iter_timed_purchases`.
+        chunk_size (int): Number of purchases read at a time.
+        split_time (Optional[str]): First time of the test purchases, e.g.
+        "2024-06-01". By default, the time leaving the latest
+        `test_fraction` of the purchases for the test, found in a first pass.
+        test_fraction (float): Share of the purchases held out when no
+        split time is given.
+        **columns (str): The `customer_col`, `item_col` and `time_col`
+        names, see `iter_timed_purchases`.
+
+    Raises:
+        ValueError: If either side of the split has no purchases.
+
+    Returns:
+        HoldoutSplit: The purchase counts before and after the split time.
+    """
+    if split_time is None:
+        times: ndarray = np.concatenate([
+            chunk_times for _, _, chunk_times in iter_timed_purchases(
+                orders_path, chunk_size, **columns
+            )
+        ])
+        split: np.datetime64 = np.datetime64(
+            int(np.quantile(times.view(np.int64), 1 - test_fraction, method="higher")), "ns"
+        )
+    else:
+        split = np.datetime64(to_datetime(split_time).to_datetime64(), "ns")
+    train, test = InteractionAccumulator(), InteractionAccumulator()
+    for customer_ids, item_ids, chunk_times in iter_timed_purchases(
+        orders_path, chunk_size, **columns
+    ):
+        before = chunk_times < split
+        train.add(customer_ids[before], item_ids[before])
+        test.add(customer_ids[~before], item_ids[~before])
+    if not train.rows_read or not test.rows_read:
+        raise ValueError(f"No purchases on one side of the split time {split}.")
+    return HoldoutSplit(train.build(), test.build(), split)
+
+
+def top_columns(scores: csr_matrix, n: int) -> ndarray:
+    """
+    Ranks the best scored columns of every row at once, ties broken by
+    column like `RecommendationTable` breaks them by item id.
+
+    Args:
+        scores (csr_matrix): Item scores, one row per customer.
+        n (int): Columns kept per row.
+
+    Returns:
+        ndarray: A (rows, n) array of columns, best first, padded with -1
+        where a row has fewer positive scores.
+    """
+    rows: ndarray = np.repeat(np.arange(scores.shape[0]), np.diff(scores.indptr))
+    positive = scores.data > 0
+    rows, columns, values = rows[positive], scores.indices[positive], scores.data[positive]
+    order: ndarray = np.lexsort((columns, -values, rows))
+    rows, columns = rows[order], columns[order]
+    ranks: ndarray = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    kept = ranks < n
+    top = np.full((scores.shape[0], n), -1, dtype=np.int64)
+    top[rows[kept], ranks[kept]] = columns[kept]
+    return top
+
+
+class Evaluation:
+    """
+    Evaluates the recommendations of the known test customers for several
+    numbers of similar customers and of recommended items.
+
+    Attributes:
+        _split (HoldoutSplit): The purchases.
+        _search (NeighbourSearch): The engine fitted on the train purchases.
+        _similar_customers_numbers (List[int]): Numbers of neighbours asked
+        to `kneighbors`, the first one being the customer itself.
+        _top_ns (List[int]): Numbers of recommended items.
+        _exclude_purchased (bool): Whether items the customer bought before
+        the split are neither recommended nor expected.
+        _train_rows (ndarray): Train row of every evaluated customer.
+        _relevant (csr_matrix): Items every evaluated customer bought after
+        the split, in train columns.
+        _num_relevant (ndarray): Number of such items, those missing from
+        the train purchases included.
+        cold_customers (int): Test customers without train purchases, which
+        the neighbour search can't answer and aren't evaluated.
+    """
+
+    def __init__(
+        self,
+        split: HoldoutSplit,
+        search: NeighbourSearch,
+        similar_customers_numbers: List[int],
+        top_ns: List[int],
+        exclude_purchased: bool = False,
+    ):
+        self._split: HoldoutSplit = split
+        self._search: NeighbourSearch = search
+        self._similar_customers_numbers: List[int] = sorted(similar_customers_numbers)
+        self._top_ns: List[int] = sorted(top_ns)
+        self._exclude_purchased: bool = exclude_purchased
+        known: ndarray = np.isin(split.test.customer_ids, split.train.customer_ids)
+        test_rows: ndarray = np.flatnonzero(known)
+        train_rows: ndarray = split.train.customer_rows(split.test.customer_ids[known])
+        relevant: csr_matrix = _in_columns(
+            split.test.matrix[test_rows], split.test.item_ids, split.train.item_ids
+        )
+        num_relevant: ndarray = np.diff(split.test.matrix[test_rows].indptr)
+        if exclude_purchased:
+            repurchased: csr_matrix = relevant.multiply(split.train.matrix[train_rows] > 0)
+            relevant = (relevant - repurchased).tocsr()
+            relevant.eliminate_zeros()
+            num_relevant = num_relevant - np.diff(repurchased.tocsr().indptr)
+        expected = num_relevant > 0
+        self._train_rows: ndarray = train_rows[expected]
+        self._relevant: csr_matrix = relevant[expected]
+        self._num_relevant: ndarray = num_relevant[expected]
+        self.cold_customers: int = int(len(known) - known.sum())
+
+    @property
+    def num_customers(self) -> int:
+        """int: Number of evaluated customers."""
+        return len(self._train_rows)
+
+    def _evaluate_batch(self, batch: slice) -> Dict[Tuple[int, int], List]:  # pylint: disable=too-many-locals
+        """
+        Evaluates a batch of customers with a single `kneighbors` call.
+
+        Args:
+            batch (slice): Positions of the customers.
+
+        Returns:
+            Dict[Tuple[int, int], List]: Sums of the precisions, recalls and
+            hits, and the recommended columns, by (similar customers number,
+            number of recommendations).
+        """
+        train: CustomerItemsMatrix = self._split.train
+        rows: ndarray = self._train_rows[batch]
+        _, neighbour_rows = self._search.kneighbors(
+            train.matrix[rows], n_neighbors=self._similar_customers_numbers[-1]
+        )
+        relevant: csr_matrix = self._relevant[batch]
+        num_relevant: ndarray = self._num_relevant[batch]
+        sums: Dict[Tuple[int, int], List] = {}
+        for similar_customers_number in self._similar_customers_numbers:
+            neighbours = neighbour_rows[:, 1:similar_customers_number]  # not the customer
+            selection = csr_matrix(
+                (
+                    np.ones(neighbours.size),
+                    (np.repeat(np.arange(len(rows)), neighbours.shape[1]), neighbours.ravel()),
+                ),
+                shape=(len(rows), train.matrix.shape[0]),
+            )
+            scores: csr_matrix = selection @ train.matrix
+            if self._exclude_purchased:
+                scores = (scores - scores.multiply(train.matrix[rows] > 0)).tocsr()
+            top: ndarray = top_columns(scores, self._top_ns[-1])
+            recommended = top >= 0
+            hits = np.zeros(top.shape, dtype=bool)
+            hits[recommended] = np.asarray(
+                relevant[np.nonzero(recommended)[0], top[recommended]]
+            ).ravel() > 0
+            for n in self._top_ns:
+                num_hits: ndarray = hits[:, :n].sum(axis=1)
+                sums[(similar_customers_number, n)] = [
+                    float((num_hits / n).sum()),
+                    float((num_hits / num_relevant).sum()),
+                    int((num_hits > 0).sum()),
+                    np.unique(top[:, :n][recommended[:, :n]]),
+                ]
+        return sums
+
+    def run(self, batch_size: int = 1024, workers: int = 1) -> List[Dict[str, Any]]:
+        """
+        Evaluates every customer, batches running on several threads.
+
+        Args:
+            batch_size (int): Customers per `kneighbors` call.
+            workers (int): Batches evaluated at once. Neighbour searches and
+            sparse products release the GIL, and a sharded search spreads
+            each one over its processes.
+
+        Returns:
+            List[Dict[str, Any]]: The precision, recall, hit rate and
+            coverage of every similar customers number and number of
+            recommendations.
+        """
+        totals: Dict[Tuple[int, int], List] = {
+            key: [0.0, 0.0, 0, np.zeros(self._split.train.num_items, dtype=bool)]
+            for key in (
+                (k, n) for k in self._similar_customers_numbers for n in self._top_ns
+            )
+        }
+        batches: List[slice] = [
+            slice(start, start + batch_size) for start in range(0, self.num_customers, batch_size)
+        ]
+        with ThreadPoolExecutor(max(workers, 1), thread_name_prefix="evaluation") as executor:
+            for done, sums in enumerate(executor.map(self._evaluate_batch, batches), start=1):
+                for key, (precision, recall, hits, columns) in sums.items():
+                    totals[key][0] += precision
+                    totals[key][1] += recall
+                    totals[key][2] += hits
+                    totals[key][3][columns] = True
+                logger.info("%d/%d batches evaluated", done, len(batches))
+        customers: int = max(self.num_customers, 1)
+        return [
+            {
+                "similar_customers_number": k,
+                "top_n": n,
+                "precision": precision / customers,
+                "recall": recall / customers,
+                "hit_rate": hits / customers,
+                "coverage": float(covered.mean()) if covered.size else 0.0,
+            }
+            for (k, n), (precision, recall, hits, covered) in totals.items()
+        ]
+
+
+def evaluate(  # pylint: disable=too-many-locals
+    orders_path: str,
+    similar_customers_numbers: Optional[List[int]] = None,
+    top_ns: Optional[List[int]] = None,
+    conf_template_path: Optional[str] = None,
+    metric: str = "cosine",
+    split_time: Optional[str] = None,
+    test_fraction: float = 0.2,
+    exclude_purchased: bool = False,
+    chunk_size: int = 1_000_000,
+    batch_size: int = 1024,
+    workers: int = 1,
+    **conf_overrides: Any,
+) -> Dict[str, Any]:
+    """
+    Trains the model on the purchases before the split time and evaluates
+    it on the ones after.
+
+    Args:
+        orders_path (str): The orders export, see `iter_timed_purchases`.
+        similar_customers_numbers (Optional[List[int]]): Numbers of
+        neighbours evaluated, the configured one by default.
+        top_ns (Optional[List[int]]): Numbers of recommendations evaluated,
+        3 and 10 by default.
+        conf_template_path (Optional[str]): Model configuration giving the
+        neighbour search engine settings.
+        metric (str): Distance metric of the model.
+        split_time (Optional[str]): First time of the test purchases, see
+        `split_purchases`.
+        test_fraction (float): Share of the purchases held out when no split
+        time is given.
+        exclude_purchased (bool): Whether items the customer bought before
+        the split are neither recommended nor expected.
+        chunk_size (int): Number of purchases read at a time.
+        batch_size (int): Customers per `kneighbors` call.
+        workers (int): Batches evaluated at once.
+        **conf_overrides (Any): Configuration settings overriding the
+        template ones, e.g. `neighbour_search_engine`; the orders columns,
+        see `iter_timed_purchases`.
+
+    Returns:
+        Dict[str, Any]: The report, with the metrics, the split sizes, the
+        wall time of every stage and the peak memory.
+    """
+    columns: Dict[str, str] = {
+        name: conf_overrides.pop(name)
+        for name in ("customer_col", "item_col", "time_col")
+        if name in conf_overrides
+    }
+    start: float = perf_counter()
+    split: HoldoutSplit = split_purchases(
+        orders_path, chunk_size, split_time, test_fraction, **columns
+    )
+    split_seconds: float = perf_counter() - start
+    conf: Dict[str, Any] = {
+        **read_conf_template(conf_template_path),
+        **{key: value for key, value in conf_overrides.items() if value is not None},
+    }
+    search: NeighbourSearch = NeighbourSearchFactory.get_search(
+        fit_model(split.train, metric), SimpleNamespace(**conf)
+    )
+    fit_seconds: float = perf_counter() - start - split_seconds
+    evaluation = Evaluation(
+        split,
+        search,
+        similar_customers_numbers or [conf["similar_customers_number"]],
+        top_ns or [3, 10],
+        exclude_purchased,
+    )
+    results: List[Dict[str, Any]] = evaluation.run(batch_size, workers)
+    return {
+        "orders_path": orders_path,
+        "split_time": str(split.split_time),
+        "train": _sizes(split.train),
+        "test": _sizes(split.test),
+        "evaluated_customers": evaluation.num_customers,
+        "cold_test_customers": evaluation.cold_customers,
+        "metric": metric,
+        "neighbour_search_engine": conf.get("neighbour_search_engine") or "exact",
+        "exclude_purchased": exclude_purchased,
+        "results": results,
+        "split_seconds": split_seconds,
+        "fit_seconds": fit_seconds,
+        "evaluate_seconds": perf_counter() - start - split_seconds - fit_seconds,
+        "wall_time_seconds": perf_counter() - start,
+        "peak_memory_bytes": peak_memory_bytes(),
+    }
+
+
+def _to_times(values: Any) -> ndarray:
+    """
+    Converts order dates or timestamps to `datetime64[ns]`.
+
+    Args:
+        values (Any): The values of the time column.
+
+    Returns:
+        ndarray: The times.
+    """
+    return np.asarray(to_datetime(values), dtype="datetime64[ns]")
+
+
+def _in_columns(matrix: csr_matrix, item_ids: ndarray, column_item_ids: ndarray) -> csr_matrix:
+    """
+    Lays out purchases along other item columns, dropping the items that
+    aren't among them.
+
+    Args:
+        matrix (csr_matrix): The purchases, with a column per `item_ids`.
+        item_ids (ndarray): The sorted item ids of its columns.
+        column_item_ids (ndarray): The sorted item ids of the new columns.
+
+    Returns:
+        csr_matrix: Binary purchases, with a column per `column_item_ids`.
+    """
+    coo = matrix.tocoo()
+    columns: ndarray = np.searchsorted(column_item_ids, item_ids)
+    found: ndarray = columns < len(column_item_ids)
+    found[found] = column_item_ids[columns[found]] == item_ids[found]
+    known: ndarray = found[coo.col]
+    return csr_matrix(
+        (np.ones(int(known.sum())), (coo.row[known], columns[coo.col[known]])),
+        shape=(matrix.shape[0], len(column_item_ids)),
+    )
+
+
+def _sizes(counts: CustomerItemsMatrix) -> Dict[str, int]:
+    """
+    Describes one side of the split.
+
+    Args:
+        counts (CustomerItemsMatrix): Its purchase counts.
+
+    Returns:
+        Dict[str, int]: The purchases, customers and items.
+    """
+    return {
+        "purchases": int(counts.matrix.sum()),
+        "customers": len(counts.customer_ids),
+        "items": counts.num_items,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Runs the evaluation from the command line and prints its report.
+
+    Args:
+        argv (Optional[List[str]]): Command line arguments, `sys.argv` by default.
+
+    Returns:
+        Dict[str, Any]: The report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--orders", required=True, help="CSV or Parquet orders export")
+    parser.add_argument("--customer-column", default="customer_id")
+    parser.add_argument("--item-column", default="item_id")
+    parser.add_argument("--time-column", default="order_date")
+    parser.add_argument("--split-time", help="first time of the test purchases")
+    parser.add_argument(
+        "--test-fraction",
+        type=float,
+        default=0.2,
+        help="latest share of the purchases held out when no split time is given",
+    )
+    parser.add_argument(
+        "--conf-template",
+        default=os.path.join("src", "api", "conf", "knn_model_conf.json"),
+        help="model configuration the neighbour search settings are read from",
+    )
+    parser.add_argument("--metric", default="cosine")
+    parser.add_argument("--engine", choices=["exact", "lsh", "sharded"])
+    parser.add_argument("--shards", type=int, help="shards of the sharded engine")
+    parser.add_argument(
+        "--similar-customers",
+        type=int,
+        nargs="+",
+        help="similar_customers_number values evaluated, the configured one by default",
+    )
+    parser.add_argument("--top-n", type=int, nargs="+", default=[3, 10])
+    parser.add_argument(
+        "--exclude-purchased",
+        action="store_true",
+        help="neither recommend nor expect the items bought before the split",
+    )
+    parser.add_argument("--chunk-size", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", help="JSON report path, printed when missing")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    report: Dict[str, Any] = evaluate(
+        args.orders,
+        similar_customers_numbers=args.similar_customers,
+        top_ns=args.top_n,
+        conf_template_path=args.conf_template if os.path.exists(args.conf_template) else None,
+        metric=args.metric,
+        split_time=args.split_time,
+        test_fraction=args.test_fraction,
+        exclude_purchased=args.exclude_purchased,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        neighbour_search_engine=args.engine,
+        neighbour_search_shards=args.shards,
+        customer_col=args.customer_column,
+        item_col=args.item_column,
+        time_col=args.time_column,
+    )
+    output: str = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Builds a sparse customer-item matrix from purchases streamed in chunks, so
+the training data never has to fit in memory as a dense table.
+"""
+
+from typing import List
+
+import numpy as np
+from numpy import ndarray
+from scipy.sparse import coo_matrix
+
+from api.index.customer_items_matrix import CustomerItemsMatrix
+
+
+class InteractionAccumulator:
+    """
+    Accumulates (customer, item, count) triplets and sums up duplicates.
+
+    Chunks are buffered as they arrive and merged once the buffer grows
+    larger than the merged triplets, so memory stays proportional to the
+    number of distinct (customer, item) pairs rather than to the number of
+    purchases read.
+
+    Attributes:
+        _customers (List[ndarray]): Buffered customer ids, one array per chunk.
+        _items (List[ndarray]): Buffered item ids, aligned with `_customers`.
+        _counts (List[ndarray]): Buffered counts, aligned with `_customers`.
+        _buffered (int): Number of buffered triplets, merged ones included.
+        _merged (int): Number of triplets after the last merge.
+        rows_read (int): Number of purchases added so far.
+    """
+
+    def __init__(self):
+        self._customers: List[ndarray] = []
+        self._items: List[ndarray] = []
+        self._counts: List[ndarray] = []
+        self._buffered: int = 0
+        self._merged: int = 0
+        self.rows_read: int = 0
+
+    def add(self, customer_ids: ndarray, item_ids: ndarray) -> None:
+        """
+        Adds a chunk of purchases, one row per purchased item.
+
+        Args:
+            customer_ids (ndarray): The customer of every purchase.
+            item_ids (ndarray): The item of every purchase.
+        """
+        customer_ids = np.asarray(customer_ids, dtype=np.int64)
+        self._customers.append(customer_ids)
+        self._items.append(np.asarray(item_ids, dtype=np.int64))
+        self._counts.append(np.ones(len(customer_ids), dtype=np.float64))
+        self._buffered += len(customer_ids)
+        self.rows_read += len(customer_ids)
+        if self._buffered > 2 * max(self._merged, 1_000_000):
+            self._merge()
+
+    def _merge(self) -> None:
+        """Sums up the buffered duplicates into a single set of triplets."""
+        matrix: CustomerItemsMatrix = self._to_matrix()
+        coo: coo_matrix = matrix.matrix.tocoo()
+        self._customers = [matrix.customer_ids[coo.row]]
+        self._items = [matrix.item_ids[coo.col]]
+        self._counts = [coo.data]
+        self._buffered = self._merged = coo.nnz
+
+    def _to_matrix(self) -> CustomerItemsMatrix:
+        """
+        Builds the matrix of the buffered triplets.
+
+        Returns:
+            CustomerItemsMatrix: The purchase counts.
+        """
+        customer_ids, rows = np.unique(np.concatenate(self._customers), return_inverse=True)
+        item_ids, cols = np.unique(np.concatenate(self._items), return_inverse=True)
+        matrix = coo_matrix(
+            (np.concatenate(self._counts), (rows, cols)),
+            shape=(len(customer_ids), len(item_ids)),
+        ).tocsr()  # duplicated (customer, item) pairs are summed up
+        matrix.sort_indices()
+        return CustomerItemsMatrix(customer_ids, item_ids, matrix)
+
+    def build(self) -> CustomerItemsMatrix:
+        """
+        Builds the customer-item matrix of every purchase added.
+
+        Raises:
+            ValueError: If no purchase was added.
+
+        Returns:
+            CustomerItemsMatrix: Purchase counts, rows and columns sorted by
+            customer and item id.
+        """
+        if not self.rows_read:
+            raise ValueError("No purchases to build the customer items matrix from.")
+        return self._to_matrix()
@@ -0,0 +1,180 @@
+"""
+Command line job precomputing the recommendation table of an artefacts
+version, or adding new orders to it and refreshing only the customers they
+affect.
+
+Usage, from the repository root:
+
+    # every customer
+    PYTHONPATH=src python -m training.precompute_recommendations \\
+        --conf src/knn/artefacts/<version>/knn_model_conf.json
+
+    # add new orders, then recompute only the customers of the new orders and
+    # the ones they are neighbours of
+    PYTHONPATH=src python -m training.precompute_recommendations \\
+        --conf src/knn/artefacts/<version>/knn_model_conf.json --new-orders <orders export>
+
+New orders are added to the purchase counts of the version and the model is
+fitted again on them, both written back so the next refresh builds on them.
+Every file is replaced atomically, so serving workers watching the model pick
+the new ones up with their next reload.
+"""
+
+import argparse
+import json
+import logging
+import os
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from joblib import dump, load
+from numpy import ndarray
+from sklearn.base import clone
+
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.index.recommendation_table import RecommendationTable
+from api.neighbours.neighbour_search_factory import NeighbourSearchFactory
+from training.train_knn_model import (
+    RECOMMENDATION_TABLE_FILE_NAME,
+    build_recommendation_table,
+    iter_purchases,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_purchases(
+    orders_path: str, chunk_size: int = 1_000_000, customer_col: str = "customer_id"
+) -> Tuple[ndarray, ndarray]:
+    """
+    Reads the purchases of an orders export.
+
+    Args:
+        orders_path (str): The new orders, see `iter_purchases`.
+        chunk_size (int): Number of purchases read at a time.
+        customer_col (str): Name of the customer id column.
+
+    Returns:
+        Tuple[ndarray, ndarray]: The customer and item ids of every purchase.
+    """
+    chunks: List[Tuple[ndarray, ndarray]] = list(
+        iter_purchases(orders_path, chunk_size, customer_col)
+    )
+    if not chunks:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    customer_ids, item_ids = zip(*chunks)
+    return (
+        np.concatenate(customer_ids).astype(np.int64),
+        np.concatenate(item_ids).astype(np.int64),
+    )
+
+
+def precompute(
+    conf_path: str,
+    num_candidates: int = 50,
+    new_purchases: Optional[Tuple[ndarray, ndarray]] = None,
+) -> Dict[str, Any]:
+    """
+    Computes the recommendation table of an artefacts version and writes it
+    where its configuration points to, adding the path to the configuration
+    when it's missing.
+
+    New purchases are first added to the purchase counts and the model is
+    fitted again on them, so the customers who bought get their updated
+    vectors both as queries and as neighbours. The counts and the model are
+    written back to the artefacts.
+
+    Args:
+        conf_path (str): The `knn_model_conf.json` of the artefacts version.
+        num_candidates (int): Candidate items kept per customer when the whole
+        table is built.
+        new_purchases (Optional[Tuple[ndarray, ndarray]]): The customer and
+        item ids of new purchases, see `read_purchases`. Only the records
+        they affect are recomputed when the table already exists, the whole
+        table is built otherwise.
+
+    Returns:
+        Dict[str, Any]: The table path, its size, how many records were
+        computed, the purchases added and dropped and the wall time.
+    """
+    start: float = perf_counter()
+    with open(conf_path, encoding="utf-8") as conf_file:
+        conf: Dict[str, Any] = json.load(conf_file)
+    model = load(conf["model_pkl_path"])
+    counts = CustomerItemsMatrix.load(conf["artefacts_dir"])
+    table_path: str = conf.get("recommendation_table_path") or os.path.join(
+        conf["artefacts_dir"], RECOMMENDATION_TABLE_FILE_NAME
+    )
+
+    unknown_items: int = 0
+    if new_purchases is not None:
+        counts, unknown_items = counts.add_purchases(*new_purchases)
+        counts = counts.merge_delta()
+        model = clone(model).fit(counts.matrix)
+        counts.save(conf["artefacts_dir"])
+        staging_path = f"{conf['model_pkl_path']}.tmp"
+        dump(model, staging_path)
+        os.replace(staging_path, conf["model_pkl_path"])
+
+    if new_purchases is not None and os.path.exists(table_path):
+        current = RecommendationTable.load(table_path)
+        affected: ndarray = current.affected_customers(np.unique(new_purchases[0]))
+        table = current.refresh(
+            counts, NeighbourSearchFactory.get_search(model, SimpleNamespace(**conf)), affected
+        )
+        computed: int = len(affected)
+    else:
+        table = build_recommendation_table(model, counts, conf, num_candidates)
+        computed = len(table)
+    table.save(table_path)
+
+    if conf.get("recommendation_table_path") != table_path:
+        conf["recommendation_table_path"] = table_path
+        with open(conf_path, "w", encoding="utf-8") as conf_file:
+            json.dump(conf, conf_file, indent=4)
+    return {
+        "recommendation_table_path": table_path,
+        "customers": len(table),
+        "computed_customers": computed,
+        "purchases": 0 if new_purchases is None else len(new_purchases[0]) - unknown_items,
+        "unknown_item_purchases": unknown_items,
+        "wall_time_seconds": perf_counter() - start,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Runs the job from the command line and prints its report.
+
+    Args:
+        argv (Optional[List[str]]): Command line arguments, `sys.argv` by default.
+
+    Returns:
+        Dict[str, Any]: The report of the run.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--conf", required=True, help="knn_model_conf.json of the artefacts")
+    parser.add_argument("--num-candidates", type=int, default=50)
+    parser.add_argument("--new-orders", help="CSV or Parquet export of the new orders")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000)
+    parser.add_argument("--customer-column", default="customer_id")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    new_purchases: Optional[Tuple[ndarray, ndarray]] = None
+    if args.new_orders:
+        new_purchases = read_purchases(args.new_orders, args.chunk_size, args.customer_column)
+        logger.info(
+            "%d new purchases of %d customers",
+            len(new_purchases[0]),
+            len(np.unique(new_purchases[0])),
+        )
+    report = precompute(args.conf, args.num_candidates, new_purchases)
+    print(json.dumps(report, indent=4))
+    return report
+
+
+if __name__ == "__main__":
+    main()
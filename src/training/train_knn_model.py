@@ -0,0 +1,338 @@
+"""
+Command line pipeline training the KNN model and building its serving
+artefacts in a single streaming pass over an orders export.
+
+The export holds one row per purchased item, e.g. the Parquet files written by
+
+    EXPORT DATA OPTIONS (uri = 'gs://<bucket>/orders/*.parquet', format = 'PARQUET') AS
+    SELECT o.customer_id, i.item_id
+    FROM `ing-datos-avanzado.main_data.orders` AS o, UNNEST(o.order_items) AS i
+
+Usage, from the repository root:
+
+    PYTHONPATH=src python -m training.train_knn_model \\
+        --orders <orders export> --output-dir src/knn/artefacts
+
+Every run writes a new `<output-dir>/<version>` directory holding the model
+pickle, the item of every model column, the customer-item purchase counts as
+memory-mappable `.npy` arrays, the precomputed recommendations of every
+customer, the co-purchases of every item, a `manifest.json` and a
+`knn_model_conf.json` that `KNNModel` loads directly.
+"""
+
+import argparse
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from joblib import dump
+from numpy import ndarray
+from pandas import read_csv
+from sklearn.neighbors import NearestNeighbors
+
+from api.index.co_purchase_index import CoPurchaseIndex
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.index.item_catalogue import ItemCatalogue
+from api.index.recommendation_table import RecommendationTable
+from api.memory_usage import peak_memory_bytes
+from api.neighbours.neighbour_search_factory import NeighbourSearchFactory
+from training.interaction_accumulator import InteractionAccumulator
+
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE_NAME = "knn_model.pkl"
+MANIFEST_FILE_NAME = "manifest.json"
+CONF_FILE_NAME = "knn_model_conf.json"
+RECOMMENDATION_TABLE_FILE_NAME = "recommendation_table.npy"
+ITEM_CATALOGUE_FILE_NAME = "item_catalogue.npy"
+
+
+def iter_purchases(
+    orders_path: str,
+    chunk_size: int,
+    customer_col: str = "customer_id",
+    item_col: str = "item_id",
+) -> Iterator[Tuple[ndarray, ndarray]]:
+    """
+    Reads an orders export chunk by chunk.
+
+    Args:
+        orders_path (str): A CSV file, or a Parquet file or directory of files.
+        chunk_size (int): Maximum number of rows per chunk.
+        customer_col (str): Name of the customer id column.
+        item_col (str): Name of the item id column.
+
+    Yields:
+        Tuple[ndarray, ndarray]: The customer and item ids of a chunk of purchases.
+    """
+    if orders_path.endswith(".csv"):
+        for chunk in read_csv(orders_path, usecols=[customer_col, item_col], chunksize=chunk_size):
+            yield chunk[customer_col].to_numpy(), chunk[item_col].to_numpy()
+        return
+    import pyarrow.dataset  # pylint: disable=import-outside-toplevel
+
+    dataset = pyarrow.dataset.dataset(orders_path, format="parquet")
+    for batch in dataset.to_batches(columns=[customer_col, item_col], batch_size=chunk_size):
+        yield (
+            batch.column(customer_col).to_numpy(zero_copy_only=False),
+            batch.column(item_col).to_numpy(zero_copy_only=False),
+        )
+
+
+def fit_model(counts: CustomerItemsMatrix, metric: str = "cosine") -> NearestNeighbors:
+    """
+    Fits the neighbours model on the sparse purchase counts, with the same
+    settings as the model trained in the notebook.
+
+    Args:
+        counts (CustomerItemsMatrix): Purchase counts by customer and item.
+        metric (str): Distance metric, cosine like the notebook by default.
+
+    Returns:
+        NearestNeighbors: The fitted model.
+    """
+    return NearestNeighbors(metric=metric, algorithm="brute").fit(counts.matrix)
+
+
+def read_conf_template(conf_template_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Reads the model configuration the settings of the written one are copied from.
+
+    Args:
+        conf_template_path (Optional[str]): The configuration, if any.
+
+    Returns:
+        Dict[str, Any]: The settings, with at least `similar_customers_number`.
+    """
+    conf: Dict[str, Any] = {"similar_customers_number": 3}
+    if conf_template_path:
+        with open(conf_template_path, encoding="utf-8") as conf_file:
+            conf.update(json.load(conf_file))
+    return conf
+
+
+def build_recommendation_table(
+    model: NearestNeighbors,
+    counts: CustomerItemsMatrix,
+    conf: Dict[str, Any],
+    num_candidates: int,
+    customer_ids: Optional[ndarray] = None,
+) -> RecommendationTable:
+    """
+    Precomputes the recommendations of customers with the neighbour search
+    engine and number of similar customers set in the configuration.
+
+    Args:
+        model (NearestNeighbors): The fitted model.
+        counts (CustomerItemsMatrix): The purchase counts the model was fitted on.
+        conf (Dict[str, Any]): The model configuration.
+        num_candidates (int): Candidate items kept per customer.
+        customer_ids (Optional[ndarray]): Customers to compute, all by default.
+
+    Returns:
+        RecommendationTable: The precomputed recommendations.
+    """
+    return RecommendationTable.build(
+        counts,
+        NeighbourSearchFactory.get_search(model, SimpleNamespace(**conf)),
+        conf["similar_customers_number"],
+        num_candidates,
+        customer_ids=customer_ids,
+    )
+
+
+def write_artefacts(
+    output_dir: str,
+    version: str,
+    model: NearestNeighbors,
+    counts: CustomerItemsMatrix,
+    manifest: Dict[str, Any],
+    conf: Dict[str, Any],
+    recommendation_table: Optional[RecommendationTable] = None,
+    co_purchase_index: Optional[CoPurchaseIndex] = None,
+) -> str:
+    """
+    Writes the artefacts of a training run. Files are written to a temporary
+    directory renamed once complete, so a model watcher never sees a
+    partially written version.
+
+    Args:
+        output_dir (str): Directory holding every version.
+        version (str): Name of the version directory.
+        model (NearestNeighbors): The fitted model.
+        counts (CustomerItemsMatrix): The purchase counts the model was fitted on.
+        manifest (Dict[str, Any]): Description of the run.
+        conf (Dict[str, Any]): Model configuration whose other settings are
+        copied into the written configuration, see `read_conf_template`.
+        recommendation_table (Optional[RecommendationTable]): The precomputed
+        recommendations, if any.
+        co_purchase_index (Optional[CoPurchaseIndex]): The co-purchases of
+        every item, if any.
+
+    Returns:
+        str: The version directory.
+    """
+    version_dir = os.path.join(output_dir, version)
+    staging_dir = os.path.join(output_dir, f".{version}.tmp")
+    os.makedirs(staging_dir)
+    dump(model, os.path.join(staging_dir, MODEL_FILE_NAME))
+    counts.save(staging_dir)
+    ItemCatalogue(counts.item_ids).save(os.path.join(staging_dir, ITEM_CATALOGUE_FILE_NAME))
+    if recommendation_table is not None:
+        recommendation_table.save(os.path.join(staging_dir, RECOMMENDATION_TABLE_FILE_NAME))
+    if co_purchase_index is not None:
+        co_purchase_index.save(staging_dir)
+
+    conf = {
+        **conf,
+        "model_pkl_path": os.path.join(version_dir, MODEL_FILE_NAME),
+        "artefacts_dir": version_dir,
+        "item_catalogue_path": os.path.join(version_dir, ITEM_CATALOGUE_FILE_NAME),
+        "customer_items_matrix_path": None,
+        "purchase_counts_path": None,
+        "recommendation_table_path": (
+            os.path.join(version_dir, RECOMMENDATION_TABLE_FILE_NAME)
+            if recommendation_table is not None
+            else None
+        ),
+    }
+    for file_name, content in ((CONF_FILE_NAME, conf), (MANIFEST_FILE_NAME, manifest)):
+        with open(os.path.join(staging_dir, file_name), "w", encoding="utf-8") as output_file:
+            json.dump(content, output_file, indent=4)
+    os.replace(staging_dir, version_dir)
+    return version_dir
+
+
+def train(  # pylint: disable=too-many-locals
+    orders_path: str,
+    output_dir: str,
+    chunk_size: int = 1_000_000,
+    customer_col: str = "customer_id",
+    item_col: str = "item_id",
+    conf_template_path: Optional[str] = None,
+    num_candidates: int = 50,
+    co_purchase_top_k: int = 50,
+) -> Dict[str, Any]:
+    """
+    Trains the model on an orders export and writes a new artefacts version.
+
+    Args:
+        orders_path (str): The orders export, see `iter_purchases`.
+        output_dir (str): Directory holding every version.
+        chunk_size (int): Number of purchases read at a time.
+        customer_col (str): Name of the customer id column.
+        item_col (str): Name of the item id column.
+        conf_template_path (Optional[str]): Model configuration whose other
+        settings are copied into the written configuration.
+        num_candidates (int): Candidate items precomputed per customer, 0
+        to skip the recommendation table.
+        co_purchase_top_k (int): Co-purchased items kept per item, 0 to skip
+        the co-purchase index.
+
+    Returns:
+        Dict[str, Any]: The manifest of the run, with its sizes, wall time and
+        peak memory.
+    """
+    start: float = perf_counter()
+    accumulator = InteractionAccumulator()
+    for customer_ids, item_ids in iter_purchases(orders_path, chunk_size, customer_col, item_col):
+        accumulator.add(customer_ids, item_ids)
+        logger.info("%d purchases read", accumulator.rows_read)
+    counts: CustomerItemsMatrix = accumulator.build()
+    read_seconds: float = perf_counter() - start
+    model: NearestNeighbors = fit_model(counts)
+    conf: Dict[str, Any] = read_conf_template(conf_template_path)
+    recommendation_table: Optional[RecommendationTable] = (
+        build_recommendation_table(model, counts, conf, num_candidates)
+        if num_candidates > 0
+        else None
+    )
+    co_purchase_index: Optional[CoPurchaseIndex] = (
+        CoPurchaseIndex.build(counts, co_purchase_top_k) if co_purchase_top_k > 0 else None
+    )
+
+    os.makedirs(output_dir, exist_ok=True)
+    version: str = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    manifest: Dict[str, Any] = {
+        "version": version,
+        "orders_path": orders_path,
+        "purchases": accumulator.rows_read,
+        "customers": len(counts.customer_ids),
+        "items": counts.num_items,
+        "nonzero_counts": int(counts.matrix.nnz),
+        "metric": model.metric,
+        "recommendation_candidates": num_candidates,
+        "co_purchase_top_k": co_purchase_top_k,
+        "read_seconds": read_seconds,
+        "wall_time_seconds": perf_counter() - start,
+        "peak_memory_bytes": peak_memory_bytes(),
+    }
+    manifest["artefacts_dir"] = write_artefacts(
+        output_dir,
+        version,
+        model,
+        counts,
+        manifest,
+        conf,
+        recommendation_table,
+        co_purchase_index,
+    )
+    return manifest
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Runs the pipeline from the command line and prints its manifest.
+
+    Args:
+        argv (Optional[List[str]]): Command line arguments, `sys.argv` by default.
+
+    Returns:
+        Dict[str, Any]: The manifest of the run.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--orders", required=True, help="CSV or Parquet orders export")
+    parser.add_argument("--output-dir", required=True, help="directory of the artefact versions")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000)
+    parser.add_argument("--customer-column", default="customer_id")
+    parser.add_argument("--item-column", default="item_id")
+    parser.add_argument(
+        "--conf-template",
+        default=os.path.join("src", "api", "conf", "knn_model_conf.json"),
+        help="model configuration the other settings are copied from",
+    )
+    parser.add_argument(
+        "--num-candidates",
+        type=int,
+        default=50,
+        help="candidate items precomputed per customer, 0 to skip the recommendation table",
+    )
+    parser.add_argument(
+        "--co-purchase-top-k",
+        type=int,
+        default=50,
+        help="co-purchased items kept per item, 0 to skip the co-purchase index",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    manifest = train(
+        args.orders,
+        args.output_dir,
+        chunk_size=args.chunk_size,
+        customer_col=args.customer_column,
+        item_col=args.item_column,
+        conf_template_path=args.conf_template if os.path.exists(args.conf_template) else None,
+        num_candidates=args.num_candidates,
+        co_purchase_top_k=args.co_purchase_top_k,
+    )
+    print(json.dumps(manifest, indent=4))
+    return manifest
+
+
+if __name__ == "__main__":
+    main()
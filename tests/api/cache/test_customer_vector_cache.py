@@ -0,0 +1,128 @@
+import sqlite3
+
+from api.cache.customer_vector_cache import (
+    CustomerVectorCache, SQLiteVectorStore, catalogue_version, decode_vector, encode_vector,
+)
+from api.cache.ttl_lru_cache import TTLLRUCache
+
+import numpy as np
+import pytest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def test_binary_vectors_are_bit_packed():
+    vector = np.zeros(20)
+    vector[[0, 7, 19]] = 1
+
+    data = encode_vector(vector)
+
+    assert len(data) == 1 + 3
+    assert decode_vector(data, 20).tolist() == vector.tolist()
+
+
+def test_count_vectors_are_kept_exact():
+    vector = np.array([0.0, 2.0, 1.0, 5.0])
+
+    assert decode_vector(encode_vector(vector), 4).tolist() == [0.0, 2.0, 1.0, 5.0]
+
+
+def test_vectors_of_another_catalogue_size_are_not_decoded():
+    assert decode_vector(encode_vector(np.ones(20)), 30) is None
+    assert decode_vector(encode_vector(np.array([2.0, 3.0])), 3) is None
+
+
+def test_catalogue_version_depends_on_the_item_columns():
+    assert catalogue_version(3) == "3"
+    assert catalogue_version(3, np.array([1, 2, 3])) == catalogue_version(3, np.array([1, 2, 3]))
+    assert catalogue_version(3, np.array([1, 2, 3])) != catalogue_version(3, np.array([1, 2, 4]))
+
+
+def test_store_is_shared_by_processes_on_the_same_file(tmp_path):
+    path = str(tmp_path / "vectors" / "store.sqlite")
+    writer, reader = SQLiteVectorStore(path), SQLiteVectorStore(path)
+
+    writer.put_many("v1", {1: b"b\x80", 2: b"b\x40"})
+
+    assert reader.get_many("v1", [1, 2, 3]) == {1: b"b\x80", 2: b"b\x40"}
+    assert reader.get_many("v2", [1]) == {}
+    assert reader.cache_info() == {"hits": 2, "misses": 2, "errors": 0, "hit_rate": 0.5}
+    assert sqlite3.connect(path).execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_store_expires_and_prunes_vectors(tmp_path, clock: FakeClock):
+    path = str(tmp_path / "store.sqlite")
+    store = SQLiteVectorStore(path, ttl_seconds=60, clock=clock, prune_every=2)
+    store.put_many("v1", {1: b"a"})
+
+    clock.now += 61
+    assert store.get_many("v1", [1]) == {}
+
+    store.put_many("v1", {2: b"b"})  # the second write prunes the first vector
+    assert sqlite3.connect(path).execute("SELECT customer_id FROM customer_vectors").fetchall() == [(2,)]
+
+
+def test_store_discards_vectors(tmp_path):
+    store = SQLiteVectorStore(str(tmp_path / "store.sqlite"))
+    store.put_many("v1", {1: b"a", 2: b"b"})
+
+    store.discard_many("v1", [1])
+
+    assert store.get_many("v1", [1, 2]) == {2: b"b"}
+
+
+def test_broken_store_counts_as_a_miss(tmp_path):
+    path = tmp_path / "store.sqlite"
+    path.write_bytes(b"not a database" * 100)
+    store = SQLiteVectorStore(str(path))
+
+    store.put_many("v1", {1: b"a"})
+
+    assert store.get_many("v1", [1]) == {}
+    assert store.cache_info()["errors"] == 2
+    assert store.cache_info()["misses"] == 1
+
+
+def test_cache_promotes_shared_hits_to_memory(tmp_path):
+    path = str(tmp_path / "store.sqlite")
+    vector = np.array([0.0, 1.0, 1.0])
+    CustomerVectorCache(3, "v1", TTLLRUCache(max_size=10), SQLiteVectorStore(path)).put_many({7: vector})
+    cache = CustomerVectorCache(3, "v1", TTLLRUCache(max_size=10), SQLiteVectorStore(path))
+
+    assert cache.get_many([7, 8])[7].tolist() == [0.0, 1.0, 1.0]
+    assert cache.get_many([7])[7].tolist() == [0.0, 1.0, 1.0]
+
+    info = cache.cache_info()
+    assert info["memory"]["hits"] == 1
+    assert info["shared"]["hits"] == 1
+    assert info["shared"]["misses"] == 1
+
+
+def test_cache_discards_vectors_from_both_levels(tmp_path):
+    store = SQLiteVectorStore(str(tmp_path / "store.sqlite"))
+    cache = CustomerVectorCache(2, "v1", TTLLRUCache(max_size=10), store)
+    cache.put_many({1: np.array([1.0, 0.0])})
+
+    cache.discard_many([1])
+
+    assert cache.get_many([1]) == {}
+    assert store.get_many("v1", [1]) == {}
+
+
+def test_cache_without_store():
+    cache = CustomerVectorCache(2, "v1", TTLLRUCache(max_size=10))
+    cache.put_many({1: np.array([3.0, 0.0])})
+
+    assert cache.get_many([1, 2])[1].tolist() == [3.0, 0.0]
+    assert cache.cache_info()["shared"] == {}
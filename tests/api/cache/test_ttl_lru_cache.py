@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from api.cache.ttl_lru_cache import TTLLRUCache
+
+import pytest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def test_get_and_put(clock: FakeClock):
+    cache = TTLLRUCache(max_size=2, clock=clock)
+    cache.put("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.cache_info()["hits"] == 1
+    assert cache.cache_info()["misses"] == 1
+
+
+def test_lru_eviction(clock: FakeClock):
+    cache = TTLLRUCache(max_size=2, clock=clock)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")  # "b" becomes the least recently used
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_ttl_expiration(clock: FakeClock):
+    cache = TTLLRUCache(max_size=2, ttl_seconds=10, clock=clock)
+    cache.put("a", 1)
+
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_disabled_cache(clock: FakeClock):
+    cache = TTLLRUCache(max_size=0, clock=clock)
+    cache.put("a", 1)
+
+    assert cache.get("a") is None
+
+
+def test_clear(clock: FakeClock):
+    cache = TTLLRUCache(max_size=2, clock=clock)
+    cache.put("a", 1)
+    cache.clear()
+
+    assert cache.get("a") is None
+
+
+def test_discard(clock: FakeClock):
+    cache = TTLLRUCache(max_size=2, clock=clock)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.discard("a")
+    cache.discard("missing")
+
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+
+def test_concurrent_access():
+    cache = TTLLRUCache(max_size=50)
+
+    def worker(n: int):
+        for i in range(1000):
+            cache.put((n, i % 80), i)
+            cache.get((n, (i + 1) % 80))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(worker, range(8)))
+
+    info = cache.cache_info()
+    assert info["size"] == 50
+    assert info["hits"] + info["misses"] == 8000
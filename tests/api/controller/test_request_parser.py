@@ -0,0 +1,63 @@
+from api.controller.request_parser import DEFAULT_NUM_RECOMMENDATIONS, RecommendationRequest
+
+import numpy as np
+import pytest
+
+
+def test_json_request_is_parsed_once_into_an_array():
+    request = RecommendationRequest.from_json(
+        {"customer_id": "7", "order_items": [{"item_id": 3}, {"item_id": 4.0}], "num_recommendations": 2}
+    )
+
+    assert (request.customer_id, request.num_recommendations) == (7, 2)
+    assert request.item_ids.dtype == np.int64
+    assert request.as_kwargs()["order_items"].tolist() == [3, 4]
+
+
+def test_num_recommendations_defaults():
+    request = RecommendationRequest.from_json({"customer_id": 1, "order_items": []})
+
+    assert request.num_recommendations == DEFAULT_NUM_RECOMMENDATIONS
+    assert len(request.item_ids) == 0
+
+
+@pytest.mark.parametrize("body, message", [
+    (None, "The given request is empty!"),
+    ({"customer_id": 1}, "Field required: order_items"),
+    ({"customer_id": 1, "order_items": {"item_id": 3}}, "order_items must be a list"),
+    ({"customer_id": 1, "order_items": [3]}, "Every order item must be an object with an item_id"),
+    ({"customer_id": 1.5, "order_items": []}, "customer_id must be an integer, got 1.5"),
+    ({"customer_id": 1, "order_items": [], "num_recommendations": -1}, "num_recommendations must be positive, got -1"),
+])
+def test_invalid_json_requests(body, message: str):
+    with pytest.raises(ValueError, match=message):
+        RecommendationRequest.from_json(body)
+
+
+def test_packed_requests_round_trip():
+    requests = [RecommendationRequest(1, np.array([3, 4]), 5), RecommendationRequest(2, np.array([], dtype=np.int64))]
+
+    parsed = RecommendationRequest.many_from_packed(b"".join(request.to_packed() for request in requests))
+
+    assert [(request.customer_id, request.item_ids.tolist(), request.num_recommendations) for request in parsed] == [
+        (1, [3, 4], 5),
+        (2, [], DEFAULT_NUM_RECOMMENDATIONS),
+    ]
+    assert RecommendationRequest.from_packed(requests[0].to_packed()).item_ids.tolist() == [3, 4]
+
+
+@pytest.mark.parametrize("data, message", [
+    (b"", "non-empty sequence"),
+    (RecommendationRequest(1, np.array([3, 4])).to_packed()[:-8], "Invalid packed request"),
+    (RecommendationRequest(1, np.array([3])).to_packed()[:16], "Truncated packed request"),
+])
+def test_invalid_packed_requests(data: bytes, message: str):
+    with pytest.raises(ValueError, match=message):
+        RecommendationRequest.many_from_packed(data)
+
+
+def test_single_packed_request_is_expected():
+    data = RecommendationRequest(1, np.array([3])).to_packed() * 2
+
+    with pytest.raises(ValueError, match="Expected a single packed request, got 2"):
+        RecommendationRequest.from_packed(data)
@@ -0,0 +1,57 @@
+from api.index.co_purchase_index import CoPurchaseIndex, blend_scores, top_scored_rows
+from api.index.customer_items_matrix import CustomerItemsMatrix
+
+import pytest
+from numpy import array, array_equal
+from pandas import DataFrame
+from scipy.sparse import csr_matrix
+
+
+@pytest.fixture
+def co_purchase_index() -> CoPurchaseIndex:
+    counts = CustomerItemsMatrix.from_dataframe(DataFrame({
+        "customer_id": [1, 1, 1, 2, 2, 3, 3, 4],
+        "item_id": [10, 20, 20, 10, 30, 30, 40, 50],
+        "interaction": [1, 2, 1, 1, 1, 4, 1, 1],
+    }))
+    return CoPurchaseIndex.build(counts, top_k=2, batch_size=2)
+
+
+def test_build_keeps_the_top_k_per_item(co_purchase_index: CoPurchaseIndex):
+    """Co-purchases are counted once per customer, ties broken by item id."""
+    assert co_purchase_index.top_k == 2
+    assert array_equal(co_purchase_index.matrix.toarray(), array([
+        [0, 1, 1, 0, 0],  # 10
+        [1, 0, 0, 0, 0],  # 20
+        [1, 0, 0, 1, 0],  # 30
+        [0, 0, 1, 0, 0],  # 40
+        [0, 0, 0, 0, 0],  # 50, only bought alone
+    ]))
+
+
+def test_top_items(co_purchase_index: CoPurchaseIndex):
+    assert co_purchase_index.top_items([20, 30], [20, 30], 3).tolist() == [10, 40]
+    assert co_purchase_index.top_items([30, 99], [30], 1).tolist() == [10]
+    assert co_purchase_index.top_items([], [], 3).tolist() == []
+    assert co_purchase_index.top_items([50], [50], 3).tolist() == []
+
+
+@pytest.mark.parametrize("mmap_mode", [None, "r"])
+def test_save_and_load(tmp_path, co_purchase_index: CoPurchaseIndex, mmap_mode):
+    assert CoPurchaseIndex.load(str(tmp_path), co_purchase_index.item_ids) is None
+
+    co_purchase_index.save(str(tmp_path))
+    loaded = CoPurchaseIndex.load(str(tmp_path), co_purchase_index.item_ids, mmap_mode=mmap_mode)
+
+    assert array_equal(loaded.matrix.toarray(), co_purchase_index.matrix.toarray())
+
+
+def test_blend_scores():
+    """Rows are scaled by their maximum, so both scores weigh the same."""
+    knn = csr_matrix(array([[10.0, 0, 5], [0, 0, 0]]))
+    co_purchase = csr_matrix(array([[0, 1.0, 2], [0, 3.0, 0]]))
+
+    blended = blend_scores(knn, co_purchase, weight=0.5)
+
+    assert blended.toarray().tolist() == [[0.5, 0.25, 0.75], [0, 0.5, 0]]
+    assert top_scored_rows(blended, array([1, 2, 3]), [[], [2]], [2, 2]) == [[3, 1], []]
@@ -0,0 +1,115 @@
+from api.index.customer_items_matrix import CustomerItemsMatrix
+
+import pytest
+from mmap import mmap
+
+from numpy import array, array_equal, memmap, ndarray
+from pandas import DataFrame
+
+
+@pytest.fixture
+def interactions() -> DataFrame:
+    return DataFrame({
+        "customer_id": [30, 10, 10, 20, 30],
+        "item_id": [7, 5, 9, 7, 5],
+        "interaction": [1, 2, 1, 3, 1],
+    })
+
+
+@pytest.fixture
+def customer_items_matrix(interactions: DataFrame) -> CustomerItemsMatrix:
+    return CustomerItemsMatrix.from_dataframe(interactions)
+
+
+def is_memory_mapped(values) -> bool:
+    while isinstance(values, ndarray):
+        if isinstance(values, memmap):
+            return True
+        values = values.base
+    return isinstance(values, mmap)
+
+
+def test_from_dataframe_sorts_ids(customer_items_matrix: CustomerItemsMatrix):
+    """Rows and columns must follow the sorted ids, like `pivot_table` does at training time."""
+    assert customer_items_matrix.customer_ids.tolist() == [10, 20, 30]
+    assert customer_items_matrix.item_ids.tolist() == [5, 7, 9]
+    assert customer_items_matrix.matrix.shape == (3, 3)
+
+
+def test_get_row_known_customer(customer_items_matrix: CustomerItemsMatrix):
+    row = customer_items_matrix.get_row(10)
+
+    assert row.shape == (1, 3)
+    assert array_equal(row, array([[2, 0, 1]]))
+
+
+def test_get_row_unknown_customer(customer_items_matrix: CustomerItemsMatrix):
+    assert customer_items_matrix.get_row(15) is None
+    assert customer_items_matrix.get_row(99) is None
+
+
+def test_from_dataframe_without_interaction_column():
+    """Raw exploded orders count one interaction per row."""
+    orders = DataFrame({"customer_id": [1, 1, 2], "item_id": [4, 4, 4]})
+    matrix = CustomerItemsMatrix.from_dataframe(orders)
+
+    assert array_equal(matrix.get_row(1), array([[2]]))
+
+
+def test_from_parquet(tmp_path, interactions: DataFrame):
+    path = tmp_path / "interactions.parquet"
+    interactions.to_parquet(path)
+
+    matrix = CustomerItemsMatrix.from_parquet(str(path))
+
+    assert array_equal(matrix.get_row(20), array([[0, 3, 0]]))
+
+
+def test_item_columns_drops_unknown_items(customer_items_matrix: CustomerItemsMatrix):
+    assert customer_items_matrix.item_columns(array([9, 6, 5, 100])).tolist() == [2, 0]
+
+
+def test_to_customer_ids(customer_items_matrix: CustomerItemsMatrix):
+    assert customer_items_matrix.to_customer_ids(array([2, 0])).tolist() == [30, 10]
+
+
+def test_get_rows(customer_items_matrix: CustomerItemsMatrix):
+    vectors, known = customer_items_matrix.get_rows(array([30, 15, 10]))
+
+    assert known.tolist() == [True, False, True]
+    assert array_equal(vectors, array([[1, 1, 0], [0, 0, 0], [2, 0, 1]]))
+
+
+@pytest.mark.parametrize("mmap_mode", [None, "r"])
+def test_save_and_load(tmp_path, customer_items_matrix: CustomerItemsMatrix, mmap_mode):
+    customer_items_matrix.save(str(tmp_path))
+
+    loaded = CustomerItemsMatrix.load(str(tmp_path), mmap_mode=mmap_mode)
+
+    assert array_equal(loaded.customer_ids, customer_items_matrix.customer_ids)
+    assert array_equal(loaded.matrix.toarray(), customer_items_matrix.matrix.toarray())
+    assert is_memory_mapped(loaded.matrix.data) == (mmap_mode is not None)
+
+
+def test_add_purchases(customer_items_matrix: CustomerItemsMatrix):
+    """New customers get a row in id order, unknown items are dropped and the matrix isn't modified."""
+    updated, unknown_items = customer_items_matrix.add_purchases(
+        array([20, 15, 15, 30]), array([9, 7, 7, 8])
+    )
+    updated, _ = updated.add_purchases(array([20]), array([9]))
+
+    assert unknown_items == 1
+    assert updated.matrix is customer_items_matrix.matrix
+    assert updated.delta.customer_ids.tolist() == [15, 20]
+    assert updated.has_customer(15) and updated.customer_row(15) is None
+    assert updated.get_row(20).tolist() == [[0, 3, 2]]
+    vectors, known = updated.get_rows(array([15, 99, 30]))
+    assert array_equal(vectors, array([[0, 2, 0], [0, 0, 0], [1, 1, 0]]))
+    assert known.tolist() == [True, False, True]
+    merged = updated.merge_delta()
+    assert merged.delta is None
+    assert merged.customer_ids.tolist() == [10, 15, 20, 30]
+    assert array_equal(merged.matrix.toarray(), array([[2, 0, 1], [0, 2, 0], [0, 3, 2], [1, 1, 0]]))
+    assert customer_items_matrix.customer_ids.tolist() == [10, 20, 30]
+    assert customer_items_matrix.delta is None
+    assert customer_items_matrix.get_row(20).tolist() == [[0, 3, 0]]
@@ -0,0 +1,49 @@
+from api.index.item_catalogue import ItemCatalogue
+
+import pytest
+from numpy import array, array_equal
+
+
+@pytest.fixture
+def catalogue() -> ItemCatalogue:
+    return ItemCatalogue(array([5, 7, 9]))
+
+
+def test_columns_of_known_and_unknown_items(catalogue: ItemCatalogue):
+    columns, known = catalogue.columns(array([9, 4, 5, 10, 7]))
+
+    assert known.tolist() == [True, False, True, False, True]
+    assert columns[known].tolist() == [2, 0, 1]
+
+
+def test_vectors_scatter_purchases_into_the_columns(catalogue: ItemCatalogue):
+    vectors, unknown_items = catalogue.vectors(
+        rows=array([1, 0, 1, 1, 0]),
+        item_ids=array([9, 5, 9, 8, 7]),
+        values=array([1, 2, 3, 1, 1]),
+        num_rows=3,
+    )
+
+    assert vectors.tolist() == [[2, 1, 0], [0, 0, 4], [0, 0, 0]]
+    assert unknown_items == 1
+
+
+def test_empty_catalogue_knows_no_item():
+    vectors, unknown_items = ItemCatalogue(array([], dtype=int)).vectors(array([0]), array([5]), array([1]), 1)
+
+    assert vectors.shape == (1, 0)
+    assert unknown_items == 1
+
+
+def test_unsorted_item_ids_are_rejected():
+    with pytest.raises(ValueError):
+        ItemCatalogue(array([5, 9, 7]))
+    with pytest.raises(ValueError):
+        ItemCatalogue(array([5, 5, 7]))
+
+
+def test_save_and_load(tmp_path, catalogue: ItemCatalogue):
+    path = str(tmp_path / "item_catalogue.npy")
+    catalogue.save(path)
+
+    assert array_equal(ItemCatalogue.load(path, mmap_mode="r").item_ids, catalogue.item_ids)
@@ -0,0 +1,17 @@
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.index.popularity_index import PopularityIndex
+
+from pandas import DataFrame
+
+
+def test_popular_items():
+    counts = CustomerItemsMatrix.from_dataframe(DataFrame({
+        "customer_id": [1, 1, 2, 3, 4],
+        "item_id": [10, 20, 20, 30, 30],
+        "interaction": [3, 1, 1, 1, 1],
+    }))
+
+    popularity_index = PopularityIndex.build(counts, top_k=2)
+
+    assert popularity_index.popular.tolist() == [10, 20]  # ties broken by item id
+    assert popularity_index.recommend_popular([10], 3) == [20]
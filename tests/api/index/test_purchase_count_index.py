@@ -0,0 +1,63 @@
+from api.index.purchase_count_index import PurchaseCountIndex
+
+import pytest
+from numpy import array
+from pandas import DataFrame
+
+
+@pytest.fixture
+def purchase_count_index() -> PurchaseCountIndex:
+    orders = DataFrame({
+        "customer_id": [1, 1, 1, 2, 2, 2, 3, 3],
+        "item_id": [10, 10, 20, 20, 30, 10, 40, 40],
+    })
+    return PurchaseCountIndex.from_dataframe(orders)
+
+
+def test_item_totals(purchase_count_index: PurchaseCountIndex):
+    assert purchase_count_index.item_totals(array([1, 2])).tolist() == [3, 2, 1, 0]
+
+
+def test_added_purchases_are_counted(purchase_count_index: PurchaseCountIndex):
+    updated = purchase_count_index.add_purchases(array([2, 4, 4]), array([40, 20, 99]))
+
+    assert updated.item_totals(array([2, 4])).tolist() == [1, 2, 1, 1]
+    assert updated.item_totals_many([array([2, 4]), array([3])]).toarray().tolist() == [[1, 2, 1, 1], [0, 0, 0, 2]]
+    assert updated.merge_delta().item_totals(array([2, 4])).tolist() == [1, 2, 1, 1]
+    assert purchase_count_index.item_totals(array([2, 4])).tolist() == [1, 1, 1, 0]
+
+
+def test_top_items_sums_counts_across_customers(purchase_count_index: PurchaseCountIndex):
+    """Every item must appear once, no matter how many neighbours bought it."""
+    result = purchase_count_index.top_items(array([1, 2]), array([]), 3)
+
+    assert result.tolist() == [10, 20, 30]
+
+
+def test_top_items_excludes_order_items(purchase_count_index: PurchaseCountIndex):
+    result = purchase_count_index.top_items(array([1, 2]), array([10, 99]), 3)
+
+    assert result.tolist() == [20, 30]
+
+
+def test_top_items_never_returns_unbought_items(purchase_count_index: PurchaseCountIndex):
+    result = purchase_count_index.top_items(array([3]), array([]), 5)
+
+    assert result.tolist() == [40]
+
+
+def test_top_items_unknown_customers(purchase_count_index: PurchaseCountIndex):
+    assert purchase_count_index.top_items(array([7, 8]), array([10]), 3).tolist() == []
+
+
+def test_top_items_single_customer_and_item(purchase_count_index: PurchaseCountIndex):
+    """A single neighbour and a single excluded item used to break the `IN` tuple formatting."""
+    assert purchase_count_index.top_items(array([2]), array([20]), 1).tolist() == [10]
+
+
+def test_top_items_breaks_ties_by_item_id():
+    orders = DataFrame({"customer_id": [1] * 6, "item_id": [50, 40, 30, 20, 10, 60]})
+
+    result = PurchaseCountIndex.from_dataframe(orders).top_items(array([1]), array([]), 2)
+
+    assert result.tolist() == [10, 20]
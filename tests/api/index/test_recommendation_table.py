@@ -0,0 +1,100 @@
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.index.purchase_count_index import PurchaseCountIndex
+from api.index.recommendation_table import RecommendationTable
+from api.neighbours.neighbour_search import ExactNeighbourSearch
+
+import numpy as np
+import pytest
+from numpy import memmap
+from pandas import DataFrame
+from sklearn.neighbors import NearestNeighbors
+
+
+def random_counts(seed: int = 0) -> CustomerItemsMatrix:
+    rng = np.random.default_rng(seed)
+    orders = DataFrame({
+        "customer_id": rng.integers(0, 60, 600) * 3,
+        "item_id": rng.zipf(1.5, 600) % 25,
+    })
+    return CustomerItemsMatrix.from_dataframe(orders)
+
+
+def exact_search(counts: CustomerItemsMatrix) -> ExactNeighbourSearch:
+    return ExactNeighbourSearch(NearestNeighbors(metric="cosine", algorithm="brute").fit(counts.matrix))
+
+
+def live_recommendations(counts, search, customer_id, excluded, num, k=4):
+    _, rows = search.kneighbors(counts.get_row(customer_id), n_neighbors=k)
+    neighbours = counts.to_customer_ids(rows.ravel()[1:])
+    return PurchaseCountIndex(counts).top_items(neighbours, np.array(excluded), num).tolist()
+
+
+@pytest.fixture
+def counts() -> CustomerItemsMatrix:
+    return random_counts()
+
+
+def test_matches_the_live_path(counts: CustomerItemsMatrix):
+    search = exact_search(counts)
+    table = RecommendationTable.build(counts, search, 4, num_candidates=30, batch_size=7)
+
+    assert len(table) == len(counts.customer_ids)
+    for customer_id in counts.customer_ids:
+        for excluded in ([], [0, 1], [2, 3, 99]):
+            assert table.recommend(customer_id, excluded, 3) == live_recommendations(
+                counts, search, customer_id, excluded, 3
+            )
+
+
+def test_falls_back_when_too_few_candidates_are_left(counts: CustomerItemsMatrix):
+    table = RecommendationTable.build(counts, exact_search(counts), 4, num_candidates=3)
+    customer_id = int(counts.customer_ids[0])
+    candidates = table.records["candidates"][0].tolist()
+
+    assert table.recommend(customer_id, [], 3) == candidates
+    assert table.recommend(customer_id, candidates[:1], 3) is None
+    assert table.recommend(customer_id + 1, [], 3) is None  # unknown customer
+
+
+def test_padding_means_every_candidate_was_seen():
+    counts = CustomerItemsMatrix.from_dataframe(
+        DataFrame({"customer_id": [1, 2, 3], "item_id": [10, 10, 20]})
+    )
+    table = RecommendationTable.build(counts, exact_search(counts), 2, num_candidates=5)
+
+    assert table.records["candidates"][0].tolist() == [10, -1, -1, -1, -1]
+    assert table.recommend(1, [10], 3) == []
+
+
+def test_refresh_recomputes_affected_customers(counts: CustomerItemsMatrix):
+    table = RecommendationTable.build(counts, exact_search(counts), 4, num_candidates=10)
+    changed = np.array([counts.customer_ids[5], 1000])  # 1000 is a new customer
+    updated_orders = DataFrame({
+        "customer_id": np.concatenate([np.repeat(counts.customer_ids, 2), [changed[0], 1000, 1000]]),
+        "item_id": np.concatenate([np.tile([1, 2], len(counts.customer_ids)), [7, 7, 8]]),
+    })
+    updated = CustomerItemsMatrix.from_dataframe(updated_orders)
+    search = exact_search(updated)
+
+    affected = table.affected_customers(changed)
+    refreshed = table.refresh(updated, search, affected)
+    rebuilt = RecommendationTable.build(updated, search, 4, num_candidates=10)
+
+    assert set(affected) >= {changed[0], 1000}
+    assert refreshed.records["customer_id"].tolist() == rebuilt.records["customer_id"].tolist()
+    recomputed = np.isin(refreshed.records["customer_id"], affected)
+    assert (refreshed.records[recomputed] == rebuilt.records[recomputed]).all()
+    assert (refreshed.records[~recomputed] == table.records[np.isin(table.records["customer_id"], refreshed.records["customer_id"][~recomputed])]).all()
+
+
+def test_save_and_load(tmp_path, counts: CustomerItemsMatrix):
+    table = RecommendationTable.build(counts, exact_search(counts), 3, num_candidates=5)
+    path = str(tmp_path / "table.npy")
+
+    table.save(path)
+    loaded = RecommendationTable.load(path, mmap_mode="r")
+
+    assert isinstance(loaded.records, memmap)
+    assert (loaded.num_neighbours, loaded.num_candidates) == (2, 5)
+    assert (loaded.records == table.records).all()
+    assert list(tmp_path.iterdir()) == [tmp_path / "table.npy"]
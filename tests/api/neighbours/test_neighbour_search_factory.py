@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+from api.neighbours.neighbour_search import ExactNeighbourSearch
+from api.neighbours.neighbour_search_factory import NeighbourSearchFactory
+from api.neighbours.random_projection_lsh import RandomProjectionLSH
+from api.neighbours.sharded_neighbour_search import ShardedNeighbourSearch
+
+import pytest
+from numpy import eye
+from sklearn.neighbors import NearestNeighbors
+
+
+@pytest.fixture
+def model() -> NearestNeighbors:
+    return NearestNeighbors(metric="cosine", algorithm="brute").fit(eye(4))
+
+
+def test_default_engine_is_exact(model: NearestNeighbors):
+    assert isinstance(NeighbourSearchFactory.get_search(model, SimpleNamespace()), ExactNeighbourSearch)
+
+
+def test_lsh_engine(model: NearestNeighbors):
+    conf = SimpleNamespace(neighbour_search_engine="lsh", lsh_num_tables=2, lsh_num_bits=4)
+
+    assert isinstance(NeighbourSearchFactory.get_search(model, conf), RandomProjectionLSH)
+
+
+@pytest.mark.parametrize("conf, num_probes", [({}, 1), ({"lsh_num_probes": 0}, 0), ({"lsh_num_probes": 2}, 2)])
+def test_lsh_engine_probes(model: NearestNeighbors, conf: dict, num_probes: int):
+    search = NeighbourSearchFactory.get_search(model, SimpleNamespace(neighbour_search_engine="lsh", **conf))
+
+    assert search._num_probes == num_probes
+
+
+def test_lsh_engine_requires_cosine():
+    model = NearestNeighbors(metric="euclidean").fit(eye(4))
+
+    with pytest.raises(ValueError):
+        NeighbourSearchFactory.get_search(model, SimpleNamespace(neighbour_search_engine="lsh"))
+
+
+def test_unknown_engine(model: NearestNeighbors):
+    with pytest.raises(ValueError):
+        NeighbourSearchFactory.get_search(model, SimpleNamespace(neighbour_search_engine="faiss"))
+
+
+def test_sharded_engine(model: NearestNeighbors):
+    conf = SimpleNamespace(neighbour_search_engine="sharded", neighbour_search_shards=2)
+
+    search = NeighbourSearchFactory.get_search(model, conf)
+
+    search.close()
+    assert isinstance(search, ShardedNeighbourSearch)
+    assert search.num_shards == 2
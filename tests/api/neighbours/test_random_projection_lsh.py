@@ -0,0 +1,64 @@
+from api.neighbours.neighbour_search import ExactNeighbourSearch, recall_at_k
+from api.neighbours.random_projection_lsh import RandomProjectionLSH
+
+import pytest
+import numpy as np
+from numpy import ndarray
+from scipy.sparse import csr_matrix
+from sklearn.neighbors import NearestNeighbors
+
+
+@pytest.fixture(scope="module")
+def purchases() -> ndarray:
+    """Binary purchase vectors of customers spread around a few buying profiles."""
+    rng = np.random.default_rng(7)
+    profiles = rng.random((10, 120)) < 0.15
+    customers = profiles[rng.integers(10, size=1500)] ^ (rng.random((1500, 120)) < 0.03)
+    return customers.astype(np.float64)
+
+
+@pytest.fixture(scope="module")
+def exact_search(purchases: ndarray) -> ExactNeighbourSearch:
+    return ExactNeighbourSearch(NearestNeighbors(metric="cosine", algorithm="brute").fit(purchases))
+
+
+def test_recall_at_k_against_exact_model(purchases: ndarray, exact_search: ExactNeighbourSearch):
+    lsh = RandomProjectionLSH(purchases, num_tables=16, num_bits=10, num_probes=2)
+
+    assert recall_at_k(lsh, exact_search, purchases[:200], k=5) >= 0.9
+
+
+def test_recall_grows_with_tables(purchases: ndarray, exact_search: ExactNeighbourSearch):
+    few_tables = RandomProjectionLSH(purchases, num_tables=2, num_bits=12, num_probes=0)
+    many_tables = RandomProjectionLSH(purchases, num_tables=16, num_bits=12, num_probes=0)
+
+    assert recall_at_k(many_tables, exact_search, purchases[:200], k=5) > recall_at_k(
+        few_tables, exact_search, purchases[:200], k=5
+    )
+
+
+def test_kneighbors_matches_sklearn_contract(purchases: ndarray, exact_search: ExactNeighbourSearch):
+    """The query customer comes first and distances are the exact cosine distances, sorted."""
+    lsh = RandomProjectionLSH(csr_matrix(purchases), num_tables=8, num_bits=8, num_probes=1)
+
+    distances, neighbours = lsh.kneighbors(purchases[:10], n_neighbors=3)
+    exact_distances, _ = exact_search.kneighbors(purchases[:10], n_neighbors=3)
+
+    assert distances.shape == neighbours.shape == (10, 3)
+    assert neighbours[:, 0].tolist() == list(range(10))
+    assert np.all(np.diff(distances, axis=1) >= 0)
+    assert np.all(distances >= exact_distances - 1e-12)
+
+
+def test_kneighbors_falls_back_to_all_customers(purchases: ndarray):
+    """Too small buckets must still return the requested number of neighbours."""
+    lsh = RandomProjectionLSH(purchases[:20], num_tables=1, num_bits=40, num_probes=0)
+
+    _, neighbours = lsh.kneighbors(purchases[:1], n_neighbors=20)
+
+    assert sorted(neighbours[0].tolist()) == list(range(20))
+
+
+def test_invalid_num_bits(purchases: ndarray):
+    with pytest.raises(ValueError):
+        RandomProjectionLSH(purchases, num_bits=64)
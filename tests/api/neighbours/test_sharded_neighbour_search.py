@@ -0,0 +1,118 @@
+import os
+
+from api.neighbours.neighbour_search import ExactNeighbourSearch
+from api.neighbours.sharded_neighbour_search import (
+    CsrRows,
+    MappedArray,
+    ShardedNeighbourSearch,
+    merge_top_k,
+    shard_rows,
+)
+
+import numpy as np
+import pytest
+from joblib import dump, load
+from numpy import ndarray
+from scipy.sparse import csr_matrix
+from sklearn.neighbors import NearestNeighbors
+
+
+@pytest.fixture(scope="module")
+def model() -> NearestNeighbors:
+    """Continuous vectors, so no two customers are at the same distance of a query."""
+    return NearestNeighbors(metric="cosine", algorithm="brute").fit(
+        np.random.default_rng(3).random((500, 40))
+    )
+
+
+@pytest.fixture(scope="module")
+def sharded_search(model: NearestNeighbors) -> ShardedNeighbourSearch:
+    search = ShardedNeighbourSearch(model, num_shards=3)
+    yield search
+    search.close()
+
+
+def test_merged_top_k_is_the_unsharded_one(model: NearestNeighbors, sharded_search: ShardedNeighbourSearch):
+    queries: ndarray = np.random.default_rng(4).random((50, 40))
+
+    distances, neighbours = sharded_search.kneighbors(queries, n_neighbors=7)
+    exact_distances, exact_neighbours = ExactNeighbourSearch(model).kneighbors(queries, n_neighbors=7)
+
+    assert np.array_equal(neighbours, exact_neighbours)
+    np.testing.assert_allclose(distances, exact_distances, atol=1e-12)
+
+
+def test_more_neighbours_than_a_shard_holds(model: NearestNeighbors, sharded_search: ShardedNeighbourSearch):
+    distances, neighbours = sharded_search.kneighbors(model._fit_X[:2], n_neighbors=200)
+
+    assert neighbours.shape == (2, 200)
+    assert neighbours[:, 0].tolist() == [0, 1]
+    assert np.all(np.diff(distances, axis=1) >= 0)
+    with pytest.raises(ValueError):
+        sharded_search.kneighbors(model._fit_X[:1], n_neighbors=501)
+
+
+def test_sparse_shards_and_restart_after_close():
+    purchases = csr_matrix((np.random.default_rng(5).random((60, 30)) < 0.2).astype(np.float64))
+    model = NearestNeighbors(metric="cosine", algorithm="brute").fit(purchases)
+    search = ShardedNeighbourSearch(model, num_shards=2)
+
+    distances, _ = search.kneighbors(purchases[:10], n_neighbors=5)
+    search.close()
+    restarted_distances, _ = search.kneighbors(purchases[:10], n_neighbors=5)
+    search.close()
+
+    exact_distances, _ = model.kneighbors(purchases[:10], n_neighbors=5)
+    np.testing.assert_allclose(distances, exact_distances, atol=1e-12)
+    np.testing.assert_array_equal(restarted_distances, distances)
+
+
+def test_merge_breaks_ties_by_row():
+    distances, rows = merge_top_k(
+        [np.array([[0.1, 0.5]]), np.array([[0.1, 0.2]])], [np.array([[4, 5]]), np.array([[1, 2]])], 3
+    )
+
+    assert rows.tolist() == [[1, 4, 2]]
+    assert distances.tolist() == [[0.1, 0.1, 0.2]]
+
+
+def test_at_most_one_shard_per_customer():
+    model = NearestNeighbors(metric="cosine").fit(np.eye(2))
+    search = ShardedNeighbourSearch(model, num_shards=4)
+    search.close()
+
+    assert search.num_shards == 2
+    with pytest.raises(ValueError):
+        ShardedNeighbourSearch(model, num_shards=0)
+
+
+@pytest.mark.parametrize("sparse", [True, False])
+def test_shards_map_their_rows_from_the_model_file(tmp_path, sparse: bool):
+    data = (np.random.default_rng(6).random((20, 8)) < 0.3).astype(np.float64)
+    dump(NearestNeighbors(metric="cosine").fit(csr_matrix(data) if sparse else data), tmp_path / "model.pkl")
+    model = load(tmp_path / "model.pkl", mmap_mode="r")
+
+    rows = shard_rows(model._fit_X, 5, 12)
+
+    if sparse:
+        assert isinstance(rows, CsrRows) and isinstance(rows.data, MappedArray)
+        assert rows.data.filename == str(tmp_path / "model.pkl")
+        np.testing.assert_array_equal(rows.load().toarray(), data[5:12])
+    else:
+        assert isinstance(rows, MappedArray)
+        np.testing.assert_array_equal(rows.load(), data[5:12])
+    # rows in memory are sent as they are
+    np.testing.assert_array_equal(shard_rows(data, 5, 12), data[5:12])
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="forks a worker")
+def test_forked_workers_share_the_shards(model: NearestNeighbors, sharded_search: ShardedNeighbourSearch):
+    shards = sharded_search._shards
+    _, expected = sharded_search.kneighbors(model._fit_X[:3], n_neighbors=4)
+
+    pid = os.fork()
+    if pid == 0:
+        _, neighbours = sharded_search.kneighbors(model._fit_X[:3], n_neighbors=4)
+        os._exit(0 if np.array_equal(neighbours, expected) and sharded_search._shards is shards else 1)
+
+    assert os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0
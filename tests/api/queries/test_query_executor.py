@@ -0,0 +1,132 @@
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import Barrier, Event, Lock
+from unittest.mock import MagicMock
+
+from api.queries.query_executor import BigQueryExecutor, InMemoryQueryExecutor, chain_future
+
+import pytest
+from pandas import DataFrame
+
+
+def make_client(on_query=None) -> MagicMock:
+    client = MagicMock()
+
+    def query(sql, job_config=None, timeout=None):
+        if on_query is not None:
+            on_query()
+        job = MagicMock()
+        job.result.return_value.to_dataframe.return_value = DataFrame({"sql": [sql]})
+        return job
+
+    client.query.side_effect = query
+    return client
+
+
+def test_queries_run_concurrently():
+    """Independent queries overlap instead of running one after the other."""
+    barrier = Barrier(3, timeout=5)
+    executor = BigQueryExecutor(lambda: make_client(barrier.wait), max_workers=3)
+
+    futures = [executor.submit(f"SELECT {i}") for i in range(3)]
+
+    assert [f.result(timeout=5)["sql"][0] for f in futures] == ["SELECT 0", "SELECT 1", "SELECT 2"]
+    executor.shutdown()
+
+
+def test_clients_are_reused():
+    created = []
+    executor = BigQueryExecutor(lambda: created.append(make_client()) or created[-1], max_workers=2)
+
+    for i in range(5):
+        executor.query(f"SELECT {i}")
+
+    assert len(created) == 1
+    assert created[0].query.call_count == 5
+    executor.shutdown()
+
+
+def test_concurrency_is_bounded_by_max_workers():
+    lock, running, peak = Lock(), [0], [0]
+    release = Event()
+
+    def on_query():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        release.wait(1)
+        with lock:
+            running[0] -= 1
+
+    executor = BigQueryExecutor(lambda: make_client(on_query), max_workers=2)
+    futures = [executor.submit("SELECT 1") for _ in range(6)]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+
+    assert peak[0] <= 2
+    executor.shutdown()
+
+
+def test_query_times_out():
+    release = Event()
+    executor = BigQueryExecutor(lambda: make_client(lambda: release.wait(5)), timeout_seconds=0.05)
+
+    with pytest.raises(FutureTimeoutError):
+        executor.query("SELECT 1")
+    release.set()
+    executor.shutdown()
+
+
+def test_wait_timeout_covers_queueing():
+    assert BigQueryExecutor(make_client, timeout_seconds=12.0).wait_timeout == 24.0
+    assert InMemoryQueryExecutor(lambda query, job_config: DataFrame()).wait_timeout is None
+
+
+def test_from_client_passes_timeout_to_bigquery():
+    client = make_client()
+    executor = BigQueryExecutor.from_client(client, timeout_seconds=12.0)
+
+    executor.query("SELECT 1")
+
+    client.query.assert_called_once_with("SELECT 1", job_config=None, timeout=12.0)
+    executor.shutdown()
+
+
+def test_in_memory_executor_records_queries():
+    executor = InMemoryQueryExecutor(lambda query, job_config: DataFrame({"n": [len(query)]}))
+
+    assert executor.query("SELECT 1")["n"][0] == 8
+    assert executor.queries == ["SELECT 1"]
+
+
+def test_in_memory_executor_propagates_errors():
+    def fail(query, job_config):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        InMemoryQueryExecutor(fail).query("SELECT 1")
+
+
+def test_chain_future():
+    executor = InMemoryQueryExecutor(lambda query, job_config: DataFrame({"n": [1, 2]}))
+
+    assert chain_future(executor.submit("SELECT 1"), len).result() == 2
+
+
+def test_bigquery_stats_record_bytes_processed():
+    client = make_client()
+    client.query.side_effect = None
+    client.query.return_value.total_bytes_processed = 100
+    client.query.return_value.cache_hit = True
+    executor = BigQueryExecutor.from_client(client)
+
+    executor.query("SELECT 1", job_config=MagicMock(labels={"query_name": "one"}))
+    executor.query("SELECT 1", job_config=MagicMock(labels={"query_name": "one"}))
+    executor.query("SELECT 2")
+
+    stats = executor.stats.snapshot()
+    assert stats["one"]["runs"] == 2
+    assert stats["one"]["bytes_processed"] == 200
+    assert stats["one"]["remote_cache_hits"] == 2
+    assert stats["adhoc"]["runs"] == 1
+    executor.shutdown()
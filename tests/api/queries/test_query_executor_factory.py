@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from api.queries.query_executor import BigQueryExecutor
+from api.queries.query_executor_factory import QueryExecutorFactory
+from api.queries.sqlite_query_executor import SQLiteQueryExecutor
+
+import pytest
+
+
+def test_default_backend_is_bigquery():
+    executor = QueryExecutorFactory.get_executor(SimpleNamespace(), MagicMock())
+
+    assert isinstance(executor, BigQueryExecutor)
+    assert executor.dialect == "bigquery"
+
+
+def test_sqlite_backend():
+    conf = SimpleNamespace(query_backend="sqlite", local_orders_path="orders.parquet")
+
+    executor = QueryExecutorFactory.get_executor(conf)
+
+    assert isinstance(executor, SQLiteQueryExecutor)
+    assert executor.dialect == "sqlite"
+
+
+def test_sqlite_backend_requires_orders():
+    with pytest.raises(ValueError):
+        QueryExecutorFactory.get_executor(SimpleNamespace(query_backend="sqlite"))
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        QueryExecutorFactory.get_executor(SimpleNamespace(query_backend="duckdb"))
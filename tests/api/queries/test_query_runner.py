@@ -0,0 +1,94 @@
+from unittest.mock import MagicMock
+
+from api.cache.ttl_lru_cache import TTLLRUCache
+from api.queries.parameterised_query import ParameterisedQuery
+from api.queries.query_executor import InMemoryQueryExecutor
+from api.queries.query_runner import QueryRunner
+
+import pytest
+from numpy import array, int64
+from pandas import DataFrame
+
+
+QUERY = ParameterisedQuery(
+    "items", "SELECT @limit FROM t WHERE id IN UNNEST(@ids)", {"ids": "ARRAY<INT64>", "limit": "INT64"}
+)
+
+
+@pytest.fixture
+def executor() -> InMemoryQueryExecutor:
+    return InMemoryQueryExecutor(
+        lambda query, job_config: DataFrame({"p": [len(job_config.query_parameters)]})
+    )
+
+
+def test_bind_normalises_numpy_values():
+    assert QUERY.bind(limit=int64(3), ids=array([5])) == (("ids", (5,)), ("limit", 3))
+
+
+def test_bind_rejects_unknown_parameters():
+    with pytest.raises(ValueError):
+        QUERY.bind(ids=[1], limit=3, other=2)
+
+
+def test_job_config_has_parameters_and_label():
+    job_config = QUERY.job_config(QUERY.bind(ids=[5], limit=3))
+
+    assert job_config.labels == {"query_name": "items"}
+    assert [(p.name, p.to_api_repr()["parameterType"]["type"]) for p in job_config.query_parameters] == [
+        ("ids", "ARRAY"),
+        ("limit", "INT64"),
+    ]
+    assert job_config.query_parameters[0].values == [5]
+
+
+def test_sql_text_is_the_same_for_every_parameter(executor: InMemoryQueryExecutor):
+    runner = QueryRunner(executor, TTLLRUCache(max_size=0))
+
+    runner.run(QUERY, ids=[1], limit=3)
+    runner.run(QUERY, ids=[1, 2, 3], limit=1)
+
+    assert executor.queries == [QUERY.sql, QUERY.sql]
+
+
+def test_results_are_cached_by_name_and_parameters(executor: InMemoryQueryExecutor):
+    runner = QueryRunner(executor, TTLLRUCache(max_size=10))
+
+    first = runner.run(QUERY, ids=[1, 2], limit=3)
+    assert runner.run(QUERY, ids=array([1, 2]), limit=3) is first
+    assert runner.submit(QUERY, ids=(1, 2), limit=3).result() is first
+    runner.run(QUERY, ids=[1, 2], limit=4)
+
+    assert len(executor.queries) == 2
+    assert runner.query_stats()["cache"]["hits"] == 2
+
+
+def test_uncached_submissions_skip_the_cache(executor: InMemoryQueryExecutor):
+    runner = QueryRunner(executor, TTLLRUCache(max_size=10))
+    runner.run(QUERY, ids=[1], limit=1)
+
+    runner.submit(QUERY, cached=False, ids=[1], limit=1).result()
+    runner.submit(QUERY, cached=False, ids=[2], limit=1).result()
+
+    assert len(executor.queries) == 3
+    assert runner.query_stats()["cache"]["size"] == 1
+
+
+def test_failed_queries_are_not_cached():
+    handler = MagicMock(side_effect=[RuntimeError("boom"), DataFrame({"p": [1]})])
+    runner = QueryRunner(InMemoryQueryExecutor(handler), TTLLRUCache(max_size=10))
+
+    with pytest.raises(RuntimeError):
+        runner.submit(QUERY, ids=[1], limit=1).result()
+    assert runner.submit(QUERY, ids=[1], limit=1).result()["p"].tolist() == [1]
+
+
+def test_query_stats_by_query_name(executor: InMemoryQueryExecutor):
+    runner = QueryRunner(executor, TTLLRUCache(max_size=0))
+
+    runner.run(QUERY, ids=[1], limit=1)
+    runner.run(QUERY, ids=[2], limit=1)
+
+    stats = runner.query_stats()["queries"]["items"]
+    assert stats["runs"] == 2
+    assert stats["wall_time_seconds"] >= 0
@@ -0,0 +1,72 @@
+from api.cache.ttl_lru_cache import TTLLRUCache
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.queries.customer_items_array import PARAMETERISED_QUERY as CUSTOMER_ITEMS_ARRAY_QUERY
+from api.queries.customers_items_matrix import PARAMETERISED_QUERY as CUSTOMERS_ITEMS_MATRIX_QUERY
+from api.queries.customers_purchases import PARAMETERISED_QUERY as CUSTOMERS_PURCHASES_QUERY
+from api.queries.most_sold_products_for_customer import (
+    PARAMETERISED_QUERY as MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY,
+)
+from api.queries.query_runner import QueryRunner
+from api.queries.sqlite_query_executor import SQLiteQueryExecutor
+
+import pytest
+from pandas import DataFrame
+
+
+ORDERS = DataFrame({
+    "customer_id": [1, 1, 1, 2, 2, 3, 3, 3],
+    "item_id": [10, 10, 20, 20, 30, 10, 20, 20],
+})
+
+
+@pytest.fixture
+def executor(tmp_path) -> SQLiteQueryExecutor:
+    orders_path = str(tmp_path / "orders.parquet")
+    items_path = str(tmp_path / "items.parquet")
+    ORDERS.to_parquet(orders_path)
+    DataFrame({"item_id": [10, 20, 30, 40]}).to_parquet(items_path)
+    return SQLiteQueryExecutor(orders_path, items_path=items_path)
+
+
+@pytest.fixture
+def runner(executor: SQLiteQueryExecutor) -> QueryRunner:
+    return QueryRunner(executor, TTLLRUCache(max_size=0))
+
+
+def test_customers_items_matrix(runner: QueryRunner):
+    counts = CustomerItemsMatrix.from_dataframe(runner.run(CUSTOMERS_ITEMS_MATRIX_QUERY))
+
+    assert counts.matrix.toarray().tolist() == [[2, 1, 0], [0, 1, 1], [1, 2, 0]]
+
+
+def test_customer_items_array_follows_item_order(runner: QueryRunner):
+    result = runner.run(CUSTOMER_ITEMS_ARRAY_QUERY, customer_id=2)
+
+    assert result["interaction"].tolist() == [1, 1, 1, 1]
+    assert len(runner.run(CUSTOMER_ITEMS_ARRAY_QUERY, customer_id=99)) == 0
+
+
+def test_customers_purchases(runner: QueryRunner):
+    result = runner.run(CUSTOMERS_PURCHASES_QUERY, customer_ids=[1, 2])
+
+    assert sorted(result.itertuples(index=False, name=None)) == [
+        (1, 10, 2), (1, 20, 1), (2, 20, 1), (2, 30, 1)
+    ]
+
+
+def test_most_sold_products_excludes_items(runner: QueryRunner):
+    result = runner.run(
+        MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY,
+        customer_ids=[1, 3],
+        excluded_item_ids=[10],
+        num_recommendations=2,
+    )
+
+    assert result["item_id"].tolist() == [20]
+
+
+def test_errors_are_set_on_the_future(executor: SQLiteQueryExecutor):
+    future = executor.submit("SELECT * FROM missing")
+
+    assert future.exception() is not None
+    assert executor.stats.snapshot()["adhoc"]["runs"] == 1
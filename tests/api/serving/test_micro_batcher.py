@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from api.knn_model import Recommendation
+from api.serving.micro_batcher import MicroBatcher
+
+import pytest
+
+
+def fake_model() -> SimpleNamespace:
+    """A model recommending the customer id, recording its batches."""
+    return SimpleNamespace(recommend_many_with_tier=MagicMock(side_effect=lambda requests, batch_size: (
+        Recommendation([request["customer_id"]], "knn") for request in requests
+    )))
+
+
+def test_concurrent_requests_are_batched():
+    micro_batcher = MicroBatcher(max_wait_seconds=0.2, max_batch_size=3)
+    model, other_model = fake_model(), fake_model()
+    requests = [(model, 1), (other_model, 2), (model, 3), (model, 4)]
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(
+            lambda args: micro_batcher.recommend(args[0], {"customer_id": args[1]}), requests
+        ))
+    micro_batcher.close()
+
+    assert results == [Recommendation([customer_id], "knn") for _, customer_id in requests]
+    batch_sizes = [
+        len(call.args[0])
+        for call in model.recommend_many_with_tier.call_args_list + other_model.recommend_many_with_tier.call_args_list
+    ]
+    assert sum(batch_sizes) == 4
+    assert len(batch_sizes) < 4  # at least two requests shared a call
+
+
+def test_batch_errors_are_raised_to_every_request():
+    micro_batcher = MicroBatcher(max_wait_seconds=0.01)
+    model = SimpleNamespace(recommend_many_with_tier=MagicMock(side_effect=RuntimeError("query failed")))
+
+    with pytest.raises(RuntimeError):
+        micro_batcher.recommend(model, {"customer_id": 1})
+    micro_batcher.close()
+
+
+def test_a_failing_request_does_not_fail_its_batch():
+    micro_batcher = MicroBatcher(max_wait_seconds=0.2, max_batch_size=3)
+
+    def recommend_many_with_tier(requests, batch_size):
+        for request in requests:
+            if request["customer_id"] == 2:
+                raise ValueError("unknown customer")
+        return [Recommendation([request["customer_id"]], "knn") for request in requests]
+
+    model = SimpleNamespace(recommend_many_with_tier=MagicMock(side_effect=recommend_many_with_tier))
+    futures = [micro_batcher.submit(model, {"customer_id": customer_id}) for customer_id in (1, 2, 3)]
+
+    assert futures[0].result(5) == Recommendation([1], "knn")
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    assert futures[2].result(5) == Recommendation([3], "knn")
+    assert [len(call.args[0]) for call in model.recommend_many_with_tier.call_args_list] == [3, 1, 1, 1]
+    micro_batcher.close()
+
+
+def test_invalid_limits():
+    with pytest.raises(ValueError):
+        MicroBatcher(max_wait_seconds=0.01, max_batch_size=0)
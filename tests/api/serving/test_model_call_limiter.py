@@ -0,0 +1,53 @@
+from threading import Event
+
+from api.serving.model_call_limiter import ModelCallLimiter, ModelCallTimeoutError, OverloadedError
+
+import pytest
+
+
+def test_run_returns_the_result_and_raises_the_errors():
+    limiter = ModelCallLimiter(max_concurrent=1, max_queued=0)
+
+    assert limiter.run(lambda a, b=0: a + b, 1, b=2) == 3
+    with pytest.raises(ZeroDivisionError):
+        limiter.run(lambda: 1 / 0)
+    assert limiter.in_flight == 0
+
+
+def test_calls_past_the_limits_are_shed():
+    limiter = ModelCallLimiter(max_concurrent=1, max_queued=1)
+    limiter.admit()
+    limiter.admit()
+
+    with pytest.raises(OverloadedError):
+        limiter.run(lambda: 1)
+    with pytest.raises(OverloadedError):
+        limiter.admit()
+    assert limiter.stats()["in_flight"] == 2
+
+    limiter.release()
+
+    assert limiter.run(lambda: 1) == 1
+
+
+def test_timed_out_calls_keep_their_slot_until_they_finish():
+    """Waiting calls are cancelled, running ones can't be."""
+    limiter = ModelCallLimiter(max_concurrent=1, max_queued=1, timeout_seconds=0.05)
+    release = Event()
+
+    with pytest.raises(ModelCallTimeoutError):
+        limiter.run(release.wait, 5)
+    assert limiter.in_flight == 1
+    with pytest.raises(ModelCallTimeoutError):
+        limiter.run(release.wait, 5)
+    assert limiter.in_flight == 1
+
+    release.set()
+    limiter.shutdown()
+
+    assert limiter.in_flight == 0
+
+
+def test_invalid_limits():
+    with pytest.raises(ValueError):
+        ModelCallLimiter(max_concurrent=0, max_queued=1)
@@ -0,0 +1,103 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from http.client import HTTPConnection
+from threading import Event, Thread
+
+from api.serving.prefork_server import PreforkServer, ServerSettings
+
+import pytest
+from flask import Flask
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Nothing listening on port {port}")
+
+
+def test_settings_from_env():
+    settings = ServerSettings.from_env({"PORT": "8080", "WEB_WORKERS": "4", "MODEL_PRELOAD": "0"})
+
+    assert (settings.port, settings.workers, settings.preload) == (8080, 4, False)
+    assert settings.threads == ServerSettings().threads
+
+
+def test_worker_drains_the_requests_in_flight():
+    started, release = Event(), Event()
+    app = Flask(__name__)
+
+    @app.route("/slow")
+    def slow():
+        started.set()
+        release.wait(5)
+        return "done"
+
+    port = free_port()
+    exited = []
+    server = PreforkServer(
+        lambda: app,
+        ServerSettings(host="127.0.0.1", port=port, graceful_timeout_seconds=5),
+        on_worker_exit=exited.append,
+    )
+    thread = Thread(target=server.serve)
+    thread.start()
+    wait_for_port(port)
+
+    connection = HTTPConnection("127.0.0.1", port, timeout=5)
+    connection.request("GET", "/slow")
+    assert started.wait(5)
+    server.stop()
+    time.sleep(0.3)
+    with pytest.raises(OSError):  # no longer accepting
+        socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+    release.set()
+
+    assert connection.getresponse().read() == b"done"
+    thread.join(5)
+    assert exited == [app]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="forks its workers")
+def test_workers_are_forked_and_stop_on_sigterm():
+    port = free_port()
+    script = (
+        "import os\n"
+        "from flask import Flask\n"
+        "from api.serving.prefork_server import PreforkServer, ServerSettings\n"
+        "app = Flask('test')\n"
+        "app.route('/pid')(lambda: str(os.getpid()))\n"
+        f"PreforkServer(lambda: app, ServerSettings(host='127.0.0.1', port={port}, workers=2)).serve()\n"
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-c", script], env={**os.environ, "PYTHONPATH": "src"},
+        cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))),
+    )
+    try:
+        wait_for_port(port)
+        pids = set()
+        for _ in range(20):
+            connection = HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/pid")
+            pids.add(int(connection.getresponse().read()))
+            connection.close()
+
+        assert process.pid not in pids
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(10) == 0
+    finally:
+        process.kill()
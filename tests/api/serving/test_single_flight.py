@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from unittest.mock import MagicMock
+
+from api.serving.single_flight import SingleFlight
+
+import pytest
+
+
+def test_concurrent_identical_calls_run_once():
+    single_flight = SingleFlight()
+    started, release = Event(), Event()
+
+    def leader_call():
+        started.set()
+        release.wait(5)
+        return [1, 2]
+
+    follower_call = MagicMock()
+    with ThreadPoolExecutor(5) as executor:
+        leader = executor.submit(single_flight.do, "key", leader_call)
+        assert started.wait(5)
+        followers = [executor.submit(single_flight.do, "key", follower_call) for _ in range(3)]
+        other = executor.submit(single_flight.do, "other key", lambda: [3])
+        assert other.result(5) == [3]
+        time.sleep(0.1)
+        release.set()
+
+        assert leader.result(5) == [1, 2]
+        assert [follower.result(5) for follower in followers] == [[1, 2]] * 3
+    follower_call.assert_not_called()
+    assert single_flight.in_flight == 0
+    assert single_flight.do("key", lambda: [4]) == [4]  # results aren't kept
+
+
+def test_followers_get_the_exception_of_the_leader():
+    single_flight = SingleFlight()
+    started, release = Event(), Event()
+
+    def failing_call():
+        started.set()
+        release.wait(5)
+        raise ValueError("unknown customer")
+
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(single_flight.do, "key", failing_call)
+        assert started.wait(5)
+        follower = executor.submit(single_flight.do, "key", lambda: [1])
+        time.sleep(0.1)
+        release.set()
+
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result(5)
+    assert single_flight.in_flight == 0
@@ -1,4 +1,9 @@
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
 from api.flask_app_builder import FlaskAppBuilder
+from api.model_registry import ModelRegistry
 
 import pytest
 from flask import Flask, Blueprint
@@ -53,4 +58,28 @@ def test_with_multiple_blueprints(flask_app_builder: FlaskAppBuilder):
 def test_build(flask_app_builder: FlaskAppBuilder):
     app = flask_app_builder.build()
     
-    assert isinstance(app, Flask)
\ No newline at end of file
+    assert isinstance(app, Flask)
+
+
+def test_with_recommender_is_lazy(flask_app_builder: FlaskAppBuilder):
+    model_factory = MagicMock(return_value=SimpleNamespace(model_version="v1", model_pkl_path="model.pkl"))
+    model_registry = ModelRegistry("conf.json", model_factory=model_factory)
+
+    app: Flask = flask_app_builder.with_recommender(model_registry).build()
+
+    assert app.extensions["model_registry"] is model_registry
+    model_factory.assert_not_called()
+
+
+def test_with_recommender_warm_up(flask_app_builder: FlaskAppBuilder):
+    model = SimpleNamespace(model_version="v1", model_pkl_path="model.pkl")
+    model_registry = ModelRegistry("conf.json", model_factory=MagicMock(return_value=model))
+    warm_up_hook = MagicMock()
+
+    flask_app_builder.with_recommender(model_registry, warm_up=True, warm_up_hook=warm_up_hook).build()
+    deadline = time.monotonic() + 5
+    while not model_registry.is_ready and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert model_registry.is_ready
+    warm_up_hook.assert_called_once_with(model)
@@ -1,8 +1,26 @@
+import json
+import os
+from concurrent.futures import Future
 from unittest.mock import MagicMock
-from api.knn_model import KNNModel
-from api.queries.customer_items_array import QUERY as CUSTOMER_ITEMS_ARRAY_QUERY
-from api.queries.most_sold_products_for_customer import QUERY as MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY
+from api.knn_model import KNNModel, Recommendation
+from api.metrics import STAGE_SECONDS
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.index.item_catalogue import ItemCatalogue
+from api.index.co_purchase_index import CoPurchaseIndex
+from api.index.popularity_index import PopularityIndex
+from api.index.purchase_count_index import PurchaseCountIndex
+from api.index.recommendation_table import RecommendationTable
+from api.queries.customer_items_array import PARAMETERISED_QUERY as CUSTOMER_ITEMS_ARRAY_QUERY
+from api.queries.customers_purchases import PARAMETERISED_QUERY as CUSTOMERS_PURCHASES_QUERY
+from api.queries.most_sold_products_for_customer import PARAMETERISED_QUERY as MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY
+from api.queries.parameterised_query import ParameterisedQuery
+from api.queries.query_runner import QueryRunner
+from api.cache.ttl_lru_cache import TTLLRUCache
+from api.queries.query_executor import BigQueryExecutor, InMemoryQueryExecutor
+from api.queries.sqlite_query_executor import SQLiteQueryExecutor
+from training.train_knn_model import train
 
+import numpy as np
 import pytest
 from google.cloud.bigquery import Client
 from numpy import array, ndarray
@@ -20,6 +38,25 @@ def mock_knn_model(mock_bq_client: MagicMock) -> KNNModel:
     return KNNModel(r"src/api/conf/knn_model_conf.json", bq_client=mock_bq_client)
 
 
+def stage_count(name: str) -> float:
+    """Counts the observations of a stage so far."""
+    return sum(
+        value for sample_name, labels, value in STAGE_SECONDS.collect().samples
+        if sample_name == "recommender_stage_seconds_count" and labels == {"stage": name}
+    )
+
+
+def assert_queried_once(mock_bq_client: MagicMock, query: ParameterisedQuery, **parameters):
+    """Checks the client ran the query once, with the given parameters and the default timeout."""
+    mock_bq_client.query.assert_called_once()
+    (sql,), kwargs = mock_bq_client.query.call_args
+    assert sql == query.sql
+    assert kwargs["timeout"] == 30.0
+    assert kwargs["job_config"].labels == {"query_name": query.name}
+    expected = query.job_config(query.bind(**parameters)).query_parameters
+    assert kwargs["job_config"].query_parameters == expected
+
+
 def test_knn_model_init_with_conf_path():
     """Test the initialization of KNNModel with a configuration path.
 
@@ -28,14 +65,14 @@ def test_knn_model_init_with_conf_path():
     - The configuration (`_conf`) is loaded and is not None.
     - The configuration contains required attributes like `model_pkl_path` and `similar_customers_number`.
     - The model (`_model`) is loaded and is not None.
-    - The BigQuery client (`_bq_client`) is an instance of `Client`.
+    - The query executor (`_query_executor`) runs on BigQuery.
     """
     knn_model =KNNModel(r"src/api/conf/knn_model_conf.json")
     assert knn_model._conf is not None
     assert hasattr(knn_model._conf, "model_pkl_path"), "Missing model_pkl_path in model conf"
     assert hasattr(knn_model._conf, "similar_customers_number"), "Missing similar_customers_number in model conf"
     assert knn_model._model is not None
-    assert isinstance(knn_model._bq_client, Client)
+    assert isinstance(knn_model._query_executor, BigQueryExecutor)
 
 
 def test_knn_model_init_with_custom_bq_client(mock_knn_model: KNNModel, mock_bq_client: MagicMock):
@@ -46,9 +83,11 @@ def test_knn_model_init_with_custom_bq_client(mock_knn_model: KNNModel, mock_bq_
         mock_bq_client (MagicMock): The mock BigQuery client.
 
     This test checks that when KNNModel is initialized with a custom BigQuery client,
-    the client is correctly assigned to the `_bq_client` attribute.
+    the client is the one used to run the queries.
     """
-    assert mock_knn_model._bq_client is mock_bq_client
+    mock_bq_client.query.return_value.result.return_value.to_dataframe.return_value = DataFrame({"item_id": [101]})
+    mock_knn_model._query_recommended_items([1], [10], 1)
+    mock_bq_client.query.assert_called_once()
     
 
 def test_query_customer_items_matrix(mock_bq_client: MagicMock, mock_knn_model: KNNModel):
@@ -63,13 +102,13 @@ def test_query_customer_items_matrix(mock_bq_client: MagicMock, mock_knn_model:
     - Returns a NumPy array (`ndarray`) representing customer items.
     - Ensures the returned array has the correct shape.
     """
-    mock_bq_client.query.return_value.to_dataframe.return_value.to_numpy.return_value = array([[1,2,3]])
+    mock_bq_client.query.return_value.result.return_value.to_dataframe.return_value.to_numpy.return_value = array([range(32)])
     customer_id = 9  # a random customer id just for testing purposes
     result = mock_knn_model._query_customer_items_matrix(customer_id)
     
-    mock_bq_client.query.assert_called_once_with(CUSTOMER_ITEMS_ARRAY_QUERY.format(customer_id))
+    assert_queried_once(mock_bq_client, CUSTOMER_ITEMS_ARRAY_QUERY, customer_id=customer_id)
     assert isinstance(result, ndarray)
-    assert result.shape == (1, 3)
+    assert result.shape == (1, 32)
     
 
 def test_query_recommended_items(mock_bq_client: MagicMock, mock_knn_model: KNNModel):
@@ -83,18 +122,18 @@ def test_query_recommended_items(mock_bq_client: MagicMock, mock_knn_model: KNNM
     - Calls the expected query using the given `similar_customers`, `item_ids`, and `num_recommendations`.
     - Returns a list of recommended item IDs.
     """
-    mock_bq_client.query.return_value.to_dataframe.return_value = DataFrame({"item_id": [101, 102, 103]})
+    mock_bq_client.query.return_value.result.return_value.to_dataframe.return_value = DataFrame({"item_id": [101, 102, 103]})
     similar_customers = [1,2,3]
     item_ids = [10,20]
     num_recommendations = 3
     result = mock_knn_model._query_recommended_items(similar_customers, item_ids, num_recommendations)
     
-    mock_bq_client.query.assert_called_once_with(
-        MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY.format(
-            tuple(similar_customers),
-            tuple(item_ids),
-            num_recommendations
-        )
+    assert_queried_once(
+        mock_bq_client,
+        MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY,
+        customer_ids=similar_customers,
+        excluded_item_ids=item_ids,
+        num_recommendations=num_recommendations,
     )
     assert isinstance(result, list)
     
@@ -128,7 +167,8 @@ def test_recommend_valid_case(mock_knn_model: KNNModel):
     assert recommendations == [101, 102, 103]
 
 
-def test_recommend_no_order_items(mock_knn_model: KNNModel):
+def test_recommend_no_order_items(mock_bq_client: MagicMock, mock_knn_model: KNNModel):
+    """An empty order excludes no item, the similar customers' items are still recommended."""
     mock_knn_model\
         ._query_customer_items_matrix = MagicMock(
             return_value = array([[1, 0, 1, 0, 1]])
@@ -136,13 +176,18 @@ def test_recommend_no_order_items(mock_knn_model: KNNModel):
     mock_knn_model._model.kneighbors = MagicMock(
         return_value = (None, array([[1, 2, 3, 4, 5]])) 
     )
+    mock_bq_client.query.return_value.result.return_value.to_dataframe.return_value = DataFrame({"item_id": [101, 102]})
     
     recommendations = mock_knn_model.recommend(
         customer_id= 1,
         order_items=[],
         num_recommendations=3
     )
-    assert recommendations == []
+    assert recommendations == [101, 102]
+    assert_queried_once(
+        mock_bq_client, MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY,
+        customer_ids=[2, 3, 4, 5], excluded_item_ids=[], num_recommendations=3,
+    )
 
 
 def test_invalid_conf_path_raises_error():
@@ -153,3 +198,477 @@ def test_invalid_conf_path_raises_error():
     """
     with pytest.raises(ValueError):
         KNNModel(r"src/api/knn_model_conf.json")
+
+
+def test_query_customer_items_matrix_from_memory(mock_bq_client: MagicMock, mock_knn_model: KNNModel):
+    """Known customers are served from the in-memory matrix, unknown ones fall back to BigQuery."""
+    mock_knn_model._customer_items_matrix = CustomerItemsMatrix.from_dataframe(
+        DataFrame({"customer_id": [4, 4], "item_id": [1, 3], "interaction": [1, 1]})
+    )
+    mock_bq_client.query.return_value.result.return_value.to_dataframe.return_value.to_numpy.return_value = array([[0, 0]])
+    mock_knn_model._model.n_features_in_ = 2
+
+    assert mock_knn_model._query_customer_items_matrix(4).tolist() == [[1, 1]]
+    mock_bq_client.query.assert_not_called()
+
+    mock_knn_model._query_customer_items_matrix(5)
+    assert_queried_once(mock_bq_client, CUSTOMER_ITEMS_ARRAY_QUERY, customer_id=5)
+
+
+@pytest.mark.parametrize("customers, items, error", [(5, 32, "5 customers"), (11, 31, "31 items")])
+def test_customer_items_matrix_must_match_the_model(tmp_path, customers: int, items: int, error: str):
+    """The shipped model was trained on 11 customers and 32 items."""
+    matrix_path = str(tmp_path / "matrix.parquet")
+    DataFrame({
+        "customer_id": [item % customers for item in range(items)],
+        "item_id": range(items),
+    }).to_parquet(matrix_path)
+    with open("src/api/conf/knn_model_conf.json", encoding="utf-8") as conf_file:
+        conf = json.load(conf_file)
+    conf["customer_items_matrix_path"] = matrix_path
+    conf_path = tmp_path / "knn_model_conf.json"
+    conf_path.write_text(json.dumps(conf))
+
+    with pytest.raises(ValueError, match=error):
+        KNNModel(str(conf_path))
+
+
+def test_query_recommended_items_from_memory(mock_bq_client: MagicMock, mock_knn_model: KNNModel):
+    mock_knn_model._purchase_count_index = PurchaseCountIndex.from_dataframe(
+        DataFrame({"customer_id": [2, 2, 3], "item_id": [10, 20, 20]})
+    )
+
+    result = mock_knn_model._query_recommended_items([2, 3], [10], 3)
+
+    mock_bq_client.query.assert_not_called()
+    assert result == [20]
+
+
+def test_recommend_many_single_kneighbors_call(mock_bq_client: MagicMock, mock_knn_model: KNNModel):
+    """A batch makes one kneighbors call and one purchases query, whatever its size."""
+    mock_knn_model._query_customers_items_matrix = MagicMock(
+        return_value=array([[1, 0, 1], [0, 1, 1]])
+    )
+    mock_knn_model._model.kneighbors = MagicMock(
+        return_value=(None, array([[1, 2, 3], [4, 2, 5]]))
+    )
+    mock_bq_client.query.return_value.result.return_value.to_dataframe.return_value = DataFrame({
+        "customer_id": [2, 3, 5],
+        "item_id": [10, 20, 30],
+        "interaction": [1, 2, 5],
+    })
+
+    recommendations = list(mock_knn_model.recommend_many([
+        {"customer_id": 1, "order_items": [{"item_id": 20}], "num_recommendations": 3},
+        {"customer_id": 4, "order_items": [], "num_recommendations": 1},
+    ]))
+
+    mock_knn_model._query_customers_items_matrix.assert_called_once_with([1, 4])
+    mock_knn_model._model.kneighbors.assert_called_once()
+    assert_queried_once(mock_bq_client, CUSTOMERS_PURCHASES_QUERY, customer_ids=[2, 3, 5])
+    assert recommendations == [[10], [30]]
+
+
+def test_recommend_many_batches(mock_knn_model: KNNModel):
+    mock_knn_model._query_customers_items_matrix = MagicMock(side_effect=lambda ids: array([[1]] * len(ids)))
+    mock_knn_model._model.kneighbors = MagicMock(side_effect=lambda m, n_neighbors: (None, array([[0, 1]] * len(m))))
+    mock_knn_model._purchase_count_index = PurchaseCountIndex.from_dataframe(
+        DataFrame({"customer_id": [1], "item_id": [7]})
+    )
+
+    recommendations = list(mock_knn_model.recommend_many(
+        ({"customer_id": c, "order_items": []} for c in range(5)), batch_size=2
+    ))
+
+    assert mock_knn_model._model.kneighbors.call_count == 3
+    assert recommendations == [[7]] * 5
+
+
+def test_recommend_caches_similar_customers(mock_knn_model: KNNModel):
+    """The customer vector and neighbours are computed once per customer and model version."""
+    mock_knn_model._query_customer_items_matrix = MagicMock(return_value=array([[1, 0, 1]]))
+    mock_knn_model._model.kneighbors = MagicMock(return_value=(None, array([[1, 2, 3]])))
+    mock_knn_model._query_recommended_items = MagicMock(return_value=[101])
+
+    for _ in range(3):
+        mock_knn_model.recommend(customer_id=1, order_items=[{"item_id": 26}])
+
+    mock_knn_model._query_customer_items_matrix.assert_called_once_with(1)
+    mock_knn_model._model.kneighbors.assert_called_once()
+    assert mock_knn_model.cache_info()["hits"] == 2
+
+    mock_knn_model._model_version = "retrained"
+    mock_knn_model.recommend(customer_id=1, order_items=[{"item_id": 26}])
+    assert mock_knn_model._model.kneighbors.call_count == 2
+
+
+def test_recommend_many_uses_cache(mock_knn_model: KNNModel):
+    mock_knn_model._query_customers_items_matrix = MagicMock(return_value=array([[1, 0], [0, 1]]))
+    mock_knn_model._model.kneighbors = MagicMock(return_value=(None, array([[1, 2], [4, 2]])))
+    mock_knn_model._purchase_count_index = PurchaseCountIndex.from_dataframe(
+        DataFrame({"customer_id": [2], "item_id": [7]})
+    )
+    requests = [{"customer_id": 1, "order_items": []}, {"customer_id": 4, "order_items": []}]
+
+    list(mock_knn_model.recommend_many(requests))
+    recommendations = list(mock_knn_model.recommend_many(requests))
+
+    mock_knn_model._model.kneighbors.assert_called_once()
+    assert recommendations == [[7], [7]]
+
+
+def test_query_customers_items_matrix_runs_queries_concurrently(mock_knn_model: KNNModel):
+    """Every customer missing from the matrix is queried, and the vectors keep the request order."""
+    executor = InMemoryQueryExecutor(
+        lambda query, job_config: DataFrame([[job_config.query_parameters[0].value] * 2])
+    )
+    mock_knn_model._query_runner = QueryRunner(executor, TTLLRUCache(max_size=0))
+    mock_knn_model._customer_items_matrix = CustomerItemsMatrix.from_dataframe(
+        DataFrame({"customer_id": [4, 5], "item_id": [1, 2], "interaction": [3, 1]})
+    )
+    mock_knn_model._model.n_features_in_ = 2
+
+    vectors = mock_knn_model._query_customers_items_matrix([7, 4, 8])
+
+    assert len(executor.queries) == 2
+    assert vectors.tolist() == [[7, 7], [3, 0], [8, 8]]
+
+
+def test_customer_vectors_are_shared_through_the_store(tmp_path, mock_bq_client: MagicMock):
+    """A vector queried by a worker is found by the others, and dropped once the customer buys."""
+    with open("src/api/conf/knn_model_conf.json", encoding="utf-8") as conf_file:
+        conf = json.load(conf_file)
+    conf["customer_vector_store_path"] = str(tmp_path / "customer_vectors.sqlite")
+    conf_path = tmp_path / "knn_model_conf.json"
+    conf_path.write_text(json.dumps(conf))
+    workers = [KNNModel(str(conf_path), bq_client=mock_bq_client) for _ in range(2)]
+    num_items = workers[0]._model.n_features_in_
+    vector = np.zeros(num_items)
+    vector[0] = 2.0
+    for worker in workers:
+        worker._query_runner = QueryRunner(
+            InMemoryQueryExecutor(lambda query, job_config: DataFrame([vector])),
+            TTLLRUCache(max_size=10),
+        )
+
+    assert workers[0]._query_customers_items_matrix([9, 9]).tolist() == [vector.tolist()] * 2
+    assert workers[1]._query_customer_items_matrix(9).tolist() == [vector.tolist()]
+    workers[1]._customer_items_matrix = CustomerItemsMatrix.from_dataframe(
+        DataFrame({"customer_id": [1], "item_id": [1], "interaction": [1]})
+    )
+    workers[1].apply_orders(np.array([9]), np.array([1]))
+    workers[0]._customer_vector_cache._memory.clear()
+    workers[0]._query_customer_items_matrix(9)
+
+    assert [len(worker._query_runner._executor.queries) for worker in workers] == [2, 0]
+    assert workers[0].query_stats()["cache"]["size"] == 0
+    assert workers[1].query_stats()["customer_vectors"]["shared"]["hits"] == 1
+
+
+def test_queued_queries_time_out(mock_knn_model: KNNModel):
+    """A saturated query pool fails the request instead of blocking its thread forever."""
+    executor = MagicMock(wait_timeout=0.01, dialect="bigquery")
+    executor.submit.return_value = Future()  # never runs
+    mock_knn_model._query_executor = executor
+    mock_knn_model._query_runner = QueryRunner(executor, TTLLRUCache(max_size=0))
+    mock_knn_model._model.kneighbors = MagicMock(side_effect=lambda m, n_neighbors: (None, array([[0, 1]] * len(m))))
+
+    with pytest.raises(TimeoutError):
+        mock_knn_model._query_customer_items_matrix(9)
+    with pytest.raises(TimeoutError):
+        list(mock_knn_model.recommend_many([{"customer_id": 1, "order_items": []}]))
+
+
+def test_recommend_many_prefetches_next_batch_purchases(mock_knn_model: KNNModel):
+    """The purchases of a batch are submitted before the previous batch is ranked."""
+    events = []
+    executor = InMemoryQueryExecutor(
+        lambda query, job_config: events.append("query") or DataFrame({"customer_id": [1], "item_id": [7]})
+    )
+    mock_knn_model._query_runner = QueryRunner(executor, TTLLRUCache(max_size=0))
+    mock_knn_model._query_customers_items_matrix = MagicMock(side_effect=lambda ids: array([[1]] * len(ids)))
+    mock_knn_model._model.kneighbors = MagicMock(side_effect=lambda m, n_neighbors: (None, array([[0, 1]] * len(m))))
+
+    for recommendation in mock_knn_model.recommend_many(
+        ({"customer_id": c, "order_items": []} for c in range(4)), batch_size=2
+    ):
+        events.append(recommendation)
+
+    assert events == ["query", "query", [7], [7], [7], [7]]
+
+
+def test_repeated_queries_are_served_from_cache(mock_bq_client: MagicMock, mock_knn_model: KNNModel):
+    """A single-item IN list is a valid query, and running it again doesn't reach BigQuery."""
+    mock_bq_client.query.return_value.result.return_value.to_dataframe.return_value = DataFrame({"item_id": [101]})
+    mock_bq_client.query.return_value.total_bytes_processed = 2048
+
+    for _ in range(2):
+        assert mock_knn_model._query_recommended_items([5], [10], 1) == [101]
+
+    mock_bq_client.query.assert_called_once()
+    stats = mock_knn_model.query_stats()
+    assert stats["queries"]["most_sold_products_for_customer"]["bytes_processed"] == 2048
+    assert stats["cache"]["hits"] == 1
+
+
+def test_recommend_on_the_sqlite_backend(tmp_path, mock_knn_model: KNNModel):
+    orders_path = str(tmp_path / "orders.parquet")
+    DataFrame({
+        "customer_id": [1, 1, 2, 2, 2, 3, 3],
+        "item_id": [5, 6, 5, 7, 7, 7, 8],
+    }).to_parquet(orders_path)
+    items_path = str(tmp_path / "items.parquet")
+    DataFrame({"item_id": range(32)}).to_parquet(items_path)
+    mock_knn_model._query_runner = QueryRunner(
+        SQLiteQueryExecutor(orders_path, items_path=items_path), TTLLRUCache(max_size=0)
+    )
+    mock_knn_model._neighbour_search.kneighbors = MagicMock(return_value=(None, array([[1, 2, 3]])))
+
+    recommendations = mock_knn_model.recommend(
+        customer_id=1, order_items=[{"item_id": 5, "item_tags": []}], num_recommendations=2
+    )
+
+    assert mock_knn_model._neighbour_search.kneighbors.call_args.args[0].shape == (1, 32)
+    assert recommendations == [7, 8]
+
+
+def test_single_and_batch_recommendations_agree_on_an_empty_order(tmp_path, mock_knn_model: KNNModel):
+    orders_path = str(tmp_path / "orders.parquet")
+    DataFrame({
+        "customer_id": [1, 1, 2, 2, 2, 3],
+        "item_id": [5, 6, 5, 7, 7, 7],
+    }).to_parquet(orders_path)
+    items_path = str(tmp_path / "items.parquet")
+    DataFrame({"item_id": range(32)}).to_parquet(items_path)
+    mock_knn_model._query_runner = QueryRunner(
+        SQLiteQueryExecutor(orders_path, items_path=items_path), TTLLRUCache(max_size=0)
+    )
+    mock_knn_model._neighbour_search.kneighbors = MagicMock(return_value=(None, array([[1, 2, 3]])))
+    request = {"customer_id": 1, "order_items": [], "num_recommendations": 2}
+    vector_stages = stage_count("customer_vectors")
+
+    single = mock_knn_model.recommend(**request)
+    mock_knn_model._neighbours_cache.clear()  # the batch searches the neighbours again
+    batch = list(mock_knn_model.recommend_many([request]))
+
+    assert single == [7, 5]
+    assert batch == [single]
+    assert stage_count("customer_vectors") == vector_stages + 2  # one series for both paths
+
+
+def test_recommend_from_the_recommendation_table(mock_knn_model: KNNModel):
+    records = np.zeros(2, dtype=RecommendationTable.record_dtype(2, 4))
+    records["customer_id"] = [7, 8]
+    records["candidates"] = [[101, 102, 103, 104], [105, -1, -1, -1]]
+    mock_knn_model._recommendation_table = RecommendationTable(records)
+    mock_knn_model._neighbour_search.kneighbors = MagicMock()
+    mock_knn_model._query_recommended_items = MagicMock(return_value=[201])
+
+    assert mock_knn_model.recommend(customer_id=7, order_items=[{"item_id": 102}], num_recommendations=2) == [101, 103]
+    assert list(mock_knn_model.recommend_many([
+        {"customer_id": 8, "order_items": [], "num_recommendations": 3},
+        {"customer_id": 7, "order_items": [], "num_recommendations": 4},
+    ])) == [[105], [101, 102, 103, 104]]
+    mock_knn_model._neighbour_search.kneighbors.assert_not_called()
+    mock_knn_model._query_recommended_items.assert_not_called()
+
+
+@pytest.fixture
+def trained_knn_model(tmp_path) -> KNNModel:
+    """A model trained on 4 customers: 1 and 2 are neighbours, and so are 3 and 4."""
+    orders_path = str(tmp_path / "orders.parquet")
+    DataFrame({
+        "customer_id": [1, 1, 1, 2, 2, 3, 3, 4],
+        "item_id": [10, 20, 20, 10, 20, 30, 40, 30],
+    }).to_parquet(orders_path)
+    conf_template = tmp_path / "conf.json"
+    conf_template.write_text(json.dumps({"similar_customers_number": 2, "index_rebuild_drift": 0.5, "fallback_top_k": 0, "co_purchase_top_k": 0}))
+    manifest = train(
+        orders_path, str(tmp_path / "artefacts"), conf_template_path=str(conf_template), num_candidates=3
+    )
+    return KNNModel(os.path.join(manifest["artefacts_dir"], "knn_model_conf.json"))
+
+
+def test_customer_vectors_follow_the_item_catalogue(trained_knn_model: KNNModel):
+    """Purchases are laid out in the trained columns, whatever the item table holds."""
+    executor = InMemoryQueryExecutor(
+        lambda query, job_config: DataFrame({
+            "customer_id": [8, 9, 9, 9],
+            "item_id": [40, 99, 20, 10],
+            "interaction": [1, 3, 2, 1],
+        })
+    )
+    trained_knn_model._query_runner = QueryRunner(executor, TTLLRUCache(max_size=0))
+
+    vectors = trained_knn_model._query_customers_items_matrix([9, 2, 8, 9])
+
+    assert vectors.tolist() == [[1, 2, 0, 0], [1, 1, 0, 0], [0, 0, 0, 1], [1, 2, 0, 0]]
+    assert executor.queries == [CUSTOMERS_PURCHASES_QUERY.sql_for(executor.dialect)]
+    assert trained_knn_model.query_stats()["unknown_item_purchases"] == 1
+
+
+def test_item_catalogue_must_match_the_model(tmp_path, trained_knn_model: KNNModel):
+    artefacts_dir = os.path.dirname(trained_knn_model.model_pkl_path)
+    with open(os.path.join(artefacts_dir, "knn_model_conf.json"), encoding="utf-8") as conf_file:
+        conf = json.load(conf_file)
+    ItemCatalogue(array([10, 20, 30])).save(str(tmp_path / "catalogue.npy"))
+    conf["item_catalogue_path"] = str(tmp_path / "catalogue.npy")
+    conf_path = tmp_path / "conf_with_catalogue.json"
+    conf_path.write_text(json.dumps(conf))
+
+    with pytest.raises(ValueError):
+        KNNModel(str(conf_path))
+
+
+def test_dense_vectors_must_match_the_model(mock_knn_model: KNNModel):
+    """Without a catalogue, an item table grown since training is an error, not a shifted vector."""
+    mock_knn_model._query_runner = QueryRunner(
+        InMemoryQueryExecutor(lambda query, job_config: DataFrame({"interaction": [0] * 33})),
+        TTLLRUCache(max_size=0),
+    )
+
+    with pytest.raises(ValueError):
+        mock_knn_model._query_customer_items_matrix(9)
+
+
+def test_apply_orders_without_customer_items_matrix(mock_knn_model: KNNModel):
+    with pytest.raises(ValueError):
+        mock_knn_model.apply_orders(array([1]), array([10]))
+
+
+def test_apply_orders(trained_knn_model: KNNModel):
+    """New purchases count right away for the customers they are neighbours of."""
+    assert trained_knn_model.recommend(customer_id=3, order_items=[{"item_id": 30}]) == []
+
+    report = trained_knn_model.apply_orders(array([4, 4, 5, 5]), array([20, 99, 10, 20]))
+
+    assert report == {
+        "purchases": 3,
+        "unknown_item_purchases": 1,
+        "customers": 2,
+        "index_drift": 0.5,
+        "index_rebuild_started": True,
+    }
+    assert trained_knn_model.recommend(customer_id=3, order_items=[{"item_id": 30}]) == [20]
+    assert list(trained_knn_model.recommend_many([{"customer_id": 3, "order_items": []}])) == [[20, 30]]
+    assert trained_knn_model._customer_items_matrix.get_row(5).tolist() == [[1, 1, 0, 0]]
+    trained_knn_model._rebuild_thread.join(5)
+
+
+def test_rebuild_index(trained_knn_model: KNNModel):
+    trained_knn_model.apply_orders(array([5, 5]), array([10, 20]))
+    assert trained_knn_model._rebuild_thread is None  # a drift of 0.25 is below the threshold
+    assert 3 not in trained_knn_model._stale_customers
+
+    trained_knn_model.apply_orders(array([4]), array([20]))
+    trained_knn_model._rebuild_thread.join(5)
+
+    assert trained_knn_model._neighbour_index.customer_ids.tolist() == [1, 2, 3, 4, 5]
+    assert trained_knn_model.index_drift == 0
+    assert trained_knn_model._stale_customers == frozenset()
+    assert trained_knn_model._recommendation_table.find(5) is not None
+    trained_knn_model._neighbour_search.kneighbors = MagicMock()
+    assert trained_knn_model.recommend(customer_id=3, order_items=[{"item_id": 30}]) == [20]
+    trained_knn_model._neighbour_search.kneighbors.assert_not_called()
+
+
+def test_orders_are_kept_in_a_delta_until_the_index_is_rebuilt(trained_knn_model: KNNModel):
+    matrix = trained_knn_model._customer_items_matrix.matrix
+    trained_knn_model.apply_orders(array([5]), array([10]))
+
+    assert trained_knn_model._customer_items_matrix.matrix is matrix
+    assert trained_knn_model._customer_items_matrix.delta.customer_ids.tolist() == [5]
+
+    build_popularity_index = trained_knn_model._build_popularity_index
+
+    def apply_orders_while_rebuilding(counts):
+        trained_knn_model.apply_orders(array([6]), array([20]))
+        return build_popularity_index(counts)
+
+    trained_knn_model._build_popularity_index = apply_orders_while_rebuilding
+    trained_knn_model.rebuild_index()
+
+    assert trained_knn_model._neighbour_index.customer_ids.tolist() == [1, 2, 3, 4, 5]
+    assert trained_knn_model._customer_items_matrix.customer_ids.tolist() == [1, 2, 3, 4, 5]
+    assert trained_knn_model._customer_items_matrix.delta.customer_ids.tolist() == [6]
+    assert trained_knn_model._customer_items_matrix.get_row(6).tolist() == [[0, 1, 0, 0]]
+    assert trained_knn_model._purchase_count_index.item_totals(array([5, 6])).tolist() == [1, 1, 0, 0]
+    assert trained_knn_model.index_drift == 0.2
+
+
+def test_cold_start_tiers(trained_knn_model: KNNModel):
+    """Customers without purchases skip the vector query and the neighbour search."""
+    trained_knn_model._popularity_index = PopularityIndex.build(trained_knn_model._customer_items_matrix, 3)
+    trained_knn_model._co_purchase_index = CoPurchaseIndex.build(trained_knn_model._customer_items_matrix, 3)
+    trained_knn_model._neighbour_search.kneighbors = MagicMock()
+    trained_knn_model._query_runner = MagicMock()
+
+    assert trained_knn_model.recommend_with_tier(99, [{"item_id": 10}], 1) == Recommendation([20], "co_purchase")
+    assert trained_knn_model.recommend_with_tier(99, [{"item_id": 30}], 2) == Recommendation([40, 20], "popular")
+    assert trained_knn_model.recommend_with_tier(99, [], 2) == Recommendation([20, 10], "popular")
+    trained_knn_model._neighbour_search.kneighbors.assert_not_called()
+    trained_knn_model._query_runner.run.assert_not_called()
+    trained_knn_model._query_runner.submit.assert_not_called()
+
+
+def test_known_customers_are_completed_by_the_cold_start_tiers(trained_knn_model: KNNModel):
+    trained_knn_model._popularity_index = PopularityIndex.build(trained_knn_model._customer_items_matrix, 3)
+    trained_knn_model._co_purchase_index = CoPurchaseIndex.build(trained_knn_model._customer_items_matrix, 3)
+
+    assert trained_knn_model.recommend_with_tier(1, [{"item_id": 10}], 1) == Recommendation([20], "knn")
+    assert trained_knn_model.recommend_with_tier(4, [{"item_id": 30}], 3) == Recommendation([40, 20, 10], "popular")
+    assert list(trained_knn_model.recommend_many_with_tier([
+        {"customer_id": 4, "order_items": [{"item_id": 30}], "num_recommendations": 3},
+        {"customer_id": 99, "order_items": [{"item_id": 10}], "num_recommendations": 1},
+        {"customer_id": 1, "order_items": [{"item_id": 10}], "num_recommendations": 1},
+    ])) == [
+        Recommendation([40, 20, 10], "popular"),
+        Recommendation([20], "co_purchase"),
+        Recommendation([20], "knn"),
+    ]
+
+
+@pytest.fixture
+def blend_knn_model(trained_knn_model: KNNModel) -> KNNModel:
+    trained_knn_model._popularity_index = PopularityIndex.build(trained_knn_model._customer_items_matrix, 3)
+    trained_knn_model._co_purchase_index = CoPurchaseIndex.build(trained_knn_model._customer_items_matrix, 3)
+    trained_knn_model._scoring_mode = "blend"
+    return trained_knn_model
+
+
+def test_unknown_scoring_mode(trained_knn_model: KNNModel):
+    trained_knn_model._conf.scoring_mode = "random"
+    with pytest.raises(ValueError):
+        trained_knn_model._check_scoring_mode()
+
+    trained_knn_model._conf.scoring_mode = "blend"
+    with pytest.raises(ValueError):
+        trained_knn_model._check_scoring_mode()  # co_purchase_top_k is 0
+
+
+def test_blend_scoring_mode(blend_knn_model: KNNModel):
+    """Customer 4's neighbour bought 40, and 40 was bought with 30: both scores agree on it."""
+    assert blend_knn_model.recommend_with_tier(4, [{"item_id": 30}], 1) == Recommendation([40], "blend")
+    # customer 1's neighbour bought 10 and 20, only 20 is bought with the order item too
+    assert blend_knn_model.recommend_with_tier(1, [{"item_id": 10}], 2) == Recommendation([20, 30], "popular")
+
+
+def test_blend_scoring_mode_of_cold_customers(blend_knn_model: KNNModel):
+    blend_knn_model._neighbour_search.kneighbors = MagicMock()
+    blend_knn_model._query_runner = MagicMock()
+
+    assert blend_knn_model.recommend_with_tier(99, [{"item_id": 30}], 1) == Recommendation([40], "co_purchase")
+    blend_knn_model._neighbour_search.kneighbors.assert_not_called()
+    blend_knn_model._query_runner.run.assert_not_called()
+
+
+def test_blend_scoring_mode_batches(blend_knn_model: KNNModel):
+    requests = [
+        {"customer_id": 4, "order_items": [{"item_id": 30}], "num_recommendations": 1},
+        {"customer_id": 99, "order_items": [{"item_id": 10}], "num_recommendations": 1},
+        {"customer_id": 1, "order_items": [{"item_id": 10}], "num_recommendations": 2},
+    ]
+
+    assert list(blend_knn_model.recommend_many_with_tier(requests, batch_size=2)) == [
+        blend_knn_model.recommend_with_tier(**request) for request in requests
+    ]
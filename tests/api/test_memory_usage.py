@@ -0,0 +1,17 @@
+import sys
+
+from api.memory_usage import memory_usage, peak_memory_bytes
+
+import pytest
+
+
+def test_peak_memory_bytes():
+    assert peak_memory_bytes() > 0
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc")
+def test_memory_usage_on_linux():
+    usage = memory_usage()
+
+    assert 0 < usage["pss_bytes"] <= usage["rss_bytes"] <= usage["peak_rss_bytes"]
+    assert usage["shared_bytes"] <= usage["rss_bytes"]
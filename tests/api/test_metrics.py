@@ -0,0 +1,123 @@
+
+from api.metrics import (
+    MetricsRegistry,
+    STAGE_ERRORS,
+    STAGE_SECONDS,
+    disable_tracing,
+    enable_tracing,
+    model_metrics,
+    stage,
+)
+
+import pytest
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+
+def samples(family) -> dict:
+    return {(name, tuple(sorted(labels.items()))): value for name, labels, value in family.samples}
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1.0))
+
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, "a")
+
+    result = samples(histogram.collect())
+    assert [result[("latency_seconds_bucket", (("le", le), ("stage", "a")))] for le in ("0.1", "1.0", "+Inf")] == [1, 3, 4]
+    assert result[("latency_seconds_count", (("stage", "a"),))] == 4
+    assert result[("latency_seconds_sum", (("stage", "a"),))] == pytest.approx(4.05)
+
+
+def test_render_text_format():
+    registry = MetricsRegistry()
+    registry.counter("errors_total", "Errors.", ("stage",)).inc('say "hi"')
+
+    assert registry.render() == (
+        "# HELP errors_total Errors.\n"
+        "# TYPE errors_total counter\n"
+        'errors_total{stage="say \\"hi\\""} 1.0\n'
+    )
+
+
+def test_render_adds_labels_to_every_sample():
+    registry = MetricsRegistry()
+    registry.counter("errors_total", "Errors.", ("stage",)).inc("parse")
+    registry.histogram("latency_seconds", "Latency.", buckets=(1.0,)).observe(0.5)
+
+    lines = registry.render(labels={"worker": "7"}).splitlines()
+
+    assert [line for line in lines if not line.startswith("#")] == [
+        'errors_total{stage="parse",worker="7"} 1.0',
+        'latency_seconds_bucket{le="1.0",worker="7"} 1',
+        'latency_seconds_bucket{le="+Inf",worker="7"} 1',
+        'latency_seconds_sum{worker="7"} 0.5',
+        'latency_seconds_count{worker="7"} 1',
+    ]
+
+
+def test_stage_times_and_counts_errors():
+    before = samples(STAGE_ERRORS.collect()).get(("recommender_stage_errors_total", (("stage", "failing"),)), 0)
+
+    with stage("ok"):
+        pass
+    with pytest.raises(ValueError):
+        with stage("failing"):
+            raise ValueError()
+
+    assert samples(STAGE_SECONDS.collect())[("recommender_stage_seconds_count", (("stage", "ok"),))] >= 1
+    assert samples(STAGE_ERRORS.collect())[("recommender_stage_errors_total", (("stage", "failing"),))] == before + 1
+
+
+def test_stage_spans_when_tracing():
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+
+    enable_tracing(provider)
+    try:
+        with stage("kneighbors"):
+            pass
+    finally:
+        disable_tracing()
+    with stage("untraced"):
+        pass
+
+    assert [span.name for span in exporter.get_finished_spans()] == ["kneighbors"]
+
+
+def test_model_metrics():
+    families = {
+        family.name: family
+        for family in model_metrics(
+            {"hits": 1, "misses": 3, "hit_rate": 0.25},
+            {"queries": {"q": {"runs": 2, "remote_cache_hits": 1}}, "cache": {}},
+        )
+    }
+
+    assert samples(families["recommender_cache_hits_total"]) == {
+        ("recommender_cache_hits_total", (("cache", "neighbours"),)): 1,
+        ("recommender_cache_hits_total", (("cache", "query_results"),)): 0,
+    }
+    assert families["recommender_cache_hit_rate"].type == "gauge"
+    assert samples(families["recommender_unknown_item_purchases_total"]) == {
+        ("recommender_unknown_item_purchases_total", ()): 0,
+    }
+    vector_families = {
+        family.name: family
+        for family in model_metrics(
+            {}, {"customer_vectors": {"memory": {"hits": 4}, "shared": {"hits": 2}}}
+        )
+    }
+    assert samples(vector_families["recommender_cache_hits_total"]) == {
+        ("recommender_cache_hits_total", (("cache", "neighbours"),)): 0,
+        ("recommender_cache_hits_total", (("cache", "query_results"),)): 0,
+        ("recommender_cache_hits_total", (("cache", "customer_vectors_memory"),)): 4,
+        ("recommender_cache_hits_total", (("cache", "customer_vectors_shared"),)): 2,
+    }
+    assert samples(families["recommender_query_runs_total"]) == {
+        ("recommender_query_runs_total", (("query", "q"),)): 2
+    }
@@ -0,0 +1,145 @@
+import os
+from threading import Event
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from api.model_registry import ModelRegistry
+
+import pytest
+
+
+@pytest.fixture
+def model_files(tmp_path) -> SimpleNamespace:
+    conf_path, pkl_path = tmp_path / "conf.json", tmp_path / "model.pkl"
+    conf_path.write_text("{}")
+    pkl_path.write_bytes(b"v1")
+    return SimpleNamespace(conf_path=str(conf_path), pkl_path=str(pkl_path))
+
+
+@pytest.fixture
+def model_factory(model_files: SimpleNamespace) -> MagicMock:
+    versions = iter(range(1, 100))
+    return MagicMock(
+        side_effect=lambda _: SimpleNamespace(
+            model_version=f"v{next(versions)}", model_pkl_path=model_files.pkl_path
+        )
+    )
+
+
+def test_model_is_loaded_lazily(model_files: SimpleNamespace, model_factory: MagicMock):
+    registry = ModelRegistry(model_files.conf_path, model_factory=model_factory)
+
+    model_factory.assert_not_called()
+    assert registry.model_version is None
+    assert not registry.is_ready
+
+    assert registry.get().model_version == "v1"
+    assert registry.get().model_version == "v1"
+    model_factory.assert_called_once_with(model_files.conf_path)
+    assert registry.is_ready
+
+
+def test_warm_up(model_files: SimpleNamespace, model_factory: MagicMock):
+    registry = ModelRegistry(model_files.conf_path, model_factory=model_factory)
+    hook = MagicMock()
+
+    registry.warm_up(hook).join(5)
+
+    assert registry.is_ready
+    hook.assert_called_once_with(registry.get())
+
+
+def test_not_ready_while_warming_up(model_files: SimpleNamespace, model_factory: MagicMock):
+    registry = ModelRegistry(model_files.conf_path, model_factory=model_factory)
+    release = Event()
+
+    thread = registry.warm_up(lambda _: release.wait(5))
+    registry.get()
+    assert registry.is_loaded and not registry.is_ready
+    release.set()
+    thread.join(5)
+    assert registry.is_ready
+
+
+def test_reload_swaps_model(model_files: SimpleNamespace, model_factory: MagicMock):
+    registry = ModelRegistry(model_files.conf_path, model_factory=model_factory)
+    in_flight = registry.get()
+
+    assert registry.reload() is True
+    assert registry.get().model_version == "v2"
+    assert in_flight.model_version == "v1"  # in-flight requests keep the old model
+
+
+def test_failed_reload_keeps_current_model(model_files: SimpleNamespace, model_factory: MagicMock):
+    registry = ModelRegistry(model_files.conf_path, model_factory=model_factory)
+    registry.get()
+    model_factory.side_effect = ValueError("corrupted pickle")
+
+    assert registry.reload() is False
+    assert registry.model_version == "v1"
+    assert registry.last_reload_error == "corrupted pickle"
+
+
+def test_single_reload_at_a_time(model_files: SimpleNamespace, model_factory: MagicMock):
+    registry = ModelRegistry(model_files.conf_path, model_factory=model_factory)
+    loading, release = Event(), Event()
+
+    def slow_factory(_):
+        loading.set()
+        release.wait(5)
+        return SimpleNamespace(model_version="slow", model_pkl_path=model_files.pkl_path)
+
+    model_factory.side_effect = slow_factory
+    assert registry.reload_in_background() is True
+    loading.wait(5)
+    assert registry.reload_in_background() is False
+    assert registry.reload() is False
+    release.set()
+
+
+def test_watcher_reloads_changed_pickle(model_files: SimpleNamespace, model_factory: MagicMock):
+    registry = ModelRegistry(model_files.conf_path, model_factory=model_factory)
+    registry.get()
+    registry.start_watching(0.01)
+    try:
+        stat = os.stat(model_files.pkl_path)
+        os.utime(model_files.pkl_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        for _ in range(500):
+            if registry.model_version != "v1":
+                break
+            Event().wait(0.01)
+    finally:
+        registry.stop_watching()
+
+    assert registry.model_version == "v2"
+
+
+def test_background_reloads_are_claimed_before_starting(model_files: SimpleNamespace, model_factory: MagicMock):
+    registry = ModelRegistry(model_files.conf_path, model_factory=model_factory)
+    release = Event()
+    model_factory.side_effect = lambda _: release.wait(5) and SimpleNamespace(
+        model_version="v2", model_pkl_path=model_files.pkl_path
+    )
+
+    assert [registry.reload_in_background() for _ in range(3)] == [True, False, False]
+    release.set()
+
+
+def test_watcher_does_not_retry_a_failed_reload(model_files: SimpleNamespace, model_factory: MagicMock):
+    registry = ModelRegistry(model_files.conf_path, model_factory=model_factory)
+    registry.get()
+    model_factory.side_effect = ValueError("corrupted pickle")
+    stat = os.stat(model_files.pkl_path)
+    os.utime(model_files.pkl_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    registry.start_watching(0.01)
+    try:
+        for _ in range(500):
+            if model_factory.call_count > 1:
+                break
+            Event().wait(0.01)
+        Event().wait(0.1)
+    finally:
+        registry.stop_watching()
+
+    assert model_factory.call_count == 2  # the first load, then a single failed reload
+    assert registry.model_version == "v1"
@@ -0,0 +1,56 @@
+import json
+from queue import Queue
+
+from api.updates.order_events import JsonLinesOrderEvents, QueueOrderEvents
+
+
+def event(customer_id: int, *item_ids: int) -> dict:
+    return {"customer_id": customer_id, "order_items": [{"item_id": i} for i in item_ids]}
+
+
+def test_json_lines_events_are_read_once(tmp_path):
+    path = tmp_path / "orders.jsonl"
+    source = JsonLinesOrderEvents(str(path))
+    assert source.poll(10) == []  # the file doesn't exist yet
+
+    with open(path, "w", encoding="utf-8") as events_file:
+        events_file.write(json.dumps(event(1, 10)) + "\n" + json.dumps(event(2, 20)) + "\n")
+        events_file.write(json.dumps(event(3, 30))[:10])  # still being written
+    assert source.poll(1) == [event(1, 10)]
+    assert source.poll(10) == [event(2, 20)]
+
+    with open(path, "a", encoding="utf-8") as events_file:
+        events_file.write(json.dumps(event(3, 30))[10:] + "\n")
+    assert source.poll(10) == [event(3, 30)]
+    assert source.poll(10) == []
+
+
+def test_json_lines_events_skip_invalid_lines(tmp_path):
+    path = tmp_path / "orders.jsonl"
+    path.write_text("not json\n{\"customer_id\": 1}\n\n" + json.dumps(event(4, 40)) + "\n")
+    source = JsonLinesOrderEvents(str(path))
+
+    assert source.poll(10) == [event(4, 40)]
+    assert source.invalid_events == 2
+
+
+def test_json_lines_events_restart_after_truncation(tmp_path):
+    path = tmp_path / "orders.jsonl"
+    path.write_text(json.dumps(event(1, 10, 11)) + "\n")
+    source = JsonLinesOrderEvents(str(path))
+    source.poll(10)
+
+    path.write_text(json.dumps(event(2, 20)) + "\n")
+
+    assert source.poll(10) == [event(2, 20)]
+
+
+def test_queue_events():
+    queue = Queue()
+    for queued in (event(1, 10), {"customer_id": "x", "order_items": []}, event(2, 20)):
+        queue.put(queued)
+    source = QueueOrderEvents(queue)
+
+    assert source.poll(1) == [event(1, 10)]
+    assert source.poll(10) == [event(2, 20)]
+    assert source.invalid_events == 1
@@ -0,0 +1,110 @@
+from queue import Queue
+from threading import Event
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from api.model_registry import ModelRegistry
+from api.updates.order_events import QueueOrderEvents
+from api.updates.order_updater import OrderUpdater
+
+import pytest
+
+
+@pytest.fixture
+def model() -> SimpleNamespace:
+    return SimpleNamespace(
+        model_version="v1",
+        model_pkl_path="model.pkl",
+        apply_orders=MagicMock(side_effect=lambda customer_ids, item_ids: {"purchases": len(item_ids)}),
+    )
+
+
+@pytest.fixture
+def queue() -> Queue:
+    return Queue()
+
+
+@pytest.fixture
+def updater(model: SimpleNamespace, queue: Queue) -> OrderUpdater:
+    return OrderUpdater(
+        ModelRegistry("conf.json", model_factory=lambda _: model), QueueOrderEvents(queue), batch_size=2
+    )
+
+
+def test_events_wait_until_the_model_is_loaded(updater: OrderUpdater, queue: Queue):
+    queue.put({"customer_id": 1, "order_items": [{"item_id": 10}]})
+
+    assert updater.poll_once() == 0
+    assert queue.qsize() == 1
+
+
+def test_poll_once_applies_events_in_batches(updater: OrderUpdater, model: SimpleNamespace, queue: Queue):
+    updater._model_registry.get()
+    for customer_id in (1, 2, 3):
+        queue.put({"customer_id": customer_id, "order_items": [{"item_id": 10}, {"item_id": 20}]})
+
+    assert updater.poll_once() == 2
+    customer_ids, item_ids = model.apply_orders.call_args.args
+    assert customer_ids.tolist() == [1, 1, 2, 2]
+    assert item_ids.tolist() == [10, 20, 10, 20]
+    assert updater.poll_once() == 1
+    assert updater.poll_once() == 0
+    assert updater.stats["applied_events"] == 3
+    assert updater.stats["applied_purchases"] == 6
+
+
+def test_failed_updates_are_counted(updater: OrderUpdater, model: SimpleNamespace, queue: Queue):
+    updater._model_registry.get()
+    model.apply_orders.side_effect = ValueError("no customer items matrix")
+    queue.put({"customer_id": 1, "order_items": [{"item_id": 10}]})
+
+    assert updater.poll_once() == 1
+    assert updater.stats["failed_events"] == 1
+    assert updater.stats["applied_events"] == 0
+
+
+def test_applied_orders_survive_reloads_of_the_same_version(queue: Queue):
+    def new_model(version: str) -> SimpleNamespace:
+        return SimpleNamespace(
+            model_version=version,
+            model_pkl_path="model.pkl",
+            apply_orders=MagicMock(side_effect=lambda customer_ids, item_ids: {"purchases": len(item_ids)}),
+        )
+
+    models = iter([new_model("v1"), new_model("v1"), new_model("v2")])
+    registry = ModelRegistry("conf.json", model_factory=lambda _: next(models))
+    updater = OrderUpdater(registry, QueueOrderEvents(queue), batch_size=2)
+    registry.get()
+    queue.put({"customer_id": 1, "order_items": [{"item_id": 10}, {"item_id": 20}]})
+    queue.put({"customer_id": 2, "order_items": [{"item_id": 10}]})
+    updater.poll_once()
+    updater.poll_once()
+
+    registry.reload()
+    queue.put({"customer_id": 3, "order_items": [{"item_id": 30}]})
+    updater.poll_once()
+
+    reloaded = registry.get()
+    replayed, applied = [call.args for call in reloaded.apply_orders.call_args_list]
+    assert replayed[0].tolist() == [1, 1, 2]
+    assert replayed[1].tolist() == [10, 20, 10]
+    assert applied[0].tolist() == [3]
+    assert updater.stats["replayed_purchases"] == 3
+
+    registry.reload()  # a retrained model already holds the orders
+    updater.poll_once()
+
+    registry.get().apply_orders.assert_not_called()
+
+
+def test_start_and_stop(updater: OrderUpdater, model: SimpleNamespace, queue: Queue):
+    updater._model_registry.get()
+    applied = Event()
+    model.apply_orders.side_effect = lambda customer_ids, item_ids: applied.set() or {"purchases": 1}
+    queue.put({"customer_id": 1, "order_items": [{"item_id": 10}]})
+
+    updater.start(interval_seconds=0.01)
+    assert applied.wait(5)
+    updater.stop()
+
+    model.apply_orders.assert_called_once()
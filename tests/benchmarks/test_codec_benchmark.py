@@ -0,0 +1,19 @@
+import json
+
+from codec_benchmark import legacy_parse, main
+
+
+def test_legacy_parse_reads_the_item_ids():
+    assert legacy_parse(b'{"customer_id": 1, "order_items": [{"item_id": 3}]}') == [3]
+
+
+def test_codec_benchmark_report(tmp_path):
+    output = tmp_path / "codec.json"
+
+    main(["--requests", "50", "--items", "20", "--order-items", "4", "--warm-up", "5", "--output", str(output)])
+
+    report = json.loads(output.read_text())
+    assert set(report["parse"]) == {"legacy_json", "json", "packed"}
+    assert set(report["serialise"]) == {"json", "orjson"}
+    assert report["request_bytes"]["packed"] == 8 * (3 + 4)
+    assert report["parse"]["packed"]["p50_us"] <= report["parse"]["packed"]["p99_us"]
@@ -0,0 +1,47 @@
+from fake_bigquery import FakeBigQueryClient
+
+from api.index.customer_items_matrix import CustomerItemsMatrix
+from api.queries.customer_items_array import PARAMETERISED_QUERY as CUSTOMER_ITEMS_ARRAY_QUERY
+from api.queries.customers_purchases import PARAMETERISED_QUERY as CUSTOMERS_PURCHASES_QUERY
+from api.queries.most_sold_products_for_customer import PARAMETERISED_QUERY as MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY
+
+import pytest
+from pandas import DataFrame
+
+
+@pytest.fixture
+def client() -> FakeBigQueryClient:
+    return FakeBigQueryClient(CustomerItemsMatrix.from_dataframe(
+        DataFrame({"customer_id": [1, 1, 2, 2, 2], "item_id": [10, 20, 20, 30, 30]})
+    ))
+
+
+def run(client: FakeBigQueryClient, query, **parameters) -> DataFrame:
+    job_config = query.job_config(query.bind(**parameters))
+    return client.query(query.sql, job_config=job_config).result().to_dataframe()
+
+
+def test_customer_items_array(client: FakeBigQueryClient):
+    assert run(client, CUSTOMER_ITEMS_ARRAY_QUERY, customer_id=2)["interaction"].tolist() == [0, 1, 2]
+    assert run(client, CUSTOMER_ITEMS_ARRAY_QUERY, customer_id=9)["interaction"].tolist() == [0, 0, 0]
+
+
+def test_customers_purchases(client: FakeBigQueryClient):
+    purchases = run(client, CUSTOMERS_PURCHASES_QUERY, customer_ids=[2, 7])
+
+    assert purchases.values.tolist() == [[2, 20, 1], [2, 30, 2]]
+
+
+def test_most_sold_products(client: FakeBigQueryClient):
+    items = run(
+        client, MOST_SOLD_PRODUCTS_FOR_CUSTOMER_QUERY,
+        customer_ids=[1, 2], excluded_item_ids=[30], num_recommendations=2,
+    )
+
+    assert items["item_id"].tolist() == [20, 10]
+    assert client.queries == {"most_sold_products_for_customer": 1}
+
+
+def test_unknown_query(client: FakeBigQueryClient):
+    with pytest.raises(ValueError):
+        client.query("SELECT 1")
@@ -0,0 +1,48 @@
+import json
+
+from recommend_benchmark import load_workload, main, summarise
+
+
+def test_summarise():
+    summary = summarise([0.001, 0.002, 0.003, 0.004], errors=1, elapsed_seconds=0.5)
+
+    assert summary["requests"] == 4
+    assert summary["errors"] == 1
+    assert summary["p50_ms"] == 2.5
+    assert summary["throughput_rps"] == 8
+
+
+def test_load_workload_skips_other_lines(tmp_path):
+    path = tmp_path / "workload.jsonl"
+    path.write_text(
+        '{"customer_id": 1, "order_items": []}\n'
+        '{"request_id": "user-001", "title": "not a recommendation"}\n'
+        "\n"
+        "not json\n"
+    )
+
+    bodies, skipped = load_workload(str(path))
+
+    assert bodies == [{"customer_id": 1, "order_items": []}]
+    assert skipped == 2
+
+
+def test_benchmark_report(tmp_path):
+    """A tiny run through the fake BigQuery writes a comparable JSON report."""
+    output = tmp_path / "results.json"
+    args = [
+        "--customers", "300", "--items", "40", "--requests", "30", "--warm-up", "5",
+        "--serve-from", "bigquery", "--no-caches", "--output", str(output),
+    ]
+
+    main(args)
+    main(args + ["--output", str(tmp_path / "second.json"), "--baseline", str(output)])
+
+    report = json.loads(output.read_text())
+    for mode in ("model", "http"):
+        assert report["results"][mode]["requests"] == 25
+        assert report["results"][mode]["errors"] == 0
+        assert report["results"][mode]["p50_ms"] <= report["results"][mode]["p99_ms"]
+    assert report["bigquery_queries"]["customers_purchases"] == 60
+    assert "customer_items_array" not in report["bigquery_queries"]
+    assert set(json.loads((tmp_path / "second.json").read_text())["comparison"]) == {"model", "http"}
@@ -0,0 +1,23 @@
+import json
+
+from sharded_search_benchmark import main, purchase_vectors
+
+
+def test_purchase_vectors_are_binary():
+    matrix = purchase_vectors(customers=20, items=10, purchases=5, seed=0)
+
+    assert matrix.shape == (20, 10)
+    assert set(matrix.data.tolist()) == {1.0}
+
+
+def test_sharded_search_benchmark_report(tmp_path):
+    output = tmp_path / "sharded.json"
+
+    main([
+        "--customers", "300", "--items", "40", "--queries", "10", "--clients", "2",
+        "--shards", "2", "--output", str(output),
+    ])
+
+    report = json.loads(output.read_text())
+    assert report["unsharded"]["queries_per_second"] > 0
+    assert report["sharded"]["2"]["same_distances"]
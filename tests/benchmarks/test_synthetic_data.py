@@ -0,0 +1,38 @@
+from synthetic_data import generate_workload, item_popularity, iter_orders, write_orders
+
+from numpy import bincount, concatenate, unique
+from pandas import read_parquet
+
+
+def test_popularity_is_skewed():
+    popularity = item_popularity(100, skew=1.1)
+
+    assert abs(popularity.sum() - 1) < 1e-9
+    assert popularity[0] > 10 * popularity[50]
+
+
+def test_every_customer_orders_something():
+    chunks = list(iter_orders(customers=250, items=30, chunk_customers=100))
+
+    customers = concatenate([chunk["customer_id"] for chunk in chunks])
+    items = concatenate([chunk["item_id"] for chunk in chunks])
+    assert len(chunks) == 3
+    assert unique(customers).tolist() == list(range(250))
+    assert items.max() < 30
+    assert bincount(items).argmax() == 0  # the most popular item
+
+
+def test_write_orders(tmp_path):
+    path = str(tmp_path / "orders.parquet")
+
+    rows = write_orders(path, customers=50, items=10, chunk_customers=20)
+
+    assert len(read_parquet(path)) == rows
+
+
+def test_generate_workload():
+    bodies = generate_workload(200, customers=100, items=10, unknown_customers=0.5)
+
+    assert len(bodies) == 200
+    assert all(1 <= len(body["order_items"]) <= 3 for body in bodies)
+    assert any(body["customer_id"] >= 100 for body in bodies)
@@ -0,0 +1,311 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Event
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from api.flask_app_builder import FlaskAppBuilder
+from api.knn_model import Recommendation
+from api.model_registry import ModelRegistry
+from api.serving.micro_batcher import MicroBatcher
+from api.serving.model_call_limiter import ModelCallLimiter
+from api.updates.order_events import QueueOrderEvents
+from api.updates.order_updater import OrderUpdater
+from api.controller.admin_controller import admin_bp
+from api.controller.controller import controller_bp
+from api.controller.health_controller import health_bp
+from api.controller.metrics_controller import metrics_bp
+from api.controller.request_parser import PACKED_CONTENT_TYPE, RecommendationRequest
+
+import numpy as np
+import pytest
+from flask import Flask
+
+
+HEAVY_MODULES = ["sklearn", "pandas", "scipy", "google.cloud.bigquery"]
+
+
+def test_import_is_fast_and_light(record_property):
+    """Importing the app must not load the model nor its heavy dependencies."""
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import main\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {HEAVY_MODULES} if m in sys.modules]}}))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        env={**os.environ, "PYTHONPATH": "src", "MODEL_WARM_UP": "0"},
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True, text=True, check=True,
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    record_property("import_seconds", report["seconds"])
+
+    assert report["loaded"] == []
+    assert report["seconds"] < 5
+
+
+@pytest.fixture
+def model() -> SimpleNamespace:
+    return SimpleNamespace(
+        model_version="v1",
+        model_pkl_path="model.pkl",
+        recommend_with_tier=MagicMock(return_value=Recommendation([101, 102], "knn")),
+    )
+
+
+@pytest.fixture
+def app(model: SimpleNamespace) -> Flask:
+    model_registry = ModelRegistry("conf.json", model_factory=lambda _: model)
+    return FlaskAppBuilder() \
+        .with_config({"TESTING": True}) \
+        .with_recommender(model_registry) \
+        .with_blueprints([controller_bp, health_bp]) \
+        .build()
+
+
+def test_ready_once_model_is_loaded(app: Flask):
+    client = app.test_client()
+
+    assert client.get("/ready").status_code == 503
+    app.extensions["model_registry"].get()
+    response = client.get("/ready")
+
+    assert response.status_code == 200
+    assert response.json == {"ready": True, "model_version": "v1", "last_reload_error": None}
+
+
+def test_first_request_latency(app: Flask, model: SimpleNamespace, record_property):
+    client = app.test_client()
+    body = {"customer_id": 1, "order_items": [{"item_id": 3}], "num_recommendations": 2}
+
+    start = time.perf_counter()
+    response = client.post("/items/recommend", json=body)
+    record_property("first_request_seconds", time.perf_counter() - start)
+
+    assert response.status_code == 200
+    assert response.json == {"recommended_items": [101, 102], "tier": "knn", "model_version": "v1"}
+    call_kwargs = model.recommend_with_tier.call_args.kwargs
+    assert (call_kwargs["customer_id"], call_kwargs["num_recommendations"]) == (1, 2)
+    assert call_kwargs["order_items"].tolist() == [3]
+
+
+def test_packed_requests(app: Flask, model: SimpleNamespace):
+    model.recommend_many_with_tier = MagicMock(side_effect=lambda requests: (
+        Recommendation(request["order_items"].tolist(), "knn") for request in requests
+    ))
+    client = app.test_client()
+    packed = [RecommendationRequest(1, np.array([3, 4]), 2), RecommendationRequest(2, np.array([5]))]
+
+    response = client.post("/items/recommend", data=packed[0].to_packed(), content_type=PACKED_CONTENT_TYPE)
+    batch_response = client.post(
+        "/items/recommend/batch",
+        data=b"".join(request.to_packed() for request in packed),
+        content_type=PACKED_CONTENT_TYPE,
+    )
+
+    assert response.json["recommended_items"] == [101, 102]
+    assert model.recommend_with_tier.call_args.kwargs["order_items"].tolist() == [3, 4]
+    assert [json.loads(line) for line in batch_response.get_data(as_text=True).splitlines()] == [
+        {"customer_id": 1, "recommended_items": [3, 4], "tier": "knn"},
+        {"customer_id": 2, "recommended_items": [5], "tier": "knn"},
+    ]
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    ({"json": {"order_items": []}}, "Field required: customer_id"),
+    ({"json": {"customer_id": 1, "order_items": [{"item_id": "x"}]}}, "item_id must be an integer, got 'x'"),
+    ({"data": b"", "content_type": "application/json"}, "The given request is empty!"),
+    ({"data": b"\x01\x00", "content_type": PACKED_CONTENT_TYPE}, "The packed request must be a non-empty sequence of int64 values!"),
+])
+def test_invalid_requests_are_rejected(app: Flask, kwargs: dict, message: str):
+    response = app.test_client().post("/items/recommend", **kwargs)
+
+    assert response.status_code == 400
+    assert response.json == {"Exception": message}
+
+
+def test_query_timeouts_are_gateway_timeouts(app: Flask, model: SimpleNamespace):
+    model.recommend_with_tier.side_effect = TimeoutError()
+
+    response = app.test_client().post("/items/recommend", json={"customer_id": 1, "order_items": []})
+
+    assert response.status_code == 504
+
+
+def test_metrics_endpoint(model: SimpleNamespace):
+    model.cache_info = MagicMock(return_value={"hits": 3, "misses": 1, "hit_rate": 0.75})
+    model.query_stats = MagicMock(return_value={
+        "queries": {"customers_purchases": {"runs": 2, "bytes_processed": 2048}},
+        "cache": {"hits": 0, "misses": 2, "hit_rate": 0.0},
+    })
+    app = FlaskAppBuilder() \
+        .with_config({"TESTING": True}) \
+        .with_recommender(ModelRegistry("conf.json", model_factory=lambda _: model)) \
+        .with_metrics() \
+        .with_blueprints([controller_bp, metrics_bp]) \
+        .build()
+    client = app.test_client()
+    client.post("/items/recommend", json={"customer_id": 1, "order_items": [{"item_id": 3}]})
+    client.post("/items/recommend", json={"customer_id": "x", "order_items": []})
+
+    response = client.get("/metrics")
+    text = response.get_data(as_text=True)
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    worker = f'worker="{os.getpid()}"'
+    assert f'recommender_stage_seconds_count{{stage="parse",{worker}}}' in text
+    assert f'recommender_stage_errors_total{{stage="parse",{worker}}}' in text
+    assert (
+        'recommender_http_request_seconds_count{endpoint="/items/recommend",method="POST",'
+        f'status="400",{worker}}}'
+    ) in text
+    assert f'recommender_cache_hit_rate{{cache="neighbours",{worker}}} 0.75' in text
+    assert f'recommender_query_bytes_processed_total{{query="customers_purchases",{worker}}} 2048' in text
+    assert f'recommender_unknown_item_purchases_total{{{worker}}} 0' in text
+
+
+def test_admin_model_reports_order_updates(model: SimpleNamespace):
+    model.query_stats = MagicMock(return_value={})
+    model.apply_orders = MagicMock(return_value={"purchases": 1})
+    model_registry = ModelRegistry("conf.json", model_factory=lambda _: model)
+    events = Queue()
+    order_updater = OrderUpdater(model_registry, QueueOrderEvents(events))
+    app = FlaskAppBuilder() \
+        .with_config({"TESTING": True, "ADMIN_TOKEN": "secret"}) \
+        .with_recommender(model_registry) \
+        .with_order_updates(order_updater) \
+        .with_blueprints([admin_bp]) \
+        .build()
+    model_registry.get()
+    events.put({"customer_id": 1, "order_items": [{"item_id": 3}]})
+    events.put({"customer_id": None, "order_items": []})
+    order_updater.poll_once()
+
+    response = app.test_client().get("/admin/model", headers={"X-Admin-Token": "secret"})
+
+    assert response.status_code == 200
+    assert response.json["order_updates"] == {
+        "applied_events": 1,
+        "failed_events": 0,
+        "applied_purchases": 1,
+        "replayed_purchases": 0,
+        "last_update": {"purchases": 1},
+        "invalid_events": 1,
+    }
+
+
+@pytest.mark.parametrize("admin_token, headers, status", [
+    (None, {}, 403),
+    (None, {"X-Admin-Token": ""}, 403),
+    ("secret", {"X-Admin-Token": "guess"}, 403),
+    ("secret", {"X-Admin-Token": "secret"}, 200),
+])
+def test_admin_endpoints_require_the_admin_token(model: SimpleNamespace, admin_token, headers: dict, status: int):
+    model.query_stats = MagicMock(return_value={})
+    model_registry = ModelRegistry("conf.json", model_factory=lambda _: model)
+    model_registry.reload_in_background = MagicMock(return_value=True)
+    app = FlaskAppBuilder() \
+        .with_config({"TESTING": True, "WTF_CSRF_ENABLED": False, "ADMIN_TOKEN": admin_token}) \
+        .with_recommender(model_registry) \
+        .with_blueprints([admin_bp]) \
+        .build()
+    client = app.test_client()
+
+    assert client.get("/admin/model", headers=headers).status_code == status
+    reload_response = client.post("/admin/model/reload", headers=headers)
+
+    assert reload_response.status_code == (202 if status == 200 else 403)
+    assert model_registry.reload_in_background.called == (status == 200)
+
+
+def test_model_calls_are_limited(model: SimpleNamespace):
+    model.recommend_with_tier.side_effect = lambda **_: time.sleep(0.5)
+    model.recommend_many_with_tier = MagicMock(return_value=iter([Recommendation([101], "knn")]))
+    model.query_stats = MagicMock(return_value={})
+    model_call_limiter = ModelCallLimiter(max_concurrent=1, max_queued=1, timeout_seconds=0.05)
+    app = FlaskAppBuilder() \
+        .with_config({"TESTING": True, "ADMIN_TOKEN": "secret"}) \
+        .with_recommender(ModelRegistry("conf.json", model_factory=lambda _: model)) \
+        .with_model_call_limiter(model_call_limiter) \
+        .with_blueprints([controller_bp, admin_bp]) \
+        .build()
+    client = app.test_client()
+    body = {"customer_id": 1, "order_items": [{"item_id": 3}]}
+
+    assert client.post("/items/recommend", json=body).status_code == 504
+    batch_response = client.post("/items/recommend/batch", json=[body])  # takes the last slot while streaming
+    overloaded = client.post("/items/recommend", json=body)
+
+    assert overloaded.status_code == 503
+    assert overloaded.headers["Retry-After"] == "1"
+    assert client.post("/items/recommend/batch", json=[body]).status_code == 503
+    assert client.get("/admin/model", headers={"X-Admin-Token": "secret"}).json["model_calls"]["in_flight"] == 2
+    assert batch_response.get_data(as_text=True) == '{"customer_id":1,"recommended_items":[101],"tier":"knn"}\n'
+    batch_response.close()
+    assert model_call_limiter.in_flight == 1
+
+
+def test_identical_requests_are_coalesced(model: SimpleNamespace):
+    started, release = Event(), Event()
+
+    def slow_recommendation(**_) -> Recommendation:
+        started.set()
+        release.wait(5)
+        return Recommendation([101, 102], "knn")
+
+    model.recommend_with_tier.side_effect = slow_recommendation
+    app = FlaskAppBuilder() \
+        .with_config({"TESTING": True}) \
+        .with_recommender(ModelRegistry("conf.json", model_factory=lambda _: model)) \
+        .with_request_coalescing() \
+        .with_blueprints([controller_bp]) \
+        .build()
+
+    def post(order_items):
+        return app.test_client().post(
+            "/items/recommend", json={"customer_id": 1, "order_items": order_items}
+        ).json
+
+    with ThreadPoolExecutor(3) as executor:
+        leader = executor.submit(post, [{"item_id": 3}, {"item_id": 4}])
+        assert started.wait(5)
+        followers = [executor.submit(post, [{"item_id": 4}, {"item_id": 3}]) for _ in range(2)]
+        time.sleep(0.2)
+        release.set()
+
+        assert [future.result(5) for future in [leader, *followers]] == [leader.result()] * 3
+    model.recommend_with_tier.assert_called_once()
+
+
+def test_requests_are_micro_batched(model: SimpleNamespace):
+    model.recommend_many_with_tier = MagicMock(side_effect=lambda requests, batch_size: (
+        Recommendation([request["customer_id"]], "knn") for request in requests
+    ))
+    app = FlaskAppBuilder() \
+        .with_config({"TESTING": True}) \
+        .with_recommender(ModelRegistry("conf.json", model_factory=lambda _: model)) \
+        .with_model_call_limiter(ModelCallLimiter(max_concurrent=1, max_queued=3, timeout_seconds=5)) \
+        .with_request_coalescing(micro_batcher=MicroBatcher(max_wait_seconds=0.2)) \
+        .with_blueprints([controller_bp]) \
+        .build()
+
+    def post(customer_id):
+        return app.test_client().post(
+            "/items/recommend", json={"customer_id": customer_id, "order_items": []}
+        ).json["recommended_items"]
+
+    with ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(post, [1, 2, 3, 4])) == [[1], [2], [3], [4]]
+    app.extensions["micro_batcher"].close()
+
+    assert model.recommend_many_with_tier.call_count < 4  # more requests than the limiter's single thread
+    model.recommend_with_tier.assert_not_called()
@@ -0,0 +1,75 @@
+import json
+
+from training.evaluate_knn_model import main, split_purchases, top_columns
+
+import numpy as np
+import pytest
+from pandas import DataFrame
+from scipy.sparse import csr_matrix
+
+
+@pytest.fixture
+def orders_path(tmp_path) -> str:
+    """Customers 1 and 2 buy alike, so do 3 and 4; customer 5 only buys after the split."""
+    orders = DataFrame({
+        "customer_id": [1, 1, 2, 2, 2, 3, 3, 4, 4, 4, 1, 3, 5],
+        "item_id": [10, 20, 10, 20, 30, 40, 50, 40, 50, 60, 30, 60, 10],
+        "order_date": ["2024-01-05"] * 10 + ["2024-02-10"] * 3,
+    })
+    path = str(tmp_path / "orders.csv")
+    orders.to_csv(path, index=False)
+    return path
+
+
+def results_by_top_n(report: dict) -> dict:
+    return {
+        result["top_n"]: {name: round(result[name], 4) for name in ("precision", "recall", "hit_rate", "coverage")}
+        for result in report["results"]
+    }
+
+
+def test_split_purchases_at_a_time(orders_path: str):
+    split = split_purchases(orders_path, chunk_size=4, split_time="2024-02-01")
+
+    assert split.train.customer_ids.tolist() == [1, 2, 3, 4]
+    assert split.test.customer_ids.tolist() == [1, 3, 5]
+    assert split.train.matrix.sum() == 10
+
+
+def test_default_split_holds_out_the_latest_purchases(orders_path: str):
+    split = split_purchases(orders_path, test_fraction=0.2)
+
+    assert str(split.split_time).startswith("2024-02-10")
+    assert split.test.matrix.sum() == 3
+
+
+def test_evaluation_report(orders_path: str, tmp_path):
+    output = tmp_path / "report.json"
+
+    report = main([
+        "--orders", orders_path, "--split-time", "2024-02-01", "--similar-customers", "2",
+        "--top-n", "1", "3", "--workers", "2", "--batch-size", "1", "--output", str(output),
+    ])
+
+    assert (report["evaluated_customers"], report["cold_test_customers"]) == (2, 1)
+    assert results_by_top_n(report) == {
+        1: {"precision": 0.0, "recall": 0.0, "hit_rate": 0.0, "coverage": 0.3333},
+        3: {"precision": 0.3333, "recall": 1.0, "hit_rate": 1.0, "coverage": 1.0},
+    }
+    assert report["wall_time_seconds"] > 0
+    assert json.loads(output.read_text())["results"] == report["results"]
+
+
+def test_evaluation_excluding_purchased_items(orders_path: str, tmp_path):
+    report = main([
+        "--orders", orders_path, "--split-time", "2024-02-01", "--similar-customers", "2",
+        "--top-n", "1", "--exclude-purchased", "--output", str(tmp_path / "report.json"),
+    ])
+
+    assert results_by_top_n(report) == {1: {"precision": 1.0, "recall": 1.0, "hit_rate": 1.0, "coverage": 0.3333}}
+
+
+def test_top_columns_breaks_ties_by_column():
+    scores = csr_matrix(np.array([[1.0, 3.0, 1.0, 0.0], [0.0, 0.0, 0.0, 2.0], [0.0, 0.0, 0.0, 0.0]]))
+
+    assert top_columns(scores, 2).tolist() == [[1, 0], [3, -1], [-1, -1]]
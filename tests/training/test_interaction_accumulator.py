@@ -0,0 +1,37 @@
+from training.interaction_accumulator import InteractionAccumulator
+
+import pytest
+from numpy import array
+from pandas import DataFrame
+
+from api.index.customer_items_matrix import CustomerItemsMatrix
+
+
+def test_chunks_are_summed_like_a_single_dataframe():
+    orders = DataFrame({"customer_id": [3, 1, 3, 1, 2, 3], "item_id": [10, 10, 10, 20, 30, 30]})
+    accumulator = InteractionAccumulator()
+    for start in range(0, len(orders), 2):
+        chunk = orders[start:start + 2]
+        accumulator.add(chunk["customer_id"].to_numpy(), chunk["item_id"].to_numpy())
+
+    counts = accumulator.build()
+    expected = CustomerItemsMatrix.from_dataframe(orders)
+
+    assert accumulator.rows_read == 6
+    assert counts.customer_ids.tolist() == expected.customer_ids.tolist()
+    assert counts.item_ids.tolist() == expected.item_ids.tolist()
+    assert (counts.matrix != expected.matrix).nnz == 0
+
+
+def test_merges_keep_the_counts():
+    accumulator = InteractionAccumulator()
+    for _ in range(3):
+        accumulator.add(array([1, 2]), array([5, 5]))
+        accumulator._merge()
+
+    assert accumulator.build().matrix.toarray().tolist() == [[3.0], [3.0]]
+
+
+def test_build_without_purchases_raises():
+    with pytest.raises(ValueError):
+        InteractionAccumulator().build()
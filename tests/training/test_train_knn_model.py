@@ -0,0 +1,124 @@
+import json
+import os
+from mmap import mmap
+from unittest.mock import MagicMock
+
+from api.knn_model import KNNModel
+from training.precompute_recommendations import main as precompute_main
+from training.train_knn_model import main
+
+import pytest
+from numpy import memmap, ndarray
+from pandas import DataFrame
+
+
+@pytest.fixture
+def orders() -> DataFrame:
+    return DataFrame({
+        "customer_id": [1, 1, 1, 2, 2, 3, 3, 4],
+        "item_id": [10, 20, 20, 10, 20, 30, 40, 30],
+    })
+
+
+def is_memory_mapped(values) -> bool:
+    while isinstance(values, ndarray):
+        if isinstance(values, memmap):
+            return True
+        values = values.base
+    return isinstance(values, mmap)
+
+
+@pytest.mark.parametrize("file_name", ["orders.csv", "orders.parquet"])
+def test_artefacts_are_loadable_by_knn_model(tmp_path, orders: DataFrame, file_name: str):
+    conf_template = tmp_path / "conf.json"
+    conf_template.write_text(json.dumps(
+        {"similar_customers_number": 2, "neighbours_cache_size": 10, "mmap_mode": "r"}
+    ))
+    orders_path = str(tmp_path / file_name)
+    if file_name.endswith(".csv"):
+        orders.to_csv(orders_path, index=False)
+    else:
+        orders.to_parquet(orders_path)
+
+    manifest = main([
+        "--orders", orders_path,
+        "--output-dir", str(tmp_path / "artefacts"),
+        "--chunk-size", "3",
+        "--conf-template", str(conf_template),
+    ])
+
+    assert manifest["purchases"] == 8
+    assert (manifest["customers"], manifest["items"]) == (4, 4)
+    assert manifest["wall_time_seconds"] > 0
+    with open(os.path.join(manifest["artefacts_dir"], "manifest.json"), encoding="utf-8") as f:
+        assert json.load(f)["version"] == manifest["version"]
+
+    knn_model = KNNModel(os.path.join(manifest["artefacts_dir"], "knn_model_conf.json"))
+    assert knn_model._model.n_features_in_ == 4
+    assert knn_model._item_catalogue.item_ids.tolist() == [10, 20, 30, 40]
+    assert is_memory_mapped(knn_model._item_catalogue.item_ids)
+    assert is_memory_mapped(knn_model._model._fit_X.data)
+    assert is_memory_mapped(knn_model._customer_items_matrix.matrix.indices)
+    assert manifest["co_purchase_top_k"] == 50
+    assert is_memory_mapped(knn_model._co_purchase_index.matrix.indices)
+    # the neighbours only bought one more item, the most popular item left completes the recommendations
+    assert knn_model.recommend(customer_id=1, order_items=[{"item_id": 10}], num_recommendations=2) == [20, 30]
+    assert knn_model.recommend(customer_id=4, order_items=[{"item_id": 30}], num_recommendations=2) == [40, 20]
+
+
+def test_recommendation_table_refresh(tmp_path, orders: DataFrame):
+    orders_path = str(tmp_path / "orders.parquet")
+    orders.to_parquet(orders_path)
+    conf_template = tmp_path / "conf.json"
+    conf_template.write_text(json.dumps({"similar_customers_number": 2}))
+    manifest = main([
+        "--orders", orders_path,
+        "--output-dir", str(tmp_path / "artefacts"),
+        "--conf-template", str(conf_template),
+        "--num-candidates", "3",
+    ])
+    conf_path = os.path.join(manifest["artefacts_dir"], "knn_model_conf.json")
+    knn_model = KNNModel(conf_path)
+    knn_model._neighbour_search.kneighbors = MagicMock()
+
+    assert len(knn_model._recommendation_table) == 4
+    assert knn_model.recommend(customer_id=1, order_items=[{"item_id": 10}], num_recommendations=1) == [20]
+    knn_model._neighbour_search.kneighbors.assert_not_called()
+
+    new_orders_path = str(tmp_path / "new_orders.parquet")
+    DataFrame({"customer_id": [4], "item_id": [10]}).to_parquet(new_orders_path)
+    report = precompute_main(["--conf", conf_path, "--new-orders", new_orders_path])
+
+    assert report["customers"] == 4
+    assert report["computed_customers"] == 2  # customer 4 and customer 3, whose neighbour it is
+    assert report["purchases"] == 1
+
+
+def test_recommendation_table_refresh_adds_the_new_orders(tmp_path, orders: DataFrame):
+    orders_path = str(tmp_path / "orders.parquet")
+    orders.to_parquet(orders_path)
+    conf_template = tmp_path / "conf.json"
+    conf_template.write_text(json.dumps({"similar_customers_number": 2}))
+    manifest = main([
+        "--orders", orders_path,
+        "--output-dir", str(tmp_path / "artefacts"),
+        "--conf-template", str(conf_template),
+    ])
+    conf_path = os.path.join(manifest["artefacts_dir"], "knn_model_conf.json")
+    new_orders_path = str(tmp_path / "new_orders.parquet")
+    DataFrame({"customer_id": [4, 4, 5], "item_id": [10, 99, 40]}).to_parquet(new_orders_path)
+
+    report = precompute_main(["--conf", conf_path, "--new-orders", new_orders_path])
+    knn_model = KNNModel(conf_path)
+
+    assert (report["purchases"], report["unknown_item_purchases"]) == (2, 1)
+    assert report["customers"] == 5
+    assert knn_model._customer_items_matrix.get_row(4).tolist() == [[1, 0, 1, 0]]
+    assert knn_model._customer_items_matrix.get_row(5).tolist() == [[0, 0, 0, 1]]
+    assert knn_model._model.n_samples_fit_ == 5
+    assert knn_model._model._fit_X[3].toarray().tolist() == [[1, 0, 1, 0]]
+
+    # a later refresh builds on the counts written by the previous one
+    precompute_main(["--conf", conf_path, "--new-orders", new_orders_path])
+
+    assert KNNModel(conf_path)._customer_items_matrix.get_row(4).tolist() == [[2, 0, 1, 0]]